@@ -0,0 +1,473 @@
+# agent/asr_backends.py
+# 语音识别后端。每个后端都是一个recognition_factory：用(model, format, sample_rate, callback)创建会话，
+# 会话提供start / send_audio_frame / stop，识别结果通过回调的on_open / on_event / on_error / on_close返回。
+# 'dashscope' 为阿里云实时识别；'local' 在独立进程中运行离线识别器，音频经共享内存传入，不经过网络。
+import re
+import json
+import time
+import queue
+import struct
+import logging
+import importlib
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+class SessionStopped(Exception):
+    """会话已经停止后仍在发送音频"""
+
+class ASRResult:
+    """识别结果，接口与dashscope的RecognitionResult一致（ASRCallback只用到这些）"""
+
+    def __init__(self, sentence: dict = None, message: str = None):
+        self._sentence = sentence
+        self.message = message
+
+    def get_sentence(self) -> dict:
+        return self._sentence
+
+    @staticmethod
+    def is_sentence_end(sentence: dict) -> bool:
+        """带end_time的结果为一句话的最终结果，否则为中间结果"""
+        return sentence is not None and sentence.get('end_time') is not None
+
+class ASRBackendCallback:
+    """会话回调的基类，各方法默认什么都不做"""
+
+    def on_open(self) -> None:
+        pass
+
+    def on_event(self, result: ASRResult) -> None:
+        pass
+
+    def on_error(self, result: ASRResult) -> None:
+        pass
+
+    def on_complete(self) -> None:
+        pass
+
+    def on_close(self) -> None:
+        pass
+
+class DashScopeASRBackend:
+    """
+    DashScope实时识别会话，对Recognition的薄封装。
+    api_key为空时使用进程全局的dashscope.api_key；服务模式下各会话可用
+    functools.partial(DashScopeASRBackend, api_key=...)使用各自的密钥。
+    """
+
+    def __init__(self, model, format, sample_rate, callback, api_key: str = None):
+        from dashscope.audio.asr import Recognition
+        kwargs = {'api_key': api_key} if api_key else {}
+        self._recognition = Recognition(model=model, format=format, sample_rate=sample_rate, callback=callback,
+                                        **kwargs)
+
+    def start(self):
+        self._recognition.start()
+
+    def send_audio_frame(self, data: bytes):
+        from dashscope.common.error import InvalidParameter
+        try:
+            self._recognition.send_audio_frame(data)
+        except InvalidParameter as e:
+            if "Speech recognition has stopped" in str(e):
+                raise SessionStopped(str(e)) from e
+            raise
+
+    def stop(self):
+        self._recognition.stop()
+
+class SharedAudioRing:
+    """
+    单生产者、单消费者的共享内存环形缓冲区。
+    头部为写入位置、读取位置（均为累计字节数）；每条记录为[会话ID u32][长度 u32][写入时刻 f64][PCM]，
+    音频只在写入和读出时各复制一次，不经过序列化和管道。
+    """
+
+    HEADER_SIZE = 16
+    RECORD_HEADER = struct.Struct('<IId')
+
+    def __init__(self, capacity: int, name: str = None):
+        create = name is None
+        self.capacity = capacity
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=self.HEADER_SIZE + capacity)
+        self._positions = np.ndarray((2,), dtype=np.uint64, buffer=self._shm.buf)
+        self._data = np.ndarray((capacity,), dtype=np.uint8, buffer=self._shm.buf, offset=self.HEADER_SIZE)
+        if create:
+            self._positions[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def used(self) -> int:
+        return int(self._positions[0] - self._positions[1])
+
+    def _copy_in(self, position: int, data: bytes):
+        start = position % self.capacity
+        view = np.frombuffer(data, dtype=np.uint8)
+        first = min(len(view), self.capacity - start)
+        self._data[start:start + first] = view[:first]
+        if first < len(view):
+            self._data[:len(view) - first] = view[first:]
+
+    def _copy_out(self, position: int, size: int) -> bytes:
+        start = position % self.capacity
+        first = min(size, self.capacity - start)
+        if first == size:
+            return self._data[start:start + size].tobytes()
+        return self._data[start:].tobytes() + self._data[:size - first].tobytes()
+
+    def write(self, session_id: int, data: bytes) -> bool:
+        """写入一条记录，空间不足时返回False（由调用方计为丢弃）"""
+        size = self.RECORD_HEADER.size + len(data)
+        write_pos = int(self._positions[0])
+        if write_pos + size - int(self._positions[1]) > self.capacity:
+            return False
+        self._copy_in(write_pos, self.RECORD_HEADER.pack(session_id, len(data), time.time()))
+        if data:
+            self._copy_in(write_pos + self.RECORD_HEADER.size, data)
+        # 数据写完后再推进写入位置，消费者不会读到一半的记录
+        self._positions[0] = write_pos + size
+        return True
+
+    def read(self):
+        """读出一条记录，返回(会话ID, PCM, 写入时刻)，没有数据时返回None"""
+        read_pos = int(self._positions[1])
+        if read_pos == int(self._positions[0]):
+            return None
+        session_id, length, written_at = self.RECORD_HEADER.unpack(
+            self._copy_out(read_pos, self.RECORD_HEADER.size))
+        data = self._copy_out(read_pos + self.RECORD_HEADER.size, length) if length else b''
+        self._positions[1] = read_pos + self.RECORD_HEADER.size + length
+        return session_id, data, written_at
+
+    def clear(self):
+        """丢弃未读的记录（仅在没有消费者时调用）"""
+        self._positions[1] = self._positions[0]
+
+    def close(self, unlink: bool = False):
+        # 先释放对共享内存的引用，否则close会报错
+        self._positions = None
+        self._data = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+class VoskEngine:
+    """Vosk流式识别器。中文模型的结果以空格分词，这里去掉汉字之间的空格。"""
+
+    _CJK_SPACE = re.compile(r'(?<=[一-鿿])\s+(?=[一-鿿])')
+
+    def __init__(self, model_path: str, sample_rate: int):
+        from vosk import Model, KaldiRecognizer, SetLogLevel
+        SetLogLevel(-1)
+        self._recognizer = KaldiRecognizer(Model(model_path), sample_rate)
+
+    def _text(self, result: str, key: str = 'text') -> str:
+        return self._CJK_SPACE.sub('', json.loads(result).get(key, ''))
+
+    def accept_waveform(self, data: bytes) -> bool:
+        """送入音频，检测到一句话结束时返回True"""
+        return self._recognizer.AcceptWaveform(data)
+
+    def result(self) -> str:
+        return self._text(self._recognizer.Result())
+
+    def partial_result(self) -> str:
+        return self._text(self._recognizer.PartialResult(), 'partial')
+
+    def final_result(self) -> str:
+        """结束当前会话，返回尚未输出的最后一句"""
+        return self._text(self._recognizer.FinalResult())
+
+LOCAL_ENGINES = {
+    'vosk': VoskEngine,
+}
+
+def load_engine(spec: str, model_path: str, sample_rate: int):
+    """按名称或'模块:工厂'创建识别器，在识别进程中调用"""
+    factory = LOCAL_ENGINES.get(spec)
+    if factory is None:
+        module_name, _, attr = spec.partition(':')
+        factory = getattr(importlib.import_module(module_name), attr)
+    return factory(model_path, sample_rate)
+
+# 识别进程收到会话ID为0的记录时退出
+_SHUTDOWN_SESSION = 0
+
+def _local_worker(ring_name: str, capacity: int, data_ready, results, worker_stats,
+                  engine_spec: str, model_path: str, sample_rate: int):
+    """
+    识别进程主循环。一个识别器依次服务各个会话：收到新会话的音频时先结束上一个会话，
+    收到空记录表示该会话停止，输出最后一句后回复'closed'。
+    """
+    ring = SharedAudioRing(capacity, name=ring_name)
+    try:
+        engine = load_engine(engine_spec, model_path, sample_rate)
+    except Exception as e:
+        results.put(('error', None, f"加载本地识别器失败: {type(e).__name__}: {e}"))
+        ring.close()
+        return
+    results.put(('ready', None, None))
+    # CPU时间从模型加载完成后开始统计
+    cpu_started = time.process_time()
+
+    parent = multiprocessing.parent_process()
+    current = None
+    ended = set()
+    samples = 0
+    last_partial = ''
+
+    def finish(session_id):
+        nonlocal current, samples, last_partial
+        text = engine.final_result()
+        if text:
+            results.put(('final', session_id, (text, samples * 1000 // sample_rate)))
+        current = None
+        samples = 0
+        last_partial = ''
+
+    while True:
+        record = ring.read()
+        if record is None:
+            # 每写入一条记录信号量加一，读空后才等待；多出的计数只会造成一次空读
+            if not data_ready.acquire(timeout=0.5) and parent is not None and not parent.is_alive():
+                break
+            continue
+        session_id, data, written_at = record
+        worker_stats[0] += 1
+        worker_stats[1] += time.time() - written_at
+        if session_id == _SHUTDOWN_SESSION:
+            break
+        if not data:
+            if session_id == current:
+                finish(session_id)
+            ended.add(session_id)
+            results.put(('closed', session_id, None))
+        elif session_id not in ended:
+            if session_id != current:
+                if current is not None:
+                    finish(current)
+                current = session_id
+            samples += len(data) // 2
+            if engine.accept_waveform(data):
+                text = engine.result()
+                if text:
+                    results.put(('final', session_id, (text, samples * 1000 // sample_rate)))
+                last_partial = ''
+            else:
+                partial = engine.partial_result()
+                if partial and partial != last_partial:
+                    last_partial = partial
+                    results.put(('partial', session_id, partial))
+        worker_stats[2] = time.process_time() - cpu_started
+    worker_stats[2] = time.process_time() - cpu_started
+    ring.close()
+
+class LocalASRSession:
+    """本地识别的一个会话，与DashScope会话接口相同"""
+
+    def __init__(self, backend, session_id: int, callback):
+        self.backend = backend
+        self.session_id = session_id
+        self.callback = callback
+        self._closed = threading.Event()
+        self._stopped = False
+
+    def start(self):
+        self.backend.ensure_ready()
+        self.backend.register(self)
+        self.callback.on_open()
+
+    def send_audio_frame(self, data: bytes):
+        if self._stopped:
+            raise SessionStopped("Speech recognition has stopped.")
+        self.backend.write(self.session_id, data)
+
+    def stop(self):
+        """与DashScope一致，等识别进程输出最后一句后才返回"""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self.backend.write(self.session_id, b'') and not self._closed.wait(config.ASR_LOCAL_STOP_TIMEOUT_SECONDS):
+            logger.warning("本地识别进程未及时结束会话。")
+        self.backend.unregister(self)
+        self.callback.on_complete()
+        self.callback.on_close()
+
+class LocalASRBackend:
+    """
+    本地离线识别。识别器运行在独立进程中，不占用主进程的GIL；
+    音频经共享内存环形缓冲区传入，识别结果经队列返回，由分发线程交给各会话的回调。
+    实例可直接作为recognition_factory，所有会话共用同一个识别进程（模型只加载一次）。
+    """
+
+    def __init__(self, engine: str = config.ASR_LOCAL_ENGINE, model_path: str = config.ASR_LOCAL_MODEL_PATH,
+                 sample_rate: int = config.SAMPLE_RATE, ring_seconds: float = config.ASR_LOCAL_RING_SECONDS):
+        self.engine = engine
+        self.model_path = model_path
+        self.sample_rate = sample_rate
+        self._context = multiprocessing.get_context('spawn')
+        self._ring = SharedAudioRing(int(ring_seconds * sample_rate * 2))
+        # 用信号量而不是Event通知：Event.set()会等待被唤醒的进程确认，阻塞音频线程
+        self._data_ready = self._context.Semaphore(0)
+        self._results = None  # 结果队列，每次启动识别进程时新建
+        # 识别进程写入：处理的记录数、累计传输延迟（秒）、模型加载后的进程CPU时间（秒）
+        self._worker_stats = self._context.Array('d', 3, lock=False)
+        self._process = None
+        self._ready = threading.Event()
+        self._error = None
+        self._sessions = {}
+        self._next_session_id = _SHUTDOWN_SESSION + 1
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._dispatcher = None
+        self._closing = False
+
+        # 统计信息
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_dropped = 0
+        self.partials = 0
+        self.finals = 0
+
+    def __call__(self, model, format, sample_rate, callback) -> LocalASRSession:
+        with self._lock:
+            session_id = self._next_session_id
+            self._next_session_id += 1
+        return LocalASRSession(self, session_id, callback)
+
+    def start(self):
+        """启动识别进程（不等待模型加载），可在创建Agent时提前调用"""
+        with self._lock:
+            if self._process is not None:
+                return
+            # 识别进程意外退出后重新启动时，丢弃上一个进程未读完的音频；
+            # 被杀死的进程可能还持有结果队列的锁，队列也换成新的
+            self._ring.clear()
+            self._results = self._context.Queue()
+            self._ready.clear()
+            self._error = None
+            self._process = self._context.Process(
+                target=_local_worker, name="LocalASR", daemon=True,
+                args=(self._ring.name, self._ring.capacity, self._data_ready, self._results, self._worker_stats,
+                      self.engine, self.model_path, self.sample_rate))
+            self._process.start()
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="LocalASRDispatch", daemon=True)
+            self._dispatcher.start()
+        logger.info(f"本地识别进程已启动（{self.engine}），正在加载模型...")
+
+    def ensure_ready(self):
+        self.start()
+        if not self._ready.wait(config.ASR_LOCAL_READY_TIMEOUT_SECONDS):
+            raise TimeoutError("本地识别器加载超时")
+        if self._error:
+            raise RuntimeError(self._error)
+
+    def register(self, session: LocalASRSession):
+        with self._lock:
+            self._sessions[session.session_id] = session
+
+    def unregister(self, session: LocalASRSession):
+        with self._lock:
+            self._sessions.pop(session.session_id, None)
+
+    def write(self, session_id: int, data: bytes) -> bool:
+        with self._write_lock:
+            written = self._ring.write(session_id, data)
+        if not written:
+            # 识别进程跟不上，丢弃这一块音频而不是阻塞采集
+            self.frames_dropped += 1
+            return False
+        self._data_ready.release()
+        if data:
+            self.frames_sent += 1
+            self.bytes_sent += len(data)
+        return True
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                kind, session_id, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if self._process is None or not self._process.is_alive():
+                    break
+                continue
+            except (EOFError, OSError):
+                break
+            if kind == 'ready':
+                logger.info("本地识别器已就绪。")
+                self._ready.set()
+                continue
+            if kind == 'error' and session_id is None:
+                logger.error(payload)
+                self._error = payload
+                self._ready.set()
+                break
+            with self._lock:
+                session = self._sessions.get(session_id)
+            if session is None:
+                continue
+            if kind == 'closed':
+                session._closed.set()
+            elif kind == 'partial':
+                self.partials += 1
+                session.callback.on_event(ASRResult({'text': payload, 'end_time': None}))
+            elif kind == 'final':
+                text, end_ms = payload
+                self.finals += 1
+                session.callback.on_event(ASRResult({'text': text, 'end_time': end_ms}))
+        if not self._ready.is_set():
+            self._error = self._error or "本地识别进程启动失败"
+            self._ready.set()
+        if not self._closing:
+            # 识别进程意外退出，通知进行中的会话，由守护循环重连（会重新启动识别进程）
+            with self._lock:
+                sessions = list(self._sessions.values())
+                self._process = None
+            for session in sessions:
+                session.callback.on_error(ASRResult(message="本地识别进程已退出"))
+
+    def close(self):
+        """通知识别进程退出并释放共享内存"""
+        self._closing = True
+        if self._process is not None:
+            with self._write_lock:
+                self._ring.write(_SHUTDOWN_SESSION, b'')
+            self._data_ready.release()
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout=1)
+            self._dispatcher = None
+        self._ring.close(unlink=True)
+
+    def get_stats(self) -> dict:
+        records = self._worker_stats[0]
+        return {
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_dropped": self.frames_dropped,
+            "partials": self.partials,
+            "finals": self.finals,
+            "avg_transfer_ms": self._worker_stats[1] / records * 1000 if records else 0.0,
+            "worker_cpu_seconds": self._worker_stats[2],
+        }
+
+def create_asr_backend(name: str = config.ASR_BACKEND):
+    """按配置创建识别后端（即recognition_factory）"""
+    if name == 'dashscope':
+        return DashScopeASRBackend
+    if name == 'local':
+        backend = LocalASRBackend()
+        # 提前启动识别进程，模型加载与其余初始化同时进行
+        backend.start()
+        return backend
+    raise ValueError(f"未知的语音识别后端: {name}")
@@ -1,138 +1,333 @@
 # agent/asr_handler.py
-import pyaudio
 import os
-import dashscope
 import logging
-from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
+from collections import deque
 import config
 import threading
 import time
-import numpy as np
+from .audio_capture import AudioCapture
+from .vad import VADGate
+from .asr_backends import ASRBackendCallback, ASRResult, SessionStopped, DashScopeASRBackend
+from .audio_encoder import AudioEncoderStage
+from utils.tracing import tracer, startup
+from utils.session_recorder import recorder, KIND_ASR_FINAL, KIND_ASR_PARTIAL, KIND_ASR_STATUS
+from utils.logger_setup import utterance_context
 
 logger = logging.getLogger(__name__)
 
+class HandoverStats:
+    """
+    记录每次ASR会话切换所花的时间：断线重连为断开到新会话建立；热备切换为旧会话处理的最后一个音频块
+    到新会话接收的第一个音频块之间的间隔（无缝切换时约为一个音频块的时长）
+    """
+
+    def __init__(self, maxlen: int = 200):
+        self._records = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, seconds: float):
+        with self._lock:
+            self._records.append((kind, seconds))
+        logger.info(f"ASR会话切换({kind})耗时: {seconds * 1000:.0f} ms")
+
+    def summary(self) -> dict:
+        with self._lock:
+            records = list(self._records)
+        result = {}
+        for kind, seconds in records:
+            item = result.setdefault(kind, {"count": 0, "avg_ms": 0.0, "max_ms": 0.0})
+            item["count"] += 1
+            item["avg_ms"] += seconds * 1000
+            item["max_ms"] = max(item["max_ms"], seconds * 1000)
+        for item in result.values():
+            item["avg_ms"] /= item["count"]
+        return result
+
+class ASRCallback(ASRBackendCallback):
+    """单个Recognition会话的回调。只有当前活跃会话的开关状态会影响ASRHandler。"""
+
+    def __init__(self, outer_instance):
+        self.outer = outer_instance
+        self.recognition = None
+
+    def _is_active(self) -> bool:
+        return self.recognition is not None and self.recognition is self.outer.recognition
+
+    def on_open(self) -> None:
+        if self._is_active():
+            logger.info("🎤 语音识别服务已连接，请开始说话...")
+            startup.mark('asr_connected')
+            self.outer._is_running = True
+            self.outer._connection_lost.clear()
+            recorder.record(KIND_ASR_STATUS, "open")
+        else:
+            logger.info("🎤 热备语音识别会话已连接。")
+
+    def on_close(self) -> None:
+        if self._is_active():
+            logger.info("🎤 语音识别服务已关闭。")
+            self.outer._is_running = False
+            recorder.record(KIND_ASR_STATUS, "close")
+        else:
+            logger.debug("非活跃的语音识别会话已关闭。")
+
+    def on_error(self, message) -> None:
+        logger.error(f"语音识别出错: {message.message}")
+        recorder.record(KIND_ASR_STATUS, f"error: {message.message}")
+        if self._is_active() and not self.outer.session_results:
+            # 还没有任何结果就出错，可能是识别服务不接受当前的上传格式
+            self.outer.audio_encoder.on_session_error(message.message)
+        if self._is_active():
+            self.outer._connection_lost.set()
+            self.on_close()
+        else:
+            self.outer._discard_standby(self.recognition)
+
+    def on_event(self, result: ASRResult) -> None:
+        # 旧会话在停止过程中仍可能返回最后一句，照常转发
+        sentence = result.get_sentence()
+        if not sentence or 'text' not in sentence:
+            return
+        if self._is_active():
+            if not self.outer.session_results:
+                self.outer.audio_encoder.on_session_result()
+            self.outer.session_results += 1
+        if ASRResult.is_sentence_end(sentence):
+            user_text = sentence['text']
+            logger.info(f"识别到你说: {user_text}")
+            # 每句话分配一个追踪ID，一直传递到UI
+            trace_id = tracer.new_trace(voice_end=self.outer.last_voiced_at, sentence_end=time.time())
+            recorder.record(KIND_ASR_FINAL, user_text, trace_id)
+            if self.outer.on_sentence_end_callback:
+                with utterance_context(trace_id):
+                    self.outer.on_sentence_end_callback(user_text, trace_id)
+        elif sentence['text']:
+            recorder.record(KIND_ASR_PARTIAL, sentence['text'])
+            if self.outer.on_partial_callback:
+                self.outer.on_partial_callback(sentence['text'])
+
 class ASRHandler:
-    def __init__(self, on_sentence_end_callback):
+    def __init__(self, on_sentence_end_callback, audio_capture: AudioCapture, vad_gate: VADGate = None,
+                 handover_stats: HandoverStats = None, on_partial_callback=None,
+                 recognition_factory=None, audio_encoder: AudioEncoderStage = None):
         self.on_sentence_end_callback = on_sentence_end_callback
-        self.mic = None
-        self.stream = None
+        # 中间结果回调（可选），用于预测生成
+        self.on_partial_callback = on_partial_callback
+        # 音频采集由独立线程负责，麦克风在会话之间保持打开
+        self.audio_capture = audio_capture
+        self.audio_reader = audio_capture.reader
+        # VAD门控决定哪些音频块上传；由外部传入时噪声基底可跨会话保留
+        self.vad_gate = vad_gate or VADGate()
+        self.handover_stats = handover_stats or HandoverStats()
+        # 上传前的编码阶段，由外部传入时回退状态与统计跨会话保留
+        self.audio_encoder = audio_encoder or AudioEncoderStage(config.FORMAT_PCM)
+        # 当前会话创建时使用的上传格式，以及已收到的识别结果数
+        self.session_format = self.audio_encoder.format
+        self.session_results = 0
+        # 识别后端（见asr_backends），也可替换为离线测试用的识别器替身
+        self.recognition_factory = recognition_factory or DashScopeASRBackend
         self.recognition = None
         self._is_running = False
         self._connection_lost = threading.Event()
+        # 是否因静默重置（而非出错）而结束
+        self.ended_by_reset = False
+        # 最后一个有声音频块的时间，用于延迟追踪
+        self.last_voiced_at = None
+
+        # 热备会话：静默重置前提前建立，切换时无需等待连接
+        self._standby = None
+        self._standby_opened_at = None
+        self._standby_format = None
+        self._standby_lock = threading.Lock()
+        self._standby_thread = None
+        self._closing = False
+        # 最近一个音频块处理完（已发送或被门控丢弃）的时刻，以及热备切换前旧会话的最后一个块的时刻
+        self._last_block_at = None
+        self._handover_from = None
 
-        class ASRCallback(RecognitionCallback):
-            def __init__(self, outer_instance):
-                self.outer = outer_instance
-            def on_open(self) -> None:
-                logger.info("🎤 语音识别服务已连接，请开始说话...")
-                try:
-                    self.outer.mic = pyaudio.PyAudio()
-                    self.outer.stream = self.outer.mic.open(
-                        format=pyaudio.paInt16,
-                        channels=config.CHANNELS,
-                        rate=config.SAMPLE_RATE,
-                        input=True
-                    )
-                    self.outer._is_running = True
-                    self.outer._connection_lost.clear()
-                except Exception as e:
-                    logger.error(f"打开麦克风失败: {e}")
-                    self.outer._connection_lost.set()
-            def on_close(self) -> None:
-                logger.info("🎤 语音识别服务已关闭。")
-                self.outer._is_running = False
-                if self.outer.stream:
-                    if self.outer.stream.is_active():
-                        self.outer.stream.stop_stream()
-                    self.outer.stream.close()
-                if self.outer.mic:
-                    self.outer.mic.terminate()
-                self.outer.stream = self.outer.mic = None
-            def on_error(self, message) -> None:
-                logger.error(f"语音识别出错: {message.message}")
-                self.outer._connection_lost.set()
-                self.on_close()
-            def on_event(self, result: RecognitionResult) -> None:
-                sentence = result.get_sentence()
-                if 'text' in sentence and RecognitionResult.is_sentence_end(sentence):
-                    user_text = sentence['text']
-                    logger.info(f"识别到你说: {user_text}")
-                    if self.outer.on_sentence_end_callback:
-                        self.outer.on_sentence_end_callback(user_text)
-        
-        self.callback = ASRCallback(self)
-        self.recognition = Recognition(
+        self.recognition = self._create_recognition()
+
+    def _create_recognition(self):
+        callback = ASRCallback(self)
+        recognition = self.recognition_factory(
             model=config.ASR_MODEL,
-            format=config.FORMAT_PCM,
+            format=self.audio_encoder.format,
             sample_rate=config.SAMPLE_RATE,
-            callback=self.callback
+            callback=callback
         )
+        callback.recognition = recognition
+        return recognition
 
     def start_session(self):
         self.recognition.start()
+        self.audio_encoder.begin_session()
+        self.session_results = 0
+        # 回放断线期间采集到但尚未发送的音频，避免重连时丢字
+        preroll_blocks = int(config.ASR_PREROLL_SECONDS * config.SAMPLE_RATE / config.BLOCK_SIZE)
+        self.audio_reader.begin_session(preroll_blocks)
+        self.vad_gate.reset_session()
         logger.info("ASR会话已启动。")
 
+    def _request_standby(self):
+        """在后台建立热备会话"""
+        if self._standby is not None or (self._standby_thread and self._standby_thread.is_alive()):
+            return
+        self._standby_thread = threading.Thread(target=self._open_standby, name="ASRStandby", daemon=True)
+        self._standby_thread.start()
+
+    def _open_standby(self):
+        try:
+            audio_format = self.audio_encoder.format
+            recognition = self._create_recognition()
+            recognition.start()
+        except Exception as e:
+            logger.warning(f"热备ASR会话建立失败，将退回到普通重连: {e}")
+            return
+        with self._standby_lock:
+            if self._closing or not self._is_running:
+                # 主会话已结束，热备会话不再需要
+                threading.Thread(target=self._stop_recognition, args=(recognition,), daemon=True).start()
+                return
+            self._standby = recognition
+            self._standby_opened_at = time.time()
+            self._standby_format = audio_format
+        logger.info("热备ASR会话已就绪。")
+
+    def _discard_standby(self, recognition):
+        with self._standby_lock:
+            if self._standby is recognition:
+                self._standby = None
+                self._standby_opened_at = None
+
+    def _handover(self) -> float:
+        """切换到热备会话，旧会话在后台停止。返回新会话的建立时间。"""
+        # 切换耗时在新会话接收第一个音频块时记录
+        self._handover_from = self._last_block_at or time.perf_counter()
+        self._end_stream(self.recognition)
+        with self._standby_lock:
+            old, self.recognition = self.recognition, self._standby
+            opened_at = self._standby_opened_at
+            self.session_format = self._standby_format
+            self._standby = None
+            self._standby_opened_at = None
+        self.vad_gate.reset_session()
+        self.audio_encoder.begin_session()
+        self.session_results = 0
+        threading.Thread(target=self._stop_recognition, args=(old,), daemon=True).start()
+        return opened_at
+
+    def _end_stream(self, recognition):
+        """会话停止前发送编码流的结尾（Ogg Opus的EOS页），让识别服务知道这条音频流已完整结束"""
+        data = self.audio_encoder.end_session()
+        if data and recognition is not None:
+            try:
+                recognition.send_audio_frame(data)
+            except Exception as e:
+                logger.debug(f"发送音频流结尾时出错: {e}")
+
+    @staticmethod
+    def _stop_recognition(recognition):
+        try:
+            recognition.stop()
+        except Exception as e:
+            logger.debug(f"停止旧ASR会话时出错: {e}")
+
     def run_audio_loop(self):
         """运行音频发送循环，直到连接断开，并增加了VAD逻辑。"""
-        
+
         # --- VAD 逻辑初始化 ---
         last_speech_time = time.time()
-        
+        standby_at = config.SILENCE_TIMEOUT_SECONDS - config.ASR_STANDBY_LEAD_SECONDS
+
         while self._is_running and not self._connection_lost.is_set():
             try:
-                if self.stream and not self.stream.is_stopped():
-                    data = self.stream.read(config.BLOCK_SIZE, exception_on_overflow=False)
-                    
-                    # --- VAD 核心计算 ---
-                    # 将字节数据转换为numpy数组
-                    audio_data = np.frombuffer(data, dtype=np.int16)
-                    # 计算音量（RMS能量）
-                    if audio_data.size > 0:
-                        # 先将数据转为64位浮点数再计算，避免整数平方溢出问题
-                        audio_data_fp = audio_data.astype(np.float64)
-                        # 计算音量（RMS能量）
-                        energy = np.sqrt(np.mean(audio_data_fp**2))
-                        # logger.debug(f"当前音频能量: {energy:.2f}")  # 注释掉频繁的调试信息
-                    else:
-                        # 如果音频块为空，则能量为0
-                        energy = 0
-                    
-                    # --- VAD 判断逻辑 ---
-                    is_speech = energy > config.VAD_ENERGY_THRESHOLD
+                if self.audio_capture.is_running:
+                    data = self.audio_reader.read(timeout=0.5)
+                    if data is None:
+                        continue
+                    recorder.record_audio(self.audio_reader.read_seq, data)
+
+                    # --- VAD 判断与上传门控 ---
+                    frames = self.vad_gate.process(data)
+                    is_speech = self.vad_gate.is_speech
+                    if self.audio_reader.last_voiced is not None:
+                        # 多路采集时只有算作说话的输入源（例如麦克风）能让静默计时重新开始，游戏声音不算
+                        is_speech = self.audio_reader.last_voiced
                     if is_speech:
+                        last_speech_time = self.last_voiced_at = time.time()
+                    elif self.vad_gate.suppressed:
+                        # 播放回复期间麦克风被屏蔽，不算静默：否则长回复一播完就会重置会话，正好赶上用户接话
                         last_speech_time = time.time()
-                    
+
                     # 在发送前检查会话是否仍然有效
                     if not self._is_running:
+                        self.audio_reader.unread()
+                        break
+
+                    if self.audio_encoder.format != self.session_format:
+                        # 编码已回退为PCM，按新格式重建会话
+                        logger.warning("上传格式已改变，重建ASR会话。")
+                        self.audio_reader.unread()
+                        self.ended_by_reset = True
+                        self.stop()
                         break
 
                     try:
-                        self.recognition.send_audio_frame(data)
-                    except dashscope.common.error.InvalidParameter as e:
-                        # 捕获会话已停止的异常，并优雅地退出
-                        if "Speech recognition has stopped" in str(e):
-                            logger.warning("ASR会话已停止，停止发送音频数据。")
-                            break
-                        else:
-                            raise # 重新抛出其他类型的InvalidParameter异常
-                    
+                        for frame in frames:
+                            data = self.audio_encoder.encode(frame)
+                            if data:
+                                self.recognition.send_audio_frame(data)
+                            if self.audio_encoder.format != self.session_format:
+                                break
+                    except SessionStopped:
+                        # 会话已停止，优雅地退出
+                        logger.warning("ASR会话已停止，停止发送音频数据。")
+                        # 未发送成功的音频块留给下一个会话回放
+                        self.audio_reader.unread()
+                        break
+                    self._last_block_at = time.perf_counter()
+                    if self._handover_from is not None:
+                        self.handover_stats.record("standby", self._last_block_at - self._handover_from)
+                        self._handover_from = None
+
+                    silent_for = time.time() - last_speech_time
+                    if is_speech:
+                        continue
+
+                    # 即将静默重置时，提前建立热备会话
+                    if config.ASR_STANDBY_ENABLED and silent_for > standby_at:
+                        self._request_standby()
+
                     # 静默超时逻辑
-                    if not is_speech and time.time() - last_speech_time > config.SILENCE_TIMEOUT_SECONDS:
+                    if silent_for > config.SILENCE_TIMEOUT_SECONDS:
                         logger.info(f"检测到超过 {config.SILENCE_TIMEOUT_SECONDS} 秒的持续静默，将主动重置连接以保持活性...")
+                        if self._standby is not None:
+                            # 无缝切换到热备会话，新会话的静默计时从其建立时刻开始
+                            last_speech_time = self._handover()
+                            continue
+                        self.ended_by_reset = True
                         self.stop() # 主动停止
                         break # 退出循环，让守护进程接管
 
                 else:
-                    break 
+                    logger.error("音频采集线程已停止。")
+                    self._connection_lost.set()
+                    break
             except (IOError, OSError) as e:
-                logger.error(f"音频读取错误: {e}")
+                logger.error(f"音频发送错误: {e}")
                 self._connection_lost.set()
                 break
-    
+
     def stop(self):
         """外部调用的停止方法。"""
+        with self._standby_lock:
+            self._closing = True
+            standby, self._standby = self._standby, None
+        if standby is not None:
+            self._stop_recognition(standby)
         if self._is_running:
             self._is_running = False
             self._connection_lost.set() # 发送停止信号
             if self.recognition:
+                self._end_stream(self.recognition)
                 self.recognition.stop()
@@ -0,0 +1,281 @@
+# agent/async_runtime.py
+# 异步运行模式：所有LLM流式请求在同一个事件循环中复用连接池，
+# 不再为每个进行中的回复占用一个系统线程。ASR与音频采集仍沿用线程模式。
+import time
+import asyncio
+import logging
+import threading
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError, RateLimitError
+import httpx
+import config
+from ui.webview_window import RefutationWebViewWindow, StreamingAIResponse
+from utils.tracing import tracer, startup
+from utils.session_recorder import recorder, KIND_LLM_REQUEST, KIND_LLM_DELTA, KIND_LLM_END
+from utils.logger_setup import echo_token, finish_token_echo, utterance_context
+from .llm_handler import LLMHandler
+from .hedging import AsyncHedgedStream
+from .llm_dispatcher import LLMDispatcher, LLMJob
+from .main_agent import MainAgent
+
+logger = logging.getLogger(__name__)
+
+class AsyncLLMHandler(LLMHandler):
+    """使用AsyncOpenAI的LLM处理器，get_response为协程"""
+
+    def __init__(self, client: AsyncOpenAI, window: RefutationWebViewWindow, response_cache=None,
+                 memory=None, moderator=None, loop: asyncio.AbstractEventLoop = None):
+        super().__init__(client, window, response_cache=response_cache, memory=memory, moderator=moderator)
+        self.loop = loop
+        self.last_activity = 0.0
+
+    async def prewarm(self):
+        """发一次轻量请求，提前完成DNS、TCP与TLS握手，让连接进入连接池"""
+        started = time.perf_counter()
+        try:
+            await self.client.models.list()
+        except Exception as e:
+            # 即使接口返回错误，连接通常也已经建立
+            logger.debug(f"连接预热请求返回异常: {e}")
+        self.last_activity = time.time()
+        logger.info(f"LLM连接预热完成，耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def keep_warm(self, interval: float = config.LLM_KEEPALIVE_INTERVAL_SECONDS):
+        """空闲时定期预热，避免长时间安静后的首个请求重新握手"""
+        while True:
+            await asyncio.sleep(interval)
+            if time.time() - self.last_activity >= interval:
+                await self.prewarm()
+
+    async def _summarize_async(self, messages: list) -> str:
+        response = await self.client.chat.completions.create(
+            model=config.MEMORY_SUMMARY_MODEL,
+            messages=messages,
+            max_tokens=config.MEMORY_SUMMARY_MAX_TOKENS,
+        )
+        return response.choices[0].message.content
+
+    def summarize(self, messages: list) -> str:
+        """对话记忆在自己的后台线程中调用，请求交给事件循环执行"""
+        return asyncio.run_coroutine_threadsafe(self._summarize_async(messages), self.loop).result(timeout=60)
+
+    async def _replay_cached_async(self, reply: str, job: LLMJob = None):
+        chunk_size = 3
+        interval = chunk_size / config.RESPONSE_CACHE_REPLAY_CHARS_PER_SECOND
+        trace_ids = job.trace_ids if job else None
+        with StreamingAIResponse(self.window, trace_ids=trace_ids) as stream:
+            for i in range(0, len(reply), chunk_size):
+                if job:
+                    job.mark_first_token()
+                    tracer.mark(trace_ids, 'first_token')
+                stream.append(reply[i:i + chunk_size])
+                await asyncio.sleep(interval)
+        logger.info(f"AI回复完成(缓存): {reply}")
+
+    async def get_response(self, text_to_refute: str, job: LLMJob = None):
+        """获取AI回复并通过WebView显示（协程）。任务被取消时关闭进行中的流。"""
+        if not self.client or not self.window:
+            logger.error("LLM客户端或WebView窗口未初始化！")
+            return
+
+        if job and job.is_cancelled():
+            logger.info(f"请求已被取消，跳过: {text_to_refute}")
+            return
+
+        logger.info("[🤖 AI杠精 正在思考...]")
+        self.window.add_user_message(text_to_refute)
+        self.last_activity = time.time()
+
+        context = self.prompt_context()
+        if self.response_cache:
+            cached = self.response_cache.get(text_to_refute, context.cache_namespace, config.LLM_MODEL)
+            if cached is not None:
+                cached, aborted = self.moderate_cached(text_to_refute, cached, context)
+                await self._replay_cached_async(cached, job)
+                if not aborted:
+                    self.remember(text_to_refute, cached, job, context)
+                return cached
+
+        trace_ids = job.trace_ids if job else None
+        tag = job.utterance_id if job else None
+        recorder.record(KIND_LLM_REQUEST, text_to_refute, tag)
+        try:
+            tracer.mark(trace_ids, 'llm_request')
+            hedged = AsyncHedgedStream(self, text_to_refute, self.hedge_policy, context)
+            logger.info("[🤖 AI杠精 生成中...]")
+            moderation = self.moderator.begin() if self.moderator else None
+            deltas = moderation.afilter(hedged) if moderation is not None else hedged
+
+            response_text = ""
+            try:
+                with StreamingAIResponse(self.window, trace_ids=trace_ids) as stream:
+                    async for content in deltas:
+                        if job:
+                            job.mark_first_token()
+                        tracer.mark(trace_ids, 'first_token')
+                        response_text += content
+                        recorder.record(KIND_LLM_DELTA, content, tag)
+                        stream.append(content)
+                        echo_token(content)
+                    tracer.mark(trace_ids, 'last_token')
+            finally:
+                await hedged.aclose()
+                self.last_activity = time.time()
+
+            finish_token_echo()
+            if moderation is not None and moderation.aborted:
+                # 命中需要中止的违禁词：流已在上面关闭，这条回复不缓存也不计入对话记忆
+                recorder.record(KIND_LLM_END, "moderated", tag)
+                logger.warning(f"AI回复命中违禁词，已中止: {response_text}")
+                return response_text
+            model = hedged.model or config.LLM_MODEL
+            recorder.record(KIND_LLM_END, model, tag)
+            logger.info(f"AI回复完成({model}): {response_text}")
+            if self.response_cache:
+                self.response_cache.put(text_to_refute, context.cache_namespace, model, response_text)
+            self.remember(text_to_refute, response_text, job, context)
+            return response_text
+
+        except asyncio.CancelledError:
+            logger.info("[🤖 AI杠精] 回复已被更新的句子取代，已中止。")
+            recorder.record(KIND_LLM_END, "cancelled", tag)
+            raise
+        except APIConnectionError as e:
+            logger.error(f"LLM网络连接失败: {e.__cause__}")
+        except RateLimitError:
+            logger.warning("LLM请求频率过高，请稍后再试。")
+        except Exception as e:
+            logger.error(f"调用大模型时发生未知错误: {e}", exc_info=True)
+
+class AsyncLLMDispatcher(LLMDispatcher):
+    """
+    异步版调度器。排队、合并与抢占策略与线程版相同，
+    工作者是事件循环中的任务，取消请求时直接取消对应的任务。
+    """
+
+    def __init__(self, handler, loop: asyncio.AbstractEventLoop, **kwargs):
+        super().__init__(handler, **kwargs)
+        self.loop = loop
+        self._wakeup = None
+        self._tasks = []
+        self._running_jobs = {}  # task -> job
+
+    def start(self):
+        """启动工作任务（可在任意线程调用）"""
+        asyncio.run_coroutine_threadsafe(self._start_tasks(), self.loop).result()
+        logger.info(f"异步LLM调度器已启动: {self.max_workers}个工作任务，排队策略={self.policy}，抢占模式={self.preempt_mode}")
+
+    async def _start_tasks(self):
+        if self._tasks:
+            return
+        with self._cond:
+            self._stopped = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(), name=f"LLMWorker-{i}") for i in range(self.max_workers)]
+
+    def _notify_workers(self):
+        if self._wakeup is not None:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _cancel_job_task(self, task, job):
+        # 在事件循环线程中执行，确认该任务仍在处理这个请求后再取消
+        if self._running_jobs.get(task) is job:
+            task.cancel()
+
+    async def _worker(self):
+        task = asyncio.current_task()
+        while True:
+            self._wakeup.clear()
+            with self._cond:
+                if self._stopped:
+                    return
+                job = self._take_job() if self._pending else None
+            if job is None:
+                await self._wakeup.wait()
+                continue
+
+            self._running_jobs[task] = job
+            job.set_cancel_callback(lambda: self.loop.call_soon_threadsafe(self._cancel_job_task, task, job))
+            try:
+                with utterance_context(job.utterance_id):
+                    await self._handler(job.text, job)
+            except asyncio.CancelledError:
+                if not job.is_cancelled():
+                    raise
+                # 只是取消了当前请求，工作任务继续运行
+                task.uncancel()
+            except Exception as e:
+                logger.error(f"LLM工作任务处理请求时发生异常: {e}", exc_info=True)
+            finally:
+                self._running_jobs.pop(task, None)
+                self._finish_job(job)
+
+    def _join_workers(self):
+        tasks, self._tasks = self._tasks, []
+        if not tasks or self.loop.is_closed():
+            return
+        self._notify_workers()
+
+        async def wait_tasks():
+            await asyncio.wait(tasks, timeout=2)
+
+        try:
+            asyncio.run_coroutine_threadsafe(wait_tasks(), self.loop).result(timeout=3)
+        except Exception as e:
+            logger.warning(f"等待LLM工作任务退出时出错: {e}")
+
+class AsyncMainAgent(MainAgent):
+    """
+    异步运行模式的Agent。LLM请求在后台事件循环中通过AsyncOpenAI发出，
+    HTTP连接池大小固定并保持长连接，启动时预热、空闲时保持温热。
+    """
+
+    supports_speculation = False
+
+    def _create_llm_pipeline(self, base_url: str):
+        # 事件循环与客户端归本Agent所有，停止时一并关闭（服务模式下由多个会话共享，见server/session.py）
+        self._owns_loop = True
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="AsyncAgentLoop", daemon=True)
+        self._loop_thread.start()
+        self._keepalive_task = None
+
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=config.LLM_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=config.LLM_POOL_MAX_CONNECTIONS,
+                keepalive_expiry=config.LLM_POOL_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+        )
+        self.llm_client = AsyncOpenAI(api_key=self.api_key, base_url=base_url, http_client=http_client)
+        logger.info(f"异步大模型客户端已初始化（连接池上限 {config.LLM_POOL_MAX_CONNECTIONS}）。")
+
+        self.llm_handler = AsyncLLMHandler(self.llm_client, self.window, response_cache=self.response_cache,
+                                           memory=self.conversation_memory, moderator=self.moderator,
+                                           loop=self._loop)
+        self.llm_dispatcher = AsyncLLMDispatcher(self.llm_handler.get_response, self._loop)
+
+    async def _warm_up(self):
+        with startup.step('llm_prewarm'):
+            await self.llm_handler.prewarm()
+        self._keepalive_task = asyncio.create_task(self.llm_handler.keep_warm())
+
+    def _start_llm_warm_up(self):
+        """预热在事件循环中进行，之后空闲时保持连接温热"""
+        if config.LLM_PREWARM_ENABLED:
+            asyncio.run_coroutine_threadsafe(self._warm_up(), self._loop)
+
+    async def _shutdown(self):
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        await self.llm_client.close()
+
+    def stop(self):
+        super().stop()
+        if not self._owns_loop or self._loop.is_closed() or not self._loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=3)
+        except Exception as e:
+            logger.warning(f"关闭异步客户端时出错: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=2)
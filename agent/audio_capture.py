@@ -0,0 +1,259 @@
+# agent/audio_capture.py
+import threading
+import logging
+import numpy as np
+import config
+
+try:
+    import pyaudio
+except ImportError:  # 离线基准测试等场景可以不安装PyAudio，改用其他音频输入源
+    pyaudio = None
+
+logger = logging.getLogger(__name__)
+
+# PortAudio的输入溢出错误码（paInputOverflowed）
+PA_INPUT_OVERFLOWED = -9981
+
+class AudioRingBuffer:
+    """
+    单生产者/单消费者的无锁环形缓冲区，存储空间在创建时一次性分配。
+    生产者只修改写序号，消费者只修改自己的读序号；消费者读取后再校验写序号，
+    若该块已被覆盖则视为溢出并跳到最旧的有效块（类似seqlock）。
+    """
+
+    def __init__(self, capacity_blocks: int, block_size: int = config.BLOCK_SIZE):
+        self.capacity = max(2, capacity_blocks)
+        self.block_size = block_size
+        self._buf = np.zeros((self.capacity, block_size), dtype=np.int16)
+        # 每个块是否有“算作说话”的输入源发声，由多路混音采集写入；单路采集时不使用
+        self._voiced = np.zeros(self.capacity, dtype=bool)
+        self.has_voice_flags = False
+        self._write_seq = 0  # 已写入的块总数
+        self._data_ready = threading.Event()
+
+    @property
+    def write_seq(self) -> int:
+        return self._write_seq
+
+    def write(self, data: bytes, voiced: bool = None):
+        """写入一个音频块（仅由采集线程调用）"""
+        self.write_samples(np.frombuffer(data, dtype=np.int16), voiced)
+
+    def write_samples(self, samples: np.ndarray, voiced: bool = None):
+        """把样本直接写入槽位，浮点样本截断为int16，不产生中间数组"""
+        index = self._write_seq % self.capacity
+        slot = self._buf[index]
+        n = min(samples.size, self.block_size)
+        np.copyto(slot[:n], samples[:n], casting='unsafe')
+        if n < self.block_size:
+            slot[n:] = 0
+        if voiced is not None:
+            self._voiced[index] = voiced
+            self.has_voice_flags = True
+        # 先写数据再发布序号
+        self._write_seq += 1
+        self._data_ready.set()
+
+    def read_block(self, seq: int):
+        """读取序号为seq的块副本；若该块已被覆盖则返回None"""
+        data = self._buf[seq % self.capacity].tobytes()
+        # 写序号达到seq+capacity时，生产者可能正在覆盖该槽位
+        if self._write_seq - seq >= self.capacity:
+            return None
+        return data
+
+    def is_voiced(self, seq: int):
+        """序号为seq的块是否有说话声；没有逐块标记时返回None"""
+        if not self.has_voice_flags:
+            return None
+        return bool(self._voiced[seq % self.capacity])
+
+    def wait_for_data(self, timeout: float) -> bool:
+        ready = self._data_ready.wait(timeout)
+        self._data_ready.clear()
+        return ready
+
+    def reader(self) -> "RingReader":
+        return RingReader(self)
+
+class RingReader:
+    """环形缓冲区的读取游标。游标在ASR会话之间保持不变，因此断线期间的音频可在新会话中回放。"""
+
+    def __init__(self, ring: AudioRingBuffer):
+        self.ring = ring
+        self.read_seq = ring.write_seq
+        self.overflows = 0       # 因发送过慢被覆盖而丢失的块数
+        self.replayed_blocks = 0 # 在新会话中回放的块数
+        self.replay_sessions = 0
+        # 最近读出的块是否有说话声（见AudioRingBuffer.is_voiced）
+        self.last_voiced = None
+
+    @property
+    def backlog(self) -> int:
+        return self.ring.write_seq - self.read_seq
+
+    def read(self, timeout: float = 0.5):
+        """读取下一个音频块，超时无数据时返回None"""
+        while True:
+            lag = self.ring.write_seq - self.read_seq
+            if lag <= 0:
+                if not self.ring.wait_for_data(timeout):
+                    return None
+                continue
+            if lag > self.ring.capacity - 1:
+                # 写入端已追上读取端，跳到最旧的有效块
+                skipped = lag - (self.ring.capacity - 1)
+                self.read_seq += skipped
+                self.overflows += skipped
+                logger.warning(f"音频发送落后，丢弃了{skipped}个被覆盖的音频块。")
+                continue
+            data = self.ring.read_block(self.read_seq)
+            if data is None:
+                continue
+            self.last_voiced = self.ring.is_voiced(self.read_seq)
+            self.read_seq += 1
+            return data
+
+    def unread(self, blocks: int = 1):
+        """把游标回退若干块，使其在下次读取时重新发送（例如发送失败时）"""
+        self.read_seq = max(self.read_seq - blocks, self.ring.write_seq - (self.ring.capacity - 1), 0)
+
+    def begin_session(self, max_preroll_blocks: int):
+        """新会话开始时调用：保留最多max_preroll_blocks块未发送的音频用于回放"""
+        backlog = self.backlog
+        if backlog > max_preroll_blocks:
+            self.read_seq += backlog - max_preroll_blocks
+            backlog = max_preroll_blocks
+        if backlog > 0:
+            self.replayed_blocks += backlog
+            self.replay_sessions += 1
+            logger.info(f"新ASR会话将回放{backlog}个音频块"
+                        f"（约{backlog * self.ring.block_size / config.SAMPLE_RATE:.1f}秒）。")
+
+class PyAudioSource:
+    """
+    默认的音频输入源：通过PyAudio打开麦克风。
+    device可以是设备序号或设备名称的一部分（例如立体声混音、loopback/monitor设备），为空时使用默认麦克风；
+    指定设备时默认使用该设备自己的采样率和声道数，由混音器重采样。
+    """
+
+    def __init__(self, block_size: int = config.BLOCK_SIZE, device=None, rate: int = None, channels: int = None):
+        if pyaudio is None:
+            raise RuntimeError("未安装PyAudio，无法打开麦克风。")
+        self.mic = pyaudio.PyAudio()
+        try:
+            device_index = None
+            if device is not None:
+                info = self._find_device(device)
+                device_index = info['index']
+                rate = rate or int(info['defaultSampleRate'])
+                channels = channels or min(2, int(info['maxInputChannels']))
+                logger.info(f"打开音频输入设备: {info['name']}（{rate} Hz，{channels}声道）")
+            self.rate = rate or config.SAMPLE_RATE
+            self.channels = channels or config.CHANNELS
+            # 每次读取的帧数与block_size对应相同的时长
+            frames_per_buffer = block_size * self.rate // config.SAMPLE_RATE
+            self.stream = self.mic.open(
+                format=pyaudio.paInt16,
+                channels=self.channels,
+                rate=self.rate,
+                input=True,
+                input_device_index=device_index,
+                frames_per_buffer=frames_per_buffer,
+            )
+        except Exception:
+            self.mic.terminate()
+            raise
+
+    def _find_device(self, device) -> dict:
+        if isinstance(device, int):
+            return self.mic.get_device_info_by_index(device)
+        for i in range(self.mic.get_device_count()):
+            info = self.mic.get_device_info_by_index(i)
+            if device.lower() in info['name'].lower() and info['maxInputChannels'] > 0:
+                return info
+        raise RuntimeError(f"找不到音频输入设备: {device}")
+
+    def read(self, frames: int) -> bytes:
+        return self.stream.read(frames, exception_on_overflow=True)
+
+    def close(self):
+        if self.stream.is_active():
+            self.stream.stop_stream()
+        self.stream.close()
+        self.mic.terminate()
+
+class AudioCapture:
+    """
+    独立的音频采集线程（生产者）。
+    只负责从音频输入源读取音频块并写入环形缓冲区，网络发送的卡顿不会再阻塞采集。
+    麦克风在多个ASR会话之间保持打开。source_factory可替换输入源（例如离线测试用的WAV文件）。
+    """
+
+    def __init__(self, block_size: int = config.BLOCK_SIZE,
+                 ring_seconds: float = config.AUDIO_RING_SECONDS,
+                 source_factory=None):
+        self.block_size = block_size
+        capacity = int(ring_seconds * config.SAMPLE_RATE / block_size) + 1
+        self.ring = AudioRingBuffer(capacity, block_size)
+        self.reader = self.ring.reader()
+        self.source_factory = source_factory or PyAudioSource
+        self.source = None
+        self._thread = None
+        self._running = False
+        self.device_overflows = 0  # 声卡缓冲区溢出次数
+
+    @property
+    def is_running(self) -> bool:
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """打开音频输入源并启动采集线程"""
+        if self.is_running:
+            return
+        self.source = self.source_factory(block_size=self.block_size)
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, name="AudioCapture", daemon=True)
+        self._thread.start()
+        logger.info("🎤 麦克风已打开，音频采集线程已启动。")
+
+    def _capture_loop(self):
+        while self._running:
+            try:
+                data = self.source.read(self.block_size)
+            except (IOError, OSError) as e:
+                if getattr(e, 'errno', None) == PA_INPUT_OVERFLOWED:
+                    self.device_overflows += 1
+                    logger.warning(f"声卡输入缓冲区溢出（累计{self.device_overflows}次）。")
+                    continue
+                if self._running:
+                    logger.error(f"音频读取错误: {e}")
+                break
+            self.ring.write(data)
+        self._running = False
+        self._close_device()
+
+    def _close_device(self):
+        try:
+            if self.source:
+                self.source.close()
+        except Exception as e:
+            logger.debug(f"关闭音频设备时出错: {e}")
+        self.source = None
+
+    def stop(self):
+        """停止采集并关闭麦克风"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        logger.info("🎤 音频采集已停止。")
+
+    def get_stats(self) -> dict:
+        return {
+            "device_overflows": self.device_overflows,
+            "ring_overflows": self.reader.overflows,
+            "replayed_blocks": self.reader.replayed_blocks,
+            "replay_sessions": self.reader.replay_sessions,
+            "backlog_blocks": self.reader.backlog,
+        }
@@ -0,0 +1,275 @@
+# agent/audio_encoder.py
+# 上传前的音频编码：VAD门控之后、send_audio_frame之前把PCM编码为Ogg封装的Opus，降低上行带宽。
+# 需要opuslib与系统的libopus；缺少时或识别服务不接受时自动回退为原始PCM。
+import time
+import struct
+import logging
+import threading
+import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import opuslib
+except Exception:  # 没有libopus时opuslib在导入时就会抛出普通Exception
+    opuslib = None
+
+def _ogg_crc_table() -> list:
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04C11DB7) if r & 0x80000000 else (r << 1)
+        table.append(r & 0xFFFFFFFF)
+    return table
+
+_OGG_CRC_TABLE = _ogg_crc_table()
+
+def ogg_crc(data: bytes) -> int:
+    """Ogg页校验和（CRC-32，多项式0x04C11DB7，不反转，与zlib.crc32不同）"""
+    crc = 0
+    table = _OGG_CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[((crc >> 24) ^ byte) & 0xFF]
+    return crc
+
+class OggOpusWriter:
+    """把Opus包封装成Ogg页（RFC 7845）。每次flush输出一页，便于按音频块实时上传。"""
+
+    _PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+
+    def __init__(self, sample_rate: int, channels: int, pre_skip: int, serial: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.pre_skip = pre_skip
+        self.serial = serial
+        self._sequence = 0
+        # 粒度位置固定以48kHz计
+        self._granule = pre_skip
+        self._packets = []          # [(包, 到这个包结束为止的粒度位置)]
+
+    def _page(self, packets: list, granule: int, header_type: int = 0) -> bytes:
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+        header = self._PAGE_HEADER.pack(b'OggS', 0, header_type, granule, self.serial, self._sequence, 0, len(lacing))
+        page = bytearray(header + lacing + b''.join(packets))
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+        self._sequence += 1
+        return bytes(page)
+
+    def headers(self) -> bytes:
+        """流开头的OpusHead与OpusTags两页"""
+        head = struct.pack('<8sBBHIhB', b'OpusHead', 1, self.channels, self.pre_skip, self.sample_rate, 0, 0)
+        vendor = b'refutation-agent'
+        tags = struct.pack('<8sI', b'OpusTags', len(vendor)) + vendor + struct.pack('<I', 0)
+        return self._page([head], 0, header_type=0x02) + self._page([tags], 0)
+
+    def add(self, packet: bytes, samples: int):
+        self._granule += samples * 48000 // self.sample_rate
+        self._packets.append((packet, self._granule))
+
+    def trim_end(self, samples: int):
+        """流末尾补齐的静音不计入粒度位置，解码端据此裁掉（RFC 7845 第4.5节）。在加入最后一个包之后调用"""
+        self._granule -= samples * 48000 // self.sample_rate
+        if self._packets:
+            self._packets[-1] = (self._packets[-1][0], self._granule)
+
+    def flush(self, eos: bool = False) -> bytes:
+        """把已加入的包写成页；每页最多255个分段，超出时拆成多页。eos为True时最后一页带流结束标记"""
+        pages = bytearray()
+        while self._packets:
+            count, segments = 0, 0
+            for packet, _ in self._packets:
+                needed = len(packet) // 255 + 1
+                if segments + needed > 255 and count:
+                    break
+                segments += needed
+                count += 1
+            batch, self._packets = self._packets[:count], self._packets[count:]
+            # 包不跨页，每页的粒度位置就是页上最后一个包结束时的位置
+            pages += self._page([packet for packet, _ in batch], batch[-1][1],
+                                header_type=0x04 if eos and not self._packets else 0)
+        return bytes(pages)
+
+class PCMEncoder:
+    """不编码，原样上传"""
+
+    format = config.FORMAT_PCM
+
+    def begin_stream(self) -> bytes:
+        return b''
+
+    def encode(self, pcm: bytes) -> bytes:
+        return pcm
+
+    def end_stream(self) -> bytes:
+        return b''
+
+class OpusEncoder:
+    """PCM → Ogg Opus。按frame_ms切帧，不足一帧的尾部留到下一块；每个输入块输出一页或多页。"""
+
+    format = 'opus'
+
+    def __init__(self, sample_rate: int = config.SAMPLE_RATE, channels: int = config.CHANNELS,
+                 bitrate: int = config.ASR_OPUS_BITRATE, frame_ms: int = config.ASR_OPUS_FRAME_MS):
+        if opuslib is None:
+            raise RuntimeError("未安装opuslib或找不到libopus")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bitrate = bitrate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self._encoder = None
+        self._writer = None
+        self._serial = 0
+        self._pending = b''
+
+    def begin_stream(self) -> bytes:
+        """每个识别会话是一条新的Ogg流，返回流头"""
+        self._encoder = opuslib.Encoder(self.sample_rate, self.channels, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = self.bitrate
+        self._encoder.signal = opuslib.SIGNAL_VOICE
+        pre_skip = self._encoder.lookahead * 48000 // self.sample_rate
+        self._serial += 1
+        self._writer = OggOpusWriter(self.sample_rate, self.channels, pre_skip, self._serial)
+        self._pending = b''
+        return self._writer.headers()
+
+    def encode(self, pcm: bytes) -> bytes:
+        data = self._pending + pcm
+        frame_bytes = self.frame_samples * 2 * self.channels
+        usable = len(data) - len(data) % frame_bytes
+        for offset in range(0, usable, frame_bytes):
+            packet = self._encoder.encode(data[offset:offset + frame_bytes], self.frame_samples)
+            self._writer.add(packet, self.frame_samples)
+        self._pending = data[usable:]
+        return self._writer.flush()
+
+    def end_stream(self) -> bytes:
+        """结束当前Ogg流：不足一帧的尾部补静音编码成最后一个包，最后一页带EOS标记"""
+        if self._writer is None:
+            return b''
+        frame_bytes = self.frame_samples * 2 * self.channels
+        valid = len(self._pending) // (2 * self.channels)
+        packet = self._encoder.encode(self._pending.ljust(frame_bytes, b'\x00'), self.frame_samples)
+        self._writer.add(packet, self.frame_samples)
+        self._writer.trim_end(self.frame_samples - valid)
+        self._pending = b''
+        data, self._writer = self._writer.flush(eos=True), None
+        return data
+
+class AudioEncoderStage:
+    """
+    音频上传编码阶段，跨ASR会话保留。识别会话以format属性创建；编码器不可用、编码出错，
+    或使用压缩格式的会话连续若干次在出结果前就出错时，回退为PCM并保持不变。
+    """
+
+    def __init__(self, audio_format: str = config.ASR_AUDIO_FORMAT,
+                 fallback_errors: int = config.ASR_ENCODER_FALLBACK_ERRORS):
+        self.fallback_errors = fallback_errors
+        self.encoder = PCMEncoder()
+        if audio_format == 'opus':
+            try:
+                self.encoder = OpusEncoder()
+            except Exception as e:
+                logger.warning(f"Opus编码不可用，改为上传PCM: {e}")
+        elif audio_format != config.FORMAT_PCM:
+            logger.warning(f"不支持的上传格式{audio_format}，改为上传PCM。")
+        self._lock = threading.Lock()
+        self._session_errors = 0
+        self._header = b''
+        self._ended = False
+
+        # 统计信息
+        self.fallbacks = 0
+        self.pcm_bytes = 0
+        self.sent_bytes = 0
+        self.encode_cpu = 0.0
+
+    @property
+    def format(self) -> str:
+        return self.encoder.format
+
+    def begin_session(self):
+        """新的识别会话开始（包括热备切换），下一次编码的输出带上流头"""
+        with self._lock:
+            self._header = self._run(self.encoder.begin_stream)
+            self._ended = False
+
+    def end_session(self) -> bytes:
+        """
+        识别会话结束（包括热备切换前的旧会话），返回要在这个会话上发送的流尾；
+        之后的编码输出为空，直到下一次begin_session
+        """
+        with self._lock:
+            if self._ended:
+                return b''
+            self._ended = True
+            if self._header:
+                # 这个会话还没有发送过任何音频，流头也没有发出去
+                self._header = b''
+                return b''
+            data = self._run(self.encoder.end_stream)
+            self.sent_bytes += len(data)
+            return data
+
+    def _run(self, func, *args) -> bytes:
+        started = time.thread_time()
+        try:
+            return func(*args)
+        except Exception as e:
+            self._fall_back(f"编码出错: {e}")
+            return b''
+        finally:
+            self.encode_cpu += time.thread_time() - started
+
+    def encode(self, pcm: bytes) -> bytes:
+        """编码一个音频块，返回要发送的数据（可能为空）"""
+        with self._lock:
+            if self._ended:
+                return b''
+            encoder = self.encoder
+            data = self._run(encoder.encode, pcm)
+            if self.encoder is not encoder:
+                # 编码出错已回退，本会话的格式不再可用
+                return b''
+            if self._header:
+                data, self._header = self._header + data, b''
+            self.pcm_bytes += len(pcm)
+            self.sent_bytes += len(data)
+            return data
+
+    def _fall_back(self, reason: str):
+        if isinstance(self.encoder, PCMEncoder):
+            return
+        logger.warning(f"音频上传回退为PCM（{reason}）")
+        self.encoder = PCMEncoder()
+        self._header = b''
+        self.fallbacks += 1
+
+    def on_session_result(self):
+        """会话已经返回识别结果，说明识别服务接受当前格式"""
+        self._session_errors = 0
+
+    def on_session_error(self, message: str):
+        """会话在返回任何结果前出错"""
+        if isinstance(self.encoder, PCMEncoder):
+            return
+        self._session_errors += 1
+        if self._session_errors >= self.fallback_errors:
+            with self._lock:
+                self._fall_back(f"连续{self._session_errors}个会话在出结果前出错: {message}")
+
+    def get_stats(self) -> dict:
+        audio_seconds = self.pcm_bytes / (config.SAMPLE_RATE * 2 * config.CHANNELS)
+        return {
+            "format": self.format,
+            "fallbacks": self.fallbacks,
+            "audio_seconds": audio_seconds,
+            "pcm_bytes": self.pcm_bytes,
+            "sent_bytes": self.sent_bytes,
+            "bytes_saved": self.pcm_bytes - self.sent_bytes,
+            "saved_ratio": 1 - self.sent_bytes / self.pcm_bytes if self.pcm_bytes else 0.0,
+            "upload_kbps": self.sent_bytes * 8 / 1000 / audio_seconds if audio_seconds else 0.0,
+            "encode_cpu_ms_per_second": self.encode_cpu * 1000 / audio_seconds if audio_seconds else 0.0,
+        }
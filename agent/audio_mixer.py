@@ -0,0 +1,295 @@
+# agent/audio_mixer.py
+# 多路音频采集：同时采集麦克风与系统声音（loopback/monitor设备）等多个输入源，
+# 每路单独重采样、增益与VAD，按块对齐后混音写入同一个环形缓冲区。
+import time
+import threading
+import logging
+import numpy as np
+import config
+from .audio_capture import AudioCapture, PA_INPUT_OVERFLOWED
+from .vad import create_vad
+
+logger = logging.getLogger(__name__)
+
+class BlockResampler:
+    """
+    把一个输入块（任意采样率、单/多声道int16）转换为out_frames个float32样本。
+    采样率为整数倍时按块平均抽取（兼作简单的低通），否则线性插值；所有中间结果复用预分配缓冲区。
+    """
+
+    def __init__(self, in_rate: int, channels: int = 1, out_frames: int = config.BLOCK_SIZE,
+                 out_rate: int = config.SAMPLE_RATE):
+        self.in_rate = in_rate
+        self.channels = channels
+        self.out_frames = out_frames
+        self.in_frames = out_frames * in_rate // out_rate
+        self._mono = np.zeros(self.in_frames, dtype=np.float32)
+        self._out = np.empty(out_frames, dtype=np.float32)
+
+        if in_rate == out_rate:
+            self.mode = 'copy'
+        elif in_rate % out_rate == 0:
+            self.mode = 'decimate'
+            self._factor = in_rate // out_rate
+        else:
+            self.mode = 'linear'
+            positions = np.arange(out_frames, dtype=np.float64) * (self.in_frames / out_frames)
+            self._idx0 = np.minimum(positions.astype(np.intp), self.in_frames - 1)
+            self._idx1 = np.minimum(self._idx0 + 1, self.in_frames - 1)
+            self._frac = (positions - self._idx0).astype(np.float32)
+            self._tmp = np.empty(out_frames, dtype=np.float32)
+
+    def process(self, data: bytes) -> np.ndarray:
+        """返回内部缓冲区的视图，下次调用时会被覆盖"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        n = min(samples.size // self.channels, self.in_frames)
+        mono = self._mono
+        if n < self.in_frames:
+            mono[n:] = 0
+        if self.channels == 1:
+            np.copyto(mono[:n], samples[:n], casting='unsafe')
+        else:
+            frames = samples[:n * self.channels].reshape(n, self.channels)
+            np.add.reduce(frames, axis=1, dtype=np.float32, out=mono[:n])
+            mono *= 1.0 / self.channels
+
+        if self.mode == 'copy':
+            return mono
+        out = self._out
+        if self.mode == 'decimate':
+            np.mean(mono.reshape(-1, self._factor), axis=1, out=out)
+        else:
+            np.take(mono, self._idx0, out=out)
+            np.take(mono, self._idx1, out=self._tmp)
+            self._tmp -= out
+            self._tmp *= self._frac
+            out += self._tmp
+        return out
+
+class SourceChannel:
+    """
+    一路输入源：读取、重采样、增益、VAD，结果写入本路的小型SPSC队列，由混音端按块取出。
+    同时统计本路的CPU耗时（不含阻塞读取）与相对系统时钟的漂移。
+    """
+
+    def __init__(self, name: str, source, gain: float = 1.0, keep_alive: bool = True, gate: bool = True,
+                 block_size: int = config.BLOCK_SIZE, queue_blocks: int = 8):
+        self.name = name
+        self.source = source
+        self.gain = gain
+        # 该输入源有声音时是否算作“在说话”，决定能否重置静默计时
+        self.keep_alive = keep_alive
+        # 是否只在本路VAD判定有声时才混入（压低多路底噪叠加）
+        self.gate = gate
+        self.rate = getattr(source, 'rate', config.SAMPLE_RATE)
+        self.resampler = BlockResampler(self.rate, getattr(source, 'channels', config.CHANNELS), block_size)
+        self.vad = create_vad(block_size=block_size)
+        self.hangover_blocks = config.VAD_HANGOVER_BLOCKS
+        self._hangover = 0
+        self.is_speech = False
+
+        self._queue = np.zeros((max(2, queue_blocks), block_size), dtype=np.float32)
+        self._speech = np.zeros(self._queue.shape[0], dtype=bool)
+        self._write_seq = 0
+        self._read_seq = 0
+
+        # 统计信息
+        self.blocks = 0
+        self.speech_blocks = 0
+        self.cpu_seconds = 0.0
+        self.underruns = 0   # 混音时本路没有新块，补静音
+        self.dropped = 0     # 本路积压过多（时钟偏快），丢弃最旧的块
+        self.overflows = 0
+        self._frames_read = 0
+        self._clock_started = None
+        self._last_read_at = None
+
+    @property
+    def backlog(self) -> int:
+        return self._write_seq - self._read_seq
+
+    def capture_once(self):
+        """阻塞读取一个块并处理（在本路的采集线程中调用）"""
+        data = self.source.read(self.resampler.in_frames)
+        now = time.monotonic()
+        if self._clock_started is None:
+            # 以第一块读完的时刻为起点，之后按帧数与墙钟时间对比估算漂移
+            self._clock_started = now
+        else:
+            self._frames_read += self.resampler.in_frames
+        self._last_read_at = now
+
+        started = time.thread_time()
+        samples = self.resampler.process(data)
+        if self.gain != 1.0:
+            samples *= self.gain
+        if self.vad.process(samples):
+            self._hangover = self.hangover_blocks
+            self.is_speech = True
+        elif self._hangover > 0:
+            self._hangover -= 1
+        else:
+            self.is_speech = False
+
+        index = self._write_seq % self._queue.shape[0]
+        np.copyto(self._queue[index], samples)
+        self._speech[index] = self.is_speech
+        self._write_seq += 1
+        self.blocks += 1
+        self.speech_blocks += self.is_speech
+        self.cpu_seconds += time.thread_time() - started
+
+    def take(self, max_lag: int):
+        """取出下一块用于混音，返回(样本, 是否有声)；没有新块时返回(None, False)"""
+        backlog = self._write_seq - self._read_seq
+        if backlog <= 0:
+            self.underruns += 1
+            return None, False
+        if backlog > max_lag:
+            # 本路时钟偏快，跳过积压的旧块以保持对齐
+            skipped = backlog - 1
+            self._read_seq += skipped
+            self.dropped += skipped
+        index = self._read_seq % self._queue.shape[0]
+        self._read_seq += 1
+        return self._queue[index], bool(self._speech[index])
+
+    def drift_ppm(self) -> float:
+        """输入源实际采样率相对标称值的偏差（百万分之一），需要运行一段时间才准确"""
+        if self._clock_started is None:
+            return 0.0
+        elapsed = self._last_read_at - self._clock_started
+        if elapsed < 1.0:
+            return 0.0
+        return (self._frames_read / (elapsed * self.rate) - 1.0) * 1e6
+
+    def get_stats(self) -> dict:
+        block_seconds = self.resampler.out_frames / config.SAMPLE_RATE
+        cpu_per_block = self.cpu_seconds / self.blocks if self.blocks else 0.0
+        return {
+            "rate": self.rate,
+            "resample": self.resampler.mode,
+            "blocks": self.blocks,
+            "speech_ratio": self.speech_blocks / self.blocks if self.blocks else 0.0,
+            "cpu_us_per_block": cpu_per_block * 1e6,
+            "cpu_realtime_pct": cpu_per_block / block_seconds * 100,
+            "drift_ppm": self.drift_ppm(),
+            "underruns": self.underruns,
+            "dropped": self.dropped,
+            "device_overflows": self.overflows,
+        }
+
+class MixingAudioCapture(AudioCapture):
+    """
+    多路音频采集器，接口与AudioCapture相同。
+    第一路输入源（通常是麦克风）作为主时钟：每读到一块，就从其他各路取出对齐的一块，
+    按增益混音后直接写入环形缓冲区的int16槽位，并标记该块是否有算作说话的声音。
+    其他各路各有一个采集线程，时钟偏差通过丢块或补静音吸收。
+    """
+
+    def __init__(self, sources=config.AUDIO_SOURCES, block_size: int = config.BLOCK_SIZE,
+                 ring_seconds: float = config.AUDIO_RING_SECONDS, source_factory=None,
+                 max_lag_blocks: int = config.AUDIO_MIX_MAX_LAG_BLOCKS):
+        super().__init__(block_size, ring_seconds, source_factory)
+        self.source_specs = [dict(spec) for spec in sources]
+        self.max_lag_blocks = max(1, max_lag_blocks)
+        self.channels = []
+        self._threads = []
+        self._mix = np.zeros(block_size, dtype=np.float32)
+        self.mix_cpu_seconds = 0.0
+        self.mixed_blocks = 0
+
+    def _open_channel(self, spec: dict) -> SourceChannel:
+        factory = spec.get('factory') or self.source_factory
+        source = factory(block_size=self.block_size, device=spec.get('device'),
+                         rate=spec.get('rate'), channels=spec.get('channels'))
+        return SourceChannel(spec.get('name', str(spec.get('device'))), source, gain=spec.get('gain', 1.0),
+                             keep_alive=spec.get('keep_alive', True), gate=spec.get('gate', True),
+                             block_size=self.block_size)
+
+    def start(self):
+        """打开全部输入源并启动各路采集线程"""
+        if self.is_running:
+            return
+        self.channels = []
+        try:
+            for spec in self.source_specs:
+                self.channels.append(self._open_channel(spec))
+        except Exception:
+            self._close_device()
+            raise
+        self._running = True
+        self._threads = [threading.Thread(target=self._secondary_loop, args=(channel,),
+                                          name=f"AudioCapture-{channel.name}", daemon=True)
+                         for channel in self.channels[1:]]
+        for thread in self._threads:
+            thread.start()
+        self._thread = threading.Thread(target=self._capture_loop, name="AudioCapture", daemon=True)
+        self._thread.start()
+        names = "、".join(f"{c.name}({c.rate} Hz)" for c in self.channels)
+        logger.info(f"🎤 多路音频采集已启动: {names}")
+
+    def _read_channel(self, channel: SourceChannel) -> bool:
+        """读取一块，返回False表示该输入源已失效"""
+        try:
+            channel.capture_once()
+        except (IOError, OSError) as e:
+            if getattr(e, 'errno', None) == PA_INPUT_OVERFLOWED:
+                channel.overflows += 1
+                self.device_overflows += 1
+                logger.warning(f"输入源{channel.name}的声卡缓冲区溢出（累计{channel.overflows}次）。")
+                return True
+            if self._running:
+                logger.error(f"输入源{channel.name}读取错误: {e}")
+            return False
+        return True
+
+    def _secondary_loop(self, channel: SourceChannel):
+        while self._running and self._read_channel(channel):
+            pass
+
+    def _capture_loop(self):
+        master = self.channels[0]
+        while self._running and self._read_channel(master):
+            self._mix_block()
+        self._running = False
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._close_device()
+
+    def _mix_block(self):
+        started = time.thread_time()
+        mix = self._mix
+        mix.fill(0)
+        voiced = False
+        for i, channel in enumerate(self.channels):
+            # 主时钟那一路总是恰好有一个新块
+            samples, speech = channel.take(1 if i == 0 else self.max_lag_blocks)
+            if samples is None:
+                continue
+            if speech and channel.keep_alive:
+                voiced = True
+            if speech or not channel.gate:
+                mix += samples
+        np.clip(mix, -32768, 32767, out=mix)
+        self.ring.write_samples(mix, voiced=voiced)
+        self.mixed_blocks += 1
+        self.mix_cpu_seconds += time.thread_time() - started
+
+    def _close_device(self):
+        for channel in self.channels:
+            try:
+                channel.source.close()
+            except Exception as e:
+                logger.debug(f"关闭输入源{channel.name}时出错: {e}")
+
+    def stop(self):
+        super().stop()
+        for name, stats in self.get_stats()["sources"].items():
+            logger.info(f"输入源{name}统计: {stats}")
+
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        stats["mix_cpu_us_per_block"] = self.mix_cpu_seconds / self.mixed_blocks * 1e6 if self.mixed_blocks else 0.0
+        stats["sources"] = {channel.name: channel.get_stats() for channel in self.channels}
+        return stats
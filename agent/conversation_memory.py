@@ -0,0 +1,238 @@
+# agent/conversation_memory.py
+# 有token预算的滚动对话记忆。
+# 新的对话轮次只追加在末尾，两次压缩之间发给大模型的提示词前缀保持不变，
+# 服务端的前缀缓存（prompt caching）因此可以持续命中。
+import time
+import logging
+import threading
+import unicodedata
+import config
+
+logger = logging.getLogger(__name__)
+
+# 每条消息在角色标记等格式上的额外开销（估算值）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "以下是你和对方之前对话的摘要，回复时可以引用："
+
+SUMMARY_INSTRUCTION = (
+    "你负责整理一场直播辩论的记忆。请把已有摘要和新的对话记录合并成一段简洁的中文摘要，"
+    "保留对方提出过的观点、你反驳过的论点和仍未结束的争论，不要编造内容，不超过{max_tokens}字。"
+)
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数，无需加载分词器。
+    中日韩字符按每字1个token计，其余字符按每4个字符1个token计，
+    对中文略有高估，用作预算上限时偏于安全。
+    """
+    if not text:
+        return 0
+    wide = 0
+    for ch in text:
+        if unicodedata.east_asian_width(ch) in ('W', 'F'):
+            wide += 1
+    return wide + (len(text) - wide + 3) // 4
+
+SUMMARY_HEADER_TOKENS = estimate_tokens(SUMMARY_HEADER) + 1
+
+def build_summary_messages(previous_summary: str, turns: list) -> list:
+    """构造让大模型压缩旧对话的消息列表"""
+    lines = []
+    if previous_summary:
+        lines.append(f"已有摘要：{previous_summary}")
+    lines.append("新的对话记录：")
+    for user_text, reply, _ in turns:
+        lines.append(f"对方：{user_text}")
+        lines.append(f"你：{reply}")
+    return [
+        {'role': 'system', 'content': SUMMARY_INSTRUCTION.format(max_tokens=config.MEMORY_SUMMARY_MAX_TOKENS)},
+        {'role': 'user', 'content': "\n".join(lines)},
+    ]
+
+class PromptUsageStats:
+    """统计每次请求的提示词大小与服务端缓存命中的token数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.max_prompt_tokens = 0
+
+    def record(self, usage):
+        """记录一次请求的usage（流式响应最后一个块中返回），返回本次缓存命中的token数"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        ratio = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        logger.info(f"本次请求提示词 {prompt_tokens} tokens，缓存命中 {cached_tokens} tokens（{ratio:.0%}），"
+                    f"输出 {completion_tokens} tokens")
+        return cached_tokens
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "avg_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0.0,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "cache_hit_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            }
+
+class ConversationMemory:
+    """
+    对话记忆：[系统提示词(+摘要), 旧轮次..., 当前句子]。
+    - 新轮次只追加，不改写已有内容，保证提示词前缀稳定；
+    - 历史超过预算的一定比例时，在后台线程把较早的轮次压缩成摘要，不阻塞回复；
+    - 压缩尚未完成时若超出硬预算，本次请求临时丢弃最早的轮次，保证不超预算。
+    """
+
+    def __init__(self, token_budget: int = config.MEMORY_TOKEN_BUDGET,
+                 compact_ratio: float = config.MEMORY_COMPACT_RATIO,
+                 keep_recent_turns: int = config.MEMORY_KEEP_RECENT_TURNS,
+                 summarizer=None):
+        self.token_budget = token_budget
+        self.compact_ratio = compact_ratio
+        self.keep_recent_turns = keep_recent_turns
+        # summarizer(messages) -> str，由LLM处理器提供
+        self.summarizer = summarizer
+        self.summary = ""
+        self._summary_tokens = 0
+        self._turns = []  # (用户文本, 回复, 估算token数)
+        self._history_tokens = 0
+        # 系统提示词与当前句子占用的token，由最近一次构造消息时更新
+        self._base_tokens = 0
+        self._lock = threading.Lock()
+        self._compact_thread = None
+
+        # 统计信息
+        self.turns_added = 0
+        self.compactions = 0
+        self.compaction_failures = 0
+        self.turns_compacted = 0
+        self.trimmed_requests = 0
+        self.last_compaction_ms = 0.0
+        self.last_prompt_estimate = 0
+
+    def build_messages(self, system_prompt: str, text: str, system_tokens: int = None) -> list:
+        """构造带历史的消息列表，估算大小不超过token_budget。system_tokens为预先估算的提示词token数"""
+        with self._lock:
+            summary = self.summary
+            summary_tokens = self._summary_tokens
+            turns = list(self._turns)
+
+        system_content = f"{system_prompt}\n\n{SUMMARY_HEADER}{summary}" if summary else system_prompt
+        if system_tokens is None:
+            system_tokens = estimate_tokens(system_content)
+        elif summary:
+            system_tokens += SUMMARY_HEADER_TOKENS + summary_tokens
+        base_tokens = system_tokens + estimate_tokens(text) + 2 * MESSAGE_OVERHEAD_TOKENS
+        self._base_tokens = base_tokens
+        available = self.token_budget - base_tokens
+        history_tokens = sum(tokens for _, _, tokens in turns)
+
+        # 硬预算兜底：只影响本次请求，记忆本身等待后台压缩
+        start = 0
+        while history_tokens > available and start < len(turns):
+            history_tokens -= turns[start][2]
+            start += 1
+        if start:
+            self.trimmed_requests += 1
+            logger.warning(f"对话历史超出预算，本次请求临时省略最早的{start}轮对话。")
+
+        messages = [{'role': 'system', 'content': system_content}]
+        for user_text, reply, _ in turns[start:]:
+            messages.append({'role': 'user', 'content': user_text})
+            messages.append({'role': 'assistant', 'content': reply})
+        messages.append({'role': 'user', 'content': text})
+        self.last_prompt_estimate = base_tokens + history_tokens
+        return messages
+
+    def add_turn(self, user_text: str, reply: str):
+        """回复完成后追加一轮对话，必要时在后台触发压缩"""
+        if not reply:
+            return
+        tokens = estimate_tokens(user_text) + estimate_tokens(reply) + 2 * MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._turns.append((user_text, reply, tokens))
+            self._history_tokens += tokens
+            self.turns_added += 1
+            # 只剩最近几轮时没有可压缩的内容，不开线程
+            if (len(self._turns) > self.keep_recent_turns
+                    and self._history_tokens + self._summary_tokens + self._base_tokens
+                    > self.token_budget * self.compact_ratio):
+                self._request_compaction()
+
+    def _request_compaction(self):
+        """在持有self._lock时调用，保证同一时间只有一个压缩线程"""
+        if self.summarizer is None:
+            return
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        self._compact_thread = threading.Thread(target=self._compact, name="MemoryCompaction", daemon=True)
+        self._compact_thread.start()
+
+    def _compact(self):
+        """把除最近几轮以外的对话合并进摘要。一次压缩尽量多的轮次，使前缀变化的次数最少。"""
+        with self._lock:
+            count = len(self._turns) - self.keep_recent_turns
+            if count <= 0:
+                return
+            old_turns = self._turns[:count]
+            previous_summary = self.summary
+
+        started = time.perf_counter()
+        try:
+            summary = self.summarizer(build_summary_messages(previous_summary, old_turns))
+        except Exception as e:
+            self.compaction_failures += 1
+            logger.warning(f"对话记忆压缩失败，稍后重试: {e}")
+            return
+        if not summary:
+            self.compaction_failures += 1
+            return
+
+        with self._lock:
+            # 压缩期间新追加的轮次保留在末尾
+            del self._turns[:count]
+            self._history_tokens = sum(tokens for _, _, tokens in self._turns)
+            self.summary = summary.strip()
+            self._summary_tokens = estimate_tokens(self.summary)
+            self.compactions += 1
+            self.turns_compacted += count
+        self.last_compaction_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"对话记忆已压缩: {count}轮对话合并为约{self._summary_tokens} tokens的摘要，"
+                    f"耗时 {self.last_compaction_ms:.0f} ms")
+
+    def clear(self):
+        with self._lock:
+            self._turns.clear()
+            self._history_tokens = 0
+            self.summary = ""
+            self._summary_tokens = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "turns": len(self._turns),
+                "history_tokens": self._history_tokens,
+                "summary_tokens": self._summary_tokens,
+                "turns_added": self.turns_added,
+                "compactions": self.compactions,
+                "compaction_failures": self.compaction_failures,
+                "turns_compacted": self.turns_compacted,
+                "trimmed_requests": self.trimmed_requests,
+                "last_compaction_ms": self.last_compaction_ms,
+                "last_prompt_estimate": self.last_prompt_estimate,
+            }
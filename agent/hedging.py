@@ -0,0 +1,459 @@
+# agent/hedging.py
+# 对冲请求：首token迟迟不来时，向备用模型（或同一模型）再发一个请求，采用先出字的那个并取消另一个；
+# 熔断器在某个模型连续失败或过慢时暂时跳过它。
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+import config
+from .conversation_memory import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+class TTFTTracker:
+    """最近若干次首token延迟，按分位数给出对冲等待时间"""
+
+    def __init__(self, window: int = config.LLM_HEDGE_WINDOW, percentile: float = config.LLM_HEDGE_PERCENTILE,
+                 min_samples: int = config.LLM_HEDGE_MIN_SAMPLES,
+                 default_delay: float = config.LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+                 min_delay: float = config.LLM_HEDGE_MIN_DELAY_SECONDS,
+                 max_delay: float = config.LLM_HEDGE_MAX_DELAY_SECONDS):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, ttft: float):
+        with self._lock:
+            self._samples.append(ttft)
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        value = samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+class CircuitBreaker:
+    """
+    按模型熔断：连续失败（含首token超过慢阈值）达到次数后断开一段时间，
+    期满后进入半开状态，只放行一个探测请求，成功则恢复，失败则再次断开；
+    探测请求超过慢阈值仍没有结果（例如被对冲请求取消）时再放行下一个。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = config.LLM_BREAKER_FAILURE_THRESHOLD,
+                 open_seconds: float = config.LLM_BREAKER_OPEN_SECONDS,
+                 slow_ttft: float = config.LLM_BREAKER_SLOW_TTFT_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.slow_ttft = slow_ttft
+        self._states = {}  # 模型 -> [状态, 连续失败次数, 断开截止时刻, 探测请求截止时刻]
+        self._lock = threading.Lock()
+        self.trips = 0
+
+    def _state(self, model: str) -> list:
+        return self._states.setdefault(model, [self.CLOSED, 0, 0.0, 0.0])
+
+    def allow(self, model: str) -> bool:
+        with self._lock:
+            state = self._state(model)
+            now = time.monotonic()
+            if state[0] == self.OPEN and now >= state[2]:
+                state[0] = self.HALF_OPEN
+            if state[0] == self.CLOSED:
+                return True
+            if state[0] == self.HALF_OPEN and now >= state[3]:
+                # 放行唯一的探测请求，其余请求在它有结果之前仍然跳过这个模型
+                state[3] = now + self.slow_ttft
+                return True
+            return False
+
+    def record_success(self, model: str, ttft: float = None):
+        if ttft is not None and ttft > self.slow_ttft:
+            self.record_failure(model, reason=f"首token耗时{ttft:.1f}秒")
+            return
+        with self._lock:
+            state = self._state(model)
+            if state[0] != self.CLOSED:
+                logger.info(f"模型{model}已恢复，熔断器闭合。")
+            state[:] = [self.CLOSED, 0, 0.0, 0.0]
+
+    def record_failure(self, model: str, reason: str = ""):
+        with self._lock:
+            state = self._state(model)
+            state[1] += 1
+            if state[0] == self.HALF_OPEN or state[1] >= self.failure_threshold:
+                if state[0] != self.OPEN:
+                    self.trips += 1
+                state[0] = self.OPEN
+                state[2] = time.monotonic() + self.open_seconds
+                state[3] = 0.0
+                logger.warning(f"模型{model}连续失败{state[1]}次（{reason}），{self.open_seconds:.1f}秒内跳过。")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"trips": self.trips, "states": {model: s[0] for model, s in self._states.items()}}
+
+class HedgeStats:
+    """对冲统计：对冲比例、备用请求胜出比例与额外开销"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0            # 因首token超时而发出备用请求的次数
+        self.hedge_wins = 0        # 备用请求先出字的次数
+        self.fallbacks = 0         # 因请求失败而改用下一个候选模型的次数
+        self.breaker_skips = 0     # 主模型被熔断、直接从备用模型开始的次数
+        self.failed = 0            # 所有候选模型都失败的次数
+        self.extra_requests = 0
+        self.extra_prompt_tokens = 0
+        self.prompt_tokens = 0
+        self.wasted_chunks = 0     # 被取消的请求已收到的文本块
+        self.wins_by_model = {}
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_win(self, model: str):
+        with self._lock:
+            self.wins_by_model[model] = self.wins_by_model.get(model, 0) + 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "hedge_win_rate": self.hedge_wins / self.hedged if self.hedged else 0.0,
+                "fallbacks": self.fallbacks,
+                "breaker_skips": self.breaker_skips,
+                "failed": self.failed,
+                "extra_requests": self.extra_requests,
+                "extra_prompt_tokens": self.extra_prompt_tokens,
+                "extra_cost_ratio": self.extra_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "wasted_chunks": self.wasted_chunks,
+                "wins_by_model": dict(self.wins_by_model),
+            }
+
+class HedgePolicy:
+    """对冲与降级策略，同步与异步模式共用：候选模型顺序、等待时间与统计"""
+
+    def __init__(self, models=None, enabled: bool = config.LLM_HEDGE_ENABLED,
+                 max_attempts: int = config.LLM_HEDGE_MAX_ATTEMPTS):
+        self.models = list(models or (config.LLM_MODEL,) + tuple(config.LLM_FALLBACK_MODELS))
+        self.enabled = enabled
+        self.max_attempts = max(1, max_attempts)
+        self.tracker = TTFTTracker()
+        self.breaker = CircuitBreaker()
+        self.stats = HedgeStats()
+
+    def candidates(self) -> list:
+        """按顺序列出本次可用的模型；全部被熔断时仍尝试主模型"""
+        allowed = [model for model in self.models if self.breaker.allow(model)]
+        if not allowed:
+            allowed = self.models[:1]
+        if len(allowed) < self.max_attempts and self.enabled:
+            # 只有一个模型可用时，对冲请求发给同一个模型
+            allowed += allowed[-1:] * (self.max_attempts - len(allowed))
+        return allowed
+
+    def hedge_delay(self):
+        return self.tracker.hedge_delay() if self.enabled else None
+
+    def begin(self, messages: list, candidates: list) -> int:
+        """记录一次新请求，返回估算的提示词token数（每个额外请求都要再付一次）"""
+        prompt_tokens = sum(estimate_tokens(str(m.get('content', ''))) for m in messages)
+        self.stats.add(requests=1, prompt_tokens=prompt_tokens, breaker_skips=int(candidates[0] != self.models[0]))
+        return prompt_tokens
+
+    def on_extra_request(self, model: str, prompt_tokens: int, hedge: bool):
+        if hedge:
+            self.stats.add(hedged=1, extra_requests=1, extra_prompt_tokens=prompt_tokens)
+            logger.info(f"[🤖 AI杠精] 首token超时，发出对冲请求: {model}")
+        else:
+            self.stats.add(fallbacks=1)
+            logger.info(f"[🤖 AI杠精] 请求失败，改用: {model}")
+
+    def next_model(self, candidates: list, launched: int):
+        """第launched个请求使用的模型，候选用完时返回None"""
+        return candidates[launched] if launched < len(candidates) else None
+
+    def on_first_token(self, model: str, ttft: float, is_hedge: bool):
+        self.tracker.observe(ttft)
+        self.breaker.record_success(model, ttft)
+        self.stats.record_win(model)
+        if is_hedge:
+            self.stats.add(hedge_wins=1)
+
+    def on_failure(self, model: str, error: Exception):
+        self.breaker.record_failure(model, reason=type(error).__name__)
+
+    def get_stats(self) -> dict:
+        return {**self.stats.get_stats(), "hedge_delay_ms": self.tracker.hedge_delay() * 1000,
+                "breaker": self.breaker.get_stats()}
+
+class _Attempt:
+    """一次流式请求，在自己的线程中读取，事件放入共享队列"""
+
+    def __init__(self, handler, text: str, model: str, events: queue.Queue, is_hedge: bool, context=None):
+        self.handler = handler
+        self.text = text
+        self.model = model
+        self.context = context
+        self.events = events
+        self.is_hedge = is_hedge
+        self.started_at = time.time()
+        self.chunks = 0
+        self._completion = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"LLMAttempt-{model}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            completion = self.handler.create_completion(self.text, model=self.model, context=self.context,
+                                                        client=self.handler.hedge_client)
+            with self._lock:
+                self._completion = completion
+                if self._closed:
+                    completion.close()
+                    raise ConnectionAbortedError("请求已取消")
+            for content in self.handler.iter_deltas(completion):
+                self.chunks += 1
+                self.events.put((self, 'delta', content))
+            self.events.put((self, 'done', None))
+        except Exception as e:
+            self.events.put((self, 'error', e))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            completion = self._completion
+        if completion is not None:
+            try:
+                completion.close()
+            except Exception as e:
+                logger.debug(f"关闭请求{self.model}时出错: {e}")
+
+class HedgedStream:
+    """
+    线程模式的对冲流式回复。迭代得到文本增量，首个增量到来前按策略发出备用请求或改用备用模型，
+    确定胜出者后关闭其余请求。model属性为胜出的模型。context为请求开始时取的人设快照，所有请求共用。
+    """
+
+    def __init__(self, handler, text: str, policy: HedgePolicy, context=None):
+        self.handler = handler
+        self.text = text
+        self.policy = policy
+        self.context = context or handler.prompt_context()
+        self.model = None
+        self._events = queue.Queue()
+        self._attempts = []
+        self._candidates = policy.candidates()
+        self._prompt_tokens = policy.begin(handler.build_messages(text, self.context), self._candidates)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._launch(hedge=False)
+
+    def _launch(self, hedge: bool) -> bool:
+        with self._lock:
+            model = self.policy.next_model(self._candidates, len(self._attempts))
+            if self._closed or model is None:
+                return False
+            if self._attempts:
+                self.policy.on_extra_request(model, self._prompt_tokens, hedge)
+            self._attempts.append(_Attempt(self.handler, self.text, model, self._events, is_hedge=hedge,
+                                           context=self.context))
+            return True
+
+    def close(self):
+        """取消全部请求（job取消时调用）"""
+        with self._lock:
+            self._closed = True
+            attempts = list(self._attempts)
+        for attempt in attempts:
+            attempt.close()
+
+    def _close_others(self, winner):
+        now = time.time()
+        for attempt in self._attempts:
+            if attempt is winner:
+                continue
+            attempt.close()
+            self.policy.stats.add(wasted_chunks=attempt.chunks)
+            if attempt.chunks == 0 and now - attempt.started_at > self.policy.breaker.slow_ttft:
+                # 被对冲请求超过且已经慢到阈值以上，计为该模型的一次失败
+                self.policy.on_failure(attempt.model, TimeoutError("首token过慢"))
+
+    def __iter__(self):
+        winner = None
+        active = 1
+        deadline = None
+        hedge_delay = self.policy.hedge_delay()
+        if hedge_delay is not None:
+            deadline = time.monotonic() + hedge_delay
+        while winner is None:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                attempt, kind, payload = self._events.get(timeout=timeout)
+            except queue.Empty:
+                deadline = None
+                if self._launch(hedge=True):
+                    active += 1
+                continue
+            if self._closed:
+                return
+            if kind == 'error':
+                active -= 1
+                self.policy.on_failure(attempt.model, payload)
+                logger.warning(f"模型{attempt.model}请求失败: {type(payload).__name__}")
+                if active == 0:
+                    if not self._launch(hedge=False):
+                        self.policy.stats.add(failed=1)
+                        raise payload
+                    active += 1
+                continue
+            winner = attempt
+            self.model = attempt.model
+            self.policy.on_first_token(attempt.model, time.time() - attempt.started_at, attempt.is_hedge)
+            self._close_others(winner)
+            if kind == 'done':
+                return
+            yield payload
+
+        while True:
+            attempt, kind, payload = self._events.get()
+            if attempt is not winner:
+                continue
+            if kind == 'delta':
+                yield payload
+            elif kind == 'done':
+                return
+            else:
+                raise payload
+
+class AsyncHedgedStream:
+    """
+    异步模式的对冲流式回复，策略与HedgedStream相同，每个请求是事件循环中的一个任务。
+    用法: async for content in stream，结束后（包括被取消时）调用await stream.aclose()。
+    """
+
+    def __init__(self, handler, text: str, policy: HedgePolicy, context=None):
+        self.handler = handler
+        self.text = text
+        self.policy = policy
+        self.context = context or handler.prompt_context()
+        self.model = None
+        self._events = asyncio.Queue()
+        self._attempts = []  # [(任务, 模型, 开始时刻, 是否对冲, 已收到的文本块数)]
+        self._candidates = policy.candidates()
+        self._prompt_tokens = policy.begin(handler.build_messages(text, self.context), self._candidates)
+        self._launch(hedge=False)
+
+    def _launch(self, hedge: bool) -> bool:
+        model = self.policy.next_model(self._candidates, len(self._attempts))
+        if model is None:
+            return False
+        if self._attempts:
+            self.policy.on_extra_request(model, self._prompt_tokens, hedge)
+        attempt = {"model": model, "started_at": time.time(), "is_hedge": hedge, "chunks": 0}
+        attempt["task"] = asyncio.ensure_future(self._run(attempt))
+        self._attempts.append(attempt)
+        return True
+
+    async def _run(self, attempt: dict):
+        completion = None
+        try:
+            completion = await self.handler.hedge_client.chat.completions.create(
+                **self.handler.completion_kwargs(self.text, attempt["model"], self.context))
+            async for chunk in completion:
+                content = self.handler.chunk_content(chunk)
+                if content:
+                    attempt["chunks"] += 1
+                    self._events.put_nowait((attempt, 'delta', content))
+            self._events.put_nowait((attempt, 'done', None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._events.put_nowait((attempt, 'error', e))
+        finally:
+            if completion is not None:
+                await completion.close()
+
+    async def aclose(self):
+        """取消全部请求并等待连接关闭"""
+        tasks = [attempt["task"] for attempt in self._attempts if not attempt["task"].done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _close_others(self, winner: dict):
+        now = time.time()
+        for attempt in self._attempts:
+            if attempt is winner:
+                continue
+            attempt["task"].cancel()
+            self.policy.stats.add(wasted_chunks=attempt["chunks"])
+            if attempt["chunks"] == 0 and now - attempt["started_at"] > self.policy.breaker.slow_ttft:
+                self.policy.on_failure(attempt["model"], TimeoutError("首token过慢"))
+
+    async def __aiter__(self):
+        winner = None
+        active = 1
+        hedge_delay = self.policy.hedge_delay()
+        deadline = None if hedge_delay is None else time.monotonic() + hedge_delay
+        while winner is None:
+            try:
+                if deadline is None:
+                    attempt, kind, payload = await self._events.get()
+                else:
+                    attempt, kind, payload = await asyncio.wait_for(
+                        self._events.get(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                deadline = None
+                if self._launch(hedge=True):
+                    active += 1
+                continue
+            if kind == 'error':
+                active -= 1
+                self.policy.on_failure(attempt["model"], payload)
+                logger.warning(f"模型{attempt['model']}请求失败: {type(payload).__name__}")
+                if active == 0:
+                    if not self._launch(hedge=False):
+                        self.policy.stats.add(failed=1)
+                        raise payload
+                    active += 1
+                continue
+            winner = attempt
+            self.model = attempt["model"]
+            self.policy.on_first_token(attempt["model"], time.time() - attempt["started_at"], attempt["is_hedge"])
+            self._close_others(winner)
+            if kind == 'done':
+                return
+            yield payload
+
+        while True:
+            attempt, kind, payload = await self._events.get()
+            if attempt is not winner:
+                continue
+            if kind == 'delta':
+                yield payload
+            elif kind == 'done':
+                return
+            else:
+                raise payload
@@ -0,0 +1,250 @@
+# agent/llm_dispatcher.py
+import time
+import threading
+import logging
+from collections import deque
+import config
+from utils.logger_setup import utterance_context
+
+logger = logging.getLogger(__name__)
+
+class LLMJob:
+    """一次待处理的LLM回复请求，携带协作式取消信号"""
+
+    def __init__(self, text: str, speculation=None, trace_id: int = None):
+        self.texts = [text]
+        # 延迟追踪ID；合并的请求包含多句话的ID
+        self.trace_ids = [trace_id] if trace_id is not None else []
+        # 已在后台提前生成的预测回复（见speculation.py），采用时无需重新请求
+        self.speculation = speculation
+        self.submitted_at = time.time()
+        self.first_token_at = None
+        self._cancel_event = threading.Event()
+        self._on_cancel = None
+
+    @property
+    def text(self) -> str:
+        return config.LLM_COALESCE_SEPARATOR.join(self.texts)
+
+    @property
+    def utterance_id(self):
+        """日志中使用的语句ID：合并的请求取最新一句的追踪ID"""
+        return self.trace_ids[-1] if self.trace_ids else None
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.speculation is not None:
+            self.speculation.cancel()
+        on_cancel = self._on_cancel
+        if on_cancel is not None:
+            try:
+                on_cancel()
+            except Exception as e:
+                logger.debug(f"取消回调执行失败: {e}")
+
+    def set_cancel_callback(self, callback):
+        """注册取消时的回调（例如关闭HTTP流），以便阻塞在网络读取上的请求也能及时中止"""
+        self._on_cancel = callback
+        if self.is_cancelled():
+            self.cancel()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+
+    @property
+    def has_output(self) -> bool:
+        return self.first_token_at is not None
+
+class LLMDispatcher:
+    """
+    有界的LLM调度器。
+    固定数量的工作线程处理排队的句子；回复进行中到来的新句子按策略合并或丢弃，
+    并可取消已过时的进行中请求，避免说话快时并发出大量流式请求。
+    """
+
+    POLICY_COALESCE = 'coalesce'
+    POLICY_LATEST = 'latest'
+    POLICY_DROP_NEW = 'drop_new'
+
+    PREEMPT_NEVER = 'never'
+    PREEMPT_BEFORE_FIRST_TOKEN = 'before_first_token'
+    PREEMPT_ALWAYS = 'always'
+
+    def __init__(self, handler, max_workers: int = config.LLM_MAX_WORKERS,
+                 max_pending: int = config.LLM_MAX_PENDING,
+                 policy: str = config.LLM_QUEUE_POLICY,
+                 preempt_mode: str = config.LLM_PREEMPT_MODE):
+        self._handler = handler  # handler(text, job)
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.policy = policy
+        self.preempt_mode = preempt_mode
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._in_flight = []
+        self._workers = []
+        self._stopped = False
+
+        # 统计信息
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def start(self):
+        """启动工作线程池"""
+        with self._cond:
+            if self._workers:
+                return
+            self._stopped = False
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"LLMWorker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"LLM调度器已启动: {self.max_workers}个工作线程，排队策略={self.policy}，抢占模式={self.preempt_mode}")
+
+    def submit(self, text: str, speculation=None, trace_id: int = None):
+        """提交一句待反驳的文本，返回对应的LLMJob；被丢弃时返回None"""
+        with self._cond:
+            if self._stopped:
+                if speculation is not None:
+                    speculation.cancel()
+                return None
+            self.submitted += 1
+            job = self._enqueue(text, speculation, trace_id)
+            if job is not None:
+                self._preempt_stale()
+                self._notify_workers()
+            depth = len(self._pending)
+        logger.debug(f"LLM队列深度: {depth}，进行中: {len(self._in_flight)}")
+        return job
+
+    def _enqueue(self, text: str, speculation=None, trace_id: int = None):
+        if self._pending and self.policy == self.POLICY_COALESCE:
+            job = self._pending[-1]
+            # 合并后文本已改变，预测生成的回复不再适用
+            for spec in (speculation, job.speculation):
+                if spec is not None:
+                    spec.cancel()
+            job.speculation = None
+            job.texts.append(text)
+            if trace_id is not None:
+                job.trace_ids.append(trace_id)
+            self.coalesced += 1
+            if len(job.texts) > self.max_pending:
+                # 合并的句子过多时，只保留最近的几句
+                job.texts.pop(0)
+                self.dropped += 1
+            logger.info(f"回复进行中，新句子已合并到排队请求中: {job.text}")
+            return job
+
+        if self._pending and self.policy == self.POLICY_LATEST:
+            self.dropped += len(self._pending)
+            logger.info(f"回复进行中，丢弃{len(self._pending)}条排队的旧句子。")
+            for job in self._pending:
+                job.cancel()
+            self._pending.clear()
+
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            logger.warning(f"LLM队列已满，丢弃新句子: {text}")
+            if speculation is not None:
+                speculation.cancel()
+            return None
+
+        job = LLMJob(text, speculation, trace_id)
+        self._pending.append(job)
+        return job
+
+    def is_idle(self) -> bool:
+        """没有排队或进行中的请求"""
+        with self._cond:
+            return not self._pending and not self._in_flight
+
+    def _preempt_stale(self):
+        """所有工作线程都在忙时，按抢占模式取消过时的进行中请求"""
+        if self.preempt_mode == self.PREEMPT_NEVER or len(self._in_flight) < self.max_workers:
+            return
+        for job in self._in_flight:
+            if job.is_cancelled():
+                continue
+            if self.preempt_mode == self.PREEMPT_ALWAYS or not job.has_output:
+                logger.info(f"新句子优先，取消进行中的回复: {job.text}")
+                job.cancel()
+
+    def _notify_workers(self):
+        """唤醒等待任务的工作者（调用时已持有self._cond）"""
+        self._cond.notify()
+
+    def _take_job(self):
+        """取出下一个排队的请求并标记为进行中（调用时已持有self._cond）"""
+        job = self._pending.popleft()
+        self._in_flight.append(job)
+        return job
+
+    def _finish_job(self, job: LLMJob):
+        with self._cond:
+            self._in_flight.remove(job)
+            if job.is_cancelled():
+                self.cancelled += 1
+            else:
+                self.completed += 1
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                job = self._take_job()
+            try:
+                with utterance_context(job.utterance_id):
+                    self._handler(job.text, job)
+            except Exception as e:
+                logger.error(f"LLM工作线程处理请求时发生异常: {e}", exc_info=True)
+            finally:
+                self._finish_job(job)
+
+    def _join_workers(self):
+        """等待所有工作者退出"""
+        with self._cond:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join(timeout=2)
+
+    def stop(self):
+        """停止调度器：丢弃排队的句子并取消进行中的请求"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self.dropped += len(self._pending)
+            for job in self._pending:
+                job.cancel()
+            self._pending.clear()
+            for job in self._in_flight:
+                job.cancel()
+            self._cond.notify_all()
+        self._join_workers()
+        stats = self.get_stats()
+        logger.info(f"LLM调度器已停止: 提交{stats['submitted']}，完成{stats['completed']}，"
+                    f"合并{stats['coalesced']}，丢弃{stats['dropped']}，取消{stats['cancelled']}")
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {
+                "queue_depth": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+            }
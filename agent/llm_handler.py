@@ -1,57 +1,260 @@
 # agent/llm_handler.py
+import time
 import logging
 from openai import OpenAI, APIConnectionError, RateLimitError
 import config
 from ui.webview_window import RefutationWebViewWindow, StreamingAIResponse
+from .llm_dispatcher import LLMJob
+from .response_cache import ResponseCache
+from .conversation_memory import ConversationMemory, PromptUsageStats
+from .hedging import HedgePolicy, HedgedStream
+from .moderation import Moderator
+from .personas import PersonaContext
+from utils.tracing import tracer
+from utils.session_recorder import recorder, KIND_LLM_REQUEST, KIND_LLM_DELTA, KIND_LLM_END
+from utils.logger_setup import echo_token, finish_token_echo
 
 logger = logging.getLogger(__name__)
 
 class LLMHandler:
-    def __init__(self, client: OpenAI, window: RefutationWebViewWindow):
+    def __init__(self, client: OpenAI, window: RefutationWebViewWindow, response_cache: ResponseCache = None,
+                 memory: ConversationMemory = None, moderator: Moderator = None):
         self.client = client
         self.window = window
         self.system_prompt = config.DEFAULT_SYSTEM_PROMPT
+        self.response_cache = response_cache
+        # 对话记忆（可选），为空时每次只发送系统提示词和当前句子
+        self.memory = memory
+        self.usage_stats = PromptUsageStats()
+        # 对冲请求、备用模型与熔断状态
+        self.hedge_policy = HedgePolicy()
+        self._hedge_client = None
+        # 违禁词审核（可选），文本增量审核后才上屏
+        self.moderator = moderator
+        # 人设注册表（可选，见personas.py），设置后system_prompt与memory改用当前人设的提示词和对话记忆
+        self.personas = None
 
-    def get_response(self, text_to_refute: str):
-        """获取AI回复并通过WebView显示"""
+    def _replay_cached(self, reply: str, job: LLMJob = None):
+        """按流式速度回放缓存的回复，走与实时回复相同的UI路径"""
+        chunk_size = 3
+        interval = chunk_size / config.RESPONSE_CACHE_REPLAY_CHARS_PER_SECOND
+        trace_ids = job.trace_ids if job else None
+        with StreamingAIResponse(self.window, trace_ids=trace_ids) as stream:
+            for i in range(0, len(reply), chunk_size):
+                if job and job.is_cancelled():
+                    logger.info("[🤖 AI杠精] 缓存回放已被更新的句子取代，已中止。")
+                    stream.finish(interrupted=True)
+                    return
+                if job:
+                    job.mark_first_token()
+                    tracer.mark(trace_ids, 'first_token')
+                stream.append(reply[i:i + chunk_size])
+                time.sleep(interval)
+        logger.info(f"AI回复完成(缓存): {reply}")
+
+    def moderate_text(self, text: str) -> tuple:
+        """审核一段完整的文本（例如缓存的回复），返回(审核后的文本, 是否命中中止类词)；没有审核器时原样返回"""
+        if self.moderator is None:
+            return text, False
+        moderation = self.moderator.begin()
+        return ''.join(moderation.filter((text,))), moderation.aborted
+
+    def moderate_cached(self, text_to_refute: str, cached: str, context: PersonaContext) -> tuple:
+        """审核缓存的回复，返回(审核后的文本, 是否中止)；中止时从缓存中删除这条回复，调用方不计入对话记忆（与实时回复一致）"""
+        moderated, aborted = self.moderate_text(cached)
+        if aborted:
+            self.response_cache.discard(text_to_refute, context.cache_namespace, config.LLM_MODEL, cached)
+            logger.warning(f"缓存的回复命中违禁词，已从缓存中删除: {cached}")
+        return moderated, aborted
+
+    def prewarm(self):
+        """发一次轻量请求，提前完成DNS、TCP与TLS握手，首个回复不必再等连接建立"""
+        started = time.perf_counter()
+        try:
+            self.client.models.list()
+        except Exception as e:
+            # 即使接口返回错误，连接通常也已经建立
+            logger.debug(f"连接预热请求返回异常: {e}")
+        logger.info(f"LLM连接预热完成，耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def prompt_context(self) -> PersonaContext:
+        """
+        本次请求使用的人设快照。一次回复的各个请求（对冲、备用模型）、缓存与记忆都使用同一个快照，
+        回复进行中切换人设只影响下一次回复。
+        """
+        if self.personas is not None:
+            return self.personas.context()
+        return PersonaContext(None, self.system_prompt, None, self.system_prompt, self.memory)
+
+    def build_messages(self, text_to_refute: str, context: PersonaContext = None) -> list:
+        """构造发送给大模型的消息列表"""
+        context = context or self.prompt_context()
+        if context.memory is not None:
+            return context.memory.build_messages(context.system_prompt, text_to_refute,
+                                                 system_tokens=context.system_tokens)
+        return [
+            {'role': 'system', 'content': context.system_prompt},
+            {'role': 'user', 'content': text_to_refute}
+        ]
+
+    def completion_kwargs(self, text_to_refute: str, model: str = None, context: PersonaContext = None) -> dict:
+        """流式请求的参数，同步与异步模式共用"""
+        kwargs = {
+            'model': model or config.LLM_MODEL,
+            'messages': self.build_messages(text_to_refute, context),
+            'stream': True,
+        }
+        if config.LLM_STREAM_USAGE:
+            kwargs['stream_options'] = {'include_usage': True}
+        return kwargs
+
+    def create_completion(self, text_to_refute: str, model: str = None, context: PersonaContext = None,
+                          client=None):
+        """发起流式请求，返回completion流"""
+        client = client or self.client
+        return client.chat.completions.create(**self.completion_kwargs(text_to_refute, model, context))
+
+    @property
+    def hedge_client(self):
+        """对冲请求使用的客户端：SDK内部不重试，失败立即交给对冲策略改用备用模型并计入熔断"""
+        if self._hedge_client is None or self._hedge_client[0] is not self.client:
+            self._hedge_client = (self.client, self.client.with_options(max_retries=0))
+        return self._hedge_client[1]
+
+    def chunk_content(self, chunk):
+        """取出流式块中的文本增量；用量信息在最后一个不带choices的块中返回"""
+        if getattr(chunk, 'usage', None) is not None:
+            self.usage_stats.record(chunk.usage)
+        if not chunk.choices:
+            return None
+        return chunk.choices[0].delta.content
+
+    def iter_deltas(self, completion):
+        """从completion流中逐个取出非空的文本增量"""
+        for chunk in completion:
+            content = self.chunk_content(chunk)
+            if content:
+                yield content
+
+    def summarize(self, messages: list) -> str:
+        """非流式请求，供对话记忆在后台压缩旧对话"""
+        response = self.client.chat.completions.create(
+            model=config.MEMORY_SUMMARY_MODEL,
+            messages=messages,
+            max_tokens=config.MEMORY_SUMMARY_MAX_TOKENS,
+        )
+        return response.choices[0].message.content
+
+    def remember(self, text_to_refute: str, reply: str, job: LLMJob = None, context: PersonaContext = None):
+        """把完整的一轮对话追加到（发起请求时所用人设的）记忆中，被取消的回复不计入"""
+        memory = (context or self.prompt_context()).memory
+        if memory is not None and not (job and job.is_cancelled()):
+            memory.add_turn(text_to_refute, reply)
+
+    def _usable_speculation(self, speculation, context: PersonaContext):
+        """预测生成开始后切换过人设时不能采用，取消后重新请求"""
+        if speculation is not None and speculation.context.cache_namespace != context.cache_namespace:
+            logger.info("[🤖 AI杠精] 预测生成使用的是切换前的人设，重新请求。")
+            speculation.cancel()
+            return None
+        return speculation
+
+    def get_response(self, text_to_refute: str, job: LLMJob = None):
+        """获取AI回复并通过WebView显示。job被取消时会关闭进行中的流式请求。"""
         if not self.client or not self.window:
             logger.error("LLM客户端或WebView窗口未初始化！")
             return
 
+        if job and job.is_cancelled():
+            logger.info(f"请求已被取消，跳过: {text_to_refute}")
+            return
+
         logger.info("[🤖 AI杠精 正在思考...]")
         
         # 在UI上显示用户听到的内容
         self.window.add_user_message(text_to_refute)
         
+        context = self.prompt_context()
+        speculation = self._usable_speculation(job.speculation if job else None, context)
+        trace_ids = job.trace_ids if job else None
+        if self.response_cache:
+            cached = self.response_cache.get(text_to_refute, context.cache_namespace, config.LLM_MODEL)
+            if cached is not None:
+                if speculation is not None:
+                    speculation.cancel()
+                cached, aborted = self.moderate_cached(text_to_refute, cached, context)
+                self._replay_cached(cached, job)
+                if not aborted:
+                    self.remember(text_to_refute, cached, job, context)
+                return cached
+        
+        model = config.LLM_MODEL
+        tag = job.utterance_id if job else None
+        recorder.record(KIND_LLM_REQUEST, text_to_refute, tag)
         try:
-            completion = self.client.chat.completions.create(
-                model=config.LLM_MODEL,
-                messages=[
-                    {'role': 'system', 'content': self.system_prompt},
-                    {'role': 'user', 'content': text_to_refute}
-                ],
-                stream=True,
-            )
-
-            logger.info("[🤖 AI杠精 生成中...]")
+            hedged = None
+            if speculation is not None:
+                # 采用预测生成的回复：先输出已缓存的token，再继续接收后续token
+                if job:
+                    job.set_cancel_callback(speculation.cancel)
+                deltas = speculation.iter_tokens()
+                tracer.mark(trace_ids, 'llm_request', speculation.started_at)
+                logger.info("[🤖 AI杠精 采用预测生成的回复...]")
+            else:
+                tracer.mark(trace_ids, 'llm_request')
+                hedged = HedgedStream(self, text_to_refute, self.hedge_policy, context)
+                if job:
+                    # 取消时关闭全部HTTP流以停止消耗额度
+                    job.set_cancel_callback(hedged.close)
+                deltas = hedged
+                logger.info("[🤖 AI杠精 生成中...]")
+            moderation = self.moderator.begin() if self.moderator else None
+            if moderation is not None:
+                deltas = moderation.filter(deltas)
             
             response_text = ""
-            with StreamingAIResponse(self.window) as stream:
-                for chunk in completion:
-                    content = chunk.choices[0].delta.content
-                    if content:
-                        response_text += content
-                        stream.append(content)
-                        # 仍然在控制台打印，方便调试
-                        print(content, end="", flush=True)
+            with StreamingAIResponse(self.window, trace_ids=trace_ids) as stream:
+                for content in deltas:
+                    if job and job.is_cancelled():
+                        logger.info("[🤖 AI杠精] 回复已被更新的句子取代，已中止。")
+                        stream.finish(interrupted=True)
+                        break
+                    if job:
+                        job.mark_first_token()
+                    tracer.mark(trace_ids, 'first_token')
+                    response_text += content
+                    recorder.record(KIND_LLM_DELTA, content, tag)
+                    stream.append(content)
+                    echo_token(content)
+                tracer.mark(trace_ids, 'last_token')
             
-            print() # 换行
-            logger.info(f"AI回复完成: {response_text}")
+            finish_token_echo()
+            if moderation is not None and moderation.aborted:
+                # 命中需要中止的违禁词：停止生成，这条回复不缓存也不计入对话记忆
+                if hedged is not None:
+                    hedged.close()
+                else:
+                    speculation.cancel()
+                recorder.record(KIND_LLM_END, "moderated", tag)
+                logger.warning(f"AI回复命中违禁词，已中止: {response_text}")
+                return response_text
+            if hedged is not None and hedged.model:
+                model = hedged.model
+            recorder.record(KIND_LLM_END, "cancelled" if job and job.is_cancelled() else model, tag)
+            logger.info(f"AI回复完成({model}): {response_text}")
+            if self.response_cache and not (job and job.is_cancelled()):
+                # 按实际出字的模型存入缓存，备用模型的回复不会在查找主模型时命中
+                self.response_cache.put(text_to_refute, context.cache_namespace, model, response_text)
+            self.remember(text_to_refute, response_text, job, context)
             return response_text
 
-        except APIConnectionError as e:
-            logger.error(f"LLM网络连接失败: {e.__cause__}")
-        except RateLimitError as e:
-            logger.warning("LLM请求频率过高，请稍后再试。")
         except Exception as e:
-            logger.error(f"调用大模型时发生未知错误: {e}", exc_info=True)
+            if job and job.is_cancelled():
+                # 取消时关闭HTTP流会让读取端抛出异常，属于预期行为
+                logger.info(f"[🤖 AI杠精] 请求已取消: {type(e).__name__}")
+            elif isinstance(e, APIConnectionError):
+                logger.error(f"LLM网络连接失败: {e.__cause__}")
+            elif isinstance(e, RateLimitError):
+                logger.warning("LLM请求频率过高，请稍后再试。")
+            else:
+                logger.error(f"调用大模型时发生未知错误: {e}", exc_info=True)
@@ -1,37 +1,191 @@
 # agent/main_agent.py
+import os
 import time
+import random
 import threading
 import logging
 from openai import OpenAI
-from .asr_handler import ASRHandler
+import config
+from .asr_handler import ASRHandler, HandoverStats
+from .asr_backends import create_asr_backend
+from .audio_encoder import AudioEncoderStage
+from .audio_capture import AudioCapture
+from .audio_mixer import MixingAudioCapture
+from .vad import VADGate
 from .llm_handler import LLMHandler
+from .llm_dispatcher import LLMDispatcher
+from .response_cache import ResponseCache
+from .conversation_memory import ConversationMemory
+from .personas import PersonaRegistry, DEFAULT_PERSONA_NAME, parse_persona_command
+from .speculation import SpeculativeRunner
+from .moderation import Moderator
+from .tts import SpeechOutput
+from live_chat.bilibili_client import BilibiliLiveClient
+from live_chat.danmaku_filter import DanmakuFilter, DanmakuSampler, format_event
 from ui.webview_window import RefutationWebViewWindow
+from utils.tracing import tracer, startup
 
 logger = logging.getLogger(__name__)
 
 class MainAgent:
-    def __init__(self, api_key: str, window: RefutationWebViewWindow):
+    # 异步模式等子类可关闭预测生成
+    supports_speculation = True
+
+    def __init__(self, api_key: str, window: RefutationWebViewWindow, base_url: str = config.LLM_BASE_URL,
+                 audio_source_factory=None, recognition_factory=None, danmaku_url: str = config.DANMAKU_URL,
+                 speech_output: SpeechOutput = None):
+        """
+        audio_source_factory、recognition_factory和speech_output可替换音频输入、识别服务与语音播报，用于离线基准测试；
+        danmaku_url可指向本地的弹幕回放服务
+        """
         logger.info("初始化Agent...")
         self.api_key = api_key
         self.window = window
+        # 语音识别后端按config.ASR_BACKEND创建（本地后端会在此时启动识别进程）
+        self.recognition_factory = recognition_factory or create_asr_backend()
+
+        self.response_cache = self._create_response_cache()
+        self.conversation_memory = ConversationMemory() if config.MEMORY_ENABLED else None
+        self.moderator = self._create_moderator()
+
+        self._create_llm_pipeline(base_url)
+        if self.conversation_memory is not None:
+            # 旧对话的摘要由LLM处理器在后台生成
+            self.conversation_memory.summarizer = self.llm_handler.summarize
+        # 人设（可选）：LLM处理器每次请求时从注册表取当前人设的提示词与对话记忆
+        self.personas = self._create_persona_registry()
+        self.llm_handler.personas = self.personas
+        self.window.personas = self.personas
+        self.speculative_runner = None
+        if config.SPECULATION_ENABLED and not self.supports_speculation:
+            logger.warning("当前运行模式不支持预测生成，已忽略SPECULATION_ENABLED。")
+        elif config.SPECULATION_ENABLED:
+            # 只在没有回复进行中时预测，避免与正常请求争抢额度
+            self.speculative_runner = SpeculativeRunner(self.llm_handler, can_speculate=self.llm_dispatcher.is_idle)
+        self.asr_handler = None
+        # 音频采集器独立于ASR会话，重连期间持续录音
+        if audio_source_factory is None and len(config.AUDIO_SOURCES) > 1:
+            self.audio_capture = MixingAudioCapture(config.AUDIO_SOURCES)
+        else:
+            self.audio_capture = AudioCapture(source_factory=audio_source_factory)
+        # 语音播报（可选）：回复文本经窗口的流式接口送入，播放期间VAD门控不上传麦克风音频
+        self.speech_output = speech_output or self._create_speech_output()
+        self.window.speech_output = self.speech_output
+        # VAD门控跨会话保留，自适应噪声基底不会因重连而重新学习
+        self.vad_gate = VADGate(echo_guard=self.speech_output)
+        # 上传编码跨会话保留；本地识别不经过网络，不需要压缩
+        self.audio_encoder = AudioEncoderStage(config.ASR_AUDIO_FORMAT if config.ASR_BACKEND == 'dashscope'
+                                               else config.FORMAT_PCM)
+        self.handover_stats = HandoverStats()
+        self._reconnect_failures = 0
+        self.danmaku_enabled = config.DANMAKU_ENABLED
+        self.danmaku_room_id = config.DANMAKU_ROOM_ID
+        self.danmaku_url = danmaku_url
+        self.danmaku_client = None
+        self.danmaku_sampler = None
         
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _create_response_cache(self):
+        if not config.RESPONSE_CACHE_ENABLED:
+            return None
+        response_cache = ResponseCache()
+        response_cache.load()
+        response_cache.start_autosave()
+        return response_cache
+
+    def _create_moderator(self):
+        """违禁词表为空时不审核"""
+        if not config.MODERATION_ENABLED:
+            return None
+        moderator = Moderator.load()
+        return moderator if moderator.automaton.pattern_count else None
+
+    def _create_persona_registry(self):
+        if not config.PERSONA_ENABLED:
+            return None
+        memory_factory = self._create_persona_memory if self.conversation_memory is not None else None
+        personas = PersonaRegistry(memory_factory=memory_factory)
+        personas.load()
+        if config.PERSONA_ACTIVE != personas.active.name:
+            personas.switch(config.PERSONA_ACTIVE)
+        personas.on_change = self._on_persona_change
+        self.window.set_persona(personas.active.name, personas.active.title)
+        return personas
+
+    def _create_persona_memory(self, name: str):
+        """内置人设沿用conversation_memory，其余人设各有一份对话记忆，切回来时历史仍在"""
+        if name == DEFAULT_PERSONA_NAME:
+            return self.conversation_memory
+        return ConversationMemory(summarizer=self.llm_handler.summarize)
+
+    def _on_persona_change(self, persona):
+        self.window.set_persona(persona.name, persona.title)
+        self.window.add_system_message(f"人设已切换为「{persona.title}」，下一句开始生效")
+
+    def _handle_persona_command(self, text: str) -> bool:
+        """“切换人设 xxx”之类的语音命令，是命令时返回True（不交给大模型）"""
+        query = parse_persona_command(text)
+        if query is None:
+            return False
+        previous = self.personas.active
+        persona = self.personas.switch(query) if query else None
+        if persona is None:
+            names = '、'.join(p["title"] for p in self.personas.describe()["personas"])
+            self.window.add_system_message(f"没有找到人设「{query}」，可用的人设: {names}")
+        elif persona is previous:
+            self.window.add_system_message(f"当前已经是「{persona.title}」")
+        return True
+
+    def _create_speech_output(self):
+        return SpeechOutput() if config.TTS_ENABLED else None
+
+    def _create_llm_pipeline(self, base_url: str):
+        """创建LLM客户端、处理器与调度器"""
         self.llm_client = OpenAI(
             api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            base_url=base_url,
         )
         logger.info("大模型客户端(LLM Client)已成功初始化。")
 
-        self.llm_handler = LLMHandler(self.llm_client, self.window)
-        self.asr_handler = None
-        
-        self._stop_event = threading.Event()
-        self._thread = None
+        self.llm_handler = LLMHandler(self.llm_client, self.window, response_cache=self.response_cache,
+                                      memory=self.conversation_memory, moderator=self.moderator)
+        self.llm_dispatcher = LLMDispatcher(self.llm_handler.get_response)
 
-    def handle_asr_result(self, text: str):
+    def handle_asr_result(self, text: str, trace_id: int = None):
         """处理ASR识别结果"""
         logger.info(f"收到ASR结果: {text}")
-        # 将LLM调用放入单独的线程，以避免阻塞ASR处理
-        threading.Thread(target=self.llm_handler.get_response, args=(text,), daemon=True).start()
+        speculation = self.speculative_runner.on_final(text) if self.speculative_runner else None
+        if self.personas is not None and self._handle_persona_command(text):
+            if speculation is not None:
+                speculation.cancel()
+            # 命令不会走到LLM与UI，追踪到此结束，避免一直占着未完成队列
+            tracer.discard(trace_id)
+            return
+        # 交给有界调度器处理，避免阻塞ASR回调，也避免每句话新开一个线程
+        self.llm_dispatcher.submit(text, speculation=speculation, trace_id=trace_id)
+
+    def handle_danmaku(self, event):
+        """处理采样选中的弹幕，与语音识别结果走同一个调度器"""
+        text = format_event(event)
+        logger.info(f"选中弹幕: {text}")
+        trace_id = tracer.new_trace(sentence_end=event.received_at)
+        self.llm_dispatcher.submit(text, trace_id=trace_id)
+
+    def _on_danmaku_event(self, event):
+        priority = self.danmaku_filter.accept(event)
+        if priority is not None:
+            self.danmaku_sampler.offer(event, priority)
+
+    def _start_danmaku(self):
+        self.danmaku_filter = DanmakuFilter()
+        # 普通弹幕只在没有回复进行中时处理，语音优先
+        self.danmaku_sampler = DanmakuSampler(self.handle_danmaku, can_emit_normal=self.llm_dispatcher.is_idle)
+        self.danmaku_client = BilibiliLiveClient(self.danmaku_room_id, on_event=self._on_danmaku_event,
+                                                 url=self.danmaku_url, cookie=os.getenv("BILIBILI_COOKIE"))
+        self.danmaku_sampler.start()
+        self.danmaku_client.start()
 
     def _run_loop(self):
         """
@@ -39,21 +193,30 @@ class MainAgent:
         """
         logger.info("Agent后台守护进程开始运行...")
         
-        # 等待UI准备就绪
-        if self.window.wait_for_ready(timeout=10):
-            logger.info("检测到WebView UI已准备就绪")
-            self.window.show_listening_status()
-        else:
-            logger.warning("WebView UI未能在超时时间内准备就绪")
-        
+        # 不等待UI：麦克风与ASR连接和页面加载同时进行，页面就绪前的UI操作由JS桥缓冲
+        disconnected_at = None
         while not self._stop_event.is_set():
             logger.info("="*20 + " 启动新ASR会话 " + "="*20)
+            session_started = None
             try:
-                self.asr_handler = ASRHandler(on_sentence_end_callback=self.handle_asr_result)
-                self.asr_handler.start_session()
+                if not self.audio_capture.is_running:
+                    with startup.step('audio_start'):
+                        self.audio_capture.start()
+                self.asr_handler = ASRHandler(on_sentence_end_callback=self.handle_asr_result,
+                                              audio_capture=self.audio_capture,
+                                              vad_gate=self.vad_gate,
+                                              handover_stats=self.handover_stats,
+                                              on_partial_callback=self.speculative_runner.on_partial
+                                              if self.speculative_runner else None,
+                                              recognition_factory=self.recognition_factory,
+                                              audio_encoder=self.audio_encoder)
+                with startup.step('asr_connect'):
+                    self.asr_handler.start_session()
+                session_started = time.time()
+                if disconnected_at is not None:
+                    self.handover_stats.record("reconnect", session_started - disconnected_at)
                 
-                if self.window.is_ready():
-                    self.window.show_listening_status()
+                self.window.show_listening_status()
                 
                 self.asr_handler.run_audio_loop()
                 
@@ -61,25 +224,73 @@ class MainAgent:
                     break
                 
                 logger.warning("ASR会话已断开。")
+                logger.info(f"音频采集统计: {self.audio_capture.get_stats()}，VAD门控统计: {self.vad_gate.get_stats()}")
 
             except Exception as e:
                 logger.error(f"ASR处理器发生未知异常: {e}", exc_info=True)
             
+            disconnected_at = time.time()
             if not self._stop_event.is_set():
-                logger.info("将在2秒后尝试重新连接...")
-                time.sleep(2)
+                delay = self._next_reconnect_delay(session_started)
+                if delay > 0:
+                    logger.info(f"将在{delay:.1f}秒后尝试重新连接...")
+                    self._stop_event.wait(delay)
         
         logger.info("Agent后台守护进程已停止。")
 
+    def _next_reconnect_delay(self, session_started) -> float:
+        """计算重连等待时间：静默重置立即重连，出错则指数退避并加随机抖动"""
+        if self.asr_handler is not None and self.asr_handler.ended_by_reset:
+            self._reconnect_failures = 0
+            return 0.0
+        if session_started is not None and time.time() - session_started > config.ASR_BACKOFF_RESET_SECONDS:
+            self._reconnect_failures = 0
+        delay = min(config.ASR_RECONNECT_MAX_DELAY,
+                    config.ASR_RECONNECT_BASE_DELAY * (2 ** self._reconnect_failures))
+        self._reconnect_failures += 1
+        # 全抖动：在[delay/2, delay]之间随机，避免多个客户端同时重连
+        return random.uniform(delay / 2, delay)
+
+    def _warm_up_llm(self):
+        with startup.step('llm_prewarm'):
+            self.llm_handler.prewarm()
+
+    def _start_llm_warm_up(self):
+        """LLM连接预热与ASR连接同时进行，不阻塞启动"""
+        if config.LLM_PREWARM_ENABLED:
+            threading.Thread(target=self._warm_up_llm, name="LLMPrewarm", daemon=True).start()
+
     def run(self):
         """在后台线程中启动Agent的守护循环"""
         if self._thread is not None and self._thread.is_alive():
             logger.warning("Agent已经在运行中。")
             return
             
+        self._start_llm_warm_up()
+        if self.personas is not None:
+            self.personas.start_watching()
+        if self.speech_output is not None:
+            self.speech_output.start()
+        self.llm_dispatcher.start()
+        if self.speculative_runner:
+            self.speculative_runner.start()
+        if self.danmaku_enabled:
+            self._start_danmaku()
         self._thread = threading.Thread(target=self._run_loop, daemon=True)
         self._thread.start()
 
+    def _stop_shared_components(self):
+        """
+        输出对冲策略、审核器与回复缓存的统计，并停止缓存的后台保存（最后保存一次）。
+        服务模式下这些组件由所有会话共享，由服务停止时统一处理。
+        """
+        logger.info(f"对冲请求统计: {self.llm_handler.hedge_policy.get_stats()}")
+        if self.moderator is not None:
+            logger.info(f"回复审核统计: {self.moderator.get_stats()}")
+        if self.response_cache:
+            logger.info(f"回复缓存统计: {self.response_cache.get_stats()}")
+            self.response_cache.stop()
+
     def stop(self):
         """停止Agent的守护循环"""
         logger.info("Agent正在停止...")
@@ -88,6 +299,30 @@ class MainAgent:
         if self.asr_handler:
             self.asr_handler.stop()
         
+        if self.danmaku_client:
+            self.danmaku_client.stop()
+            self.danmaku_sampler.stop()
+            logger.info(f"弹幕筛选统计: {self.danmaku_filter.get_stats()}，采样统计: {self.danmaku_sampler.get_stats()}")
+        if self.speculative_runner:
+            self.speculative_runner.stop()
+        self.llm_dispatcher.stop()
+        if self.speech_output is not None:
+            self.speech_output.stop()
+            logger.info(f"语音播报统计: {self.speech_output.get_stats()}")
+        self.audio_capture.stop()
+        if hasattr(self.recognition_factory, 'close'):
+            logger.info(f"识别后端统计: {self.recognition_factory.get_stats()}")
+            self.recognition_factory.close()
+        logger.info(f"ASR会话切换统计: {self.handover_stats.summary()}")
+        logger.info(f"音频上传编码统计: {self.audio_encoder.get_stats()}")
+        logger.info(f"提示词用量统计: {self.llm_handler.usage_stats.get_stats()}")
+        if self.personas is not None:
+            self.personas.stop()
+            logger.info(f"人设统计（含各人设的对话记忆）: {self.personas.get_stats()}")
+        elif self.conversation_memory is not None:
+            logger.info(f"对话记忆统计: {self.conversation_memory.get_stats()}")
+        self._stop_shared_components()
+        
         if self._thread is not None:
             self._thread.join(timeout=5)
             if self._thread.is_alive():
@@ -0,0 +1,317 @@
+# agent/moderation.py
+# AI回复的流式审核：大模型的文本增量先经过多模式匹配自动机（Aho-Corasick），再交给StreamingAIResponse上屏。
+# 只扣留可能与后续文本拼成违禁词的末尾几个字，其余文字立即放行；命中后按策略打码或中止整条回复。
+import os
+import array
+import pickle
+import bisect
+import hashlib
+import logging
+import unicodedata
+from collections import deque
+import config
+
+logger = logging.getLogger(__name__)
+
+POLICY_MASK = 'mask'
+POLICY_ABORT = 'abort'
+
+def _skippable(ch: str) -> bool:
+    """匹配时忽略的字符：标点、空白、符号与控制/零宽字符，避免用“傻 逼”“傻*逼”之类的写法绕过"""
+    return unicodedata.category(ch)[0] in ('P', 'Z', 'S', 'C')
+
+def normalize_char(ch: str) -> str:
+    """单个字符的归一化结果：全半角统一、转小写，可忽略的字符返回空串（NFKC展开时可能多于一个字符）"""
+    return ''.join(c for c in unicodedata.normalize('NFKC', ch).lower() if not _skippable(c))
+
+class AhoCorasick:
+    """
+    多模式匹配自动机，编译后全部存放在定长整数数组中，几十万个词也只占几十MB。
+    状态按广度优先编号，每个状态的子节点编号连续、按字符排序，转移用二分查找；
+    out_len为在该状态结束的最长模式长度（含失配链上的），abort标记失配链上是否有需要中止回复的模式。
+    """
+
+    VERSION = 1
+
+    def __init__(self, words):
+        """words: [(词, 是否中止)]，词已归一化"""
+        flags = {}
+        for word, abort in words:
+            if word:
+                flags[word] = flags.get(word, False) or abort
+        patterns = sorted(flags)
+        self.pattern_count = len(patterns)
+        self.max_len = max((len(p) for p in patterns), default=0)
+
+        chars, first, count, depth, parent = [0], [0], [0], [0], [0]
+        term_len, term_abort = [0], [False]
+        node_of = [0] * len(patterns)
+        active = list(range(len(patterns)))
+        level = 0
+        # 逐层建树：模式已排序，同一父节点的子节点在本层连续出现且按字符有序，编号即广度优先序
+        while active:
+            next_active = []
+            last_parent, last_char = -1, -1
+            for pi in active:
+                word = patterns[pi]
+                p, c = node_of[pi], ord(word[level])
+                if p != last_parent or c != last_char:
+                    node = len(chars)
+                    chars.append(c)
+                    first.append(0)
+                    count.append(0)
+                    depth.append(level + 1)
+                    parent.append(p)
+                    term_len.append(0)
+                    term_abort.append(False)
+                    if not count[p]:
+                        first[p] = node
+                    count[p] += 1
+                    last_parent, last_char = p, c
+                node_of[pi] = len(chars) - 1
+                if len(word) == level + 1:
+                    term_len[-1] = level + 1
+                    term_abort[-1] = flags[word]
+                else:
+                    next_active.append(pi)
+            active = next_active
+            level += 1
+
+        self.chars = array.array('i', chars)
+        self.first = array.array('i', first)
+        self.count = array.array('i', count)
+        self.depth = array.array('i', depth)
+        fail = array.array('i', bytes(4 * len(chars)))
+        out_len = array.array('i', term_len)
+        abort = array.array('b', term_abort)
+        # 失配指针：按编号顺序（即广度优先）计算，父节点的失配指针总是已经算好
+        for node in range(1, len(chars)):
+            p = parent[node]
+            if p:
+                target = self._goto_from(fail[p], chars[node], fail)
+                fail[node] = target
+                out_len[node] = max(out_len[node], out_len[target])
+                abort[node] = abort[node] or abort[target]
+        self.fail = fail
+        self.out_len = out_len
+        self.abort = abort
+        self.states = len(chars)
+
+    def _child(self, state: int, c: int) -> int:
+        lo = self.first[state]
+        hi = lo + self.count[state]
+        if hi > lo:
+            i = bisect.bisect_left(self.chars, c, lo, hi)
+            if i < hi and self.chars[i] == c:
+                return i
+        return -1
+
+    def _goto_from(self, state: int, c: int, fail) -> int:
+        while True:
+            child = self._child(state, c)
+            if child >= 0:
+                return child
+            if not state:
+                return 0
+            state = fail[state]
+
+    def step(self, state: int, ch: str) -> int:
+        """从state读入一个（已归一化的）字符，返回新状态"""
+        return self._goto_from(state, ord(ch), self.fail)
+
+    def find_all(self, text: str) -> list:
+        """整段文本中的全部命中：[(结束位置, 最长模式长度)]，用于测试与基准对照"""
+        state, hits = 0, []
+        for i, ch in enumerate(text):
+            state = self.step(state, ch)
+            if self.out_len[state]:
+                hits.append((i, self.out_len[state]))
+        return hits
+
+    def memory_bytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.chars, self.first, self.count, self.depth,
+                                                 self.fail, self.out_len, self.abort))
+
+def load_words(path: str = config.MODERATION_WORDLIST_PATH, extra=config.MODERATION_WORDS,
+               default_policy: str = config.MODERATION_POLICY) -> list:
+    """
+    读取违禁词表：UTF-8文本，每行一个词，#开头为注释；词后可用制表符跟上mask或abort指定该词的处理方式。
+    返回[(归一化后的词, 是否中止)]。
+    """
+    entries = [(word, default_policy) for word in extra]
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line.strip() or line.lstrip().startswith('#'):
+                    continue
+                word, _, policy = line.partition('\t')
+                entries.append((word, policy.strip() or default_policy))
+    elif path:
+        logger.info(f"违禁词表不存在: {path}")
+    cache = {}
+    words = []
+    for word, policy in entries:
+        normalized = []
+        for ch in word:
+            n = cache.get(ch)
+            if n is None:
+                n = cache[ch] = normalize_char(ch)
+            normalized.append(n)
+        words.append((''.join(normalized), policy == POLICY_ABORT))
+    return words
+
+class ModerationStream:
+    """
+    一条回复的审核状态。feed()返回可以立即上屏的文字，末尾可能拼成违禁词的字留到后续增量再判断；
+    flush()在流结束时放行剩余文字。命中中止类词后aborted为True，此后不再输出任何文字。
+    """
+
+    def __init__(self, moderator: "Moderator"):
+        self.moderator = moderator
+        self.automaton = moderator.automaton
+        self.aborted = False
+        self.matches = 0
+        self._state = 0
+        self._buf = []         # 尚未放行的原始字符（命中的部分已替换为打码字符）
+        self._base = 0         # _buf[0]在整条回复中的位置
+        # 最近读入自动机的字符在整条回复中的位置，用于把匹配长度换算回原文范围
+        self._positions = deque(maxlen=max(1, self.automaton.max_len))
+
+    def feed(self, text: str) -> str:
+        if self.aborted:
+            return ''
+        automaton = self.automaton
+        normalize = self.moderator.normalize
+        buf, positions = self._buf, self._positions
+        state = self._state
+        for ch in text:
+            index = self._base + len(buf)
+            buf.append(ch)
+            for c in normalize(ch):
+                state = automaton.step(state, c)
+                positions.append(index)
+                length = automaton.out_len[state]
+                if not length:
+                    continue
+                self.matches += 1
+                if automaton.abort[state]:
+                    self._abort()
+                    return ''
+                self.moderator.masked += 1
+                for j in range(positions[-length] - self._base, len(buf)):
+                    buf[j] = self.moderator.mask_char
+        self._state = state
+        depth = automaton.depth[state]
+        hold_from = positions[-depth] - self._base if depth else len(buf)
+        self.moderator.max_held_chars = max(self.moderator.max_held_chars, len(buf) - hold_from)
+        released = ''.join(buf[:hold_from])
+        del buf[:hold_from]
+        self._base += hold_from
+        return released
+
+    def _abort(self):
+        self.aborted = True
+        self._buf.clear()
+        self.moderator.aborts += 1
+
+    def flush(self) -> str:
+        """流已结束，剩余文字不可能再拼成违禁词"""
+        released = ''.join(self._buf)
+        self._buf.clear()
+        return released
+
+    def filter(self, deltas):
+        """包装文本增量的迭代器：逐段放行审核后的文字，中止时以提示语结束"""
+        for delta in deltas:
+            released = self.feed(delta)
+            if released:
+                yield released
+            if self.aborted:
+                if self.moderator.abort_notice:
+                    yield self.moderator.abort_notice
+                return
+        tail = self.flush()
+        if tail:
+            yield tail
+
+    async def afilter(self, deltas):
+        """filter()的异步版本"""
+        async for delta in deltas:
+            released = self.feed(delta)
+            if released:
+                yield released
+            if self.aborted:
+                if self.moderator.abort_notice:
+                    yield self.moderator.abort_notice
+                return
+        tail = self.flush()
+        if tail:
+            yield tail
+
+class Moderator:
+    """违禁词审核器，编译好的自动机在各条回复间共享"""
+
+    def __init__(self, automaton: AhoCorasick, mask_char: str = config.MODERATION_MASK_CHAR,
+                 abort_notice: str = config.MODERATION_ABORT_NOTICE):
+        self.automaton = automaton
+        self.mask_char = mask_char
+        self.abort_notice = abort_notice
+        self._norm_cache = {}
+
+        # 统计信息
+        self.replies = 0
+        self.masked = 0
+        self.aborts = 0
+        self.max_held_chars = 0
+
+    def normalize(self, ch: str) -> str:
+        normalized = self._norm_cache.get(ch)
+        if normalized is None:
+            normalized = self._norm_cache[ch] = normalize_char(ch)
+        return normalized
+
+    def begin(self) -> ModerationStream:
+        """开始审核一条新回复"""
+        self.replies += 1
+        return ModerationStream(self)
+
+    @classmethod
+    def load(cls, path: str = config.MODERATION_WORDLIST_PATH,
+             cache_path: str = config.MODERATION_CACHE_PATH, **kwargs) -> "Moderator":
+        """
+        读取词表并编译自动机。编译结果按词表内容与配置的摘要缓存到cache_path，
+        词表不变时直接载入数组，不必重新建树。
+        """
+        words = load_words(path)
+        digest = hashlib.sha1(repr((AhoCorasick.VERSION, sorted(words))).encode('utf-8')).hexdigest()
+        automaton = None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    cached_digest, cached = pickle.load(f)
+                if cached_digest == digest:
+                    automaton = cached
+            except Exception as e:
+                logger.warning(f"读取审核自动机缓存失败，将重新编译: {e}")
+        if automaton is None:
+            automaton = AhoCorasick(words)
+            if cache_path and automaton.pattern_count:
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+                    with open(cache_path, 'wb') as f:
+                        pickle.dump((digest, automaton), f, protocol=pickle.HIGHEST_PROTOCOL)
+                except OSError as e:
+                    logger.warning(f"保存审核自动机缓存失败: {e}")
+        logger.info(f"回复审核已启用: {automaton.pattern_count}个词，{automaton.states}个状态，"
+                    f"{automaton.memory_bytes() / 1024 / 1024:.1f} MB")
+        return cls(automaton, **kwargs)
+
+    def get_stats(self) -> dict:
+        return {
+            "patterns": self.automaton.pattern_count,
+            "replies": self.replies,
+            "masked": self.masked,
+            "aborts": self.aborts,
+            "max_held_chars": self.max_held_chars,
+        }
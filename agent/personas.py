@@ -0,0 +1,293 @@
+# agent/personas.py
+# AI人设：PERSONA_DIR目录下每个.md/.txt文件是一个人设，文件名为人设名，可选的第一行“# 标题”为显示名称，其余内容为系统提示词。
+# 提示词在加载时校验并估算token数，请求路径上不再重复计算。切换人设只替换一个引用：进行中的回复继续使用开始时取到的人设，
+# 下一次请求才使用新的人设。每个人设有自己的对话记忆与回复缓存命名空间，切回来时历史仍在。
+# 文件被修改后由后台线程去抖、重新加载，加载期间不持有请求路径上的锁。
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import config
+from .conversation_memory import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PERSONA_SUFFIXES = ('.md', '.txt')
+DEFAULT_PERSONA_NAME = 'default'
+
+# 人设名即文件名：允许中文等Unicode字母数字，\w不含路径分隔符与点号
+_NAME_PATTERN = re.compile(r'^[\w-]{1,32}$')
+# 聊天命令中人设名前后可能带的标点与空白（语音识别结果通常带句末标点）
+_COMMAND_STRIP = ' \t\r\n，,。.！!？?：:、"“”\'‘’「」'
+
+class Persona:
+    """一个人设。加载后不再修改，重新加载时创建新的对象替换旧的"""
+
+    def __init__(self, name: str, system_prompt: str, title: str = None, path: str = None):
+        self.name = name
+        self.title = title or name
+        self.system_prompt = system_prompt
+        self.path = path
+        # 加载时估算一次，构造消息时直接使用
+        self.prompt_tokens = estimate_tokens(system_prompt)
+        # 回复缓存的命名空间：提示词改动后旧的缓存自然不再命中
+        digest = hashlib.sha1(system_prompt.encode('utf-8')).hexdigest()[:12]
+        self.cache_namespace = f"persona:{name}:{digest}"
+
+    def validate(self, max_tokens: int = config.PERSONA_MAX_PROMPT_TOKENS):
+        """提示词不合法时抛出ValueError"""
+        if ('/' in self.name or '\\' in self.name or '..' in self.name
+                or not _NAME_PATTERN.fullmatch(self.name)):
+            raise ValueError(f"人设名只能包含文字、数字、下划线和连字符（最长32个字符）: {self.name}")
+        if not self.system_prompt.strip():
+            raise ValueError(f"人设「{self.name}」的提示词为空")
+        if self.prompt_tokens > max_tokens:
+            raise ValueError(f"人设「{self.name}」的提示词约{self.prompt_tokens} tokens，超过上限{max_tokens}")
+
+    @classmethod
+    def from_file(cls, path: str) -> "Persona":
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read().lstrip('\ufeff')
+        title = None
+        first, _, rest = text.partition('\n')
+        if first.startswith('# '):
+            title = first[2:].strip() or None
+            text = rest
+        persona = cls(name, text.strip(), title=title, path=path)
+        persona.validate()
+        return persona
+
+    def describe(self) -> dict:
+        return {"name": self.name, "title": self.title, "prompt_tokens": self.prompt_tokens}
+
+class PersonaContext:
+    """一次请求使用的人设快照，请求开始时取一次；之后切换人设不影响这次请求的消息、缓存与记忆"""
+
+    __slots__ = ('name', 'system_prompt', 'system_tokens', 'cache_namespace', 'memory')
+
+    def __init__(self, name, system_prompt: str, system_tokens, cache_namespace: str, memory):
+        self.name = name
+        self.system_prompt = system_prompt
+        # 提示词的估算token数，None表示需要构造消息时再估算
+        self.system_tokens = system_tokens
+        self.cache_namespace = cache_namespace
+        self.memory = memory
+
+def parse_persona_command(text: str, prefixes=config.PERSONA_COMMAND_PREFIXES):
+    """识别“切换人设 xxx”之类的命令，返回人设名或标题（可能为空串），不是命令时返回None"""
+    stripped = text.strip(_COMMAND_STRIP)
+    for prefix in prefixes:
+        if stripped.lower().startswith(prefix.lower()):
+            return stripped[len(prefix):].strip(_COMMAND_STRIP)
+    return None
+
+class PersonaRegistry:
+    """
+    人设注册表。active引用的替换是原子的，请求线程只读这个引用，不会被加载或切换阻塞；
+    目录中的文件在load()时全部校验，校验失败的文件保留上一次加载成功的版本。
+    memory_factory(name)为每个人设创建对话记忆（首次使用时创建），为空时不带历史。
+    """
+
+    def __init__(self, directory: str = config.PERSONA_DIR, default_prompt: str = config.DEFAULT_SYSTEM_PROMPT,
+                 memory_factory=None, debounce: float = config.PERSONA_RELOAD_DEBOUNCE_SECONDS,
+                 poll_interval: float = config.PERSONA_WATCH_INTERVAL_SECONDS):
+        self.directory = directory
+        self.memory_factory = memory_factory
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # 切换或重新加载后当前人设变化时调用on_change(persona)，例如更新界面上的人设名
+        self.on_change = None
+        # 内置的默认人设，目录中同名的文件可以覆盖它
+        self._builtin = Persona(DEFAULT_PERSONA_NAME, default_prompt, title=config.PERSONA_DEFAULT_TITLE)
+        self._personas = {self._builtin.name: self._builtin}
+        self.active = self._builtin
+        self._memories = {}
+        self._memory_lock = threading.Lock()
+        # 串行化load与switch（请求路径不需要这把锁）
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._signature = None
+
+        # 统计信息
+        self.loads = 0
+        self.reloads = 0
+        self.invalid = 0
+        self.switches = 0
+        self.last_load_ms = 0.0
+
+    def _scan(self) -> dict:
+        """{路径: (修改时间, 大小)}，只读目录项，不打开文件"""
+        signature = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return signature
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(PERSONA_SUFFIXES) and not entry.name.startswith('.'):
+                stat = entry.stat()
+                signature[entry.path] = (stat.st_mtime, stat.st_size)
+        return signature
+
+    def load(self) -> list:
+        """（重新）加载目录中的全部人设，返回加载失败的文件名"""
+        started = time.perf_counter()
+        signature = self._scan()
+        failed = []
+        with self._lock:
+            previous, previous_signature = self._personas, self._signature or {}
+            personas = {self._builtin.name: self._builtin}
+            for path in sorted(signature):
+                name = os.path.splitext(os.path.basename(path))[0]
+                old = previous.get(name)
+                if old is not None and old.path == path and previous_signature.get(path) == signature[path]:
+                    personas[name] = old
+                    continue
+                try:
+                    persona = Persona.from_file(path)
+                except (OSError, UnicodeDecodeError, ValueError) as e:
+                    self.invalid += 1
+                    failed.append(os.path.basename(path))
+                    if old is not None and old.path == path:
+                        personas[name] = old
+                        logger.error(f"人设文件无效，继续使用上一次加载的版本: {e}")
+                    else:
+                        logger.error(f"人设文件无效，已跳过: {e}")
+                    continue
+                if name in personas and personas[name].path is not None:
+                    logger.warning(f"人设名重复，{os.path.basename(path)}覆盖了{os.path.basename(personas[name].path)}")
+                personas[name] = persona
+            self._personas = personas
+            self._signature = signature
+            active = self.active
+            current = personas.get(active.name)
+            if current is None:
+                # 当前人设的文件被删除：正在使用的人设不突然消失，保留到下一次切换
+                logger.warning(f"当前人设「{active.title}」的文件已删除，继续使用已加载的版本。")
+            elif current is not active:
+                self.active = current
+            self.loads += 1
+            self.last_load_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"已加载{len(personas)}个人设（{self.last_load_ms:.1f} ms）: {', '.join(personas)}")
+        if current is not None and current is not active:
+            logger.info(f"当前人设「{current.title}」已更新，下一次回复开始生效。")
+            self._notify(current)
+        return failed
+
+    def names(self) -> list:
+        return list(self._personas)
+
+    def get(self, name: str):
+        return self._personas.get(name)
+
+    def find(self, query: str):
+        """按人设名或标题查找（不区分大小写），找不到时返回None"""
+        query = query.strip().lower()
+        if not query:
+            return None
+        personas = self._personas
+        if query in personas:
+            return personas[query]
+        for persona in personas.values():
+            if query in (persona.name.lower(), persona.title.lower()):
+                return persona
+        return None
+
+    def switch(self, query: str):
+        """切换当前人设，下一次请求开始生效；找不到时返回None"""
+        with self._lock:
+            persona = self.find(query)
+            if persona is None:
+                logger.warning(f"找不到人设: {query}，可用的人设: {', '.join(self._personas)}")
+                return None
+            previous, self.active = self.active, persona
+            if persona is not previous:
+                self.switches += 1
+        if persona is not previous:
+            logger.info(f"人设已切换: 「{previous.title}」 -> 「{persona.title}」，下一次回复开始生效。")
+            self._notify(persona)
+        return persona
+
+    def _notify(self, persona: Persona):
+        if self.on_change is not None:
+            try:
+                self.on_change(persona)
+            except Exception as e:
+                logger.error(f"人设变更回调出错: {e}")
+
+    def memory_for(self, name: str):
+        """人设的对话记忆，首次使用时创建"""
+        if self.memory_factory is None:
+            return None
+        memory = self._memories.get(name)
+        if memory is None:
+            with self._memory_lock:
+                memory = self._memories.get(name)
+                if memory is None:
+                    memory = self._memories[name] = self.memory_factory(name)
+        return memory
+
+    def context(self) -> PersonaContext:
+        """当前人设的快照，每次请求开始时取一次"""
+        persona = self.active
+        return PersonaContext(persona.name, persona.system_prompt, persona.prompt_tokens,
+                              persona.cache_namespace, self.memory_for(persona.name))
+
+    def describe(self) -> dict:
+        return {"active": self.active.name, "personas": [p.describe() for p in self._personas.values()]}
+
+    def start_watching(self):
+        """在后台线程中轮询目录，文件停止变化debounce秒后才重新加载（编辑器保存时常常连写几次）"""
+        if self._thread is not None or self.poll_interval <= 0:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch_loop, name="PersonaWatch", daemon=True)
+        self._thread.start()
+
+    def _watch_loop(self):
+        pending, changed_at = None, 0.0
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                signature = self._scan()
+            except OSError as e:
+                logger.debug(f"扫描人设目录失败: {e}")
+                continue
+            if signature == self._signature:
+                pending = None
+                continue
+            if signature != pending:
+                # 又有新的改动，重新开始计时
+                pending, changed_at = signature, time.monotonic()
+                continue
+            if time.monotonic() - changed_at >= self.debounce:
+                pending = None
+                self.reloads += 1
+                try:
+                    self.load()
+                except Exception as e:
+                    logger.error(f"重新加载人设失败: {e}", exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def memories(self) -> dict:
+        with self._memory_lock:
+            return dict(self._memories)
+
+    def get_stats(self) -> dict:
+        return {
+            "active": self.active.name,
+            "personas": len(self._personas),
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "invalid": self.invalid,
+            "switches": self.switches,
+            "last_load_ms": self.last_load_ms,
+            "memories": {name: memory.get_stats() for name, memory in self.memories().items()},
+        }
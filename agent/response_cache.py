@@ -0,0 +1,194 @@
+# agent/response_cache.py
+import os
+import time
+import gzip
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+import config
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """归一化ASR文本：全半角统一、转小写、去掉标点和空白"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(ch for ch in text if unicodedata.category(ch)[0] not in ('P', 'Z', 'C'))
+
+class ResponseCache:
+    """
+    回复缓存。键为归一化文本+人设命名空间（人设Prompt，或人设名加提示词摘要）+模型名，每个键保存多条候选回复并轮流使用。
+    按LRU数量上限和TTL淘汰（TTL从最近一次加入新候选回复时算起），并以gzip压缩的JSON文件持久化，
+    有改动时后台定期保存，进程被强制结束后重启，缓存仍然有效。
+    """
+
+    def __init__(self, path: str = config.RESPONSE_CACHE_PATH,
+                 max_entries: int = config.RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = config.RESPONSE_CACHE_TTL_SECONDS,
+                 max_candidates: int = config.RESPONSE_CACHE_MAX_CANDIDATES,
+                 min_candidates: int = config.RESPONSE_CACHE_MIN_CANDIDATES,
+                 save_interval: float = config.RESPONSE_CACHE_SAVE_INTERVAL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_candidates = max(1, max_candidates)
+        self.min_candidates = max(1, min(min_candidates, self.max_candidates))
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        # key -> {"updated": 最近加入候选回复的时间戳, "candidates": [回复...], "next": 下次使用的候选序号}
+        self._entries = OrderedDict()
+        self._dirty = False
+        # 串行化写盘：后台保存与退出时的保存不会同时写同一个临时文件
+        self._save_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, namespace: str, model: str) -> str:
+        raw = '\0'.join((normalize_text(text), namespace, model))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _is_expired(self, entry: dict, now: float) -> bool:
+        return now - entry["updated"] > self.ttl_seconds
+
+    def get(self, text: str, namespace: str, model: str):
+        """查找缓存的回复，未命中（或候选数量不足）时返回None"""
+        key = self.make_key(text, namespace, model)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry, now):
+                del self._entries[key]
+                self.evictions += 1
+                self._dirty = True
+                entry = None
+            if entry is None or len(entry["candidates"]) < self.min_candidates:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            candidates = entry["candidates"]
+            reply = candidates[entry["next"] % len(candidates)]
+            entry["next"] = (entry["next"] + 1) % len(candidates)
+            self.hits += 1
+            return reply
+
+    def put(self, text: str, namespace: str, model: str, reply: str):
+        """保存一条新的候选回复"""
+        if not reply:
+            return
+        key = self.make_key(text, namespace, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"updated": 0.0, "candidates": [], "next": 0}
+                self._entries[key] = entry
+            if reply not in entry["candidates"]:
+                entry["candidates"].append(reply)
+                entry["updated"] = time.time()
+                if len(entry["candidates"]) > self.max_candidates:
+                    entry["candidates"].pop(0)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+
+    def discard(self, text: str, namespace: str, model: str, reply: str):
+        """删除一条候选回复（例如审核词表更新后命中了中止类词），候选为空时删除整个条目"""
+        key = self.make_key(text, namespace, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or reply not in entry["candidates"]:
+                return
+            entry["candidates"].remove(reply)
+            if not entry["candidates"]:
+                del self._entries[key]
+            self.evictions += 1
+            self._dirty = True
+
+    def load(self):
+        """从磁盘加载缓存，跳过已过期的条目"""
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        loaded = 0
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    key, updated, candidates = json.loads(line)
+                    if now - updated > self.ttl_seconds:
+                        continue
+                    self._entries[key] = {"updated": updated, "candidates": candidates, "next": 0}
+                    loaded += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"加载回复缓存失败，将使用空缓存: {e}")
+            self._entries.clear()
+            return
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logger.info(f"已从 {self.path} 加载 {loaded} 条回复缓存。")
+
+    def save(self):
+        """把缓存写入磁盘（先写临时文件再替换，避免写到一半时损坏）"""
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [(key, e["updated"], e["candidates"]) for key, e in self._entries.items()]
+            self._dirty = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+                    f.write('\n')
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            with self._lock:
+                self._dirty = True
+            logger.error(f"保存回复缓存失败: {e}")
+
+    def start_autosave(self):
+        """在后台线程中每save_interval秒检查一次，有改动时保存"""
+        if self._thread is not None or self.save_interval <= 0:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._autosave_loop, name="ResponseCacheSave", daemon=True)
+        self._thread.start()
+
+    def _autosave_loop(self):
+        while not self._stop_event.wait(self.save_interval):
+            self.save()
+
+    def stop(self):
+        """停止后台保存并保存最后的改动"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.save()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,243 @@
+# agent/speculation.py
+import time
+import logging
+import threading
+from difflib import SequenceMatcher
+import config
+from .response_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+def text_similarity(a: str, b: str) -> float:
+    """归一化后两段文本的相似度（0~1）"""
+    a, b = normalize_text(a), normalize_text(b)
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+class Speculation:
+    """一次隐藏的预测生成：在后台拉取流式回复并缓存token，采用后再把token交给UI"""
+
+    def __init__(self, llm_handler, text: str):
+        self.llm_handler = llm_handler
+        self.text = text
+        # 开始预测时的人设快照，采用时人设已切换则放弃
+        self.context = llm_handler.prompt_context()
+        self.started_at = time.time()
+        self.first_token_at = None
+        self.adopted_at = None
+        self.error = None
+        self._tokens = []
+        self._done = False
+        self._cancelled = False
+        self._completion = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="LLMSpeculation", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            completion = self.llm_handler.create_completion(self.text, context=self.context)
+            with self._cond:
+                self._completion = completion
+                if self._cancelled:
+                    completion.close()
+                    return
+            for content in self.llm_handler.iter_deltas(completion):
+                with self._cond:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.time()
+                    self._tokens.append(content)
+                    self._cond.notify_all()
+        except Exception as e:
+            if not self._cancelled:
+                self.error = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            completion = self._completion
+            self._cond.notify_all()
+        if completion is not None:
+            try:
+                completion.close()
+            except Exception as e:
+                logger.debug(f"关闭预测生成的流时出错: {e}")
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def is_done(self) -> bool:
+        return self._done
+
+    def iter_tokens(self):
+        """先返回已缓存的token，再等待后续token，直到生成结束"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._tokens) and not self._done and not self._cancelled:
+                    self._cond.wait()
+                if index < len(self._tokens):
+                    tokens = self._tokens[index:]
+                    index = len(self._tokens)
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            for token in tokens:
+                yield token
+
+    def ttft_saved(self) -> float:
+        """与在最终句子到达后才请求相比，首token提前了多少秒"""
+        if self.first_token_at is None or self.adopted_at is None:
+            return 0.0
+        ttft = self.first_token_at - self.started_at
+        observed = max(0.0, self.first_token_at - self.adopted_at)
+        return max(0.0, ttft - observed)
+
+class SpeculativeRunner:
+    """
+    根据ASR中间结果进行预测生成。
+    中间结果保持不变超过SPECULATION_STABLE_SECONDS时，在后台开始隐藏的生成；
+    最终句子到达时，若与预测所用的文本足够相似就采用该生成，否则取消并重新请求。
+    """
+
+    def __init__(self, llm_handler, can_speculate=None,
+                 stable_seconds: float = config.SPECULATION_STABLE_SECONDS,
+                 min_similarity: float = config.SPECULATION_MIN_SIMILARITY):
+        self.llm_handler = llm_handler
+        self.can_speculate = can_speculate or (lambda: True)
+        self.stable_seconds = stable_seconds
+        self.min_similarity = min_similarity
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._partial = None
+        self._partial_norm = None
+        self._changed_at = 0.0
+        self._speculation = None
+        self._stopped = False
+        self._thread = None
+
+        # 统计信息
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+        self.aborted = 0
+        self.total_ttft_saved = 0.0
+        self._adopted = []
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._watch_loop, name="SpeculationWatch", daemon=True)
+        self._thread.start()
+        logger.info(f"预测生成已启用：中间结果稳定{self.stable_seconds}秒后开始生成。")
+
+    def on_partial(self, text: str):
+        """ASR中间结果回调"""
+        norm = normalize_text(text)
+        with self._lock:
+            if norm == self._partial_norm:
+                return
+            self._partial = text
+            self._partial_norm = norm
+            self._changed_at = time.time()
+            spec = self._speculation
+            if spec is not None and text_similarity(spec.text, text) < self.min_similarity:
+                # 用户还在继续说，预测已经过时
+                self._speculation = None
+                self.aborted += 1
+            else:
+                spec = None
+        if spec is not None:
+            logger.debug(f"中间结果已变化，取消预测生成: {spec.text}")
+            spec.cancel()
+        self._wakeup.set()
+
+    def on_final(self, text: str):
+        """最终句子到达：返回可采用的Speculation，或None（需要正常请求）"""
+        with self._lock:
+            spec, self._speculation = self._speculation, None
+            self._partial = self._partial_norm = None
+        if spec is None:
+            return None
+        if not spec.is_cancelled and spec.error is None and text_similarity(spec.text, text) >= self.min_similarity:
+            spec.adopted_at = time.time()
+            with self._lock:
+                self.hits += 1
+                self._adopted.append(spec)
+            logger.info(f"预测生成命中: 预测文本「{spec.text}」≈ 最终文本「{text}」")
+            return spec
+        with self._lock:
+            self.misses += 1
+        logger.info(f"预测生成未命中，重新请求: 预测文本「{spec.text}」 / 最终文本「{text}」")
+        spec.cancel()
+        return None
+
+    def _watch_loop(self):
+        while not self._stopped:
+            self._wakeup.wait(0.05)
+            self._wakeup.clear()
+            self._collect_adopted()
+            with self._lock:
+                if (self._partial is None or self._speculation is not None
+                        or time.time() - self._changed_at < self.stable_seconds):
+                    continue
+                if not self.can_speculate():
+                    continue
+                spec = Speculation(self.llm_handler, self._partial)
+                self._speculation = spec
+                self.attempts += 1
+            logger.debug(f"中间结果已稳定，开始预测生成: {spec.text}")
+            spec.start()
+
+    def _collect_adopted(self):
+        """首token到达后统计节省的时间"""
+        with self._lock:
+            ready = [s for s in self._adopted if s.first_token_at is not None or s.is_done]
+            if not ready:
+                return
+            self._adopted = [s for s in self._adopted if s not in ready]
+            for spec in ready:
+                saved = spec.ttft_saved()
+                self.total_ttft_saved += saved
+        for spec in ready:
+            logger.info(f"预测生成节省首token延迟: {spec.ttft_saved() * 1000:.0f} ms")
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        with self._lock:
+            spec, self._speculation = self._speculation, None
+        if spec is not None:
+            spec.cancel()
+        self._collect_adopted()
+        stats = self.get_stats()
+        logger.info(f"预测生成统计: 尝试{stats['attempts']}次，命中{stats['hits']}次，未命中{stats['misses']}次，"
+                    f"中途放弃{stats['aborted']}次，命中率{stats['hit_rate'] * 100:.0f}%，"
+                    f"平均节省首token延迟{stats['avg_ttft_saved_ms']:.0f} ms")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            decided = self.hits + self.misses
+            return {
+                "attempts": self.attempts,
+                "hits": self.hits,
+                "misses": self.misses,
+                "aborted": self.aborted,
+                "hit_rate": self.hits / decided if decided else 0.0,
+                "avg_ttft_saved_ms": self.total_ttft_saved / self.hits * 1000 if self.hits else 0.0,
+            }
@@ -0,0 +1,324 @@
+# agent/tts.py
+# 语音播报：AI回复的文本增量按句切分，每切出一段就提交合成（多段同时进行），
+# 合成结果按原顺序排队播放，第一句说完前后续句子已在合成，首个音频不必等整条回复生成完。
+# 播放期间VADGate通过echo_guard屏蔽麦克风，播放的声音不会被识别成新的一句话。
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError as FutureTimeout
+import config
+from utils.tracing import Histogram
+from .audio_capture import pyaudio
+
+logger = logging.getLogger(__name__)
+
+# 句末标点：切在标点之后（后面紧跟的引号、括号与重复标点一并留在本段）
+_STRONG_BREAKS = set('。！？!?；;…\n')
+# 弱停顿：当前段落够长时才切
+_WEAK_BREAKS = set('，,、：:')
+_CLOSERS = set('”’"\'」』）)】]》')
+
+def _speakable(text: str) -> bool:
+    return any(ch.isalnum() for ch in text)
+
+class SentenceSegmenter:
+    """
+    把流式到达的文本切成适合单独合成的段落：句末标点处总是切分；逗号等弱停顿在段落达到最少字数时切分
+    （第一段的门槛更低，尽早开始合成）；英文句点后跟空白才算句末（3.14、example.com不会被切开）；一直没有标点时按最大字数强制切分。
+    """
+
+    def __init__(self, first_min_chars: int = config.TTS_SEGMENT_FIRST_MIN_CHARS,
+                 min_chars: int = config.TTS_SEGMENT_MIN_CHARS, max_chars: int = config.TTS_SEGMENT_MAX_CHARS):
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.max_chars = max(1, max_chars)
+        self._buf = []
+        # 已遇到句末标点（或英文句点），等下一个字符确定切分位置
+        self._pending = None  # None / 'strong' / 'period'
+        self.segments = 0
+
+    def _cut(self, out: list):
+        text = ''.join(self._buf).strip()
+        self._buf = []
+        self._pending = None
+        if _speakable(text):
+            out.append(text)
+            self.segments += 1
+
+    def feed(self, text: str) -> list:
+        """送入一段文本增量，返回已经可以合成的段落"""
+        out = []
+        for ch in text:
+            if self._pending is not None:
+                if ch in _CLOSERS or ch in _STRONG_BREAKS or (ch == '.' and self._pending == 'period'):
+                    self._buf.append(ch)
+                    continue
+                if self._pending == 'strong' or ch.isspace():
+                    self._cut(out)
+                else:
+                    # 句点后面不是空白：小数、缩写或网址
+                    self._pending = None
+            self._buf.append(ch)
+            if ch in _STRONG_BREAKS:
+                self._pending = 'strong'
+            elif ch == '.':
+                self._pending = 'period'
+            elif ch in _WEAK_BREAKS:
+                if len(self._buf) >= (self.min_chars if self.segments else self.first_min_chars):
+                    self._cut(out)
+            elif len(self._buf) >= self.max_chars:
+                self._cut(out)
+        return out
+
+    def flush(self) -> list:
+        """回复结束，剩下的文本作为最后一段"""
+        out = []
+        self._cut(out)
+        return out
+
+class DashScopeTTSBackend:
+    """阿里云CosyVoice语音合成（dashscope.audio.tts_v2），返回16位单声道PCM"""
+
+    def __init__(self, model: str = config.TTS_MODEL, voice: str = config.TTS_VOICE,
+                 sample_rate: int = config.TTS_SAMPLE_RATE):
+        from dashscope.audio.tts_v2 import AudioFormat
+        self.model = model
+        self.voice = voice
+        self.sample_rate = sample_rate
+        self._format = getattr(AudioFormat, f'PCM_{sample_rate}HZ_MONO_16BIT')
+
+    def synthesize(self, text: str) -> bytes:
+        from dashscope.audio.tts_v2 import SpeechSynthesizer
+        # 合成器实例不能复用，每次调用新建一个
+        synthesizer = SpeechSynthesizer(model=self.model, voice=self.voice, format=self._format)
+        return synthesizer.call(text) or b''
+
+def create_tts_backend(name: str = config.TTS_BACKEND):
+    """按配置创建语音合成后端：带sample_rate属性与synthesize(text) -> PCM bytes方法的对象"""
+    if name == 'dashscope':
+        return DashScopeTTSBackend()
+    raise ValueError(f"未知的语音合成后端: {name}")
+
+class PyAudioSink:
+    """通过PyAudio播放16位单声道PCM，write阻塞到数据写入声卡缓冲区"""
+
+    def __init__(self, sample_rate: int, device=config.TTS_OUTPUT_DEVICE):
+        if pyaudio is None:
+            raise RuntimeError("未安装PyAudio，无法播放语音。")
+        self.audio = pyaudio.PyAudio()
+        try:
+            device_index = self._find_device(device)['index'] if device is not None else None
+            self.stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=sample_rate, output=True,
+                                          output_device_index=device_index)
+        except Exception:
+            self.audio.terminate()
+            raise
+
+    def _find_device(self, device) -> dict:
+        if isinstance(device, int):
+            return self.audio.get_device_info_by_index(device)
+        for i in range(self.audio.get_device_count()):
+            info = self.audio.get_device_info_by_index(i)
+            if device.lower() in info['name'].lower() and info['maxOutputChannels'] > 0:
+                return info
+        raise RuntimeError(f"找不到音频输出设备: {device}")
+
+    def write(self, data: bytes):
+        self.stream.write(data)
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio.terminate()
+
+class SpokenReply:
+    """一条正在播报的回复，由StreamingAIResponse在回复开始时创建"""
+
+    def __init__(self, output: "SpeechOutput"):
+        self.output = output
+        self.segmenter = SentenceSegmenter()
+        self.cancelled = False
+        self.started_at = time.perf_counter()
+        self.first_text_at = None
+        self.last_played_at = None
+
+    def feed(self, text: str):
+        if self.first_text_at is None:
+            self.first_text_at = time.perf_counter()
+        for segment in self.segmenter.feed(text):
+            self.output.submit(self, segment)
+
+    def end(self):
+        for segment in self.segmenter.flush():
+            self.output.submit(self, segment)
+
+    def cancel(self):
+        self.cancelled = True
+
+class SpeechOutput:
+    """
+    语音播报输出。合成在线程池中并发进行；播放线程按提交顺序依次等待各段的合成结果并播放，
+    这个按序排队的队列就是抖动缓冲：后面的段落先合成完也只能排队，前一段播放期间后一段的合成时间被掩盖。
+    新回复开始时打断上一条回复的播报（与界面只显示最新回复一致）。
+    """
+
+    def __init__(self, backend=None, sink_factory=None, max_concurrent: int = config.TTS_MAX_CONCURRENT,
+                 chunk_ms: int = config.TTS_PLAYBACK_CHUNK_MS, echo_tail: float = config.TTS_ECHO_TAIL_SECONDS):
+        self.backend = backend or create_tts_backend()
+        self.sink_factory = sink_factory or PyAudioSink
+        self.max_concurrent = max(1, max_concurrent)
+        self.chunk_bytes = max(1, self.backend.sample_rate * chunk_ms // 1000) * 2
+        self.echo_tail = echo_tail
+        self._executor = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._current = None
+        self._lock = threading.Lock()
+        self._sink = None
+        # 麦克风屏蔽的截止时间（time.monotonic）
+        self._guard_until = 0.0
+
+        # 统计信息
+        self.replies = 0
+        self.interrupted = 0
+        self.segments = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.first_audio = Histogram()          # 回复开始（发出请求）到开始出声
+        self.first_audio_after_text = Histogram()  # 首个文本增量到开始出声，即切分、合成与排队本身的开销
+        self.gaps = Histogram()                 # 同一条回复相邻两段之间的静音
+        self.synthesis = Histogram()            # 单段合成耗时
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="TTSSynth")
+        self._thread = threading.Thread(target=self._playback_loop, name="TTSPlayback", daemon=True)
+        self._thread.start()
+        logger.info(f"语音播报已启动（并发合成 {self.max_concurrent}，采样率 {self.backend.sample_rate} Hz）")
+
+    def begin(self) -> SpokenReply:
+        reply = SpokenReply(self)
+        with self._lock:
+            if self._current is not None and not self._current.cancelled:
+                self._current.cancel()
+                self.interrupted += 1
+            self._current = reply
+        self.replies += 1
+        return reply
+
+    def submit(self, reply: SpokenReply, text: str):
+        if reply.cancelled or self._executor is None:
+            return
+        self.segments += 1
+        self._queue.put((reply, text, self._executor.submit(self._synthesize, reply, text)))
+
+    def _synthesize(self, reply: SpokenReply, text: str):
+        """在合成线程中执行，返回(PCM, 耗时)，耗时由播放线程统计"""
+        if reply.cancelled:
+            return b'', 0.0
+        started = time.perf_counter()
+        pcm = self.backend.synthesize(text)
+        return pcm, time.perf_counter() - started
+
+    def suppressing(self) -> bool:
+        """是否正在播放（或刚播放完），VADGate据此屏蔽麦克风"""
+        return time.monotonic() < self._guard_until
+
+    def _wait_result(self, reply: SpokenReply, future):
+        """等待一段的合成结果，等待期间回复被打断时放弃"""
+        while True:
+            try:
+                return future.result(timeout=0.05)
+            except FutureTimeout:
+                if reply.cancelled:
+                    future.cancel()
+                    return None
+
+    def _playback_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._play_item(*item)
+            finally:
+                self._queue.task_done()
+
+    def _play_item(self, reply: SpokenReply, text: str, future):
+        if reply.cancelled:
+            future.cancel()
+            return
+        try:
+            result = self._wait_result(reply, future)
+        except CancelledError:
+            return
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"语音合成失败，跳过这一段: {text}，{e}")
+            return
+        if result is None:
+            return
+        pcm, elapsed = result
+        if elapsed:
+            self.synthesis.observe(elapsed)
+        if pcm and not reply.cancelled:
+            self._play(reply, pcm)
+
+    def is_idle(self) -> bool:
+        """所有已提交的段落都已播放（或放弃）"""
+        return self._queue.unfinished_tasks == 0
+
+    def _play(self, reply: SpokenReply, pcm: bytes):
+        if self._sink is None:
+            try:
+                self._sink = self.sink_factory(self.backend.sample_rate)
+            except Exception as e:
+                logger.error(f"打开音频输出失败，本段不播放: {e}")
+                return
+        now = time.perf_counter()
+        if reply.last_played_at is None:
+            self.first_audio.observe(now - reply.started_at)
+            if reply.first_text_at is not None:
+                self.first_audio_after_text.observe(now - reply.first_text_at)
+        else:
+            self.gaps.observe(now - reply.last_played_at)
+        chunk_seconds = self.chunk_bytes / 2 / self.backend.sample_rate
+        for i in range(0, len(pcm), self.chunk_bytes):
+            if reply.cancelled:
+                break
+            chunk = pcm[i:i + self.chunk_bytes]
+            # 声卡缓冲中的音频还要播放一会，屏蔽到这块播完之后再加上余量
+            self._guard_until = time.monotonic() + chunk_seconds + self.echo_tail
+            self._sink.write(chunk)
+            self.audio_seconds += len(chunk) / 2 / self.backend.sample_rate
+        reply.last_played_at = time.perf_counter()
+
+    def stop(self):
+        with self._lock:
+            if self._current is not None:
+                self._current.cancel()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+    def get_stats(self) -> dict:
+        return {
+            "replies": self.replies,
+            "interrupted": self.interrupted,
+            "segments": self.segments,
+            "failed": self.failed,
+            "audio_seconds": self.audio_seconds,
+            "first_audio": self.first_audio.snapshot(),
+            "first_audio_after_text": self.first_audio_after_text.snapshot(),
+            "gaps": self.gaps.snapshot(),
+            "synthesis": self.synthesis.snapshot(),
+        }
@@ -0,0 +1,213 @@
+# agent/vad.py
+import logging
+from collections import deque
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+class VADEngine:
+    """VAD检测器接口：判断一个int16音频块是否为语音"""
+
+    def process(self, samples: np.ndarray) -> bool:
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+class EnergyVAD(VADEngine):
+    """RMS能量检测，支持自适应噪声基底。计算复用预分配的float32缓冲区，不为每个块分配内存。"""
+
+    def __init__(self, block_size: int = config.BLOCK_SIZE,
+                 threshold: float = config.VAD_ENERGY_THRESHOLD,
+                 adaptive: bool = config.VAD_ADAPTIVE_NOISE_FLOOR,
+                 noise_ratio: float = config.VAD_NOISE_FLOOR_RATIO):
+        self.threshold = threshold
+        self.adaptive = adaptive
+        self.noise_ratio = noise_ratio
+        self._buf = np.empty(block_size, dtype=np.float32)
+        self.noise_floor = threshold / noise_ratio
+        self.last_energy = 0.0
+
+    def process(self, samples: np.ndarray) -> bool:
+        n = samples.size
+        if n == 0:
+            self.last_energy = 0.0
+            return False
+        if n > self._buf.size:
+            self._buf = np.empty(n, dtype=np.float32)
+        buf = self._buf[:n]
+        np.copyto(buf, samples, casting='unsafe')
+        energy = float(np.sqrt(np.dot(buf, buf) / n))
+        self.last_energy = energy
+
+        threshold = self.threshold
+        if self.adaptive:
+            threshold = max(threshold, self.noise_floor * self.noise_ratio)
+        is_speech = energy > threshold
+        if self.adaptive and not is_speech:
+            # 噪声基底快降慢升，持续的背景噪声会逐渐抬高阈值；只在非语音块上更新，
+            # 否则持续说话时基底会慢慢追上语音能量，几秒后语音就被判为静默
+            if energy < self.noise_floor:
+                self.noise_floor += 0.2 * (energy - self.noise_floor)
+            else:
+                self.noise_floor += 0.01 * (energy - self.noise_floor)
+            self.noise_floor = min(self.noise_floor, threshold)
+        return is_speech
+
+    def reset(self):
+        self.noise_floor = self.threshold / self.noise_ratio
+
+class ZeroCrossingVAD(VADEngine):
+    """过零率检测：语音的过零率落在一定范围内，可过滤低频嗡嗡声和高频嘶嘶声"""
+
+    def __init__(self, block_size: int = config.BLOCK_SIZE, zcr_range=config.VAD_ZCR_RANGE):
+        self.zcr_min, self.zcr_max = zcr_range
+        self._sign = np.empty(block_size, dtype=bool)
+        self._cross = np.empty(block_size - 1, dtype=bool)
+        self.last_zcr = 0.0
+
+    def process(self, samples: np.ndarray) -> bool:
+        n = samples.size
+        if n < 2:
+            self.last_zcr = 0.0
+            return False
+        if n > self._sign.size:
+            self._sign = np.empty(n, dtype=bool)
+            self._cross = np.empty(n - 1, dtype=bool)
+        sign = self._sign[:n]
+        cross = self._cross[:n - 1]
+        np.signbit(samples, out=sign)
+        np.not_equal(sign[1:], sign[:-1], out=cross)
+        zcr = np.count_nonzero(cross) / (n - 1)
+        self.last_zcr = zcr
+        return self.zcr_min <= zcr <= self.zcr_max
+
+class CompositeVAD(VADEngine):
+    """组合多个检测器，全部判定为语音才算语音"""
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+
+    def process(self, samples: np.ndarray) -> bool:
+        result = True
+        for engine in self.engines:
+            # 每个检测器都要处理，以便自适应状态持续更新
+            result = engine.process(samples) and result
+        return result
+
+    def reset(self):
+        for engine in self.engines:
+            engine.reset()
+
+_DETECTORS = {
+    'energy': EnergyVAD,
+    'zcr': ZeroCrossingVAD,
+}
+
+def register_vad(name: str, engine_cls):
+    """注册自定义VAD检测器，之后可在config.VAD_DETECTORS中按名称启用"""
+    _DETECTORS[name] = engine_cls
+
+def create_vad(detectors=config.VAD_DETECTORS, block_size: int = config.BLOCK_SIZE) -> VADEngine:
+    """根据名称列表创建VAD检测器"""
+    engines = []
+    for name in detectors:
+        if name not in _DETECTORS:
+            raise ValueError(f"未知的VAD检测器: {name}")
+        engines.append(_DETECTORS[name](block_size=block_size))
+    return engines[0] if len(engines) == 1 else CompositeVAD(engines)
+
+class VADGate:
+    """
+    根据VAD结果决定哪些音频块上传给ASR。
+    语音开始时补发之前缓存的pre-roll块，语音结束后再继续发送hangover块，
+    让识别器能看到完整的句首和句尾静音；其余静默块不再上传。
+    """
+
+    def __init__(self, engine: VADEngine = None,
+                 preroll_blocks: int = config.VAD_PREROLL_BLOCKS,
+                 hangover_blocks: int = config.VAD_HANGOVER_BLOCKS,
+                 enabled: bool = config.VAD_GATE_ENABLED,
+                 echo_guard=None):
+        self.engine = engine or create_vad()
+        # 语音播报（agent.tts.SpeechOutput）：suppressing()为真时麦克风里是我们自己播放的声音，一律不上传
+        self.echo_guard = echo_guard
+        self.hangover_blocks = hangover_blocks
+        self.enabled = enabled
+        self._preroll = deque(maxlen=preroll_blocks) if preroll_blocks > 0 else None
+        self._hangover_left = 0
+        self.is_speech = False
+        # 上一个音频块是否因播放而被屏蔽
+        self.suppressed = False
+
+        # 统计信息
+        self.blocks_in = 0
+        self.blocks_sent = 0
+        self.bytes_saved = 0
+        self.blocks_suppressed = 0
+        self.speech_cut = 0        # 说话中开始播放、补发静音句尾的次数
+
+    def process(self, data: bytes) -> list:
+        """处理一个音频块，返回现在应当发送的音频块列表（可能为空）"""
+        self.blocks_in += 1
+        if self.echo_guard is not None and self.echo_guard.suppressing():
+            # 播放中：不更新检测器（噪声基底不受播放声音影响），缓存的句首音频也一并丢弃
+            frames = []
+            tail = self._hangover_left if self.enabled else (self.hangover_blocks if self.is_speech else 0)
+            if tail > 0:
+                # 说话中开始播放：用静音补齐句尾（不能发麦克风里的播放声音），识别器才能判断这句话已结束并给出最终结果
+                frames = [bytes(len(data))] * tail
+                self.blocks_sent += tail
+                self.speech_cut += 1
+            self.is_speech = False
+            self.suppressed = True
+            self.reset_session()
+            self.blocks_suppressed += 1
+            self.bytes_saved += len(data)
+            return frames
+        self.suppressed = False
+        self.is_speech = self.engine.process(np.frombuffer(data, dtype=np.int16))
+
+        if not self.enabled:
+            self.blocks_sent += 1
+            return [data]
+
+        if self.is_speech:
+            frames = []
+            if self._hangover_left == 0 and self._preroll:
+                # 语音刚开始：先补发句首的缓存音频
+                frames.extend(self._preroll)
+                self._preroll.clear()
+            frames.append(data)
+            self._hangover_left = self.hangover_blocks
+            self.blocks_sent += len(frames)
+            return frames
+
+        if self._hangover_left > 0:
+            self._hangover_left -= 1
+            self.blocks_sent += 1
+            return [data]
+
+        if self._preroll is not None:
+            if len(self._preroll) == self._preroll.maxlen:
+                self.bytes_saved += len(self._preroll[0])
+            self._preroll.append(data)
+        else:
+            self.bytes_saved += len(data)
+        return []
+
+    def reset_session(self):
+        """新ASR会话开始时清空门控状态，噪声基底保留"""
+        if self._preroll is not None:
+            self._preroll.clear()
+        self._hangover_left = 0
+
+    def get_stats(self) -> dict:
+        return {
+            "blocks_in": self.blocks_in,
+            "blocks_sent": self.blocks_sent,
+            "bytes_saved": self.bytes_saved,
+            "blocks_suppressed": self.blocks_suppressed,
+            "speech_cut": self.speech_cut,
+        }
@@ -0,0 +1,208 @@
+# benchmarks/bench_asr.py
+# 语音识别后端对比：同一段录音按实时速度经VAD门控送入各个后端，统计每句话从最后一个有声音频块发出
+# 到收到最终结果的延迟，以及主进程与识别进程的CPU时间。另外对比共享内存环形缓冲区与multiprocessing.Queue
+# 向子进程传送音频块的开销。
+# 用法: python -m benchmarks.bench_asr --wav 录音.wav --backends local,dashscope
+#      没有模型时可用 --local-engine benchmarks.fakes:EnergyEngine 只测本地后端的进程间传输与断句
+import os
+import sys
+import time
+import argparse
+import statistics
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from agent.vad import VADGate
+from agent.asr_backends import ASRBackendCallback, ASRResult, DashScopeASRBackend, LocalASRBackend, SharedAudioRing
+from benchmarks.fakes import WavFileSource, SyntheticSpeechSource, make_schedule
+
+def load_blocks(args) -> list:
+    """把录音（或合成音频）一次性切成音频块，所有后端使用完全相同的输入"""
+    if args.wav:
+        source = WavFileSource(args.wav, loop=False)
+        count = -(-source.samples.size // config.BLOCK_SIZE)
+    else:
+        schedule = make_schedule(args.sentences, args.interval)
+        source = SyntheticSpeechSource(schedule)
+        count = int((schedule[-1][0] + 2.0) * config.SAMPLE_RATE / config.BLOCK_SIZE)
+    source.speed = float('inf')  # 不按实时速度等待
+    return [source.read(config.BLOCK_SIZE) for _ in range(count)]
+
+class _Collector(ASRBackendCallback):
+    def __init__(self):
+        self.opened = 0
+        self.partials = 0
+        self.finals = []  # [(收到时刻, 文本)]
+        self.errors = []
+
+    def on_open(self):
+        self.opened += 1
+
+    def on_event(self, result: ASRResult):
+        sentence = result.get_sentence()
+        if ASRResult.is_sentence_end(sentence):
+            self.finals.append((time.perf_counter(), sentence['text']))
+        else:
+            self.partials += 1
+
+    def on_error(self, result: ASRResult):
+        self.errors.append(result.message)
+
+def run_backend(name: str, factory, blocks: list, tail: float) -> dict:
+    collector = _Collector()
+    vad_gate = VADGate()
+    session = factory(model=config.ASR_MODEL, format=config.FORMAT_PCM, sample_rate=config.SAMPLE_RATE,
+                      callback=collector)
+    connect_started = time.perf_counter()
+    session.start()
+    connect_ms = (time.perf_counter() - connect_started) * 1000
+
+    cpu_started = time.process_time()
+    voice_ends = []  # 每段语音最后一个有声音频块发出的时刻
+    was_speech = False
+    interval = config.BLOCK_SIZE / config.SAMPLE_RATE
+    started = time.perf_counter()
+    for i, block in enumerate(blocks):
+        for frame in vad_gate.process(block):
+            session.send_audio_frame(frame)
+        if vad_gate.is_speech:
+            if not was_speech:
+                voice_ends.append(None)
+            voice_ends[-1] = time.perf_counter()
+        was_speech = vad_gate.is_speech
+        delay = started + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    time.sleep(tail)
+    session.stop()
+    cpu = time.process_time() - cpu_started
+
+    # 每句最终结果对应在它之前结束的最后一段语音
+    latencies = []
+    for received_at, _ in collector.finals:
+        ended = [t for t in voice_ends if t is not None and t <= received_at]
+        if ended:
+            latencies.append((received_at - ended[-1]) * 1000)
+    return {"name": name, "connect_ms": connect_ms, "finals": collector.finals, "partials": collector.partials,
+            "latencies": latencies, "utterances": len(voice_ends), "main_cpu": cpu, "errors": collector.errors}
+
+def report(result: dict, audio_seconds: float, worker_cpu: float = None):
+    latencies = sorted(result["latencies"])
+    print(f"{result['name']}: 建立会话 {result['connect_ms']:.0f} ms，语音段 {result['utterances']}，"
+          f"最终结果 {len(result['finals'])}，中间结果 {result['partials']}")
+    if latencies:
+        print(f"  句尾延迟 p50 {statistics.median(latencies):.0f} ms，"
+              f"p90 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]:.0f} ms，最大 {latencies[-1]:.0f} ms")
+    cpu = f"  主进程CPU {result['main_cpu']:.2f} s（{result['main_cpu'] / audio_seconds:.1%} 实时）"
+    if worker_cpu is not None:
+        cpu += f"，识别进程CPU {worker_cpu:.2f} s（{worker_cpu / audio_seconds:.1%} 实时）"
+    print(cpu)
+    for _, text in result["finals"][:3]:
+        print(f"  识别结果: {text}")
+    if result["errors"]:
+        print(f"  错误: {result['errors'][:3]}")
+
+def _drain_queue(q, count: int, results):
+    delays = []
+    for _ in range(count):
+        sent_at, _ = q.get()
+        delays.append(time.time() - sent_at)
+    results.put((delays, time.process_time()))
+
+def _drain_ring(name: str, capacity: int, count: int, data_ready, results):
+    # 与识别进程相同的读取方式：读空后才等待信号量
+    ring = SharedAudioRing(capacity, name=name)
+    delays = []
+    while len(delays) < count:
+        record = ring.read()
+        if record is None:
+            data_ready.acquire(timeout=0.5)
+            continue
+        delays.append(time.time() - record[2])
+    ring.close()
+    results.put((delays, time.process_time()))
+
+def bench_transport(blocks: list, frames: int = 500, interval: float = 0.004):
+    """
+    按固定间隔向子进程发送音频块，对比两种传送方式：发送方每块的耗时、送达延迟与接收进程的CPU时间。
+    接收进程的CPU时间包含启动时导入模块的部分，两种方式相同。
+    """
+    context = multiprocessing.get_context('spawn')
+    payloads = [blocks[i % len(blocks)] for i in range(frames)]
+    results = context.Queue()
+
+    def run(title, send, process):
+        process.start()
+        time.sleep(1.0)  # 等子进程启动完成
+        cost = 0.0
+        for i, payload in enumerate(payloads):
+            started = time.perf_counter()
+            send(payload)
+            cost += time.perf_counter() - started
+            time.sleep(interval)
+        delays, cpu = results.get()
+        process.join()
+        delays = sorted(d * 1000 for d in delays)
+        print(f"  {title:<22} 发送 {cost / frames * 1e6:6.1f} us/块，送达延迟 p50 {statistics.median(delays):.3f} ms，"
+              f"p99 {delays[int(len(delays) * 0.99)]:.3f} ms，接收进程CPU {cpu:.2f} s")
+
+    print(f"进程间传送 {frames} 个音频块（{len(blocks[0])} 字节/块，间隔 {interval * 1000:.0f} ms）:")
+    q = context.Queue()
+    run("multiprocessing.Queue", lambda payload: q.put((time.time(), payload)),
+        context.Process(target=_drain_queue, args=(q, frames, results)))
+
+    ring = SharedAudioRing(len(blocks[0]) * 64)
+    data_ready = context.Semaphore(0)
+
+    def send_ring(payload):
+        ring.write(1, payload)
+        data_ready.release()
+
+    run("共享内存环形缓冲区", send_ring,
+        context.Process(target=_drain_ring, args=(ring.name, ring.capacity, frames, data_ready, results)))
+    ring.close(unlink=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="语音识别后端对比")
+    parser.add_argument('--wav', help="16位PCM的WAV录音，默认使用合成音频")
+    parser.add_argument('--sentences', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=3.0)
+    parser.add_argument('--backends', default='local,dashscope')
+    parser.add_argument('--local-engine', default=config.ASR_LOCAL_ENGINE)
+    parser.add_argument('--model-path', default=config.ASR_LOCAL_MODEL_PATH)
+    parser.add_argument('--tail', type=float, default=1.5, help="音频结束后等待结果的时间（秒）")
+    args = parser.parse_args()
+
+    blocks = load_blocks(args)
+    audio_seconds = len(blocks) * config.BLOCK_SIZE / config.SAMPLE_RATE
+    print(f"音频时长 {audio_seconds:.1f} 秒，共 {len(blocks)} 块\n")
+
+    for name in args.backends.split(','):
+        if name == 'local':
+            backend = LocalASRBackend(engine=args.local_engine, model_path=args.model_path)
+            try:
+                result = run_backend(f"local({args.local_engine})", backend, blocks, args.tail)
+            except Exception as e:
+                print(f"local: 无法运行（{e}）")
+                backend.close()
+                continue
+            stats = backend.get_stats()
+            backend.close()
+            report(result, audio_seconds, stats["worker_cpu_seconds"])
+            print(f"  传输延迟 平均 {stats['avg_transfer_ms']:.2f} ms，丢弃 {stats['frames_dropped']} 块")
+        elif name == 'dashscope':
+            api_key = os.getenv("DASHSCOPE_API_KEY")
+            if not api_key:
+                print("dashscope: 未设置DASHSCOPE_API_KEY，跳过")
+                continue
+            import dashscope
+            dashscope.api_key = api_key
+            report(run_backend("dashscope", DashScopeASRBackend, blocks, args.tail), audio_seconds)
+        print()
+
+    bench_transport(blocks)
+
+if __name__ == '__main__':
+    main()
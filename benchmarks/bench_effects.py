@@ -0,0 +1,116 @@
+# benchmarks/bench_effects.py
+# 屏幕特效帧时间基准（只用CPU，不需要界面）：不同粒子数下，对比向量化粒子池与逐个Python对象更新+JSON序列化
+# 的每帧耗时（更新+打包绘制命令），再以空渲染器运行特效线程，统计实际帧率与超时帧。
+# 用法: python -m benchmarks.bench_effects --counts 100,500,1000,2000,5000
+import os
+import sys
+import time
+import json
+import math
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from tools.screen_effects import ParticlePool, EffectEngine
+
+class NaiveParticle:
+    def __init__(self, sprite: int, x: float, y: float):
+        direction = math.pi * 1.2 + random.uniform(-0.6, 0.6)
+        speed = random.uniform(700.0, 1300.0)
+        self.sprite = sprite
+        self.x, self.y = x, y
+        self.vx, self.vy = math.cos(direction) * speed, math.sin(direction) * speed
+        self.angle = random.uniform(-math.pi, math.pi)
+        self.spin = random.uniform(-6.0, 6.0)
+        self.scale = random.uniform(0.7, 1.4)
+        self.life = 1e9  # 基准中不让粒子消失，保持粒子数不变
+
+class NaiveSystem:
+    """对照组：每个粒子一个Python对象，逐个更新，绘制命令序列化为JSON"""
+
+    def __init__(self, count: int, width: int = 1920, height: int = 1080):
+        self.particles = [NaiveParticle(0, width / 2, height / 2) for _ in range(count)]
+
+    def frame(self, dt: float) -> str:
+        drag = config.SCREEN_EFFECTS_DRAG ** dt
+        commands = []
+        for p in self.particles:
+            p.vy += config.SCREEN_EFFECTS_GRAVITY * dt
+            p.vx *= drag
+            p.vy *= drag
+            p.x += p.vx * dt
+            p.y += p.vy * dt
+            p.angle += p.spin * dt
+            p.life -= dt
+            commands.append([p.sprite, round(p.x), round(p.y), round(p.angle * 100), round(p.scale * 100), 255])
+        return f"drawFrame({json.dumps(commands)});"
+
+def fill_pool(count: int) -> EffectEngine:
+    pool = ParticlePool(capacity=count, seed=1)
+    engine = EffectEngine(lambda js: None, pool=pool)
+    # 关闭重力、寿命极长，让粒子数在整个测量中保持不变
+    pool.gravity = 0.0
+    engine.trigger('😂', count, origin=(pool.width / 2, pool.height / 2))
+    engine.render_frame(0.0)
+    pool.vel[:] *= 0.01
+    pool.life[:] = 1e9
+    return engine
+
+def measure(frame, frames: int, dt: float) -> list:
+    times = []
+    for _ in range(frames):
+        started = time.perf_counter()
+        frame(dt)
+        times.append((time.perf_counter() - started) * 1000)
+    return sorted(times)
+
+def summary(times: list) -> str:
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    return f"p50 {statistics.median(times):6.2f} ms，p99 {p99:6.2f} ms"
+
+def run_engine(count: int, seconds: float, fps: int) -> dict:
+    """以空渲染器运行特效线程，持续补充粒子使同屏数量维持在count左右"""
+    engine = EffectEngine(lambda js: None, pool=ParticlePool(capacity=count, seed=2), fps=fps)
+    engine.start()
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        if engine.pool.count < count * 0.8:
+            engine.trigger('🤡', count // 10)
+        time.sleep(0.02)
+    engine.stop()
+    stats = engine.get_stats()
+    stats["fps"] = stats["frames"] / seconds
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="屏幕特效帧时间基准")
+    parser.add_argument('--counts', default='100,500,1000,2000,5000')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--fps', type=int, default=config.SCREEN_EFFECTS_FPS)
+    parser.add_argument('--engine-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    budget = 1000 / args.fps
+    dt = 1 / args.fps
+    counts = [int(c) for c in args.counts.split(',')]
+    print(f"每帧预算 {budget:.1f} ms（{args.fps} fps），每组 {args.frames} 帧（更新+打包绘制命令）")
+    for count in counts:
+        engine = fill_pool(count)
+        vectorized = measure(engine.render_frame, args.frames, dt)
+        naive = measure(NaiveSystem(count).frame, args.frames, dt)
+        payload = len(engine.render_frame(dt))
+        print(f"{count:>5} 粒子  向量化 {summary(vectorized)}  |  逐对象+JSON {summary(naive)}  "
+              f"|  每帧JS {payload / 1024:.1f} KB，加速 {statistics.median(naive) / statistics.median(vectorized):.1f}x"
+              f"{'' if vectorized[int(len(vectorized) * 0.99)] <= budget else '  超出预算'}")
+
+    print(f"\n特效线程实测（空渲染器，{args.engine_seconds:.0f} 秒）:")
+    for count in counts:
+        stats = run_engine(count, args.engine_seconds, args.fps)
+        print(f"{count:>5} 粒子  {stats['fps']:5.1f} fps，帧耗时 p50 {stats['frame_ms_p50']:.2f} ms，"
+              f"p99 {stats['frame_ms_p99']:.2f} ms，超时帧 {stats['late_frames']}/{stats['frames']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# benchmarks/bench_encoder.py
+# 上传编码基准：同一段音频经VAD门控后分别以PCM与不同比特率的Opus编码，
+# 统计上传码率、节省的字节数、每秒音频的编码CPU时间与每块编码耗时。
+# 用法: python -m benchmarks.bench_encoder --wav 录音.wav --bitrates 16000,24000,32000
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from agent.vad import VADGate
+from agent import audio_encoder
+from agent.audio_encoder import AudioEncoderStage
+from benchmarks.bench_asr import load_blocks
+
+def run(stage: AudioEncoderStage, frames: list):
+    stage.begin_session()
+    worst = 0.0
+    for frame in frames:
+        started = time.perf_counter()
+        stage.encode(frame)
+        worst = max(worst, time.perf_counter() - started)
+    return stage.get_stats(), worst
+
+def main():
+    parser = argparse.ArgumentParser(description="上传编码基准")
+    parser.add_argument('--wav', help="16位PCM的WAV录音，默认使用合成音频")
+    parser.add_argument('--sentences', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=3.0)
+    parser.add_argument('--bitrates', default='16000,24000,32000')
+    args = parser.parse_args()
+
+    blocks = load_blocks(args)
+    vad_gate = VADGate()
+    frames = [frame for block in blocks for frame in vad_gate.process(block)]
+    total_seconds = len(blocks) * config.BLOCK_SIZE / config.SAMPLE_RATE
+    sent_seconds = len(frames) * config.BLOCK_SIZE / config.SAMPLE_RATE
+    print(f"音频 {total_seconds:.1f} 秒，VAD门控后上传 {sent_seconds:.1f} 秒（{len(frames)} 块）")
+
+    modes = [("PCM", AudioEncoderStage(config.FORMAT_PCM))]
+    if audio_encoder.opuslib is None:
+        print("未安装opuslib或找不到libopus，只测PCM（运行时同样会自动回退为PCM）")
+    else:
+        for bitrate in (int(b) for b in args.bitrates.split(',')):
+            stage = AudioEncoderStage('opus')
+            stage.encoder.bitrate = bitrate
+            modes.append((f"Opus {bitrate // 1000}k", stage))
+
+    for title, stage in modes:
+        stats, worst = run(stage, frames)
+        print(f"{title:<10} 上传 {stats['upload_kbps']:6.1f} kbit/s，共 {stats['sent_bytes'] / 1024:7.1f} KB，"
+              f"节省 {stats['bytes_saved'] / 1024:7.1f} KB（{stats['saved_ratio']:.1%}），"
+              f"编码CPU {stats['encode_cpu_ms_per_second']:5.2f} ms/秒音频，单块最长 {worst * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/bench_hedging.py
+# 对冲请求基准：主模型大多数请求很快、少数首token极慢（长尾），备用模型稳定但略慢。
+# 对比不对冲与对冲时的首token延迟分布，以及对冲比例、备用请求胜出比例和额外开销；
+# 最后模拟主模型整体故障，观察熔断后直接使用备用模型。
+# 用法: python -m benchmarks.bench_hedging --requests 200 --slow-rate 0.08
+import os
+import sys
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI
+from agent.llm_handler import LLMHandler
+from agent.hedging import HedgePolicy, HedgedStream
+from benchmarks.fakes import NullWindow
+from benchmarks.mock_llm_server import MockLLMServer
+
+PRIMARY = "primary-model"
+FALLBACK = "fallback-model"
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run(server: MockLLMServer, policy: HedgePolicy, requests: int, concurrency: int):
+    client = OpenAI(api_key="benchmark", base_url=server.url)
+    handler = LLMHandler(client, NullWindow())
+
+    def one(i: int):
+        started = time.perf_counter()
+        ttft = None
+        try:
+            for _ in HedgedStream(handler, f"第{i}句话", policy):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+        except Exception:
+            return None
+        return ttft
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    return [r for r in results if r is not None], requests - sum(r is not None for r in results)
+
+def report(title: str, ttfts: list, failed: int, policy: HedgePolicy, server: MockLLMServer):
+    ms = [t * 1000 for t in ttfts]
+    print(f"{title}: 首token p50 {percentile(ms, 0.5):.0f} ms, p95 {percentile(ms, 0.95):.0f} ms, "
+          f"p99 {percentile(ms, 0.99):.0f} ms, 最大 {max(ms):.0f} ms, 平均 {statistics.mean(ms):.0f} ms, 失败 {failed}")
+    stats = policy.get_stats()
+    print(f"  对冲比例 {stats['hedge_rate']:.1%}，备用请求胜出 {stats['hedge_win_rate']:.1%}，"
+          f"额外请求 {stats['extra_requests']}（提示词开销 +{stats['extra_cost_ratio']:.1%}），"
+          f"降级 {stats['fallbacks']}，熔断跳过 {stats['breaker_skips']}，熔断次数 {stats['breaker']['trips']}，"
+          f"当前对冲等待 {stats['hedge_delay_ms']:.0f} ms")
+    print(f"  胜出模型 {stats['wins_by_model']}，服务端请求 {server.get_stats()['requests_by_model']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="对冲请求基准")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--primary-ttft', type=float, default=0.3)
+    parser.add_argument('--slow-rate', type=float, default=0.08, help="主模型出现长尾的概率")
+    parser.add_argument('--slow-ttft', type=float, default=4.0, help="长尾请求的首token延迟（秒）")
+    parser.add_argument('--fallback-ttft', type=float, default=0.45)
+    parser.add_argument('--probe-interval', type=float, default=0.5, help="并发故障测试中的熔断时长（秒）")
+    args = parser.parse_args()
+
+    profiles = {
+        PRIMARY: {"ttft": args.primary_ttft, "slow_rate": args.slow_rate, "slow_ttft": args.slow_ttft},
+        FALLBACK: {"ttft": args.fallback_ttft},
+    }
+    modes = (
+        ("不对冲", HedgePolicy(models=[PRIMARY], enabled=False)),
+        ("对冲", HedgePolicy(models=[PRIMARY, FALLBACK])),
+    )
+    for title, policy in modes:
+        server = MockLLMServer(token_rate=400, reply_tokens=20, model_profiles=profiles).start()
+        ttfts, failed = run(server, policy, args.requests, args.concurrency)
+        report(title, ttfts, failed, policy, server)
+        server.stop()
+
+    # 主模型整体故障：先失败降级，连续失败后熔断，之后的请求直接发给备用模型
+    outage = dict(profiles, **{PRIMARY: {"ttft": args.primary_ttft, "error_rate": 1.0}})
+    server = MockLLMServer(token_rate=400, reply_tokens=20, model_profiles=outage).start()
+    policy = HedgePolicy(models=[PRIMARY, FALLBACK])
+    ttfts, failed = run(server, policy, args.requests // 4, 1)
+    report("主模型故障", ttfts, failed, policy, server)
+    server.stop()
+
+    # 并发请求下熔断反复期满：每次半开只有一个探测请求发给主模型，其余请求继续直接使用备用模型
+    server = MockLLMServer(token_rate=400, reply_tokens=20, model_profiles=outage).start()
+    policy = HedgePolicy(models=[PRIMARY, FALLBACK])
+    policy.breaker.open_seconds = args.probe_interval
+    started = time.perf_counter()
+    ttfts, failed = run(server, policy, args.requests, args.concurrency)
+    elapsed = time.perf_counter() - started
+    report(f"主模型故障（并发{args.concurrency}，熔断{args.probe_interval:g}秒）", ttfts, failed, policy, server)
+    trips = policy.breaker.trips
+    print(f"  用时 {elapsed:.1f} 秒，主模型请求 {server.get_stats()['requests_by_model'].get(PRIMARY, 0)}个，"
+          f"上限 {args.concurrency + trips}（首次熔断前并发中的{args.concurrency}个 + 每次半开一个探测请求）")
+    server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# benchmarks/bench_logging.py
+# 日志对流式token消费速度的影响：对比原先的同步日志+逐token打印，与队列日志、关闭回显、JSON格式
+# 用法: python -m benchmarks.bench_logging --tokens 2000 --console-latency-us 200
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from utils.logger_setup import setup_global_logger, shutdown_logging, echo_token, finish_token_echo, get_logging_stats
+
+logger = logging.getLogger("bench")
+
+class SlowConsole:
+    """模拟终端：写入先进缓冲区，每次flush（以及缓冲区写满时）有固定延迟"""
+
+    def __init__(self, flush_latency: float, buffer_size: int = 8192):
+        self.flush_latency = flush_latency
+        self.buffer_size = buffer_size
+        self._pending = 0
+        self.flushes = 0
+
+    def write(self, text: str):
+        self._pending += len(text)
+        if self._pending >= self.buffer_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        self._pending = 0
+        self.flushes += 1
+        time.sleep(self.flush_latency)
+
+def legacy_drain(tokens):
+    """原先LLMHandler中的写法"""
+    for token in tokens:
+        print(token, end="", flush=True)
+    print()
+
+def drain(tokens):
+    for token in tokens:
+        echo_token(token)
+    finish_token_echo()
+
+def noisy_logger(stop: threading.Event, rate: float):
+    """另一个线程以固定频率打INFO日志，模拟VAD、音频等高频事件"""
+    i = 0
+    while not stop.is_set():
+        logger.info(f"音频块 {i} 能量 {i % 300}")
+        i += 1
+        time.sleep(1.0 / rate)
+
+def run_case(name: str, tokens, console: SlowConsole, log_dir: str, legacy: bool, use_queue: bool,
+             json_format: bool = False, echo: bool = True, noise_rate: float = 200.0):
+    setup_global_logger(use_queue=use_queue, json_format=json_format, rate_limit=0 if legacy else 20.0,
+                        log_dir=log_dir, console_stream=console)
+    config.CONSOLE_TOKEN_ECHO = echo
+    original_stdout, sys.stdout = sys.stdout, console
+    stop = threading.Event()
+    noise = threading.Thread(target=noisy_logger, args=(stop, noise_rate), daemon=True)
+    noise.start()
+    try:
+        gaps = []
+        started = time.perf_counter()
+        last = started
+        # 每50个token打一条INFO日志，相当于回复开始/结束等低频事件
+        for i in range(0, len(tokens), 50):
+            chunk = tokens[i:i + 50]
+            logger.info(f"回复片段 {i}")
+            if legacy:
+                legacy_drain(chunk)
+            else:
+                drain(chunk)
+            now = time.perf_counter()
+            gaps.append((now - last) / len(chunk))
+            last = now
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        noise.join()
+        sys.stdout = original_stdout
+        stats = get_logging_stats()
+        shutdown_logging()
+    gaps.sort()
+    p99 = gaps[min(len(gaps) - 1, int(len(gaps) * 0.99))]
+    print(f"{name:<26} {len(tokens) / elapsed:10,.0f} token/秒   p99 {p99 * 1e6:8.1f} us/token   "
+          f"限速丢弃{stats.get('rate_limited', 0)}条")
+
+def main():
+    parser = argparse.ArgumentParser(description="日志管线对token消费速度的影响")
+    parser.add_argument('--tokens', type=int, default=2000)
+    parser.add_argument('--console-latency-us', type=float, default=200.0, help="模拟终端每次刷新的耗时（微秒）")
+    parser.add_argument('--noise-rate', type=float, default=200.0, help="后台线程每秒产生的INFO日志条数")
+    args = parser.parse_args()
+
+    tokens = [f"字{i % 10}" for i in range(args.tokens)]
+    echo_setting = config.CONSOLE_TOKEN_ECHO
+    latency = args.console_latency_us / 1e6
+    with tempfile.TemporaryDirectory() as log_dir:
+        cases = (
+            ("同步日志+逐token打印", dict(legacy=True, use_queue=False)),
+            ("队列日志+缓冲回显", dict(legacy=False, use_queue=True)),
+            ("队列日志+关闭回显", dict(legacy=False, use_queue=True, echo=False)),
+            ("队列日志(JSON)+关闭回显", dict(legacy=False, use_queue=True, json_format=True, echo=False)),
+        )
+        for name, options in cases:
+            run_case(name, tokens, SlowConsole(latency), log_dir, noise_rate=args.noise_rate, **options)
+    config.CONSOLE_TOKEN_ECHO = echo_setting
+
+if __name__ == '__main__':
+    main()
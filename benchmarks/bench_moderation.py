@@ -0,0 +1,160 @@
+# benchmarks/bench_moderation.py
+# 回复审核基准：
+# 1. 编译：用随机生成的中文词表（默认10万/50万词）测量建树时间、从缓存载入的时间、数组占用内存与状态数；
+# 2. 流式审核：把模拟的回复切成token大小的增量逐段送入，测量每段的审核耗时、平均每字耗时与扣留的字数；
+# 3. 正确性：同一段文字按随机切分流式审核，结果必须与整段一次审核完全一致，并与朴素的逐词查找对照。
+# 用法: python -m benchmarks.bench_moderation --words 100000,500000
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.moderation import AhoCorasick, Moderator, load_words, normalize_char
+from benchmarks.fakes import SAMPLE_SENTENCES
+
+# 常用汉字区段的一部分，随机组词
+COMMON_CHARS = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+def random_words(count: int, rng: random.Random) -> list:
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(COMMON_CHARS) for _ in range(rng.randint(2, 6))))
+    return sorted(words)
+
+def random_reply(rng: random.Random, words: list, length: int = 300) -> str:
+    """模拟回复：样例句子拼接，中间随机插入违禁词（有的夹着空格或全角标点）"""
+    parts = []
+    while sum(len(p) for p in parts) < length:
+        parts.append(rng.choice(SAMPLE_SENTENCES))
+        if rng.random() < 0.3:
+            word = rng.choice(words)
+            if rng.random() < 0.3:
+                cut = rng.randint(1, len(word) - 1)
+                word = word[:cut] + rng.choice((' ', '\u200b', '，', '*')) + word[cut:]
+            parts.append(word)
+    return ''.join(parts)
+
+def chunked(text: str, rng: random.Random, low: int = 1, high: int = 4) -> list:
+    """按大模型token的大小切分（中文通常一个token对应1-3个字）"""
+    chunks, i = [], 0
+    while i < len(text):
+        n = rng.randint(low, high)
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+def naive_mask(text: str, words: set, max_len: int, mask_char: str) -> str:
+    """朴素对照：对归一化后的文本逐个位置尝试所有长度，命中则把原文对应范围打码"""
+    normalized, origin = [], []
+    for i, ch in enumerate(text):
+        for c in normalize_char(ch):
+            normalized.append(c)
+            origin.append(i)
+    out = list(text)
+    for end in range(len(normalized)):
+        for length in range(1, min(max_len, end + 1) + 1):
+            if ''.join(normalized[end - length + 1:end + 1]) in words:
+                for j in range(origin[end - length + 1], origin[end] + 1):
+                    out[j] = mask_char
+    return ''.join(out)
+
+def bench_build(count: int, rng: random.Random, tmpdir: str):
+    words = random_words(count, rng)
+    path = os.path.join(tmpdir, f'words_{count}.txt')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(words))
+    cache_path = os.path.join(tmpdir, f'automaton_{count}.pkl')
+
+    started = time.perf_counter()
+    built = Moderator.load(path, cache_path=cache_path)
+    build_s = time.perf_counter() - started
+    started = time.perf_counter()
+    loaded = Moderator.load(path, cache_path=cache_path)
+    load_s = time.perf_counter() - started
+    automaton = loaded.automaton
+    assert automaton.pattern_count == built.automaton.pattern_count == count
+    print(f"{count:>7} 个词: 编译 {build_s:6.2f} s，从缓存载入 {load_s:5.2f} s，"
+          f"{automaton.states} 个状态，数组 {automaton.memory_bytes() / 1024 / 1024:5.1f} MB，"
+          f"缓存文件 {os.path.getsize(cache_path) / 1024 / 1024:5.1f} MB")
+    return loaded, words
+
+def bench_stream(moderator: Moderator, words: list, rng: random.Random, replies: int):
+    chunk_us, per_char_us, held = [], [], []
+    baseline_us = []
+    for _ in range(replies):
+        chunks = chunked(random_reply(rng, words), rng)
+        # 对照：不审核时的开销只有拼接字符串
+        started = time.perf_counter()
+        text = ''
+        for chunk in chunks:
+            text += chunk
+        baseline_us.append((time.perf_counter() - started) * 1e6 / len(chunks))
+
+        stream = moderator.begin()
+        received = released = 0
+        for chunk in chunks:
+            started = time.perf_counter()
+            out = stream.feed(chunk)
+            elapsed = (time.perf_counter() - started) * 1e6
+            chunk_us.append(elapsed)
+            per_char_us.append(elapsed / len(chunk))
+            received += len(chunk)
+            released += len(out)
+            # 已收到但还没放行的字数
+            held.append(received - released)
+        stream.flush()
+    print(f"    每段增量审核 p50 {statistics.median(chunk_us):5.1f} us，p99 {percentile(chunk_us, 0.99):5.1f} us，"
+          f"最大 {max(chunk_us):6.1f} us；平均每字 {statistics.mean(per_char_us):4.2f} us"
+          f"（不审核时每段 {statistics.mean(baseline_us):4.2f} us）")
+    print(f"    扣留字数 平均 {statistics.mean(held):4.2f}，p99 {percentile(held, 0.99)}，"
+          f"最大 {max(held)}；统计 {moderator.get_stats()}")
+
+def check_correctness(words: list, rng: random.Random, rounds: int):
+    """小词表上与朴素实现逐字对照，并检查不同切分方式的结果一致"""
+    sample = rng.sample(words, 2000) + ['傻逼', '站不住脚', 'he', 'she', 'his', 'hers', 'ｓｈｅ']
+    normalized = {w for w, _ in load_words(path=None, extra=sample, default_policy='mask')}
+    moderator = Moderator(AhoCorasick([(w, False) for w in normalized]))
+    max_len = moderator.automaton.max_len
+    cases = ['ushers', '这个观点傻 逼到站不住\u200b脚', 'ＳＨＥ said his hers']
+    cases += [random_reply(rng, sample, 120) for _ in range(rounds)]
+    for text in cases:
+        whole = ''.join(moderator.begin().filter([text]))
+        expected = naive_mask(text, normalized, max_len, moderator.mask_char)
+        assert whole == expected, (text, whole, expected)
+        for _ in range(5):
+            streamed = ''.join(moderator.begin().filter(chunked(text, rng, 1, 5)))
+            assert streamed == whole, (text, streamed, whole)
+    example = ''.join(moderator.begin().filter(chunked(cases[1], rng)))
+    print(f"正确性: {len(cases)} 段文字 × 6 种切分，与朴素实现一致；例: {example}")
+
+    abort = Moderator(AhoCorasick([('站不住脚', True)]))
+    out = ''.join(abort.begin().filter(chunked('前面的话没问题，但这个说法站不住脚，后面的不该出现', rng)))
+    assert out.endswith(abort.abort_notice) and '后面' not in out, out
+    print(f"中止策略: {out}")
+
+def main():
+    parser = argparse.ArgumentParser(description="回复审核基准")
+    parser.add_argument('--words', default='100000,500000', help="词表大小，逗号分隔")
+    parser.add_argument('--replies', type=int, default=300, help="每个词表审核的模拟回复数")
+    parser.add_argument('--rounds', type=int, default=200, help="正确性检查的随机文本数")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    check_correctness(random_words(20000, rng), rng, args.rounds)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for count in (int(n) for n in args.words.split(',')):
+            moderator, words = bench_build(count, rng, tmpdir)
+            bench_stream(moderator, words, rng, args.replies)
+
+if __name__ == '__main__':
+    main()
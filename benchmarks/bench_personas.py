@@ -0,0 +1,157 @@
+# benchmarks/bench_personas.py
+# 人设基准：
+# 1. 构造消息：带历史时每次请求都重新估算提示词token数，与使用加载时估算的结果，两者的每次耗时；
+# 2. 切换与重新加载：请求线程不断取人设快照，同时另一个线程来回切换人设、连续改写人设文件（模拟编辑器多次保存），
+#    统计取快照与切换的耗时（不应受重新加载影响）以及去抖后实际的重新加载次数；
+# 3. 回复进行中切换：在本地模拟大模型服务上开始一条回复，中途切换人设，检查这条回复完整结束并记入原人设的对话记忆，
+#    下一条回复使用新人设。
+# 用法: python -m benchmarks.bench_personas --turns 12 --bursts 3
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from openai import OpenAI
+from agent.conversation_memory import ConversationMemory
+from agent.llm_handler import LLMHandler
+from agent.personas import Persona, PersonaRegistry
+from benchmarks.fakes import NullWindow
+from benchmarks.mock_llm_server import MockLLMServer
+
+# 约600 tokens的人设提示词
+LONG_PROMPT = ("你是一个宇宙第一杠精AI，无论对方说什么都要找到清奇的角度反驳，回复简短犀利、幽默、出其不意。" * 14)
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def fmt_us(values) -> str:
+    us = [v * 1e6 for v in values]
+    return f"p50={percentile(us, 0.5):.1f}µs p99={percentile(us, 0.99):.1f}µs max={max(us):.1f}µs (n={len(us)})"
+
+def write_persona(directory: str, name: str, title: str, prompt: str):
+    path = os.path.join(directory, f"{name}.md")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"# {title}\n{prompt}\n")
+
+def bench_build_messages(args):
+    persona = Persona("long", LONG_PROMPT)
+    memory = ConversationMemory(token_budget=4000, compact_ratio=10.0)
+    for i in range(args.turns):
+        memory.add_turn(f"第{i}句：今天天气真不错，适合出去玩。", f"第{i}条回复：紫外线指数都爆表了，这也叫不错？")
+    print(f"构造消息（提示词约{persona.prompt_tokens} tokens，{args.turns}轮历史）:")
+    for label, system_tokens in (("每次请求重新估算", None), ("使用加载时的估算", persona.prompt_tokens)):
+        started = time.perf_counter()
+        for i in range(args.iterations):
+            memory.build_messages(persona.system_prompt, "你说得对，但是原神是一款开放世界游戏", system_tokens=system_tokens)
+        elapsed = time.perf_counter() - started
+        print(f"  {label}: 每次 {elapsed / args.iterations * 1e6:.1f} µs")
+
+def bench_reload(args):
+    with tempfile.TemporaryDirectory() as directory:
+        write_persona(directory, "alpha", "甲", "你是甲，反驳用户说的每一句话。")
+        write_persona(directory, "beta", "乙", "你是乙，反驳用户说的每一句话。")
+        registry = PersonaRegistry(directory=directory, memory_factory=lambda name: ConversationMemory(),
+                                   debounce=args.debounce, poll_interval=args.poll)
+        registry.load()
+        registry.start_watching()
+        stop_event = threading.Event()
+        snapshot, switch = [], []
+        versions = set()
+
+        def request_loop():
+            while not stop_event.is_set():
+                started = time.perf_counter()
+                context = registry.context()
+                snapshot.append(time.perf_counter() - started)
+                if context.name == "alpha":
+                    versions.add(context.cache_namespace)
+                time.sleep(0.0005)
+
+        def switch_loop():
+            names = ("alpha", "beta")
+            i = 0
+            while not stop_event.is_set():
+                started = time.perf_counter()
+                registry.switch(names[i % 2])
+                switch.append(time.perf_counter() - started)
+                i += 1
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=request_loop, daemon=True), threading.Thread(target=switch_loop, daemon=True)]
+        for thread in threads:
+            thread.start()
+        saves = 0
+        for burst in range(args.bursts):
+            # 一次编辑：编辑器在短时间内连续保存多次，只应触发一次重新加载
+            for i in range(args.saves_per_burst):
+                write_persona(directory, "alpha", "甲", f"你是甲（第{burst}版第{i}稿），反驳用户说的每一句话。")
+                saves += 1
+                time.sleep(0.02)
+            time.sleep(args.debounce + args.poll * 3)
+        # 写坏一个文件：继续使用上一版
+        with open(os.path.join(directory, "beta.md"), 'w', encoding='utf-8') as f:
+            f.write("# 乙\n   \n")
+        time.sleep(args.debounce + args.poll * 3)
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=1)
+        registry.stop()
+        stats = registry.get_stats()
+        print(f"切换与重新加载（{args.bursts}次编辑共{saves}次保存，再写坏一个文件）:")
+        print(f"  重新加载 {stats['reloads']}次，最近一次加载 {stats['last_load_ms']:.2f} ms，无效文件 {stats['invalid']}次，"
+              f"beta仍可用: {registry.get('beta') is not None}")
+        print(f"  取人设快照 {fmt_us(snapshot)}，请求中见到甲的{len(versions)}个版本")
+        print(f"  切换 {fmt_us(switch)}")
+
+def bench_switch_in_flight(args):
+    with tempfile.TemporaryDirectory() as directory:
+        write_persona(directory, "alpha", "甲", "你是甲，反驳用户说的每一句话。")
+        write_persona(directory, "beta", "乙", "你是乙，反驳用户说的每一句话。")
+        llm = MockLLMServer(ttft=0.1, token_rate=args.token_rate, reply_tokens=args.reply_tokens).start()
+        registry = PersonaRegistry(directory=directory, memory_factory=lambda name: ConversationMemory())
+        registry.load()
+        registry.switch("alpha")
+        handler = LLMHandler(OpenAI(api_key="benchmark", base_url=llm.url), NullWindow())
+        handler.personas = registry
+        replies = {}
+        try:
+            first = threading.Thread(target=lambda: replies.__setitem__("first", handler.get_response("第一句话")))
+            first.start()
+            time.sleep(0.1 + args.reply_tokens / args.token_rate / 2)
+            registry.switch("beta")
+            first.join()
+            replies["second"] = handler.get_response("第二句话")
+        finally:
+            llm.stop()
+        alpha = registry.memory_for("alpha").get_stats()["turns_added"]
+        beta = registry.memory_for("beta").get_stats()["turns_added"]
+        print("回复进行中切换人设:")
+        print(f"  进行中的回复: {len(replies['first'] or '')}字（未中断: {bool(replies['first'])}），记入甲的记忆 {alpha}轮")
+        print(f"  下一条回复: {len(replies['second'] or '')}字，记入乙的记忆 {beta}轮")
+
+def main():
+    parser = argparse.ArgumentParser(description="人设基准")
+    parser.add_argument('--turns', type=int, default=12, help="构造消息时的历史轮数")
+    parser.add_argument('--iterations', type=int, default=2000, help="构造消息的次数")
+    parser.add_argument('--bursts', type=int, default=3, help="改写人设文件的次数")
+    parser.add_argument('--saves-per-burst', type=int, default=5, help="每次改写连续保存的次数")
+    parser.add_argument('--debounce', type=float, default=config.PERSONA_RELOAD_DEBOUNCE_SECONDS, help="去抖时间（秒）")
+    parser.add_argument('--poll', type=float, default=config.PERSONA_WATCH_INTERVAL_SECONDS, help="检查文件改动的间隔（秒）")
+    parser.add_argument('--token-rate', type=float, default=40.0, help="模拟大模型每秒输出的token数")
+    parser.add_argument('--reply-tokens', type=int, default=40, help="每条回复的token数")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    bench_build_messages(args)
+    bench_reload(args)
+    bench_switch_in_flight(args)
+    print("=" * 60)
+
+if __name__ == '__main__':
+    main()
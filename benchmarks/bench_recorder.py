@@ -0,0 +1,171 @@
+# benchmarks/bench_recorder.py
+# 会话录制基准：
+# 1. 热路径开销：录制一个音频块、一个token增量所需的时间，与逐条写JSON行（base64音频）的文本日志方式对比；
+# 2. 长录制的读取：用模拟时钟生成若干小时的录制（音频+识别结果+token+UI），测量打开文件（读索引）、
+#    随机定位读取10秒片段、全文搜索一个罕见的词所需的时间和进程内存，文件不整体载入内存。
+# 用法: python -m benchmarks.bench_recorder --hours 1 --out /tmp/bench.rec
+import os
+import sys
+import time
+import json
+import base64
+import random
+import argparse
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from utils.session_recorder import (SessionRecorder, SessionReader, KIND_AUDIO, KIND_ASR_FINAL, KIND_ASR_PARTIAL,
+                                    KIND_LLM_REQUEST, KIND_LLM_DELTA, KIND_LLM_END, KIND_UI)
+from benchmarks.fakes import SAMPLE_SENTENCES
+
+def rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('nan')
+
+def percentiles(samples: list) -> str:
+    samples = sorted(samples)
+    return (f"p50 {statistics.median(samples):6.2f} us，p99 {samples[int(len(samples) * 0.99)]:6.2f} us，"
+            f"最大 {samples[-1]:7.1f} us")
+
+def bench_hot_path(path: str, count: int):
+    """每次调用的耗时（微秒），录制器的写盘线程同时在运行"""
+    audio = os.urandom(config.BLOCK_SIZE * 2)
+    token = "站不住脚"
+
+    def measure(call, payload):
+        times = []
+        for _ in range(count):
+            started = time.perf_counter()
+            call(payload)
+            times.append((time.perf_counter() - started) * 1e6)
+        return times
+
+    recorder = SessionRecorder()
+    print(f"热路径（每种 {count} 次）:")
+    print(f"  未开启录制          音频块 {percentiles(measure(lambda p: recorder.record(KIND_AUDIO, p), audio))}")
+    recorder.start(path)
+    print(f"  二进制分块录制      音频块 {percentiles(measure(lambda p: recorder.record(KIND_AUDIO, p), audio))}")
+    print(f"  二进制分块录制   token增量 {percentiles(measure(lambda p: recorder.record(KIND_LLM_DELTA, p, 7), token))}")
+    recorder.stop()
+    size = os.path.getsize(path)
+
+    with open(path + '.jsonl', 'w', encoding='utf-8') as f:
+        def json_line(kind, payload):
+            if isinstance(payload, bytes):
+                payload = base64.b64encode(payload).decode('ascii')
+            f.write(json.dumps({"ts": time.time(), "kind": kind, "payload": payload}) + "\n")
+        print(f"  JSON行日志          音频块 {percentiles(measure(lambda p: json_line('audio', p), audio))}")
+        print(f"  JSON行日志       token增量 {percentiles(measure(lambda p: json_line('llm_delta', p), token))}")
+    print(f"  文件大小: 二进制 {size / 1024 / 1024:.1f} MB，JSON行 {os.path.getsize(path + '.jsonl') / 1024 / 1024:.1f} MB")
+    os.remove(path + '.jsonl')
+
+class SimulatedClock:
+    def __init__(self, start: float):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+def generate(path: str, hours: float, seed: int = 0) -> float:
+    """按真实节奏生成录制：每0.2秒一个音频块，每8秒一句话（中间结果、请求、40个token与对应的UI调用）"""
+    rng = random.Random(seed)
+    clock = SimulatedClock(1_700_000_000.0)
+    recorder = SessionRecorder(clock=clock, max_pending_bytes=1 << 40)
+    recorder.start(path, meta={"source": "bench_recorder"})
+    block_seconds = config.BLOCK_SIZE / config.SAMPLE_RATE
+    audio = bytes(rng.getrandbits(8) for _ in range(config.BLOCK_SIZE * 2))
+    blocks = int(hours * 3600 / block_seconds)
+    sentence_every = int(8 / block_seconds)
+    rare_at = blocks // 2 // sentence_every
+    trace_id = 0
+    started = time.perf_counter()
+    for i in range(blocks):
+        clock.now += block_seconds
+        recorder.record(KIND_AUDIO, audio)
+        if i % sentence_every == sentence_every - 1:
+            trace_id += 1
+            text = SAMPLE_SENTENCES[trace_id % len(SAMPLE_SENTENCES)]
+            if trace_id == rare_at:
+                text = "这是只出现一次的暗号"
+            for n in range(1, len(text)):
+                recorder.record(KIND_ASR_PARTIAL, text[:n])
+            recorder.record(KIND_ASR_FINAL, text, trace_id)
+            recorder.record(KIND_LLM_REQUEST, text, trace_id)
+            for _ in range(40):
+                clock.now += 0.02
+                recorder.record(KIND_LLM_DELTA, "反驳一下", trace_id)
+                recorder.record(KIND_UI, 'appendAIResponse("\\u53cd\\u9a73\\u4e00\\u4e0b");')
+            recorder.record(KIND_LLM_END, config.LLM_MODEL, trace_id)
+        if i % 500 == 0:
+            # 让写盘线程跟上，避免积压全部留在内存中
+            recorder._wake.set()
+            time.sleep(0)
+    recorder.stop()
+    print(f"生成 {hours:.1f} 小时录制: {os.path.getsize(path) / 1024 / 1024:.0f} MB，{recorder.records} 条记录，"
+          f"{recorder.chunks_written} 块，用时 {time.perf_counter() - started:.1f} 秒")
+    return hours * 3600
+
+def bench_reader(path: str, duration: float, seeks: int):
+    tracemalloc.start()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    reader = SessionReader(path)
+    open_ms = (time.perf_counter() - started) * 1000
+    print(f"打开文件（读取索引）: {open_ms:.1f} ms，{len(reader.chunks)} 块")
+
+    rng = random.Random(1)
+    times, blocks = [], 0
+    for _ in range(seeks):
+        at = reader.start_ts + rng.uniform(0, duration - 10)
+        started = time.perf_counter()
+        for record in reader.records(start=at, end=at + 10):
+            blocks += record.kind == KIND_AUDIO
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    print(f"随机定位读取10秒片段（{seeks}次，平均{blocks / seeks:.0f}个音频块）: "
+          f"p50 {statistics.median(times):.2f} ms，最大 {times[-1]:.2f} ms")
+
+    started = time.perf_counter()
+    hits = list(reader.search("暗号"))
+    search_ms = (time.perf_counter() - started) * 1000
+    print(f"全文搜索罕见词: {search_ms:.0f} ms，命中 {len(hits)} 条"
+          + (f"（第 {hits[0].ts - reader.start_ts:.0f} 秒）" if hits else ""))
+
+    started = time.perf_counter()
+    finals = sum(1 for _ in reader.records(kinds={KIND_ASR_FINAL}))
+    print(f"列出全部识别结果: {(time.perf_counter() - started) * 1000:.0f} ms，{finals} 句")
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Python堆峰值 {peak / 1024 / 1024:.1f} MB，RSS {rss_before:.0f} → {rss_mb():.0f} MB"
+          f"（RSS含已读取过的映射页，可由系统随时回收）")
+    reader.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="会话录制基准")
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--out', default=os.path.join('logs', 'bench_recorder.rec'))
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--seeks', type=int, default=200)
+    parser.add_argument('--keep', action='store_true', help="保留生成的录制文件")
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+
+    bench_hot_path(args.out, args.calls)
+    print()
+    duration = generate(args.out, args.hours)
+    bench_reader(args.out, duration, args.seeks)
+    if not args.keep:
+        os.remove(args.out)
+
+if __name__ == '__main__':
+    main()
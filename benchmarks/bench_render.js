@@ -0,0 +1,378 @@
+// benchmarks/bench_render.js
+// 气泡界面渲染层的无界面基准：在模拟DOM中加载ui/web/script.js，用合成token流驱动，
+// 与原先逐token改写textContent、每次追加都滚动的渲染方式对比。
+// 模拟DOM的开销模型：读取scrollHeight/offsetTop等布局属性时若有改动则重新布局，
+// 布局开销 = 容器内气泡数 + 自上次布局以来新写入的文本字符数（整段重写的文本需要重新排版）。
+// 每帧开销 = 该帧的布局开销 + 写入的文本字符数。时间按虚拟帧（60Hz）推进，UI操作按JSBridge的方式每帧合并送达。
+// 用法: node benchmarks/bench_render.js [--tokens 2000] [--session 600]
+'use strict';
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+const { performance } = require('perf_hooks');
+
+const FRAME_MS = 1000 / 60;
+const CLIENT_HEIGHT = 600;
+
+// 原先script.js中的渲染函数（仅保留与渲染相关的部分）
+const LEGACY_SCRIPT = `
+let currentStreamingBubble = null;
+let statusBubble = null;
+function showListeningStatus() {
+    const container = document.getElementById('chat-container');
+    if (statusBubble) { statusBubble.remove(); }
+    statusBubble = document.createElement('div');
+    statusBubble.classList.add('bubble', 'status', 'listening');
+    statusBubble.textContent = 'AI杠精偷听中... (点击关闭)';
+    container.appendChild(statusBubble);
+    scrollToBottom();
+}
+function hideListeningStatus() {
+    if (statusBubble) { statusBubble.remove(); statusBubble = null; }
+}
+function addUserMessage(text) {
+    hideListeningStatus();
+    const container = document.getElementById('chat-container');
+    const bubble = document.createElement('div');
+    bubble.classList.add('bubble', 'user');
+    bubble.appendChild(document.createTextNode(text));
+    container.appendChild(bubble);
+    scrollToBottom();
+    cleanupOldMessages();
+}
+function startAIResponse() {
+    const container = document.getElementById('chat-container');
+    currentStreamingBubble = document.createElement('div');
+    currentStreamingBubble.classList.add('bubble', 'ai', 'streaming');
+    container.appendChild(currentStreamingBubble);
+    scrollToBottom();
+}
+function appendAIResponse(text) {
+    if (currentStreamingBubble) {
+        currentStreamingBubble.classList.remove('streaming');
+        currentStreamingBubble.textContent += text;
+        currentStreamingBubble.classList.add('streaming');
+        scrollToBottom();
+    }
+}
+function finishAIResponse() {
+    if (currentStreamingBubble) {
+        currentStreamingBubble.classList.remove('streaming');
+        currentStreamingBubble = null;
+        setTimeout(() => { showListeningStatus(); }, 1000);
+        cleanupOldMessages();
+    }
+}
+function scrollToBottom() {
+    const container = document.getElementById('chat-container');
+    container.scrollTop = container.scrollHeight;
+}
+function cleanupOldMessages() {
+    const container = document.getElementById('chat-container');
+    const bubbles = container.querySelectorAll('.bubble:not(.status)');
+    const maxMessages = 6;
+    if (bubbles.length > maxMessages) {
+        for (let i = 0; i < bubbles.length - maxMessages; i++) {
+            bubbles[i].style.animation = 'slideOut 0.3s ease-in';
+            setTimeout(() => { if (bubbles[i].parentNode) { bubbles[i].remove(); } }, 300);
+        }
+    }
+}
+`;
+
+class FakeDocument {
+    constructor() {
+        this.layoutDirty = false;
+        this.dirtyChars = 0;
+        this.stats = { layouts: 0, layoutWork: 0, textChars: 0, styleChanges: 0, mutations: 0 };
+        this.container = new FakeElement(this, 'div');
+        this.container.id = 'chat-container';
+        this.container._scrollTop = 0;
+        this.head = new FakeElement(this, 'head');
+        this.body = new FakeElement(this, 'body');
+        this.documentElement = new FakeElement(this, 'html');
+    }
+
+    invalidate(chars) {
+        this.layoutDirty = true;
+        this.dirtyChars += chars;
+        this.stats.mutations++;
+    }
+
+    layout() {
+        if (!this.layoutDirty) return;
+        // 布局：逐个气泡计算高度与位置
+        let y = 12;
+        for (const child of this.container.childNodes) {
+            child._top = y;
+            y += 28 + Math.ceil(child._chars / 18) * 18 + 8;
+        }
+        this.container._scrollHeight = y + 12;
+        this.stats.layouts++;
+        this.stats.layoutWork += this.container.childNodes.length + this.dirtyChars;
+        this.layoutDirty = false;
+        this.dirtyChars = 0;
+    }
+
+    getElementById(id) {
+        if (id === 'chat-container') return this.container;
+        return new FakeElement(this, 'button');
+    }
+    querySelector() { return new FakeElement(this, 'div'); }
+    createElement(tag) { return new FakeElement(this, tag); }
+    createTextNode(text) { return new FakeText(this, String(text)); }
+    createDocumentFragment() { return new FakeElement(this, '#fragment', true); }
+}
+
+class FakeText {
+    constructor(doc, data) {
+        this.doc = doc;
+        this.data = data;
+        this.parentNode = null;
+    }
+    get _chars() { return this.data.length; }
+    remove() { if (this.parentNode) this.parentNode.removeChild(this); }
+}
+
+class FakeClassList {
+    constructor(element) { this.element = element; this.set = new Set(); }
+    add(...names) { names.forEach(n => this.set.add(n)); this.element._styleChanged(); }
+    remove(...names) { names.forEach(n => this.set.delete(n)); this.element._styleChanged(); }
+    contains(name) { return this.set.has(name); }
+}
+
+class FakeElement {
+    constructor(doc, tag, isFragment = false) {
+        this.doc = doc;
+        this.tagName = tag;
+        this.isFragment = isFragment;
+        this.childNodes = [];
+        this.parentNode = null;
+        this.classList = new FakeClassList(this);
+        this.style = { setProperty() {} };
+        this.listeners = {};
+        this._chars = 0;
+    }
+
+    get _attached() {
+        let node = this;
+        while (node) {
+            if (node === this.doc.container) return true;
+            node = node.parentNode;
+        }
+        return false;
+    }
+    _styleChanged() {
+        if (this._attached) { this.doc.stats.styleChanges++; this.doc.invalidate(0); }
+    }
+    get firstChild() { return this.childNodes[0] || null; }
+
+    insertBefore(node, ref) {
+        if (node.isFragment) {
+            for (const child of node.childNodes.splice(0)) {
+                child.parentNode = null;
+                this.insertBefore(child, ref);
+            }
+            return node;
+        }
+        if (node.parentNode) node.parentNode.removeChild(node);
+        const index = ref ? this.childNodes.indexOf(ref) : this.childNodes.length;
+        this.childNodes.splice(index, 0, node);
+        node.parentNode = this;
+        if (node instanceof FakeText) {
+            this._chars += node.data.length;
+            this.doc.stats.textChars += node.data.length;
+        }
+        if (this._attached) this.doc.invalidate(node._chars);
+        return node;
+    }
+    appendChild(node) { return this.insertBefore(node, null); }
+    removeChild(node) {
+        this.childNodes.splice(this.childNodes.indexOf(node), 1);
+        node.parentNode = null;
+        if (node instanceof FakeText) this._chars -= node.data.length;
+        if (this._attached || this === this.doc.container) this.doc.invalidate(0);
+        return node;
+    }
+    remove() { if (this.parentNode) this.parentNode.removeChild(this); }
+
+    get textContent() { return this.childNodes.map(n => n instanceof FakeText ? n.data : n.textContent).join(''); }
+    set textContent(text) {
+        for (const child of this.childNodes.splice(0)) child.parentNode = null;
+        this._chars = 0;
+        this.appendChild(new FakeText(this.doc, String(text)));
+    }
+
+    querySelectorAll() {
+        return this.childNodes.filter(n => n.classList && n.classList.contains('bubble') && !n.classList.contains('status'));
+    }
+    addEventListener(type, listener) { (this.listeners[type] = this.listeners[type] || []).push(listener); }
+    dispatch(type) { (this.listeners[type] || []).forEach(listener => listener({})); }
+
+    get offsetTop() { this.doc.layout(); return this._top || 0; }
+    get scrollHeight() { this.doc.layout(); return this._scrollHeight || 0; }
+    get clientHeight() { return CLIENT_HEIGHT; }
+    get scrollTop() { return this._scrollTop; }
+    set scrollTop(value) {
+        this.doc.layout();
+        this._scrollTop = Math.max(0, Math.min(value, (this._scrollHeight || 0) - CLIENT_HEIGHT));
+    }
+}
+
+// 虚拟时钟下的页面：setTimeout与requestAnimationFrame都按虚拟时间触发
+function createPage(source, options) {
+    const document = new FakeDocument();
+    const timers = [];
+    let rafQueue = [];
+    let now = 0;
+    const windowListeners = {};
+    const sandbox = {
+        document,
+        console,
+        RENDER_OPTIONS: options,
+        setTimeout: (fn, delay) => { const t = { at: now + (delay || 0), fn }; timers.push(t); return t; },
+        clearTimeout: (t) => { if (t) t.fn = null; },
+        requestAnimationFrame: (fn) => { rafQueue.push(fn); return rafQueue.length; },
+        getComputedStyle: () => ({ getPropertyValue: () => '13px' }),
+        addEventListener: (type, fn) => { (windowListeners[type] = windowListeners[type] || []).push(fn); },
+    };
+    sandbox.window = sandbox;
+    const context = vm.createContext(sandbox);
+    vm.runInContext(source, context);
+    (windowListeners.load || []).forEach(fn => fn({}));
+
+    return {
+        document,
+        context,
+        call(name, ...args) { context[`__args`] = args; vm.runInContext(`${name}(...__args)`, context); },
+        get(expr) { return vm.runInContext(expr, context); },
+        // 推进一帧：到期的定时器，然后是动画帧回调
+        frame() {
+            now += FRAME_MS;
+            for (const t of timers.splice(0)) {
+                if (t.at <= now) { if (t.fn) t.fn(); } else { timers.push(t); }
+            }
+            const callbacks = rafQueue;
+            rafQueue = [];
+            callbacks.forEach(fn => fn(now));
+        },
+    };
+}
+
+// 合成会话：[(帧序号, [[函数名, 参数...], ...])]，相邻的追加在同一帧内合并，与JSBridge一致
+function makeSession(exchanges, replyTokens, tokensPerSecond, gapFrames = 30) {
+    const frames = new Map();
+    const push = (frame, op) => {
+        const ops = frames.get(frame) || [];
+        const last = ops[ops.length - 1];
+        if (op[0] === 'appendAIResponse' && last && last[0] === 'appendAIResponse') {
+            last[1] += op[1];
+        } else {
+            ops.push(op);
+        }
+        frames.set(frame, ops);
+    };
+    let frame = 1;
+    for (let i = 0; i < exchanges; i++) {
+        push(frame, ['addUserMessage', `第${i}句：这个观点我不同意`]);
+        frame += 18;
+        push(frame, ['startAIResponse']);
+        for (let k = 0; k < replyTokens; k++) {
+            push(frame + Math.floor(k / tokensPerSecond * 60), ['appendAIResponse', `词${k % 10}`]);
+        }
+        frame += Math.ceil(replyTokens / tokensPerSecond * 60) + 1;
+        push(frame, ['finishAIResponse']);
+        frame += gapFrames;
+    }
+    return { frames, lastFrame: frame + 90 };
+}
+
+function percentile(sorted, q) {
+    return sorted.length ? sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * q))] : 0;
+}
+
+function runScenario(name, source, session, options) {
+    const page = createPage(source, options);
+    const stats = page.document.stats;
+    const frameTimes = [];
+    const frameWork = [];
+    for (let f = 1; f <= session.lastFrame; f++) {
+        const workBefore = stats.layoutWork + stats.textChars;
+        const started = performance.now();
+        for (const op of session.frames.get(f) || []) {
+            page.call(op[0], ...op.slice(1));
+        }
+        page.frame();
+        frameTimes.push(performance.now() - started);
+        frameWork.push(stats.layoutWork + stats.textChars - workBefore);
+    }
+    frameTimes.sort((a, b) => a - b);
+    frameWork.sort((a, b) => a - b);
+    return {
+        name,
+        page,
+        p99: percentile(frameTimes, 0.99),
+        workP99: percentile(frameWork, 0.99),
+        workMax: frameWork[frameWork.length - 1],
+        layouts: stats.layouts,
+        layoutWork: stats.layoutWork,
+        textChars: stats.textChars,
+        styleChanges: stats.styleChanges,
+        bubbles: page.document.container.childNodes.length,
+    };
+}
+
+// 向上翻到最早的消息：每次把滚动位置放到顶部并触发scroll事件，统计翻页帧的耗时
+function scrollBack(page) {
+    const container = page.document.container;
+    const times = [];
+    let pages = 0;
+    while (page.get('renderStart > historyBase') && pages < 10000) {
+        container.scrollTop = 0;
+        const started = performance.now();
+        container.dispatch('scroll');
+        page.frame();
+        times.push(performance.now() - started);
+        pages++;
+    }
+    times.sort((a, b) => a - b);
+    const first = container.childNodes[0];
+    return { pages, p99: percentile(times, 0.99), max: times[times.length - 1] || 0,
+             reachedFirst: !!first && first.textContent.startsWith('第0句'), bubbles: container.childNodes.length };
+}
+
+function printRow(r) {
+    console.log(`  ${r.name.padEnd(20)} 每帧开销 p99 ${String(r.workP99).padStart(6)} 最大 ${String(r.workMax).padStart(6)} | ` +
+                `布局${r.layouts}次 布局开销${r.layoutWork} 写入字符${r.textChars} 样式变更${r.styleChanges} | ` +
+                `JS耗时p99 ${r.p99.toFixed(3)} ms | 结束时DOM气泡${r.bubbles}个`);
+}
+
+function main() {
+    const args = process.argv.slice(2);
+    const option = (name, fallback) => {
+        const i = args.indexOf(name);
+        return i >= 0 ? Number(args[i + 1]) : fallback;
+    };
+    const tokens = option('--tokens', 2000);
+    const sessionLength = option('--session', 600);
+    const tokenRate = option('--token-rate', 120);
+    const current = fs.readFileSync(path.join(__dirname, '..', 'ui', 'web', 'script.js'), 'utf8');
+
+    console.log(`长回复：3段回复，每段${tokens}个token，${tokenRate} token/秒`);
+    const longReply = makeSession(3, tokens, tokenRate);
+    printRow(runScenario('原先的渲染', LEGACY_SCRIPT, longReply));
+    printRow(runScenario('按帧提交', current, longReply));
+
+    console.log(`长会话：${sessionLength}轮对话，每段回复40个token`);
+    const longSession = makeSession(sessionLength, 40, tokenRate, 6);
+    printRow(runScenario('原先的渲染(只留6条)', LEGACY_SCRIPT, longSession));
+    printRow(runScenario('按帧提交(不虚拟化)', current, longSession, { renderWindow: Infinity, historyLimit: Infinity }));
+    const virtualized = runScenario('按帧提交+虚拟化历史', current, longSession);
+    printRow(virtualized);
+
+    const back = scrollBack(virtualized.page);
+    console.log(`  翻看历史：${back.pages}次翻页回到最早的消息（${back.reachedFirst ? '已到达' : '未到达'}），` +
+                `翻页帧耗时 p99 ${back.p99.toFixed(3)} ms 最大 ${back.max.toFixed(2)} ms，DOM气泡${back.bubbles}个`);
+}
+
+main();
@@ -0,0 +1,149 @@
+# benchmarks/bench_startup.py
+# 启动耗时基准：对比原先的串行启动（顶层导入全部重模块、窗口创建后固定等待2秒再连接ASR）
+# 与现在的并行启动（后台线程导入并创建Agent、连接ASR和预热LLM，主线程同时创建窗口，页面发来就绪信号）。
+# 每种方式在全新的子进程中运行，导入耗时是真实的；窗口、识别服务与大模型使用本地替身。
+# 用法: python -m benchmarks.bench_startup --runs 3 --ui-load-ms 400 --asr-connect-ms 300
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import importlib
+import statistics
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 最先导入，计时起点尽量靠近进程启动
+from utils.tracing import startup
+from utils.logger_setup import setup_global_logger, shutdown_logging
+from ui.webview_window import RefutationWebViewWindow
+
+# 原先的固定等待（wait_for_ready中的time.sleep(2)）
+LEGACY_READY_SLEEP = 2.0
+
+class SimulatedWindow(RefutationWebViewWindow):
+    """
+    模拟真实窗口的时序：start()占用主线程create_ms，run()之后页面经过load_ms加载完成，
+    随后像script.js一样通过js_api发来就绪信号。生成的JS代码只计数。
+    """
+
+    def __init__(self, create_ms: float, load_ms: float):
+        super().__init__()
+        self.create_ms = create_ms
+        self.load_ms = load_ms
+        self.js_calls = 0
+
+    def start(self):
+        time.sleep(self.create_ms / 1000)
+        self.is_running = True
+
+    def run(self):
+        def load_page():
+            time.sleep(self.load_ms / 1000)
+            self.js_api.ready()
+        threading.Thread(target=load_page, name="PageLoad", daemon=True).start()
+
+    def execute_js(self, js_code: str):
+        self.js_calls += 1
+
+def _make_agent(window, asr_connect_s: float):
+    from agent.main_agent import MainAgent
+    from benchmarks.fakes import FakeASRService, SyntheticSpeechSource
+    from benchmarks.mock_llm_server import MockLLMServer
+    server = MockLLMServer(ttft=0.05).start()
+    asr_service = FakeASRService([], connect_delay=asr_connect_s)
+    agent = MainAgent(api_key="benchmark", window=window, base_url=server.url,
+                      audio_source_factory=partial(SyntheticSpeechSource, []),
+                      recognition_factory=asr_service.factory)
+    return agent, server
+
+def run_serial(window, asr_connect_s: float):
+    """按原先main.py与_run_loop的顺序：导入 → 窗口 → 等待固定时间 → 音频与ASR"""
+    with startup.step('agent_import'):
+        importlib.import_module('dashscope')
+        importlib.import_module('webview')
+        importlib.import_module('agent.main_agent')
+    with startup.step('agent_create'):
+        agent, server = _make_agent(window, asr_connect_s)
+    with startup.step('window_create'):
+        window.start()
+    window.run()
+    with startup.step('legacy_ready_wait'):
+        time.sleep(LEGACY_READY_SLEEP)
+    agent._start_llm_warm_up = lambda: None  # 原先线程模式没有预热
+    agent.run()
+    return agent, server
+
+def run_parallel(window, asr_connect_s: float):
+    """与main.py相同：后台线程导入、创建并启动Agent，主线程同时创建窗口"""
+    created = {}
+
+    def init_agent():
+        with startup.step('agent_import'):
+            importlib.import_module('dashscope')
+            importlib.import_module('agent.main_agent')
+        with startup.step('agent_create'):
+            created['agent'], created['server'] = _make_agent(window, asr_connect_s)
+        created['agent'].run()
+
+    init_thread = threading.Thread(target=init_agent, name="AgentInit", daemon=True)
+    init_thread.start()
+    with startup.step('window_create'):
+        importlib.import_module('webview')
+        window.start()
+    window.run()
+    init_thread.join()
+    return created['agent'], created['server']
+
+def child(args):
+    import tempfile
+    setup_global_logger(use_queue=True, log_dir=tempfile.mkdtemp(), console_stream=open(os.devnull, 'w'))
+    window = SimulatedWindow(args.ui_create_ms, args.ui_load_ms)
+    runner = run_serial if args.mode == 'serial' else run_parallel
+    agent, server = runner(window, args.asr_connect_ms / 1000)
+    deadline = time.time() + 10
+    while startup.time_to_listening() is None and time.time() < deadline:
+        time.sleep(0.01)
+    result = {"time_to_listening_ms": (startup.time_to_listening() or float('nan')) * 1000, **startup.summary()}
+    agent.stop()
+    server.stop()
+    shutdown_logging()
+    print(json.dumps(result, ensure_ascii=False))
+
+def spawn(mode: str, args) -> dict:
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child", "--mode", mode,
+               "--ui-create-ms", str(args.ui_create_ms), "--ui-load-ms", str(args.ui_load_ms),
+               "--asr-connect-ms", str(args.asr_connect_ms)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, cwd=root, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--ui-create-ms', type=float, default=150.0, help="模拟创建窗口占用主线程的时间")
+    parser.add_argument('--ui-load-ms', type=float, default=400.0, help="模拟页面加载到发出就绪信号的时间")
+    parser.add_argument('--asr-connect-ms', type=float, default=300.0, help="模拟ASR建立连接的时间")
+    parser.add_argument('--mode', choices=('serial', 'parallel'), default='parallel')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    for mode, title in (('serial', "原先的串行启动"), ('parallel', "并行启动")):
+        results = [spawn(mode, args) for _ in range(args.runs)]
+        listening = [r["time_to_listening_ms"] for r in results]
+        print(f"{title}: 开始偷听耗时 中位数 {statistics.median(listening):.0f} ms"
+              f"（{', '.join(f'{v:.0f}' for v in listening)}）")
+        last = results[-1]
+        for s in last["steps"]:
+            print(f"  {s['name']:<18} {s['start_ms']:7.0f} → {s['end_ms']:7.0f} ms  [{s['thread']}]")
+        for name, t in last["marks_ms"].items():
+            print(f"  {name:<18} {t:7.0f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# benchmarks/bench_tts.py
+# 语音播报基准：
+# 1. 切句：示例回复的切分结果与每字耗时；
+# 2. 首个音频与段间静音：模拟大模型按token流式输出，分别测量边生成边合成（不同并发数）与“整条回复生成完再合成”的首个音频时间，
+#    以及同一条回复相邻两段之间的静音；
+# 3. 回声：播放的声音回灌到麦克风，统计有多少混入回声的音频块被VAD门控放行（应为0）。
+# 用法: python -m benchmarks.bench_tts --replies 8 --ttft 0.3 --token-rate 40
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from agent.tts import SentenceSegmenter, SpeechOutput
+from agent.vad import VADGate
+from utils.tracing import Histogram
+from benchmarks.fakes import (FakeTTSBackend, NullAudioSink, EchoLoopback, LoopbackSource, SyntheticSpeechSource)
+
+REPLIES = (
+    "你说天气不错？紫外线指数都爆表了，出门五分钟就晒成碳，这也叫不错吗！",
+    "能赢？就这阵容，前期没节奏，后期打不过，对面随便一波团就结束了。我看悬。",
+    "削弱？它胜率才49.8%，真正该削的是你的操作，别什么都怪英雄。",
+    "早睡早起身体好，那夜班的人怎么办？作息规律才是关键，几点睡根本不重要。",
+    "Cats are cute, sure. But have you ever tried walking one? Dogs win, e.g. loyalty, exercise and fun.",
+    "先学数学？大部分业务代码连加减乘除都用不上，先写起来，遇到再补，效率高多了。",
+)
+
+def token_stream(text: str, ttft: float, token_rate: float, chars_per_token: int = 2):
+    """按大模型的节奏产出文本增量"""
+    time.sleep(ttft)
+    for i in range(0, len(text), chars_per_token):
+        yield text[i:i + chars_per_token]
+        time.sleep(1 / token_rate)
+
+def bench_segmenter():
+    print("切句结果:")
+    for reply in REPLIES[:3] + REPLIES[4:5]:
+        segmenter = SentenceSegmenter()
+        segments = []
+        for i in range(0, len(reply), 2):
+            segments.extend(segmenter.feed(reply[i:i + 2]))
+        segments.extend(segmenter.flush())
+        print("  " + " | ".join(segments))
+    text = ''.join(REPLIES) * 200
+    segmenter = SentenceSegmenter()
+    started = time.perf_counter()
+    for i in range(0, len(text), 2):
+        segmenter.feed(text[i:i + 2])
+    segmenter.flush()
+    elapsed = time.perf_counter() - started
+    print(f"  切句耗时: 每字 {elapsed / len(text) * 1e6:.2f} µs（{len(text)}字，{segmenter.segments}段）")
+
+def wait_idle(output: SpeechOutput, timeout: float = 30.0):
+    """等待已提交的段落全部播放完"""
+    deadline = time.time() + timeout
+    while time.time() < deadline and not output.is_idle():
+        time.sleep(0.02)
+
+def bench_streaming(args, max_concurrent: int) -> dict:
+    backend = FakeTTSBackend(latency=args.tts_latency, per_char=args.tts_per_char, seed=1)
+    output = SpeechOutput(backend=backend, sink_factory=NullAudioSink, max_concurrent=max_concurrent, echo_tail=0.0)
+    output.start()
+    for n in range(args.replies):
+        reply = output.begin()
+        for delta in token_stream(REPLIES[n % len(REPLIES)], args.ttft, args.token_rate):
+            reply.feed(delta)
+        reply.end()
+        wait_idle(output)
+    output.stop()
+    return output.get_stats()
+
+def bench_whole_reply(args) -> Histogram:
+    """对照：等整条回复生成完再一次合成，首个音频时间 = 首token + 生成 + 整段合成"""
+    backend = FakeTTSBackend(latency=args.tts_latency, per_char=args.tts_per_char, seed=1)
+    first_audio = Histogram()
+    for n in range(args.replies):
+        started = time.perf_counter()
+        text = ''.join(token_stream(REPLIES[n % len(REPLIES)], args.ttft, args.token_rate))
+        backend.synthesize(text)
+        first_audio.observe(time.perf_counter() - started)
+    return first_audio
+
+def bench_echo(args, guarded: bool) -> dict:
+    """回复播放期间，麦克风里只有回声；统计混入回声的音频块中被门控放行的数量"""
+    loopback = EchoLoopback()
+    backend = FakeTTSBackend(latency=args.tts_latency, per_char=args.tts_per_char, seed=2)
+    output = SpeechOutput(backend=backend, sink_factory=lambda rate: NullAudioSink(rate, loopback=loopback))
+    gate = VADGate(echo_guard=output if guarded else None)
+    source = LoopbackSource(SyntheticSpeechSource([]), loopback)
+    stop_event = threading.Event()
+    counts = {"echo_blocks": 0, "echo_forwarded": 0}
+
+    def mic_loop():
+        while not stop_event.is_set():
+            before = loopback.echo_blocks
+            frames = gate.process(source.read(config.BLOCK_SIZE))
+            if loopback.echo_blocks > before:
+                counts["echo_blocks"] += 1
+                if frames:
+                    counts["echo_forwarded"] += 1
+
+    mic = threading.Thread(target=mic_loop, daemon=True)
+    output.start()
+    mic.start()
+    for n in range(2):
+        reply = output.begin()
+        reply.feed(REPLIES[n])
+        reply.end()
+        wait_idle(output)
+    stop_event.set()
+    mic.join(timeout=1)
+    output.stop()
+    return {**counts, "blocks_suppressed": gate.blocks_suppressed}
+
+def fmt(s: dict) -> str:
+    return f"p50={s['p50_ms']:6.0f}ms p90={s['p90_ms']:6.0f}ms max={s['max_ms']:6.0f}ms (n={s['count']})"
+
+def main():
+    parser = argparse.ArgumentParser(description="语音播报基准")
+    parser.add_argument('--replies', type=int, default=6, help="每种配置播报的回复数")
+    parser.add_argument('--ttft', type=float, default=0.3, help="模拟大模型的首token延迟（秒）")
+    parser.add_argument('--token-rate', type=float, default=40.0, help="模拟大模型每秒输出的token数")
+    parser.add_argument('--tts-latency', type=float, default=0.25, help="模拟合成服务的首包延迟（秒）")
+    parser.add_argument('--tts-per-char', type=float, default=0.01, help="模拟合成服务每字的耗时（秒）")
+    parser.add_argument('--concurrency', default='1,3', help="逗号分隔的并发合成数")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    bench_segmenter()
+    print("首个音频（从发出请求算起）与段间静音:")
+    whole = bench_whole_reply(args)
+    print(f"  整条回复生成完再合成   首个音频 {fmt(whole.snapshot())}")
+    for concurrency in (int(c) for c in args.concurrency.split(',')):
+        stats = bench_streaming(args, concurrency)
+        print(f"  边生成边合成 并发{concurrency:<2}     首个音频 {fmt(stats['first_audio'])}")
+        print(f"    首个文本到首个音频 {fmt(stats['first_audio_after_text'])}")
+        print(f"    段间静音           {fmt(stats['gaps'])}，共{stats['segments']}段")
+    print("回声屏蔽（播放的声音回灌到麦克风）:")
+    for guarded in (False, True):
+        echo = bench_echo(args, guarded)
+        print(f"  {'屏蔽' if guarded else '不屏蔽'}: 含回声的音频块 {echo['echo_blocks']}，"
+              f"被放行给识别 {echo['echo_forwarded']}，门控屏蔽 {echo['blocks_suppressed']}")
+    print("=" * 60)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_vad.py
+# VAD单块处理耗时的微基准测试：对比原先的float64拷贝算法与agent.vad中的检测器
+# 用法: python -m benchmarks.bench_vad
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from agent.vad import EnergyVAD, ZeroCrossingVAD, VADGate, create_vad
+
+def legacy_energy(samples: np.ndarray) -> bool:
+    """原run_audio_loop中的VAD算法"""
+    audio_data_fp = samples.astype(np.float64)
+    energy = np.sqrt(np.mean(audio_data_fp**2))
+    return energy > config.VAD_ENERGY_THRESHOLD
+
+def make_blocks(count: int = 50):
+    """生成一半静默、一半类语音信号的测试音频块"""
+    rng = np.random.default_rng(0)
+    t = np.arange(config.BLOCK_SIZE) / config.SAMPLE_RATE
+    blocks = []
+    for i in range(count):
+        noise = rng.normal(0, 30, config.BLOCK_SIZE)
+        if i % 2:
+            noise += 3000 * np.sin(2 * np.pi * 220 * t) * rng.uniform(0.5, 1.0)
+        blocks.append(noise.astype(np.int16))
+    return blocks
+
+def bench(name: str, func, blocks, repeat: int = 5, number: int = 200):
+    def run():
+        for block in blocks:
+            func(block)
+    best = min(timeit.repeat(run, repeat=repeat, number=number))
+    per_block_us = best / (number * len(blocks)) * 1e6
+    realtime_ratio = per_block_us / (config.BLOCK_SIZE / config.SAMPLE_RATE * 1e6)
+    print(f"{name:<28} {per_block_us:8.2f} us/块   占实时的 {realtime_ratio * 100:.4f}%")
+
+def check_sustained_speech(seconds: float = 30.0) -> bool:
+    """回归检查：持续不断的语音（3000 RMS的220Hz音）在整段时间内都应判为语音，噪声基底不能追上语音能量"""
+    t = np.arange(config.BLOCK_SIZE) / config.SAMPLE_RATE
+    tone = (3000 * np.sqrt(2) * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+    count = int(seconds * config.SAMPLE_RATE / config.BLOCK_SIZE)
+    vad = create_vad()
+    results = [vad.process(tone) for _ in range(count)]
+    gate = VADGate()
+    sent = sum(len(gate.process(tone.tobytes())) for _ in range(count))
+    ok = all(results) and sent == count
+    first_miss = results.index(False) if False in results else None
+    print(f"持续语音{seconds:.0f}秒: {sum(results)}/{count}块判为语音"
+          f"{'' if first_miss is None else f'（第{first_miss}块起判为静默）'}，门控上传{sent}/{count}块 "
+          f"{'通过' if ok else '失败'}")
+    return ok
+
+class _Playback:
+    """回声屏蔽的替身：playing为真时suppressing()为真"""
+
+    def __init__(self):
+        self.playing = False
+
+    def suppressing(self) -> bool:
+        return self.playing
+
+def check_playback_cut() -> bool:
+    """回归检查：说话中开始播放时，门控应立即补发hangover块数的静音句尾，之后播放期间不再上传"""
+    t = np.arange(config.BLOCK_SIZE) / config.SAMPLE_RATE
+    tone = (3000 * np.sqrt(2) * np.sin(2 * np.pi * 220 * t)).astype(np.int16).tobytes()
+    playback = _Playback()
+    gate = VADGate(echo_guard=playback)
+    for _ in range(10):
+        gate.process(tone)
+    playback.playing = True
+    tail = gate.process(tone)
+    during = sum(len(gate.process(tone)) for _ in range(20))
+    silent = all(not any(frame) for frame in tail)
+    ok = len(tail) == gate.hangover_blocks and silent and during == 0 and gate.speech_cut == 1
+    print(f"说话中开始播放: 补发静音句尾{len(tail)}块（应为{gate.hangover_blocks}块{'，全为静音' if silent else '，含非静音'}），"
+          f"播放期间上传{during}块 {'通过' if ok else '失败'}")
+    return ok
+
+def main():
+    blocks = make_blocks()
+    print(f"块大小: {config.BLOCK_SIZE} 采样点 ({config.BLOCK_SIZE / config.SAMPLE_RATE * 1000:.0f} ms)")
+    bench("legacy float64 RMS", legacy_energy, blocks)
+    bench("EnergyVAD", EnergyVAD().process, blocks)
+    bench("ZeroCrossingVAD", ZeroCrossingVAD().process, blocks)
+    bench("create_vad() 组合", create_vad().process, blocks)
+
+    gate = VADGate()
+    byte_blocks = [b.tobytes() for b in blocks]
+    bench("VADGate (含门控)", gate.process, byte_blocks)
+
+    # 模拟一段长静默，统计上传量的节省
+    gate = VADGate()
+    silence = np.zeros(config.BLOCK_SIZE, dtype=np.int16).tobytes()
+    speech = blocks[1].tobytes()
+    stream = [silence] * 100 + [speech] * 10 + [silence] * 100
+    for data in stream:
+        gate.process(data)
+    stats = gate.get_stats()
+    print(f"门控: 输入{stats['blocks_in']}块，上传{stats['blocks_sent']}块，节省{stats['bytes_saved'] / 1024:.0f} KiB")
+
+    ok = check_sustained_speech()
+    ok = check_playback_cut() and ok
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
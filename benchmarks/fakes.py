@@ -0,0 +1,363 @@
+# benchmarks/fakes.py
+# 离线基准测试用的替身：WAV/合成音频/会话录制输入源、按时间表出结果的识别服务、按能量断句的本地识别器、不显示任何界面的窗口、
+# 语音合成与不出声的音频输出（可把播放的声音回灌给麦克风）
+import math
+import time
+import wave
+import logging
+import threading
+import numpy as np
+import config
+from agent.asr_backends import ASRResult, SessionStopped
+from ui.webview_window import RefutationWebViewWindow
+from utils.session_recorder import KIND_AUDIO
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SENTENCES = (
+    "今天天气真不错",
+    "我觉得这把游戏能赢",
+    "这个英雄太强了应该削弱",
+    "早睡早起身体好",
+    "猫比狗更可爱",
+    "学习编程一定要先学数学",
+    "这首歌是今年最好听的",
+    "外卖比自己做饭划算",
+)
+
+def make_schedule(count: int, interval: float, first_at: float = 2.0):
+    """生成句子时间表：[(相对开始的秒数, 文本), ...]"""
+    return [(first_at + i * interval, SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]) for i in range(count)]
+
+class _PacedSource:
+    """按实时速度（或speed倍速）产出音频块的输入源基类"""
+
+    def __init__(self, block_size: int, speed: float = 1.0):
+        self.block_size = block_size
+        self.speed = speed
+        self.frames_read = 0
+        self._start = None
+        self._closed = False
+
+    def _pace(self):
+        if self._start is None:
+            self._start = time.perf_counter()
+        due = self._start + self.frames_read / (config.SAMPLE_RATE * self.speed)
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _next_block(self) -> np.ndarray:
+        raise NotImplementedError
+
+    def read(self, frames: int) -> bytes:
+        if self._closed:
+            raise IOError("音频输入源已关闭")
+        block = self._next_block()
+        self.frames_read += frames
+        self._pace()
+        return block.tobytes()
+
+    def close(self):
+        self._closed = True
+
+class WavFileSource(_PacedSource):
+    """从WAV文件回放音频，代替PyAudio麦克风。非16kHz单声道的文件会先转换。"""
+
+    def __init__(self, path: str, block_size: int = config.BLOCK_SIZE, speed: float = 1.0, loop: bool = True):
+        super().__init__(block_size, speed)
+        self.loop = loop
+        with wave.open(path, 'rb') as f:
+            if f.getsampwidth() != 2:
+                raise ValueError("只支持16位PCM的WAV文件")
+            rate, channels = f.getframerate(), f.getnchannels()
+            samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        if channels > 1:
+            samples = samples.reshape(-1, channels)[:, 0]
+        if rate != config.SAMPLE_RATE:
+            positions = np.arange(0, samples.size, rate / config.SAMPLE_RATE)
+            samples = np.interp(positions, np.arange(samples.size), samples).astype(np.int16)
+        self.samples = samples
+        self._pos = 0
+
+    def _next_block(self) -> np.ndarray:
+        block = np.zeros(self.block_size, dtype=np.int16)
+        filled = 0
+        while filled < self.block_size and self.samples.size:
+            if self._pos >= self.samples.size:
+                if not self.loop:
+                    break
+                self._pos = 0
+            n = min(self.block_size - filled, self.samples.size - self._pos)
+            block[filled:filled + n] = self.samples[self._pos:self._pos + n]
+            filled += n
+            self._pos += n
+        return block
+
+class RecordedAudioSource(_PacedSource):
+    """回放会话录制中的音频块（见utils/session_recorder.py），从内存映射中逐块读取；录音结束后输出静音"""
+
+    def __init__(self, reader, block_size: int = config.BLOCK_SIZE, speed: float = 1.0, start: float = None):
+        super().__init__(block_size, speed)
+        self._records = reader.records(start=start, kinds={KIND_AUDIO})
+        self.exhausted = False
+
+    def _next_block(self) -> np.ndarray:
+        block = np.zeros(self.block_size, dtype=np.int16)
+        record = None if self.exhausted else next(self._records, None)
+        if record is None:
+            self.exhausted = True
+            return block
+        samples = np.frombuffer(record.payload, dtype=np.int16)[:self.block_size]
+        block[:samples.size] = samples
+        return block
+
+class SyntheticSpeechSource(_PacedSource):
+    """在时间表中每句话之前生成一段类语音信号，其余时间为低噪声，用于没有录音文件时"""
+
+    def __init__(self, schedule, block_size: int = config.BLOCK_SIZE, speech_seconds: float = 1.5, seed: int = 0):
+        super().__init__(block_size)
+        self.windows = [(t - speech_seconds, t) for t, _ in schedule]
+        self._rng = np.random.default_rng(seed)
+        self._t = np.arange(block_size) / config.SAMPLE_RATE
+
+    def _next_block(self) -> np.ndarray:
+        pos = self.frames_read / config.SAMPLE_RATE
+        noise = self._rng.normal(0, 20, self.block_size)
+        if any(start <= pos < end for start, end in self.windows):
+            pitch = 180 + 40 * math.sin(pos * 3)
+            noise += 4000 * np.sin(2 * np.pi * pitch * (self._t + pos))
+        return noise.astype(np.int16)
+
+class FakeASRService:
+    """
+    识别服务替身，按时间表在活跃会话上发出中间结果和句子结束事件。
+    多个会话（例如热备切换时）共享同一个时间表，每句话只发出一次最终结果。
+    """
+
+    def __init__(self, schedule, partial_lead: float = 1.0, partial_interval: float = 0.2,
+                 connect_delay: float = 0.05, start_time: float = None):
+        self.schedule = sorted(schedule)
+        self.partial_lead = partial_lead
+        self.partial_interval = partial_interval
+        self.connect_delay = connect_delay
+        self.start_time = start_time or time.time()
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.sessions = 0
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.sentences_emitted = 0
+
+    def factory(self, model, format, sample_rate, callback):
+        """与dashscope.audio.asr.Recognition构造参数一致，可直接作为recognition_factory"""
+        return FakeRecognition(self, callback)
+
+    def peek(self):
+        with self._lock:
+            if self._cursor < len(self.schedule):
+                return self.schedule[self._cursor]
+            return None
+
+    def claim(self, due_at: float):
+        """取走到期的句子，确保每句话只被一个会话发出"""
+        with self._lock:
+            if self._cursor < len(self.schedule) and self.schedule[self._cursor][0] <= due_at:
+                item = self.schedule[self._cursor]
+                self._cursor += 1
+                self.sentences_emitted += 1
+                return item
+            return None
+
+    @property
+    def finished(self) -> bool:
+        return self.peek() is None
+
+class FakeRecognition:
+    def __init__(self, service: FakeASRService, callback):
+        self.service = service
+        self.callback = callback
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        time.sleep(self.service.connect_delay)
+        self.service.sessions += 1
+        self.callback.on_open()
+        self._thread = threading.Thread(target=self._emit_loop, name="FakeASR", daemon=True)
+        self._thread.start()
+
+    def send_audio_frame(self, data: bytes):
+        if self._stopped.is_set():
+            raise SessionStopped("Speech recognition has stopped.")
+        self.service.frames_received += 1
+        self.service.bytes_received += len(data)
+
+    def _emit_loop(self):
+        while not self._stopped.wait(self.service.partial_interval):
+            now = time.time() - self.service.start_time
+            item = self.service.claim(now)
+            if item is not None:
+                t, text = item
+                self.callback.on_event(ASRResult({'text': text, 'end_time': int(t * 1000)}))
+                continue
+            upcoming = self.service.peek()
+            if upcoming is not None and now >= upcoming[0] - self.service.partial_lead:
+                t, text = upcoming
+                progress = 1 - (t - now) / self.service.partial_lead
+                prefix = text[:max(1, math.ceil(len(text) * progress))]
+                self.callback.on_event(ASRResult({'text': prefix, 'end_time': None}))
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self.callback.on_close()
+
+class EnergyEngine:
+    """
+    本地识别器替身，接口与asr_backends.VoskEngine相同：按能量断句，说话期间输出逐渐变长的中间结果，
+    静默超过endpoint_ms后输出一句。用于在没有识别模型时测量本地后端的进程间传输与断句延迟。
+    """
+
+    def __init__(self, model_path: str, sample_rate: int, threshold: float = 500.0, endpoint_ms: int = 300):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.endpoint_samples = sample_rate * endpoint_ms // 1000
+        self.sentences = 0
+        self._voiced_samples = 0
+        self._silent_samples = 0
+
+    def accept_waveform(self, data: bytes) -> bool:
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if samples.size and np.sqrt(np.mean(samples ** 2)) >= self.threshold:
+            self._voiced_samples += samples.size
+            self._silent_samples = 0
+            return False
+        self._silent_samples += samples.size
+        return self._voiced_samples > 0 and self._silent_samples >= self.endpoint_samples
+
+    def _sentence(self) -> str:
+        if not self._voiced_samples:
+            return ''
+        self.sentences += 1
+        text = f"第{self.sentences}句话（{self._voiced_samples / self.sample_rate:.1f}秒）"
+        self._voiced_samples = 0
+        return text
+
+    def result(self) -> str:
+        return self._sentence()
+
+    def partial_result(self) -> str:
+        return "嗯" * math.ceil(self._voiced_samples / (self.sample_rate * 0.2))
+
+    def final_result(self) -> str:
+        self._silent_samples = 0
+        return self._sentence()
+
+class NullWindow(RefutationWebViewWindow):
+    """不创建任何界面的窗口。仍然经过真实的JSBridge，只是把生成的JS代码丢弃并计数。"""
+
+    def __init__(self):
+        super().__init__()
+        self.is_running = True
+        self.js_calls = 0
+        self.js_chars = 0
+        self.mark_ready()
+
+    def execute_js(self, js_code: str):
+        self.js_calls += 1
+        self.js_chars += len(js_code)
+
+class FakeTTSBackend:
+    """
+    语音合成替身：等待“首包延迟+每字耗时”（带随机抖动）后返回与文字长度相当的合成音频，
+    接口与agent.tts的合成后端相同（sample_rate属性与synthesize方法），可在多个线程中同时调用。
+    """
+
+    def __init__(self, sample_rate: int = config.TTS_SAMPLE_RATE, latency: float = 0.25, per_char: float = 0.01,
+                 jitter: float = 0.3, seconds_per_char: float = 0.2, seed: int = 0):
+        self.sample_rate = sample_rate
+        self.latency = latency
+        self.per_char = per_char
+        self.jitter = jitter
+        self.seconds_per_char = seconds_per_char
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chars = 0
+
+    def synthesize(self, text: str) -> bytes:
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+            self.calls += 1
+            self.chars += len(text)
+        time.sleep((self.latency + self.per_char * len(text)) * factor)
+        t = np.arange(int(self.seconds_per_char * len(text) * self.sample_rate)) / self.sample_rate
+        return (6000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16).tobytes()
+
+class EchoLoopback:
+    """模拟扬声器的声音被麦克风拾到：NullAudioSink播放的音频重采样到16kHz后排队，LoopbackSource读取时混入麦克风音频"""
+
+    def __init__(self, gain: float = 0.5):
+        self.gain = gain
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._lock = threading.Lock()
+        self.echo_blocks = 0  # 混入了回声的麦克风音频块数
+
+    def play(self, data: bytes, sample_rate: int):
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if sample_rate != config.SAMPLE_RATE:
+            positions = np.arange(0, samples.size, sample_rate / config.SAMPLE_RATE)
+            samples = np.interp(positions, np.arange(samples.size), samples).astype(np.float32)
+        with self._lock:
+            self._pending = np.concatenate((self._pending, samples * self.gain))
+
+    def mix(self, block: np.ndarray) -> np.ndarray:
+        with self._lock:
+            echo, self._pending = self._pending[:block.size], self._pending[block.size:]
+        if not echo.size:
+            return block
+        self.echo_blocks += 1
+        mixed = block.astype(np.float32)
+        mixed[:echo.size] += echo
+        return np.clip(mixed, -32768, 32767).astype(np.int16)
+
+class LoopbackSource:
+    """包装一个音频输入源，把EchoLoopback中的回声混入读到的每个音频块"""
+
+    def __init__(self, source, loopback: EchoLoopback):
+        self.source = source
+        self.loopback = loopback
+
+    def read(self, frames: int) -> bytes:
+        block = np.frombuffer(self.source.read(frames), dtype=np.int16)
+        return self.loopback.mix(block).tobytes()
+
+    def close(self):
+        self.source.close()
+
+class NullAudioSink:
+    """不出声的音频输出，按实时速度阻塞（与声卡一样）；指定loopback时把播放的声音回灌给麦克风"""
+
+    def __init__(self, sample_rate: int, loopback: EchoLoopback = None):
+        self.sample_rate = sample_rate
+        self.loopback = loopback
+        self.seconds_written = 0.0
+        self._start = None
+
+    def write(self, data: bytes):
+        if self._start is None or time.perf_counter() > self._start + self.seconds_written:
+            # 播放中断过（上一段播完后才来新的音频），从现在重新计时
+            self._start = time.perf_counter() - self.seconds_written
+        if self.loopback is not None:
+            self.loopback.play(data, self.sample_rate)
+        self.seconds_written += len(data) / 2 / self.sample_rate
+        delay = self._start + self.seconds_written - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def close(self):
+        pass
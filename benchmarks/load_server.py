@@ -0,0 +1,207 @@
+# benchmarks/load_server.py
+# 服务模式压测：N个会话同时运行，每个会话有自己的合成音频（经websocket上传）、按时间表出结果的识别服务替身
+# 和一个订阅界面更新的页面连接，共用一个本地模拟大模型服务。
+# 报告各会话完成的回复数与公平性（Jain指数）、额度等待、VAD进程池往返耗时、音频丢弃与补静音、线程数、内存与CPU，以及延迟分位数。
+# 用法: python -m benchmarks.load_server --sessions 16 --vad-workers 0
+#       python -m benchmarks.load_server --sessions 16 --vad-workers -1   （对照：VAD在各会话的线程内计算）
+# 追踪器是进程全局的，对比不同会话数时请分别运行。
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websocket
+import config
+from server.app import ServerRuntime, AgentServer
+from server.session import SessionSpec
+from utils.tracing import tracer
+from benchmarks.fakes import FakeASRService, SyntheticSpeechSource, make_schedule
+from benchmarks.mock_llm_server import MockLLMServer
+from benchmarks.run_pipeline import ThreadSampler
+
+logger = logging.getLogger(__name__)
+
+class LoadClient:
+    """模拟一个直播间：一个线程按实时速度上传合成音频，另一个线程接收并计数界面更新"""
+
+    def __init__(self, url: str, source):
+        self.url = url
+        self.source = source
+        self.ws = None
+        self.ui_frames = 0
+        self.ui_bytes = 0
+        self.blocks_sent = 0
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.ws = websocket.create_connection(self.url)
+        self._threads = [threading.Thread(target=self._send_loop, daemon=True),
+                         threading.Thread(target=self._recv_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def _send_loop(self):
+        try:
+            while not self._stop_event.is_set():
+                self.ws.send(self.source.read(config.BLOCK_SIZE), opcode=websocket.ABNF.OPCODE_BINARY)
+                self.blocks_sent += 1
+        except (websocket.WebSocketException, OSError):
+            pass
+
+    def _recv_loop(self):
+        try:
+            while True:
+                data = self.ws.recv()
+                if not data:
+                    break
+                self.ui_frames += 1
+                self.ui_bytes += len(data)
+        except (websocket.WebSocketException, OSError):
+            pass
+
+    def stop(self):
+        self._stop_event.set()
+        self.source.close()
+        for thread in self._threads[:1]:
+            thread.join(timeout=1)
+        self.ws.close()
+        for thread in self._threads[1:]:
+            thread.join(timeout=1)
+
+def jain_index(values: list) -> float:
+    """Jain公平性指数，1为完全公平，1/n为只有一个会话得到服务"""
+    if not values or not any(values):
+        return 1.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+def run_load(args) -> dict:
+    n = args.sessions
+    llm = MockLLMServer(ttft=args.ttft, token_rate=args.token_rate, reply_tokens=args.reply_tokens).start()
+    specs, schedules, services = [], {}, {}
+    for i in range(n):
+        spec = SessionSpec(f"room{i + 1}")
+        # 各会话的句子在一个间隔内错开
+        schedules[spec.id] = make_schedule(args.sentences, args.interval, first_at=2.0 + i * args.interval / n)
+        services[spec.id] = FakeASRService(schedules[spec.id])
+        specs.append(spec)
+    duration = 2.0 + args.sentences * args.interval + args.tail
+
+    cpu_before = os.times()
+    runtime = ServerRuntime("benchmark", base_url=llm.url, vad_workers=args.vad_workers,
+                            max_concurrent=args.max_concurrent)
+    server = AgentServer(specs, runtime, port=0, recognition_factory=lambda spec: services[spec.id].factory)
+    sampler = ThreadSampler()
+    sampler.start()
+    server.start()
+    clients = {spec.id: LoadClient(f"ws://{server.host}:{server.port}/ws/{spec.id}",
+                                   SyntheticSpeechSource(schedules[spec.id]))
+               for spec in specs}
+    started = time.time()
+    for spec in specs:
+        services[spec.id].start_time = started
+        clients[spec.id].start()
+    try:
+        time.sleep(duration)
+        stats = server.get_stats()
+    finally:
+        elapsed = time.time() - started
+        for client in clients.values():
+            client.stop()
+        server.stop()
+        runtime.stop()
+        sampler.stop()
+        llm.stop()
+    cpu_after = os.times()
+
+    sessions = {}
+    for spec in specs:
+        s = stats["sessions"][spec.id]
+        sessions[spec.id] = {
+            "sentences": services[spec.id].sentences_emitted,
+            "replies": s["dispatcher"]["completed"],
+            "dropped": s["dispatcher"]["dropped"] + s["dispatcher"]["coalesced"],
+            "ui_frames": clients[spec.id].ui_frames,
+            "audio_dropped_bytes": s["audio_in"]["bytes_dropped"],
+            "audio_stalls": s["audio_in"]["stalls"],
+        }
+    ratios = [v["replies"] / v["sentences"] if v["sentences"] else 0.0 for v in sessions.values()]
+    return {
+        "sessions": n,
+        "vad_workers": stats["vad_pool"]["workers"] if stats["vad_pool"] else 0,
+        "duration_s": elapsed,
+        "per_session": sessions,
+        "fairness": jain_index(ratios),
+        "replies": sum(v["replies"] for v in sessions.values()),
+        "sentences": sum(v["sentences"] for v in sessions.values()),
+        "llm_pool": {k: v for k, v in stats["llm_pool"].items() if k != "sessions"},
+        "vad_pool": stats["vad_pool"],
+        "audio_dropped_bytes": sum(v["audio_dropped_bytes"] for v in sessions.values()),
+        "audio_stalls": sum(v["audio_stalls"] for v in sessions.values()),
+        "threads": sampler.summary(),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "cpu_s": (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system),
+        "children_cpu_s": ((cpu_after.children_user - cpu_before.children_user)
+                           + (cpu_after.children_system - cpu_before.children_system)),
+        "latency": tracer.summary(),
+        "llm_server": llm.get_stats(),
+    }
+
+def print_report(report: dict):
+    print("=" * 60)
+    print(f"会话数: {report['sessions']}，VAD进程数: {report['vad_workers'] or '不用进程池'}，"
+          f"运行时长 {report['duration_s']:.1f} 秒")
+    print(f"回复: {report['replies']}/{report['sentences']}句，公平性(Jain) {report['fairness']:.3f}")
+    replies = [v["replies"] for v in report["per_session"].values()]
+    print(f"  各会话完成回复数: 最少{min(replies)}，最多{max(replies)}")
+    p = report["llm_pool"]
+    print(f"LLM额度: 上限{p['max_concurrent']}，峰值占用{p['peak_in_use']}，峰值排队{p['peak_waiting']}，"
+          f"等待 p50={p['p50_wait_ms']:.0f}ms p99={p['p99_wait_ms']:.0f}ms")
+    v = report["vad_pool"]
+    if v:
+        print(f"VAD进程池: {v['blocks']}块，往返平均{v['avg_round_trip_ms']:.2f}ms 最大{v['max_round_trip_ms']:.1f}ms，"
+              f"超时{v['timeouts']}，缓冲区满{v['rejected']}")
+    print(f"音频: 丢弃{report['audio_dropped_bytes']}字节，补静音{report['audio_stalls']}次")
+    th = report["threads"]
+    print(f"线程数: 峰值{th['peak']}，平均{th['avg']:.1f}；内存峰值 {report['max_rss_mb']:.0f} MB；"
+          f"CPU 主进程{report['cpu_s']:.1f}s，子进程{report['children_cpu_s']:.1f}s")
+    print("延迟分位数:")
+    for name, s in report["latency"].items():
+        print(f"  {name:<15} n={s['count']:<4} p50={s['p50_ms']:7.0f}ms p90={s['p90_ms']:7.0f}ms "
+              f"p99={s['p99_ms']:7.0f}ms max={s['max_ms']:7.0f}ms")
+    print("=" * 60)
+
+def main():
+    parser = argparse.ArgumentParser(description="多会话服务模式压测")
+    parser.add_argument('--sessions', type=int, default=8, help="同时运行的会话数")
+    parser.add_argument('--vad-workers', type=int, default=config.SERVER_VAD_WORKERS,
+                        help="VAD进程数，0为CPU核数，-1为不用进程池")
+    parser.add_argument('--max-concurrent', type=int, default=config.SERVER_LLM_MAX_CONCURRENT,
+                        help="所有会话同时进行的LLM回复数上限")
+    parser.add_argument('--sentences', type=int, default=6, help="每个会话的句子数")
+    parser.add_argument('--interval', type=float, default=3.0, help="句子间隔（秒）")
+    parser.add_argument('--tail', type=float, default=5.0, help="最后一句之后继续运行的时间（秒）")
+    parser.add_argument('--ttft', type=float, default=0.3, help="模拟大模型的首token延迟（秒）")
+    parser.add_argument('--token-rate', type=float, default=40.0, help="模拟大模型每秒输出的token数")
+    parser.add_argument('--reply-tokens', type=int, default=40, help="每条回复的token数")
+    parser.add_argument('--json', dest='json_out', default=None, help="把完整报告写入JSON文件")
+    parser.add_argument('--verbose', action='store_true', help="输出INFO级别日志")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
+
+    report = run_load(args)
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
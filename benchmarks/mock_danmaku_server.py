@@ -0,0 +1,265 @@
+# benchmarks/mock_danmaku_server.py
+# 本地的B站弹幕websocket服务替身：回放录制的房间流量，或按指定速率生成合成弹幕
+# 单独运行: python -m benchmarks.mock_danmaku_server --port 8766 --rate 3000
+#           python -m benchmarks.mock_danmaku_server --replay cache/room.jsonl.gz
+import json
+import time
+import zlib
+import base64
+import random
+import socket
+import struct
+import hashlib
+import argparse
+import threading
+import socketserver
+from live_chat.bilibili_client import (encode_packet, load_recording, brotli, OP_HEARTBEAT, OP_HEARTBEAT_REPLY,
+                                       OP_MESSAGE, OP_AUTH, OP_AUTH_REPLY, PROTO_JSON, PROTO_ZLIB, PROTO_BROTLI)
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+SAMPLE_DANMAKU = [
+    "主播说得不对吧", "这也能杠？", "哈哈哈哈哈哈", "666666", "你错了，地球是圆的",
+    "凭什么这么说", "这个观点站不住脚", "前面的别刷屏了", "主播今天状态不错", "反驳一下试试",
+]
+NOISE_CMDS = ("INTERACT_WORD", "ONLINE_RANK_COUNT", "WATCHED_CHANGE", "ENTRY_EFFECT", "LIKE_INFO_V3_CLICK")
+
+def make_message(rng: random.Random, now_ms: int) -> dict:
+    """生成一条结构与真实流量相近的消息：大部分是进场等噪声，其次是弹幕，少量礼物和SC"""
+    roll = rng.random()
+    uid = rng.randint(1, 5000)
+    uname = f"观众{uid}"
+    if roll < 0.45:
+        # 真实的进场等消息带有粉丝勋章、用户信息等大段字段，单条约1KB
+        cmd = rng.choice(NOISE_CMDS)
+        medal = {"anchor_roomid": 1, "guard_level": 0, "icon_id": 0, "is_lighted": 1, "medal_color": 9272486,
+                 "medal_color_border": 9272486, "medal_color_end": 9272486, "medal_color_start": 9272486,
+                 "medal_level": rng.randint(1, 30), "medal_name": "粉丝团", "score": rng.randint(0, 99999),
+                 "special": "", "target_id": 1}
+        return {"cmd": cmd, "data": {
+            "contribution": {"grade": 0}, "contribution_v2": {"grade": 0, "rank_type": "", "text": ""},
+            "core_user_type": 0, "dmscore": 12, "fans_medal": medal, "group_medal": None, "identities": [1],
+            "is_mystery": False, "msg_type": 1, "privilege_type": 0, "roomid": 1, "score": now_ms,
+            "spread_desc": "", "spread_info": "", "tail_icon": 0, "tail_text": "", "timestamp": now_ms // 1000,
+            "trigger_time": now_ms * 1000000, "uid": uid, "uname": uname, "uname_color": "",
+            "uinfo": {"uid": uid, "base": {"name": uname, "face": "https://i0.hdslb.com/bfs/face/member/noface.jpg",
+                                           "is_mystery": False, "name_color": 0,
+                                           "official_info": {"role": 0, "title": "", "desc": "", "type": -1},
+                                           "origin_info": {"name": uname, "face": ""}, "risk_ctrl_info": None},
+                      "medal": medal, "wealth": {"level": rng.randint(1, 40), "dm_icon_key": ""},
+                      "title": None, "guard": {"level": 0, "expired_str": ""}}}}
+    if roll < 0.97:
+        # 热门房间里大量重复刷屏
+        text = rng.choice(SAMPLE_DANMAKU) if rng.random() < 0.7 else f"{rng.choice(SAMPLE_DANMAKU)}{rng.randint(0, 999)}"
+        return {"cmd": "DANMU_MSG", "info": [
+            [0, 1, 25, 16777215, now_ms, 0, 0, "", 0, 0, 0, "", 0, "{}", "{}", {}],
+            text, [uid, uname, 0, 0, 0, 10000, 1, ""], [], [0, 0, 9868950, ">50000", 0], ["", ""], 0, 0, None,
+            {"ts": now_ms // 1000, "ct": ""}, 0, 0, None, None, 0, 105,
+        ]}
+    if roll < 0.995:
+        num = rng.randint(1, 10)
+        return {"cmd": "SEND_GIFT", "data": {"uid": uid, "uname": uname, "giftName": "小花花", "num": num,
+                                             "coin_type": "gold", "total_coin": 100 * num, "timestamp": now_ms // 1000}}
+    return {"cmd": "SUPER_CHAT_MESSAGE", "data": {"uid": uid, "message": rng.choice(SAMPLE_DANMAKU),
+                                                  "price": rng.choice((30, 50, 100)), "user_info": {"uname": uname}}}
+
+def make_batch(rng: random.Random, count: int, protover: int = PROTO_ZLIB) -> bytes:
+    """把count条消息打包成一个压缩批量包（一个websocket帧）"""
+    now_ms = int(time.time() * 1000)
+    # 与真实流量一样使用紧凑的JSON格式
+    bodies = (json.dumps(make_message(rng, now_ms), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+              for _ in range(count))
+    inner = b"".join(encode_packet(OP_MESSAGE, body, PROTO_JSON) for body in bodies)
+    if protover == PROTO_BROTLI and brotli is not None:
+        return encode_packet(OP_MESSAGE, brotli.compress(inner), PROTO_BROTLI)
+    return encode_packet(OP_MESSAGE, zlib.compress(inner), PROTO_ZLIB)
+
+class MockDanmakuServer:
+    """在后台线程运行的弹幕服务替身，地址见url属性。每个连接鉴权后开始推送流量。"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, rate: float = 1000.0, batch_interval: float = 0.1,
+                 recording: list = None, speed: float = 1.0, seed: int = 0, pool_size: int = 64):
+        self.rate = rate
+        self.batch_interval = batch_interval
+        self.recording = recording
+        self.speed = speed
+        self._lock = threading.Lock()
+
+        # 预先生成一组合成批量包循环发送，避免服务端自身成为瓶颈
+        self._batches = []
+        if recording is None:
+            rng = random.Random(seed)
+            per_batch = max(1, int(rate * batch_interval))
+            self._batches = [make_batch(rng, per_batch) for _ in range(pool_size)]
+            self._messages_per_batch = per_batch
+
+        # 统计信息
+        self.connections = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.heartbeats = 0
+
+        self.server = socketserver.ThreadingTCPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"ws://{host}:{port}/sub"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="MockDanmakuServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "frames_sent": self.frames_sent,
+                "bytes_sent": self.bytes_sent,
+                "messages_sent": self.messages_sent,
+                "heartbeats": self.heartbeats,
+            }
+
+    def _frames(self):
+        """产出(发送时刻相对偏移, 帧, 消息数)"""
+        if self.recording is not None:
+            for t, data in self.recording:
+                yield t / self.speed, data, 0
+            return
+        i = 0
+        while True:
+            yield i * self.batch_interval, self._batches[i % len(self._batches)], self._messages_per_batch
+            i += 1
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _handshake(self) -> bool:
+                headers = {}
+                request_line = self.rfile.readline()
+                if not request_line:
+                    return False
+                while True:
+                    line = self.rfile.readline().decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                key = headers.get('sec-websocket-key')
+                if not key:
+                    return False
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+                self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                                  f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('ascii'))
+                return True
+
+            def _send(self, payload: bytes, opcode: int = 0x2):
+                size = len(payload)
+                if size < 126:
+                    header = struct.pack('!BB', 0x80 | opcode, size)
+                elif size < 65536:
+                    header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+                else:
+                    header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+                with self._send_lock:
+                    self.request.sendall(header + payload)
+
+            def _recv(self):
+                """读取一个客户端帧（客户端帧总是带掩码），返回(opcode, payload)"""
+                head = self.rfile.read(2)
+                if len(head) < 2:
+                    return None, None
+                opcode, size = head[0] & 0x0F, head[1] & 0x7F
+                if size == 126:
+                    size = struct.unpack('!H', self.rfile.read(2))[0]
+                elif size == 127:
+                    size = struct.unpack('!Q', self.rfile.read(8))[0]
+                mask = self.rfile.read(4) if head[1] & 0x80 else None
+                payload = self.rfile.read(size)
+                if mask:
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+                return opcode, payload
+
+            def _read_loop(self):
+                while not self._closed.is_set():
+                    try:
+                        opcode, payload = self._recv()
+                    except OSError:
+                        break
+                    if opcode is None or opcode == 0x8:
+                        break
+                    if opcode != 0x2 or len(payload) < 16:
+                        continue
+                    operation = struct.unpack_from('>I', payload, 8)[0]
+                    if operation == OP_AUTH:
+                        self._send(encode_packet(OP_AUTH_REPLY, b'{"code":0}', PROTO_JSON))
+                        self._authed.set()
+                    elif operation == OP_HEARTBEAT:
+                        with mock._lock:
+                            mock.heartbeats += 1
+                        self._send(encode_packet(OP_HEARTBEAT_REPLY, struct.pack('>I', 12345)))
+                self._closed.set()
+
+            def handle(self):
+                if not self._handshake():
+                    return
+                with mock._lock:
+                    mock.connections += 1
+                self._send_lock = threading.Lock()
+                self._authed = threading.Event()
+                self._closed = threading.Event()
+                threading.Thread(target=self._read_loop, daemon=True).start()
+                if not self._authed.wait(5):
+                    return
+                started = time.perf_counter()
+                try:
+                    for offset, frame, count in mock._frames():
+                        delay = started + offset - time.perf_counter()
+                        if delay > 0 and self._closed.wait(delay):
+                            break
+                        if self._closed.is_set():
+                            break
+                        self._send(frame)
+                        with mock._lock:
+                            mock.frames_sent += 1
+                            mock.bytes_sent += len(frame)
+                            mock.messages_sent += count
+                except OSError:
+                    pass
+                finally:
+                    self._closed.set()
+                    try:
+                        self.request.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="本地B站弹幕websocket服务替身")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--rate', type=float, default=1000.0, help="合成流量的消息速率（条/秒）")
+    parser.add_argument('--batch-interval', type=float, default=0.1, help="合成流量每个压缩批量包的间隔（秒）")
+    parser.add_argument('--replay', default=None, help="回放录制的流量文件（.jsonl.gz）")
+    parser.add_argument('--speed', type=float, default=1.0, help="回放倍速")
+    args = parser.parse_args()
+    recording = load_recording(args.replay) if args.replay else None
+    server = MockDanmakuServer(args.host, args.port, args.rate, args.batch_interval, recording, args.speed)
+    print(f"模拟弹幕服务已启动: {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# benchmarks/mock_llm_server.py
+# 本地的OpenAI兼容流式接口替身，可配置首token延迟、token速率和错误注入，
+# 也可以按模型分别配置（例如主模型偶尔很慢、备用模型稳定）
+# 单独运行: python -m benchmarks.mock_llm_server --port 8765 --ttft 0.3 --token-rate 40
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_TEXT = "你说得不对，这种观点站不住脚，换个角度想想就知道完全是反的，杠精今天就要跟你杠到底！"
+
+class MockLLMServer:
+    """在后台线程运行的模拟大模型服务，地址见url属性"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, ttft: float = 0.3,
+                 token_rate: float = 40.0, reply_tokens: int = 40, error_rate: float = 0.0,
+                 error_status: int = 500, seed: int = 0, model_profiles: dict = None):
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # 按模型覆盖的参数：{模型: {"ttft", "slow_rate", "slow_ttft", "error_rate"}}，
+        # slow_rate的请求首token延迟为slow_ttft，用来模拟长尾
+        self.model_profiles = model_profiles or {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.requests = 0
+        self.requests_by_model = {}
+        self.errors_injected = 0
+        self.tokens_sent = 0
+        self.client_disconnects = 0
+        self.connections = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        # 模拟服务端前缀缓存：记录最近一次请求的提示词
+        self._last_prompt = ""
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="MockLLMServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "requests_by_model": dict(self.requests_by_model),
+                "errors_injected": self.errors_injected,
+                "tokens_sent": self.tokens_sent,
+                "client_disconnects": self.client_disconnects,
+                "connections": self.connections,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+    def _profile(self, model: str) -> dict:
+        profile = {"ttft": self.ttft, "slow_rate": 0.0, "slow_ttft": self.ttft, "error_rate": self.error_rate}
+        profile.update(self.model_profiles.get(model, {}))
+        return profile
+
+    def _should_fail(self, model: str = None) -> bool:
+        error_rate = self._profile(model)["error_rate"]
+        with self._lock:
+            self.requests += 1
+            self.requests_by_model[model] = self.requests_by_model.get(model, 0) + 1
+            if error_rate and self._random.random() < error_rate:
+                self.errors_injected += 1
+                return True
+            return False
+
+    def _prompt_usage(self, messages: list) -> tuple:
+        """按字符数近似提示词token数，与上一次请求相同的前缀视为缓存命中"""
+        prompt = "".join(f"{m.get('role')}:{m.get('content')}\n" for m in messages)
+        with self._lock:
+            previous, self._last_prompt = self._last_prompt, prompt
+            cached = 0
+            for a, b in zip(prompt, previous):
+                if a != b:
+                    break
+                cached += 1
+            self.prompt_tokens += len(prompt)
+            self.cached_tokens += cached
+        return len(prompt), cached
+
+    def _ttft(self, model: str) -> float:
+        profile = self._profile(model)
+        with self._lock:
+            slow = profile["slow_rate"] and self._random.random() < profile["slow_rate"]
+        return profile["slow_ttft"] if slow else profile["ttft"]
+
+    def _tokens(self):
+        for i in range(self.reply_tokens):
+            start = (i * 2) % len(REPLY_TEXT)
+            yield REPLY_TEXT[start:start + 2]
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # 支持keep-alive，便于测试连接复用
+
+            def setup(self):
+                super().setup()
+                with mock._lock:
+                    mock.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/models'):
+                    self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                model = request.get('model', 'mock-model')
+                if mock._should_fail(model):
+                    self._send_json(mock.error_status, {"error": {"message": "injected error", "type": "mock_error"}})
+                    return
+
+                ttft = mock._ttft(model)
+                created = int(time.time())
+                tokens = list(mock._tokens())
+                if not request.get('stream'):
+                    time.sleep(ttft + len(tokens) / mock.token_rate)
+                    with mock._lock:
+                        mock.tokens_sent += len(tokens)
+                    self._send_json(200, {
+                        "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                                     "finish_reason": "stop"}],
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                def event(delta, finish_reason=None):
+                    chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                             "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8')
+
+                try:
+                    time.sleep(ttft)
+                    self._write_chunk(event({"role": "assistant", "content": ""}))
+                    interval = 1.0 / mock.token_rate if mock.token_rate > 0 else 0
+                    for token in tokens:
+                        self._write_chunk(event({"content": token}))
+                        with mock._lock:
+                            mock.tokens_sent += 1
+                        if interval:
+                            time.sleep(interval)
+                    self._write_chunk(event({}, "stop"))
+                    if (request.get('stream_options') or {}).get('include_usage'):
+                        prompt_tokens, cached_tokens = mock._prompt_usage(request.get('messages', []))
+                        usage = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                                 "model": model, "choices": [],
+                                 "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                           "total_tokens": prompt_tokens + len(tokens),
+                                           "prompt_tokens_details": {"cached_tokens": cached_tokens}}}
+                        self._write_chunk(f"data: {json.dumps(usage, ensure_ascii=False)}\n\n".encode('utf-8'))
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self._write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    with mock._lock:
+                        mock.client_disconnects += 1
+                    self.close_connection = True
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容流式接口替身")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=0.3, help="首token延迟（秒）")
+    parser.add_argument('--token-rate', type=float, default=40.0, help="每秒输出的token数")
+    parser.add_argument('--reply-tokens', type=int, default=40, help="每条回复的token数")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="请求失败的概率")
+    parser.add_argument('--error-status', type=int, default=500, help="注入错误时返回的HTTP状态码")
+    args = parser.parse_args()
+    server = MockLLMServer(args.host, args.port, args.ttft, args.token_rate, args.reply_tokens,
+                           args.error_rate, args.error_status)
+    print(f"模拟大模型服务已启动: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
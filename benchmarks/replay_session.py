@@ -0,0 +1,181 @@
+# benchmarks/replay_session.py
+# 会话录制的查看与回放工具。录制文件以内存映射方式打开，只读取用到的数据块。
+# 用法:
+#   python -m benchmarks.replay_session info   录制.rec
+#   python -m benchmarks.replay_session dump   录制.rec --from 60 --to 90 --kinds asr_final,llm_request
+#   python -m benchmarks.replay_session search 录制.rec 离谱
+#   python -m benchmarks.replay_session ui     录制.rec --speed 4 [--headless]
+#   python -m benchmarks.replay_session pipeline 录制.rec --speed 2 [--asr backend] [--record 新录制.rec]
+# ui只重放实际执行过的JS；pipeline把录制的音频送入真实的MainAgent，句子默认按录制时的识别结果与时刻给出，
+# --asr backend时改用config中配置的识别后端重新识别，大模型使用本地模拟服务。
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.session_recorder import SessionReader, KIND_NAMES, KIND_AUDIO, KIND_ASR_FINAL, KIND_UI, TEXT_KINDS
+
+KINDS_BY_NAME = {name: kind for kind, name in KIND_NAMES.items()}
+
+def parse_kinds(text: str):
+    if not text:
+        return None
+    try:
+        return {KINDS_BY_NAME[name.strip()] for name in text.split(',')}
+    except KeyError as e:
+        raise SystemExit(f"未知的记录类型 {e}，可选: {', '.join(KINDS_BY_NAME)}")
+
+def format_record(reader: SessionReader, record, width: int = 100) -> str:
+    if record.kind == KIND_AUDIO:
+        body = f"{len(record.payload)} 字节"
+    else:
+        body = record.payload.decode('utf-8', errors='replace').replace('\n', '\\n')
+        if len(body) > width:
+            body = body[:width] + f"…（共{len(body)}字）"
+    tag = f" #{record.tag}" if record.tag else ""
+    return f"[+{record.ts - reader.start_ts:9.3f}s] {KIND_NAMES.get(record.kind, record.kind):<11}{tag} {body}"
+
+def cmd_info(reader: SessionReader, args):
+    summary = reader.summary()
+    print(f"文件: {summary['path']}（{summary['bytes'] / 1024 / 1024:.1f} MB，"
+          f"{'有索引' if summary['indexed'] else '无索引，已按块头重建'}）")
+    print(f"时长 {summary['duration_s']:.1f} 秒，{summary['chunks']} 块，{summary['records']} 条记录"
+          f"（音频 {summary['audio_records']}，事件 {summary['events_records']}）")
+    print(f"录制参数: {reader.meta}")
+    for record in reader.records(kinds={KIND_ASR_FINAL} | {KINDS_BY_NAME['asr_status']}):
+        print(format_record(reader, record))
+
+def _window(reader: SessionReader, args):
+    start = reader.start_ts + args.from_s if args.from_s is not None else None
+    end = reader.start_ts + args.to_s if args.to_s is not None else None
+    return start, end
+
+def cmd_dump(reader: SessionReader, args):
+    start, end = _window(reader, args)
+    for record in reader.records(start=start, end=end, kinds=parse_kinds(args.kinds)):
+        print(format_record(reader, record, args.width))
+
+def cmd_search(reader: SessionReader, args):
+    start, end = _window(reader, args)
+    started = time.perf_counter()
+    matches = 0
+    for record in reader.search(args.text, kinds=parse_kinds(args.kinds) or TEXT_KINDS, start=start, end=end):
+        print(format_record(reader, record, args.width))
+        matches += 1
+    print(f"共 {matches} 条，用时 {(time.perf_counter() - started) * 1000:.1f} ms")
+
+def cmd_ui(reader: SessionReader, args):
+    """按录制时的节奏（或倍速）重新执行UI调用"""
+    from ui.webview_window import RefutationWebViewWindow
+    from benchmarks.fakes import NullWindow
+    window = NullWindow() if args.headless else RefutationWebViewWindow()
+
+    def drive():
+        if not args.headless and not window.wait_for_ready(30):
+            print("窗口未就绪")
+            return
+        start, end = _window(reader, args)
+        records = reader.records(start=start, end=end, kinds={KIND_UI})
+        base, began, calls, late = None, time.perf_counter(), 0, 0.0
+        for record in records:
+            if base is None:
+                base = record.ts
+            delay = began + (record.ts - base) / args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late = max(late, -delay)
+            window.execute_js(record.payload.decode('utf-8'))
+            calls += 1
+        print(f"重放 {calls} 次UI调用，用时 {time.perf_counter() - began:.1f} 秒，最大落后 {late * 1000:.1f} ms")
+        if not args.headless:
+            window.stop()
+
+    if args.headless:
+        drive()
+        print(f"JS共 {window.js_chars / 1024:.1f} KB")
+        return
+    threading.Thread(target=drive, name="ReplayUI", daemon=True).start()
+    window.start()
+    window.run()
+
+def cmd_pipeline(reader: SessionReader, args):
+    """把录制的音频按倍速送入真实的Agent管线，输出与run_pipeline相同的报告"""
+    from benchmarks.fakes import RecordedAudioSource
+    from benchmarks.run_pipeline import run_benchmark, print_report
+    start, end = _window(reader, args)
+    base = start if start is not None else reader.start_ts
+    finals = list(reader.records(start=start, end=end, kinds={KIND_ASR_FINAL}))
+    schedule = [((r.ts - base) / args.speed, r.payload.decode('utf-8')) for r in finals]
+    duration = ((end if end is not None else reader.end_ts) - base) / args.speed + args.tail
+    print(f"回放 {duration - args.tail:.1f} 秒音频（{args.speed}倍速），录制中有 {len(finals)} 句识别结果")
+
+    recognition_factory = None
+    if args.asr == 'backend':
+        import config
+        from agent.asr_backends import create_asr_backend
+        if config.ASR_BACKEND == 'dashscope':
+            import dashscope
+            dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
+        recognition_factory = create_asr_backend()
+        schedule = []
+    pipeline_args = argparse.Namespace(
+        duration=duration, tail=args.tail, partial_lead=1.0, ttft=args.ttft, token_rate=args.token_rate,
+        reply_tokens=args.reply_tokens, error_rate=0.0, error_status=500, runtime=args.runtime,
+        metrics_out=None, record=args.record, wav=None, speed=args.speed, tts=False,
+    )
+    report = run_benchmark(pipeline_args, schedule=schedule,
+                           source_factory=partial(RecordedAudioSource, reader, speed=args.speed, start=start),
+                           recognition_factory=recognition_factory)
+    if hasattr(recognition_factory, 'close'):
+        recognition_factory.close()
+    print_report(report)
+
+def main():
+    parser = argparse.ArgumentParser(description="会话录制的查看与回放")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add(name, func, help_text):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('path', help="录制文件")
+        p.add_argument('--from', dest='from_s', type=float, default=None, help="从录制开始后第几秒开始")
+        p.add_argument('--to', dest='to_s', type=float, default=None, help="到录制开始后第几秒结束")
+        p.set_defaults(func=func)
+        return p
+
+    add('info', cmd_info, "概要与识别结果、识别会话状态列表")
+    p = add('dump', cmd_dump, "按时间顺序列出记录")
+    p.add_argument('--kinds', default='', help=f"记录类型，逗号分隔: {', '.join(KINDS_BY_NAME)}")
+    p.add_argument('--width', type=int, default=100)
+    p = add('search', cmd_search, "搜索文字记录")
+    p.add_argument('text')
+    p.add_argument('--kinds', default='')
+    p.add_argument('--width', type=int, default=100)
+    p = add('ui', cmd_ui, "重放UI调用")
+    p.add_argument('--speed', type=float, default=1.0)
+    p.add_argument('--headless', action='store_true', help="不显示窗口，只统计JS调用")
+    p = add('pipeline', cmd_pipeline, "用录制的音频重新驱动Agent管线")
+    p.add_argument('--speed', type=float, default=1.0)
+    p.add_argument('--asr', choices=('recorded', 'backend'), default='recorded',
+                   help="recorded 按录制的识别结果给出句子；backend 用配置的识别后端重新识别")
+    p.add_argument('--tail', type=float, default=5.0)
+    p.add_argument('--ttft', type=float, default=0.3)
+    p.add_argument('--token-rate', type=float, default=40.0)
+    p.add_argument('--reply-tokens', type=int, default=40)
+    p.add_argument('--runtime', choices=('threaded', 'async'), default='threaded')
+    p.add_argument('--record', default=None, help="把这次回放再录制下来，便于与原录制对比")
+    p.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if getattr(args, 'verbose', False) else logging.WARNING,
+                        format='%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
+    with SessionReader(args.path) as reader:
+        args.func(reader, args)
+
+if __name__ == '__main__':
+    main()
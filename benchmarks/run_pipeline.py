@@ -0,0 +1,203 @@
+# benchmarks/run_pipeline.py
+# 无界面、无网络的端到端基准测试：真实的MainAgent/ASRHandler/LLMHandler代码，
+# 配合WAV回放（或合成音频）、按时间表出结果的识别服务替身、本地模拟大模型服务和空窗口。
+# 用法: python -m benchmarks.run_pipeline --sentences 20 --interval 3 --ttft 0.3 --token-rate 40
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.main_agent import MainAgent
+from agent.async_runtime import AsyncMainAgent
+from utils.tracing import tracer
+from utils.session_recorder import recorder
+from agent.tts import SpeechOutput
+from benchmarks.fakes import (FakeASRService, NullWindow, SyntheticSpeechSource, WavFileSource, make_schedule,
+                              FakeTTSBackend, NullAudioSink, EchoLoopback, LoopbackSource)
+from benchmarks.mock_llm_server import MockLLMServer
+
+logger = logging.getLogger(__name__)
+
+class ThreadSampler:
+    """定期采样线程数量"""
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ThreadSampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            count = threading.active_count()
+            self.samples.append(count)
+            self.peak = max(self.peak, count)
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join(timeout=1)
+
+    def summary(self) -> dict:
+        avg = sum(self.samples) / len(self.samples) if self.samples else threading.active_count()
+        return {"peak": self.peak, "avg": avg, "final": threading.active_count()}
+
+def run_benchmark(args, schedule=None, source_factory=None, recognition_factory=None) -> dict:
+    """schedule、source_factory与recognition_factory可替换句子时间表、音频输入与识别服务（例如回放会话录制，见replay_session.py）"""
+    if schedule is None:
+        schedule = make_schedule(args.sentences, args.interval)
+    duration = args.duration or (schedule[-1][0] + args.tail if schedule else args.tail)
+
+    server = MockLLMServer(ttft=args.ttft, token_rate=args.token_rate, reply_tokens=args.reply_tokens,
+                           error_rate=args.error_rate, error_status=args.error_status).start()
+    asr_service = FakeASRService(schedule, partial_lead=args.partial_lead)
+    if source_factory is None and args.wav:
+        source_factory = partial(WavFileSource, args.wav, speed=args.speed)
+    elif source_factory is None:
+        source_factory = partial(SyntheticSpeechSource, schedule)
+
+    speech_output = None
+    if args.tts:
+        # 播报的声音回灌到麦克风输入，检验播放期间的屏蔽
+        loopback = EchoLoopback()
+        speech_output = SpeechOutput(backend=FakeTTSBackend(),
+                                     sink_factory=lambda rate: NullAudioSink(rate, loopback=loopback))
+        inner_factory = source_factory
+        source_factory = lambda block_size: LoopbackSource(inner_factory(block_size=block_size), loopback)
+
+    tracer.export_path = args.metrics_out
+    window = NullWindow()
+    agent_cls = AsyncMainAgent if args.runtime == 'async' else MainAgent
+    agent = agent_cls(api_key="benchmark", window=window, base_url=server.url,
+                      audio_source_factory=source_factory,
+                      recognition_factory=recognition_factory or asr_service.factory,
+                      speech_output=speech_output)
+
+    sampler = ThreadSampler()
+    threads_before = threading.active_count()
+    sampler.start()
+    if args.record:
+        recorder.start(args.record, meta={"source": "run_pipeline"})
+    started = time.time()
+    asr_service.start_time = started
+    agent.run()
+    try:
+        time.sleep(duration)
+    finally:
+        elapsed = time.time() - started
+        agent.stop()
+        window.bridge.stop()
+        recorder.stop()
+        sampler.stop()
+        server.stop()
+        tracer.export()
+
+    dispatcher = agent.llm_dispatcher.get_stats()
+    server_stats = server.get_stats()
+    return {
+        "duration_s": elapsed,
+        "throughput": {
+            "sentences_emitted": asr_service.sentences_emitted,
+            "replies_completed": dispatcher["completed"],
+            "replies_per_minute": dispatcher["completed"] / elapsed * 60,
+            "tokens_streamed": server_stats["tokens_sent"],
+            "tokens_per_second": server_stats["tokens_sent"] / elapsed,
+            "ui_js_calls": window.js_calls,
+        },
+        "latency": tracer.summary(),
+        "audio": {
+            **agent.audio_capture.get_stats(),
+            **{f"vad_{k}": v for k, v in agent.vad_gate.get_stats().items()},
+            "asr_frames_received": asr_service.frames_received,
+            "asr_sessions": asr_service.sessions,
+        },
+        "dispatcher": dispatcher,
+        "ui_bridge": window.bridge.get_stats(),
+        "prompt": {
+            **agent.llm_handler.usage_stats.get_stats(),
+            **({f"memory_{k}": v for k, v in agent.conversation_memory.get_stats().items()}
+               if agent.conversation_memory is not None else {}),
+        },
+        "llm_server": server_stats,
+        "handover": agent.handover_stats.summary(),
+        "threads": {"before": threads_before, **sampler.summary()},
+        "tts": speech_output.get_stats() if speech_output is not None else None,
+    }
+
+def print_report(report: dict):
+    print("=" * 60)
+    print(f"运行时长: {report['duration_s']:.1f} 秒")
+    t = report["throughput"]
+    print(f"吞吐: 识别{t['sentences_emitted']}句，完成回复{t['replies_completed']}条"
+          f"（{t['replies_per_minute']:.1f}条/分钟），token {t['tokens_per_second']:.1f}/秒，UI JS调用{t['ui_js_calls']}次")
+    print("延迟分位数:")
+    for name, s in report["latency"].items():
+        print(f"  {name:<15} n={s['count']:<4} p50={s['p50_ms']:7.0f}ms p90={s['p90_ms']:7.0f}ms "
+              f"p99={s['p99_ms']:7.0f}ms max={s['max_ms']:7.0f}ms")
+    a = report["audio"]
+    print(f"音频: 声卡溢出{a['device_overflows']}次，环形缓冲丢块{a['ring_overflows']}，回放{a['replayed_blocks']}块，"
+          f"VAD上传{a['vad_blocks_sent']}/{a['vad_blocks_in']}块，ASR会话{a['asr_sessions']}个")
+    d = report["dispatcher"]
+    print(f"调度: 提交{d['submitted']}，完成{d['completed']}，合并{d['coalesced']}，丢弃{d['dropped']}，取消{d['cancelled']}")
+    p = report["prompt"]
+    print(f"提示词: 平均{p['avg_prompt_tokens']:.0f} tokens，最大{p['max_prompt_tokens']}，"
+          f"缓存命中率{p['cache_hit_ratio']:.0%}，记忆压缩{p.get('memory_compactions', 0)}次")
+    th = report["threads"]
+    print(f"线程数: 启动前{th['before']}，峰值{th['peak']}，平均{th['avg']:.1f}，结束时{th['final']}")
+    tts = report["tts"]
+    if tts:
+        print(f"语音播报: {tts['segments']}段，首个音频 p50={tts['first_audio']['p50_ms']:.0f}ms "
+              f"p90={tts['first_audio']['p90_ms']:.0f}ms，段间静音 p90={tts['gaps']['p90_ms']:.0f}ms "
+              f"max={tts['gaps']['max_ms']:.0f}ms，打断{tts['interrupted']}次，播放期间屏蔽麦克风{a['vad_blocks_suppressed']}块，"
+              f"说话中开始播放{a['vad_speech_cut']}次")
+    print("=" * 60)
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端管线基准测试")
+    parser.add_argument('--sentences', type=int, default=10, help="时间表中的句子数")
+    parser.add_argument('--interval', type=float, default=3.0, help="句子间隔（秒）")
+    parser.add_argument('--partial-lead', type=float, default=1.0, help="句子结束前多久开始发出中间结果（秒）")
+    parser.add_argument('--duration', type=float, default=None, help="运行时长（秒），默认按时间表自动计算")
+    parser.add_argument('--tail', type=float, default=5.0, help="最后一句之后继续运行的时间（秒）")
+    parser.add_argument('--wav', default=None, help="回放的WAV文件，不指定则使用合成音频")
+    parser.add_argument('--speed', type=float, default=1.0, help="WAV回放倍速")
+    parser.add_argument('--ttft', type=float, default=0.3, help="模拟大模型的首token延迟（秒）")
+    parser.add_argument('--token-rate', type=float, default=40.0, help="模拟大模型每秒输出的token数")
+    parser.add_argument('--reply-tokens', type=int, default=40, help="每条回复的token数")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="模拟大模型请求失败的概率")
+    parser.add_argument('--error-status', type=int, default=500, help="注入错误时的HTTP状态码")
+    parser.add_argument('--runtime', choices=('threaded', 'async'), default='threaded', help="Agent运行模式")
+    parser.add_argument('--metrics-out', default=None, help="延迟直方图的导出文件")
+    parser.add_argument('--tts', action='store_true', help="开启语音播报（合成替身，播放的声音回灌到麦克风）")
+    parser.add_argument('--record', default=None, help="把本次运行录制到此文件（会话录制格式）")
+    parser.add_argument('--json', dest='json_out', default=None, help="把完整报告写入JSON文件")
+    parser.add_argument('--max-e2e-p90-ms', type=float, default=None, help="端到端p90超过此值时以非零状态退出")
+    parser.add_argument('--verbose', action='store_true', help="输出INFO级别日志")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.max_e2e_p90_ms is not None:
+        p90 = report["latency"].get("end_to_end", {}).get("p90_ms")
+        if p90 is None or p90 > args.max_e2e_p90_ms:
+            print(f"端到端p90延迟 {p90} ms 超过阈值 {args.max_e2e_p90_ms} ms")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
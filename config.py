@@ -1,5 +1,6 @@
 # config.py
 # 存放项目的所有配置信息
+import os
 
 # 音频参数
 SAMPLE_RATE = 16000
@@ -9,6 +10,7 @@ FORMAT_PCM = 'pcm'
 BLOCK_SIZE = 3200
 
 # 模型名称
+LLM_BASE_URL = 'https://dashscope.aliyuncs.com/compatible-mode/v1'
 ASR_MODEL = 'paraformer-realtime-v2'
 LLM_MODEL = 'qwen-plus-2025-07-14' # 注意：原始代码中的模型名称带有日期，这里使用通用名称
 
@@ -23,5 +25,215 @@ DEFAULT_SYSTEM_PROMPT = (
 
 # VAD能量阈值，低于此值被认为是静默。可以根据你的麦克风灵敏度调整。
 VAD_ENERGY_THRESHOLD = 200 
+# 启用的VAD检测器，全部判定为语音才算语音：'energy' 能量检测，'zcr' 过零率检测
+VAD_DETECTORS = ('energy', 'zcr')
+VAD_ADAPTIVE_NOISE_FLOOR = True  # 是否根据环境噪声自动抬高能量阈值
+VAD_NOISE_FLOOR_RATIO = 3.0      # 能量需超过噪声基底的倍数才算语音
+VAD_ZCR_RANGE = (0.01, 0.45)     # 语音的过零率范围，超出范围的多为嗡嗡声或嘶嘶声
+# 只上传语音段给ASR：语音开始前补发的音频块数、语音结束后继续发送的音频块数
+VAD_GATE_ENABLED = True
+VAD_PREROLL_BLOCKS = 2
+VAD_HANGOVER_BLOCKS = 5
+# 语音识别后端：'dashscope' 阿里云实时识别（需联网）；'local' 本地离线识别，识别器运行在独立进程中，
+# 音频经共享内存传入。本地识别默认使用vosk（需 pip install vosk 并下载中文模型）。
+ASR_BACKEND = 'dashscope'
+ASR_LOCAL_ENGINE = 'vosk'              # 也可以写成'模块:工厂'，工厂接收(model_path, sample_rate)
+ASR_LOCAL_MODEL_PATH = os.getenv("ASR_LOCAL_MODEL_PATH", 'models/vosk-model-small-cn-0.22')
+ASR_LOCAL_RING_SECONDS = 10.0          # 共享内存环形缓冲区能容纳的音频时长，识别进程积压超过此时长时丢弃新音频
+ASR_LOCAL_READY_TIMEOUT_SECONDS = 30.0 # 等待模型加载的最长时间
+ASR_LOCAL_STOP_TIMEOUT_SECONDS = 2.0   # 停止会话时等待最后一句结果的最长时间
+# 上传给识别服务的音频格式：'opus' 编码为Ogg Opus（需 pip install opuslib 且系统装有libopus），
+# 不可用或识别服务不接受时自动回退为 'pcm'。本地识别后端始终使用PCM。
+ASR_AUDIO_FORMAT = 'opus'
+ASR_OPUS_BITRATE = 24000               # 比特率（bit/s），PCM为256000
+ASR_OPUS_FRAME_MS = 20                 # Opus帧长（毫秒）
+ASR_ENCODER_FALLBACK_ERRORS = 2        # 使用压缩格式的会话连续几次在出结果前出错后回退为PCM
 # 静默超时时间（秒），持续静默超过这个时间会主动重置ASR连接
-SILENCE_TIMEOUT_SECONDS = 20.0
\ No newline at end of file
+SILENCE_TIMEOUT_SECONDS = 20.0
+# 静默重置前提前建立热备ASR会话，重置时直接切换，不中断音频
+ASR_STANDBY_ENABLED = True
+ASR_STANDBY_LEAD_SECONDS = 2.0
+# 出错重连的指数退避参数（秒），实际等待时间带随机抖动
+ASR_RECONNECT_BASE_DELAY = 0.5
+ASR_RECONNECT_MAX_DELAY = 30.0
+ASR_BACKOFF_RESET_SECONDS = 60.0  # 会话稳定运行超过此时长后，退避计数清零
+
+# UI刷新参数：流式回复的JS调用按帧合并后批量执行
+UI_FLUSH_INTERVAL_SECONDS = 0.016  # 约60帧/秒
+UI_FLUSH_MAX_CHARS = 2048          # 缓冲文本超过此长度时立即刷新
+
+# LLM调度参数
+LLM_MAX_WORKERS = 1            # 同时进行的LLM流式请求数量上限
+LLM_MAX_PENDING = 3            # 排队等待的句子数量上限
+# 回复进行中又有新句子到来时的排队策略：
+#   'coalesce' 合并排队中的句子为一条；'latest' 只保留最新一句；'drop_new' 队列满时丢弃新句子
+LLM_QUEUE_POLICY = 'coalesce'
+LLM_COALESCE_SEPARATOR = ' '
+# 新句子到来时是否取消正在进行的回复：
+#   'never' 从不取消；'before_first_token' 仅取消尚未输出首个token的请求；'always' 总是取消
+LLM_PREEMPT_MODE = 'before_first_token'
+
+# 音频采集环形缓冲区
+AUDIO_RING_SECONDS = 10.0      # 环形缓冲区可保存的音频时长（秒）
+ASR_PREROLL_SECONDS = 4.0      # 重连后最多回放的未发送音频时长（秒）
+
+# 音频输入源。配置多于一个时启用多路采集：每路单独重采样、增益与VAD，混音后送给ASR。
+#   device: 设备序号或名称的一部分，None为默认麦克风；gain: 增益；
+#   keep_alive: 该输入源有声音时是否算作在说话（重置静默计时），系统声音/游戏声音应设为False
+AUDIO_SOURCES = (
+    {'name': 'mic', 'device': None, 'gain': 1.0, 'keep_alive': True},
+    # {'name': 'system', 'device': '立体声混音', 'gain': 0.5, 'keep_alive': False},
+)
+AUDIO_MIX_MAX_LAG_BLOCKS = 2   # 其他输入源相对主输入源最多积压的块数，超过则丢弃旧块
+
+# 回复缓存：重复的句子直接回放缓存的回复，不再请求大模型
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_PATH = os.path.join('cache', 'response_cache.json.gz')
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_TTL_SECONDS = 6 * 3600
+RESPONSE_CACHE_MAX_CANDIDATES = 3  # 每个句子最多保存的候选回复数
+RESPONSE_CACHE_MIN_CANDIDATES = 2  # 候选回复少于此数量时仍请求大模型，避免回复一字不差地重复
+RESPONSE_CACHE_REPLAY_CHARS_PER_SECOND = 30.0  # 回放缓存回复的速度，模拟流式输出
+RESPONSE_CACHE_SAVE_INTERVAL_SECONDS = 60.0    # 有改动时后台保存的间隔，0为只在退出时保存
+
+# 预测生成：ASR中间结果稳定一段时间后提前开始生成回复（默认关闭）
+SPECULATION_ENABLED = False
+SPECULATION_STABLE_SECONDS = 0.4   # 中间结果保持不变多久后开始预测生成
+SPECULATION_MIN_SIMILARITY = 0.9   # 最终句子与预测所用文本的相似度达到此值才采用预测结果
+
+# 端到端延迟追踪
+TRACING_ENABLED = True
+TRACING_EXPORT_FORMAT = 'prometheus'  # 'prometheus' 文本格式，或 'jsonl' 每次追加一行快照
+TRACING_EXPORT_PATH = os.path.join('logs', 'latency_metrics.prom')
+TRACING_EXPORT_INTERVAL_SECONDS = 30.0
+TRACING_MAX_OPEN_TRACES = 256  # 未完成的追踪超过此数量时丢弃最旧的
+
+# Agent运行模式：'threaded' 线程模式（默认）；'async' 单事件循环的异步模式
+AGENT_RUNTIME = 'threaded'
+# 异步模式的HTTP连接池参数；启动时的连接预热两种模式都使用
+LLM_POOL_MAX_CONNECTIONS = 4
+LLM_POOL_KEEPALIVE_EXPIRY_SECONDS = 120.0
+LLM_PREWARM_ENABLED = True
+LLM_KEEPALIVE_INTERVAL_SECONDS = 60.0  # 空闲超过此时间就发一次轻量请求，保持连接温热
+
+# 对冲请求与备用模型：首token超过近期TTFT的分位数仍未到达时，向下一个候选模型再发一个请求，
+# 采用先出字的那个；请求失败时依次改用备用模型。候选顺序为LLM_MODEL后接LLM_FALLBACK_MODELS。
+LLM_FALLBACK_MODELS = ('qwen-turbo',)
+LLM_HEDGE_ENABLED = True
+LLM_HEDGE_MAX_ATTEMPTS = 2              # 每句话最多同时发出的请求数（含首个请求）
+LLM_HEDGE_PERCENTILE = 0.95             # 以近期首token延迟的此分位数作为对冲等待时间
+LLM_HEDGE_WINDOW = 100                  # 参与统计的近期请求数
+LLM_HEDGE_MIN_SAMPLES = 10              # 样本不足时使用默认等待时间
+LLM_HEDGE_DEFAULT_DELAY_SECONDS = 1.5
+LLM_HEDGE_MIN_DELAY_SECONDS = 0.3
+LLM_HEDGE_MAX_DELAY_SECONDS = 3.0
+# 熔断：某个模型连续失败（或首token超过慢阈值）达到次数后，在一段时间内跳过它
+LLM_BREAKER_FAILURE_THRESHOLD = 3
+LLM_BREAKER_OPEN_SECONDS = 30.0
+LLM_BREAKER_SLOW_TTFT_SECONDS = 5.0
+
+# 对话记忆：带上最近的对话，超出预算时在后台把较早的对话压缩成摘要
+MEMORY_ENABLED = True
+MEMORY_TOKEN_BUDGET = 2000        # 单次请求提示词的token上限（估算值，含系统提示词与摘要）
+MEMORY_COMPACT_RATIO = 0.8        # 提示词达到预算的此比例时开始后台压缩
+MEMORY_KEEP_RECENT_TURNS = 4      # 压缩时保留原文的最近轮数
+MEMORY_SUMMARY_MODEL = LLM_MODEL  # 生成摘要所用的模型
+MEMORY_SUMMARY_MAX_TOKENS = 300
+# 在流式响应末尾返回token用量，用于统计提示词大小与缓存命中
+LLM_STREAM_USAGE = True
+
+# B站直播弹幕接入（默认关闭）
+DANMAKU_ENABLED = False
+DANMAKU_ROOM_ID = 0
+DANMAKU_URL = None                   # 指定时直接连接该地址（例如本地回放服务），否则通过B站接口查询
+DANMAKU_HEARTBEAT_SECONDS = 30.0
+DANMAKU_RECONNECT_BASE_DELAY = 1.0
+DANMAKU_RECONNECT_MAX_DELAY = 60.0
+DANMAKU_DEDUP_WINDOW_SECONDS = 30.0  # 此时间内重复的弹幕视为刷屏
+DANMAKU_USER_RATE_PER_SECOND = 0.1   # 每个用户的弹幕限速（条/秒）
+DANMAKU_USER_BURST = 2
+DANMAKU_MIN_LENGTH = 4               # 归一化后短于此长度的弹幕不处理
+DANMAKU_KEYWORDS = ('杠精', '反驳', '你错了', '不对', '凭什么')
+DANMAKU_GIFTER_BOOST_SECONDS = 120.0 # 送礼后多久内该用户的弹幕优先处理
+DANMAKU_EMIT_INTERVAL_SECONDS = 4.0  # 最多每隔多久把一条弹幕交给大模型
+DANMAKU_MAX_AGE_SECONDS = 15.0       # 超过此时间仍未被选中的弹幕丢弃
+DANMAKU_MAX_CANDIDATES = 64          # 每个优先级保留的候选弹幕数
+
+# 日志：各线程只把日志放进队列，由后台线程写控制台和文件
+LOG_QUEUE_ENABLED = True
+LOG_QUEUE_MAX_SIZE = 10000       # 队列满时丢弃新日志而不是阻塞
+LOG_JSON_FORMAT = False          # 每条日志输出一行JSON（带utterance_id），便于检索
+LOG_RATE_LIMIT_PER_SECOND = 20.0 # 同一行代码的INFO及以下日志每秒最多输出条数，0为不限
+LOG_RATE_LIMIT_BURST = 50
+CONSOLE_TOKEN_ECHO = False       # 是否在控制台逐token回显AI回复（完整回复仍会写入日志）
+
+# 屏幕特效：AI回复中出现表情或关键词时向屏幕抛出表情粒子（透明置顶的全屏覆盖窗口）
+SCREEN_EFFECTS_ENABLED = False
+SCREEN_EFFECTS_FPS = 60
+SCREEN_EFFECTS_MAX_PARTICLES = 4096     # 同屏粒子上限（预分配）
+SCREEN_EFFECTS_GRAVITY = 1800.0         # 像素/秒²
+SCREEN_EFFECTS_DRAG = 0.6               # 每秒保留的速度比例
+SCREEN_EFFECTS_FADE_SECONDS = 0.5       # 生命最后这段时间内逐渐透明
+SCREEN_EFFECTS_BURST_SIZE = 40          # 每次触发抛出的粒子数
+SCREEN_EFFECTS_MAX_BURSTS_PER_REPLY = 3
+SCREEN_EFFECTS_KEYWORDS = {'笑死': '😂', '离谱': '🤡', '破防': '💔', '赢': '🏆', '菜': '🥬'}
+
+# 会话录制（默认关闭）：音频块、ASR事件、LLM增量与UI调用写入logs/recordings下的二进制文件，
+# 可用 python -m benchmarks.replay_session 查看、搜索与回放
+RECORDER_ENABLED = False
+RECORDER_DIR = os.path.join('logs', 'recordings')
+RECORDER_CHUNK_BYTES = 256 * 1024          # 每路缓冲达到此大小时封块写盘
+RECORDER_FLUSH_SECONDS = 1.0               # 未写满的块最多在内存中停留的时间
+RECORDER_MAX_PENDING_BYTES = 16 * 1024 * 1024  # 写盘积压超过此大小时丢弃新记录
+RECORDER_COMPRESS = False                  # 数据块用zlib压缩（麦克风音频压缩率很低，主要省文字与静音段）
+
+# AI回复审核：文本增量经违禁词自动机过滤后再上屏，只扣留可能拼成违禁词的末尾几个字
+MODERATION_ENABLED = True
+MODERATION_WORDLIST_PATH = 'banned_words.txt'  # 每行一个词，词后可用制表符跟上mask或abort；文件不存在时不审核
+MODERATION_WORDS = ()                          # 额外的违禁词
+MODERATION_POLICY = 'mask'                     # 默认处理方式：'mask' 打码后继续；'abort' 中止整条回复
+MODERATION_MASK_CHAR = '*'
+MODERATION_ABORT_NOTICE = '（此条回复已被屏蔽）'
+MODERATION_CACHE_PATH = os.path.join('cache', 'moderation_automaton.pkl')  # 编译好的自动机缓存
+
+# 多会话服务模式（python -m server）：一个进程托管多个直播间，每个会话有自己的音频输入、识别会话、人设与对话记忆，
+# 界面更新经本地websocket推送给浏览器（例如OBS浏览器源），不再创建桌面窗口。会话列表见sessions.example.json
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8760
+SERVER_SESSIONS_PATH = 'sessions.json'
+SERVER_UI_HISTORY_BATCHES = 200        # 新连接的页面补发最近多少次界面更新
+SERVER_CLIENT_MAX_BUFFER_BYTES = 1024 * 1024  # 页面接收过慢、发送缓冲超过此大小时断开该连接
+SERVER_AUDIO_BACKLOG_SECONDS = 2.0     # 经websocket上传的音频积压超过此时长时丢弃最旧的部分
+SERVER_AUDIO_STALL_SECONDS = 1.0       # 这么久没有收到音频时以静音补齐，识别会话照常计时
+SERVER_VAD_WORKERS = 0                 # VAD进程数，0为CPU核数，-1为不用进程池（在各会话的线程内计算）
+SERVER_VAD_TIMEOUT_SECONDS = 0.5       # 等待VAD进程结果的最长时间，超时改在本进程内计算
+SERVER_VAD_RING_SECONDS = 4.0          # 每个VAD进程的共享内存缓冲区能容纳的音频时长
+SERVER_LLM_MAX_CONCURRENT = 8          # 所有会话同时进行的LLM回复数上限
+SERVER_LLM_PER_SESSION_MAX = 1         # 每个会话最多同时占用的额度
+
+# 语音播报（默认关闭）：AI回复按句切分，边生成边合成、按顺序播放；播放期间麦克风音频不上传给识别服务
+# 注意这是半双工的：没有回声消除，也不支持插话打断，播放期间（含其后TTS_ECHO_TAIL_SECONDS）用户说的话不会被识别。
+# 播放开始时用户仍在说话的，这句话到此截止（补发静音句尾让识别器给出最终结果）；回复越长，漏听的可能越大。
+TTS_ENABLED = False
+TTS_BACKEND = 'dashscope'              # 'dashscope' 阿里云CosyVoice语音合成
+TTS_MODEL = 'cosyvoice-v1'
+TTS_VOICE = 'longxiaochun'
+TTS_SAMPLE_RATE = 22050
+TTS_MAX_CONCURRENT = 3                 # 同时进行的合成请求数
+TTS_SEGMENT_FIRST_MIN_CHARS = 4        # 第一段在逗号等弱停顿处切分所需的最少字数（越小首个音频越早）
+TTS_SEGMENT_MIN_CHARS = 12             # 之后各段在弱停顿处切分所需的最少字数
+TTS_SEGMENT_MAX_CHARS = 60             # 一直没有标点时强制切分的字数
+TTS_PLAYBACK_CHUNK_MS = 40             # 每次写入声卡的音频时长，新回复打断播放的最大延迟
+TTS_OUTPUT_DEVICE = None               # 输出设备序号或名称的一部分，None为默认设备
+TTS_ECHO_TAIL_SECONDS = 0.4            # 播放结束后继续屏蔽麦克风的时间（声卡缓冲与房间混响）
+
+# AI人设：PERSONA_DIR下每个.md/.txt文件是一个人设（文件名为人设名，可选的第一行“# 标题”为显示名称，其余为系统提示词），
+# 内置的default人设即DEFAULT_SYSTEM_PROMPT。可在窗口上点击人设按钮或说“切换人设 xxx”切换，下一次回复开始生效
+PERSONA_ENABLED = True
+PERSONA_DIR = 'personas'
+PERSONA_ACTIVE = 'default'             # 启动时使用的人设
+PERSONA_DEFAULT_TITLE = '杠精'          # 内置人设的显示名称
+PERSONA_MAX_PROMPT_TOKENS = 800        # 提示词的token上限（估算值），需给对话记忆留出预算
+PERSONA_COMMAND_PREFIXES = ('切换人设', '/persona')  # 语音中以这些词开头的句子作为切换命令，不交给大模型
+PERSONA_WATCH_INTERVAL_SECONDS = 0.5   # 检查人设文件改动的间隔，0为不监视
+PERSONA_RELOAD_DEBOUNCE_SECONDS = 1.0  # 文件停止变化这么久后才重新加载
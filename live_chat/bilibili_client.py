@@ -1 +1,381 @@
-# 预留：B站弹幕客户端
\ No newline at end of file
+# live_chat/bilibili_client.py
+# B站直播弹幕客户端：websocket协议的封包解码、压缩批量包解压、鉴权与心跳、断线重连。
+# 录制房间流量: python -m live_chat.bilibili_client --room 房间号 --record cache/room.jsonl.gz --duration 60
+import json
+import time
+import gzip
+import zlib
+import base64
+import random
+import struct
+import logging
+import argparse
+import threading
+import websocket
+import config
+
+try:
+    import brotli
+except ImportError:  # 没有brotli时改用zlib压缩协议(protover=2)
+    brotli = None
+
+# 解压损坏的压缩包时可能抛出的异常
+DECOMPRESS_ERRORS = (zlib.error,) + ((brotli.error,) if brotli is not None else ())
+
+logger = logging.getLogger(__name__)
+
+# 封包头：总长度、头长度、协议版本、操作码、序号（大端）
+HEADER = struct.Struct('>IHHII')
+HEADER_LEN = HEADER.size
+
+OP_HEARTBEAT = 2
+OP_HEARTBEAT_REPLY = 3
+OP_MESSAGE = 5
+OP_AUTH = 7
+OP_AUTH_REPLY = 8
+
+PROTO_JSON = 0
+PROTO_INT = 1
+PROTO_ZLIB = 2
+PROTO_BROTLI = 3
+
+CMD_DANMAKU = 'DANMU_MSG'
+CMD_SUPER_CHAT = 'SUPER_CHAT_MESSAGE'
+CMD_GIFT = 'SEND_GIFT'
+CMD_GUARD = 'GUARD_BUY'
+# 只有这些命令会做完整的JSON解析，热门房间里大量的进场、榜单等消息直接跳过
+HANDLED_CMDS = frozenset((CMD_DANMAKU, CMD_SUPER_CHAT, CMD_GIFT, CMD_GUARD))
+
+DEFAULT_WS_URL = 'wss://broadcastlv.chat.bilibili.com/sub'
+ROOM_INIT_API = 'https://api.live.bilibili.com/room/v1/Room/room_init'
+DANMU_INFO_API = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo'
+
+_CMD_MARKER = b'"cmd"'
+
+def encode_packet(operation: int, body: bytes = b'', protover: int = PROTO_INT) -> bytes:
+    return HEADER.pack(HEADER_LEN + len(body), HEADER_LEN, protover, operation, 1) + body
+
+def peek_cmd(body) -> str:
+    """不解析整个JSON，从消息开头取出cmd字段；找不到时返回None"""
+    head = body[:64].tobytes()
+    start = head.find(_CMD_MARKER)
+    if start < 0:
+        return None
+    # 跳过冒号及可能存在的空白，定位到值的引号
+    start = head.find(b'"', start + len(_CMD_MARKER))
+    end = head.find(b'"', start + 1)
+    if start < 0 or end < 0:
+        return None
+    start += 1
+    # 部分命令带有后缀，例如 DANMU_MSG:4:0:2:2:2:0
+    return head[start:end].decode('ascii', 'replace').split(':', 1)[0]
+
+class PacketDecoder:
+    """
+    流式封包解码器。在memoryview上按偏移读取封包，不对每个封包切片复制；
+    压缩包解压后递归解码其中的多个封包。
+    """
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes_in = 0
+        self.bytes_decompressed = 0
+        self.malformed = 0
+
+    def decode(self, data):
+        """逐个产出(操作码, 包体memoryview)"""
+        self.bytes_in += len(data)
+        yield from self._decode(memoryview(data))
+
+    def _decode(self, view: memoryview):
+        offset = 0
+        size = len(view)
+        while offset + HEADER_LEN <= size:
+            packet_len, header_len, protover, operation, _ = HEADER.unpack_from(view, offset)
+            if packet_len < header_len or offset + packet_len > size:
+                self.malformed += 1
+                return
+            body = view[offset + header_len:offset + packet_len]
+            offset += packet_len
+            if protover not in (PROTO_ZLIB, PROTO_BROTLI):
+                self.packets += 1
+                yield operation, body
+                continue
+            if protover == PROTO_BROTLI and brotli is None:
+                self.malformed += 1
+                continue
+            try:
+                inner = zlib.decompress(body) if protover == PROTO_ZLIB else brotli.decompress(body)
+            except DECOMPRESS_ERRORS:
+                # 损坏的压缩包只丢弃这一个，同一帧中其后的封包照常解码
+                self.malformed += 1
+                continue
+            self.bytes_decompressed += len(inner)
+            yield from self._decode(memoryview(inner))
+
+class DanmakuEvent:
+    """一条需要处理的直播间事件：弹幕、醒目留言(SC)、礼物或上舰"""
+
+    __slots__ = ('cmd', 'uid', 'uname', 'text', 'value', 'received_at')
+
+    def __init__(self, cmd: str, uid: int, uname: str, text: str = '', value: float = 0.0, received_at: float = None):
+        self.cmd = cmd
+        self.uid = uid
+        self.uname = uname
+        self.text = text
+        # 付费金额（元），普通弹幕为0
+        self.value = value
+        self.received_at = received_at or time.time()
+
+    @property
+    def user_key(self):
+        # 未登录连接收到的uid为0，只能按（打码后的）用户名区分
+        return self.uid or self.uname
+
+    def __repr__(self):
+        return f"DanmakuEvent({self.cmd}, {self.uname}, {self.text!r}, value={self.value})"
+
+def parse_event(cmd: str, payload: dict, received_at: float = None):
+    """把消息JSON转换为DanmakuEvent，格式不符或不需要处理时返回None"""
+    try:
+        if cmd == CMD_DANMAKU:
+            info = payload['info']
+            # info[0][12]为1表示表情弹幕，没有可反驳的文字
+            if len(info[0]) > 12 and info[0][12] == 1:
+                return None
+            return DanmakuEvent(cmd, info[2][0], info[2][1], info[1], received_at=received_at)
+        data = payload['data']
+        if cmd == CMD_SUPER_CHAT:
+            return DanmakuEvent(cmd, data['uid'], data['user_info']['uname'], data['message'],
+                                float(data['price']), received_at)
+        if cmd == CMD_GIFT:
+            # 金瓜子1000个折合1元，银瓜子礼物不计价
+            value = data.get('total_coin', 0) / 1000 if data.get('coin_type') == 'gold' else 0.0
+            return DanmakuEvent(cmd, data['uid'], data['uname'], data.get('giftName', ''), value, received_at)
+        if cmd == CMD_GUARD:
+            return DanmakuEvent(cmd, data['uid'], data['username'], data.get('gift_name', ''),
+                                data.get('price', 0) * data.get('num', 1) / 1000, received_at)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        logger.debug(f"无法解析的{cmd}消息: {e}")
+    return None
+
+def fetch_danmu_info(room_id: int, cookie: str = None):
+    """查询真实房间号、弹幕服务器地址与连接token；失败时退回默认地址与匿名连接"""
+    import httpx
+
+    headers = {'User-Agent': 'Mozilla/5.0', 'Referer': 'https://live.bilibili.com/'}
+    if cookie:
+        headers['Cookie'] = cookie
+    try:
+        with httpx.Client(headers=headers, timeout=5) as client:
+            init = client.get(ROOM_INIT_API, params={'id': room_id}).json()
+            room_id = init.get('data', {}).get('room_id', room_id)
+            info = client.get(DANMU_INFO_API, params={'id': room_id, 'type': 0}).json()
+        data = info.get('data') or {}
+        hosts = data.get('host_list') or []
+        if info.get('code') == 0 and hosts:
+            host = hosts[0]
+            return room_id, f"wss://{host['host']}:{host.get('wss_port', 443)}/sub", data.get('token', '')
+        logger.warning(f"获取弹幕服务器信息失败(code={info.get('code')})，使用默认地址匿名连接。")
+    except Exception as e:
+        logger.warning(f"获取弹幕服务器信息出错，使用默认地址匿名连接: {e}")
+    return room_id, DEFAULT_WS_URL, ''
+
+class TrafficRecorder:
+    """把收到的原始websocket帧按时间写入gzip压缩的JSON Lines文件，用于离线回放"""
+
+    def __init__(self, path: str):
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._started = time.time()
+        self._lock = threading.Lock()
+        self.frames = 0
+
+    def write(self, data: bytes):
+        line = json.dumps({"t": round(time.time() - self._started, 4), "data": base64.b64encode(data).decode('ascii')})
+        with self._lock:
+            self._file.write(line + "\n")
+            self.frames += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def load_recording(path: str) -> list:
+    """读取录制文件，返回[(相对时间, 原始帧), ...]"""
+    frames = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                frames.append((item["t"], base64.b64decode(item["data"])))
+    return frames
+
+class BilibiliLiveClient:
+    """
+    B站直播间弹幕客户端。在后台线程中保持websocket连接，
+    解码出的弹幕、SC、礼物等事件通过on_event回调交给调用方（在接收线程中调用，应尽快返回）。
+    """
+
+    def __init__(self, room_id: int, on_event, url: str = None, token: str = '', uid: int = 0,
+                 cookie: str = None, protover: int = None,
+                 heartbeat_interval: float = config.DANMAKU_HEARTBEAT_SECONDS,
+                 record_path: str = None):
+        self.room_id = room_id
+        self.on_event = on_event
+        # 指定url时直接连接（例如本地回放服务），否则通过接口查询
+        self.url = url
+        self.token = token
+        self.uid = uid
+        self.cookie = cookie
+        if protover is None:
+            protover = PROTO_BROTLI if brotli is not None else PROTO_ZLIB
+        self.protover = protover
+        self.heartbeat_interval = heartbeat_interval
+        self.recorder = TrafficRecorder(record_path) if record_path else None
+
+        self.decoder = PacketDecoder()
+        self._ws = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._failures = 0
+        self.connected = threading.Event()
+
+        # 统计信息
+        self.frames = 0
+        self.messages = 0
+        self.skipped = 0
+        self.events = 0
+        self.parse_errors = 0
+        self.connects = 0
+        self.popularity = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_loop, name="BilibiliLiveClient", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        while not self._stop_event.is_set():
+            url, token = self.url, self.token
+            if url is None:
+                self.room_id, url, token = fetch_danmu_info(self.room_id, self.cookie)
+            self._auth_body = json.dumps({
+                "uid": self.uid, "roomid": self.room_id, "protover": self.protover,
+                "platform": "web", "type": 2, "key": token,
+            }).encode('utf-8')
+            header = {'Cookie': self.cookie} if self.cookie else None
+            self._ws = websocket.WebSocketApp(url, header=header, on_open=self._on_open,
+                                              on_message=self._on_message, on_error=self._on_error,
+                                              on_close=self._on_close)
+            self._ws.run_forever(skip_utf8_validation=True)
+            self.connected.clear()
+            if self._stop_event.is_set():
+                break
+            delay = min(config.DANMAKU_RECONNECT_MAX_DELAY, config.DANMAKU_RECONNECT_BASE_DELAY * (2 ** self._failures))
+            self._failures += 1
+            delay = random.uniform(delay / 2, delay)
+            logger.info(f"弹幕连接已断开，将在{delay:.1f}秒后重连...")
+            self._stop_event.wait(delay)
+
+    def _on_open(self, ws):
+        self.connects += 1
+        ws.send(encode_packet(OP_AUTH, self._auth_body), opcode=websocket.ABNF.OPCODE_BINARY)
+        threading.Thread(target=self._heartbeat_loop, args=(ws,), name="DanmakuHeartbeat", daemon=True).start()
+
+    def _heartbeat_loop(self, ws):
+        packet = encode_packet(OP_HEARTBEAT)
+        while not self._stop_event.is_set() and ws is self._ws:
+            try:
+                ws.send(packet, opcode=websocket.ABNF.OPCODE_BINARY)
+            except Exception as e:
+                logger.debug(f"弹幕心跳发送失败: {e}")
+                return
+            self._stop_event.wait(self.heartbeat_interval)
+
+    def _on_message(self, ws, data):
+        if isinstance(data, bytes):
+            self.handle_frame(data)
+
+    def _on_error(self, ws, error):
+        logger.warning(f"弹幕连接出错: {error}")
+
+    def _on_close(self, ws, status_code, message):
+        logger.info(f"弹幕连接已关闭: {status_code} {message or ''}")
+
+    def handle_frame(self, data: bytes):
+        """解码一个websocket帧，并把其中需要处理的事件交给回调"""
+        received_at = time.time()
+        self.frames += 1
+        if self.recorder:
+            self.recorder.write(data)
+        for operation, body in self.decoder.decode(data):
+            if operation == OP_MESSAGE:
+                self.messages += 1
+                cmd = peek_cmd(body)
+                if cmd is not None and cmd not in HANDLED_CMDS:
+                    self.skipped += 1
+                    continue
+                try:
+                    payload = json.loads(body.tobytes())
+                except ValueError:
+                    self.parse_errors += 1
+                    continue
+                event = parse_event(cmd or str(payload.get('cmd', '')).split(':', 1)[0], payload, received_at)
+                if event is not None:
+                    self.events += 1
+                    self.on_event(event)
+            elif operation == OP_HEARTBEAT_REPLY:
+                self.popularity = int.from_bytes(body[:4], 'big')
+            elif operation == OP_AUTH_REPLY:
+                reply = json.loads(body.tobytes() or b'{}')
+                if reply.get('code', 0) == 0:
+                    self._failures = 0
+                    self.connected.set()
+                    logger.info(f"已进入直播间 {self.room_id} 的弹幕服务。")
+                else:
+                    logger.error(f"弹幕服务鉴权失败: {reply}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._ws is not None:
+            self._ws.close()
+        if self._thread is not None:
+            self._thread.join(timeout=3)
+        if self.recorder:
+            self.recorder.close()
+        logger.info(f"弹幕客户端统计: {self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "messages": self.messages,
+            "skipped": self.skipped,
+            "events": self.events,
+            "parse_errors": self.parse_errors,
+            "malformed": self.decoder.malformed,
+            "bytes_in": self.decoder.bytes_in,
+            "bytes_decompressed": self.decoder.bytes_decompressed,
+            "connects": self.connects,
+            "popularity": self.popularity,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="连接B站直播间并打印（或录制）弹幕")
+    parser.add_argument('--room', type=int, required=True, help="直播间号")
+    parser.add_argument('--record', default=None, help="录制原始流量的文件路径（.jsonl.gz）")
+    parser.add_argument('--duration', type=float, default=60.0, help="运行时长（秒）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
+
+    client = BilibiliLiveClient(args.room, on_event=print, record_path=args.record)
+    client.start()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    client.stop()
+
+if __name__ == '__main__':
+    main()
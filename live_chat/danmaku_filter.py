@@ -0,0 +1,211 @@
+# live_chat/danmaku_filter.py
+# 弹幕筛选：去重刷屏、按用户限速、按优先级采样，把少量值得反驳的弹幕交给LLM调度器
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+import config
+from agent.response_cache import normalize_text
+from .bilibili_client import DanmakuEvent, CMD_SUPER_CHAT, CMD_GIFT, CMD_GUARD
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_NORMAL = 0
+PRIORITY_KEYWORD = 1
+PRIORITY_GIFTER = 2
+PRIORITY_SUPER_CHAT = 3
+
+def format_event(event: DanmakuEvent) -> str:
+    """转换为发给大模型的文本，带上发送者，便于AI点名反驳"""
+    if event.cmd == CMD_SUPER_CHAT:
+        return f"{event.uname}（醒目留言￥{event.value:g}）：{event.text}"
+    return f"{event.uname}：{event.text}"
+
+class DanmakuFilter:
+    """
+    弹幕过滤器，在接收线程中调用，单条处理为O(1)：
+    - 去重：时间窗口内归一化后相同的弹幕只保留第一条；
+    - 限速：每个用户一个令牌桶，醒目留言不受限制；
+    - 优先级：醒目留言 > 近期送过礼物的用户 > 命中关键词 > 普通弹幕。
+    """
+
+    def __init__(self, dedup_window: float = config.DANMAKU_DEDUP_WINDOW_SECONDS,
+                 user_rate: float = config.DANMAKU_USER_RATE_PER_SECOND,
+                 user_burst: int = config.DANMAKU_USER_BURST,
+                 min_length: int = config.DANMAKU_MIN_LENGTH,
+                 keywords=config.DANMAKU_KEYWORDS,
+                 gifter_boost_seconds: float = config.DANMAKU_GIFTER_BOOST_SECONDS,
+                 max_tracked: int = 20000):
+        self.dedup_window = dedup_window
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.min_length = min_length
+        self.keywords = tuple(normalize_text(k) for k in keywords)
+        self.gifter_boost_seconds = gifter_boost_seconds
+        self.max_tracked = max_tracked
+
+        # 归一化文本 -> 最后出现时间，按时间顺序排列，过期项从头部淘汰
+        self._recent = OrderedDict()
+        # 用户 -> [剩余令牌, 上次更新时间]
+        self._buckets = OrderedDict()
+        # 用户 -> 加权截止时间
+        self._gifters = OrderedDict()
+
+        # 统计信息
+        self.received = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.rate_limited = 0
+        self.too_short = 0
+        self.gifts = 0
+
+    @staticmethod
+    def _touch(table: OrderedDict, key, value, limit: int):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > limit:
+            table.popitem(last=False)
+
+    def _is_duplicate(self, key: str, now: float) -> bool:
+        recent = self._recent
+        while recent:
+            seen_at = next(iter(recent.values()))
+            if now - seen_at <= self.dedup_window:
+                break
+            recent.popitem(last=False)
+        duplicate = key in recent
+        # 重复刷屏会刷新时间，持续刷屏期间一直被过滤
+        self._touch(recent, key, now, self.max_tracked)
+        return duplicate
+
+    def _allow_user(self, user, now: float) -> bool:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = [float(self.user_burst), now]
+        tokens = min(self.user_burst, bucket[0] + (now - bucket[1]) * self.user_rate)
+        allowed = tokens >= 1.0
+        bucket[0] = tokens - 1.0 if allowed else tokens
+        bucket[1] = now
+        self._touch(self._buckets, user, bucket, self.max_tracked)
+        return allowed
+
+    def accept(self, event: DanmakuEvent):
+        """返回事件的优先级；应丢弃时返回None"""
+        self.received += 1
+        now = event.received_at
+        if event.cmd in (CMD_GIFT, CMD_GUARD):
+            # 礼物本身不送去反驳，只提高送礼用户之后弹幕的优先级
+            self.gifts += 1
+            if event.value > 0:
+                self._touch(self._gifters, event.user_key, now + self.gifter_boost_seconds, self.max_tracked)
+            return None
+
+        key = normalize_text(event.text)
+        is_super_chat = event.cmd == CMD_SUPER_CHAT
+        if len(key) < self.min_length and not is_super_chat:
+            self.too_short += 1
+            return None
+        if self._is_duplicate(key, now) and not is_super_chat:
+            self.duplicates += 1
+            return None
+        if not is_super_chat and not self._allow_user(event.user_key, now):
+            self.rate_limited += 1
+            return None
+
+        self.accepted += 1
+        if is_super_chat:
+            return PRIORITY_SUPER_CHAT
+        boost_until = self._gifters.get(event.user_key)
+        if boost_until is not None and boost_until >= now:
+            return PRIORITY_GIFTER
+        if any(k in key for k in self.keywords):
+            return PRIORITY_KEYWORD
+        return PRIORITY_NORMAL
+
+    def get_stats(self) -> dict:
+        return {
+            "received": self.received,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rate_limited": self.rate_limited,
+            "too_short": self.too_short,
+            "gifts": self.gifts,
+        }
+
+class DanmakuSampler:
+    """
+    优先级采样器。每个优先级一个有界队列（满了丢最旧的），
+    每隔emit_interval从最高优先级中取最新的一条交给on_select。
+    普通弹幕只在can_emit_normal()为真（例如LLM空闲）时才发出，不与语音争抢。
+    """
+
+    def __init__(self, on_select, emit_interval: float = config.DANMAKU_EMIT_INTERVAL_SECONDS,
+                 max_age: float = config.DANMAKU_MAX_AGE_SECONDS,
+                 max_candidates: int = config.DANMAKU_MAX_CANDIDATES, can_emit_normal=None):
+        self.on_select = on_select
+        self.emit_interval = emit_interval
+        self.max_age = max_age
+        self.can_emit_normal = can_emit_normal
+        self._queues = [deque(maxlen=max_candidates) for _ in range(PRIORITY_SUPER_CHAT + 1)]
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # 统计信息
+        self.offered = 0
+        self.selected = [0] * len(self._queues)
+        self.expired = 0
+
+    def offer(self, event: DanmakuEvent, priority: int):
+        with self._lock:
+            self._queues[priority].append(event)
+            self.offered += 1
+
+    def select(self, now: float = None):
+        """取出当前最值得回应的一条弹幕，没有时返回None"""
+        now = now or time.time()
+        allow_normal = self.can_emit_normal is None or self.can_emit_normal()
+        with self._lock:
+            for priority in range(len(self._queues) - 1, -1, -1):
+                queue = self._queues[priority]
+                while queue and now - queue[0].received_at > self.max_age:
+                    queue.popleft()
+                    self.expired += 1
+                if not queue or (priority == PRIORITY_NORMAL and not allow_normal):
+                    continue
+                self.selected[priority] += 1
+                return queue.pop()
+        return None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="DanmakuSampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.emit_interval):
+            event = self.select()
+            if event is None:
+                continue
+            try:
+                self.on_select(event)
+            except Exception as e:
+                logger.error(f"处理采样的弹幕时出错: {e}", exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            pending = sum(len(q) for q in self._queues)
+        return {
+            "offered": self.offered,
+            "selected": sum(self.selected),
+            "selected_by_priority": list(self.selected),
+            "expired": self.expired,
+            "pending": pending,
+        }
@@ -2,11 +2,15 @@
 import os
 import sys
 import signal
-import dashscope
-from dotenv import load_dotenv
+import argparse
+import threading
+# 最先导入：启动计时从这里开始
+from utils.tracing import tracer, startup
+from utils.session_recorder import recorder
 import logging
-from utils.logger_setup import setup_global_logger
-from agent.main_agent import MainAgent
+import config
+from utils.logger_setup import setup_global_logger, shutdown_logging
+# dashscope、openai与pywebview等较重的模块在用到时才导入：前两者在后台初始化线程中，后者在创建窗口时
 from ui.webview_window import RefutationWebViewWindow
 
 # 在所有逻辑开始前，先配置好日志
@@ -14,9 +18,14 @@ setup_global_logger()
 
 agent = None
 window = None
+effects = None
+init_thread = None
+# 后台初始化失败时置位，主线程据此退出，不显示没有Agent的窗口
+init_failed = threading.Event()
 logger = logging.getLogger(__name__)
 
 def init_dashscope_api_key():
+    from dotenv import load_dotenv
     load_dotenv()
     api_key = os.getenv("DASHSCOPE_API_KEY")
     if not api_key:
@@ -25,6 +34,46 @@ def init_dashscope_api_key():
     logger.info("DashScope API Key 已成功加载。")
     return api_key
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="AI自动反驳Agent")
+    parser.add_argument('--runtime', choices=('threaded', 'async'), default=config.AGENT_RUNTIME,
+                        help="LLM请求的运行模式：threaded 线程模式；async 单事件循环+连接池的异步模式")
+    return parser.parse_args()
+
+def load_agent_class(runtime: str):
+    """按运行模式导入Agent类，异步模式不可用时退回线程模式"""
+    if runtime == 'async':
+        try:
+            from agent.async_runtime import AsyncMainAgent
+            return AsyncMainAgent
+        except ImportError as e:
+            logger.warning(f"异步运行模式不可用，退回线程模式: {e}")
+    from agent.main_agent import MainAgent
+    return MainAgent
+
+def init_agent(runtime: str, api_key: str, window: RefutationWebViewWindow):
+    """
+    在后台线程中导入并创建Agent，随即启动麦克风、ASR连接与LLM连接预热，
+    与主线程中的窗口创建和页面加载同时进行
+    """
+    global agent
+    try:
+        with startup.step('agent_import'):
+            if config.ASR_BACKEND == 'dashscope':
+                # 本地识别后端不需要dashscope
+                import dashscope
+                dashscope.api_key = api_key
+            agent_cls = load_agent_class(runtime)
+        with startup.step('agent_create'):
+            agent = agent_cls(api_key=api_key, window=window)
+        logger.info(f"Agent运行模式: {runtime}")
+        agent.run()
+    except Exception as e:
+        logger.critical(f"Agent初始化时发生致命错误: {e}", exc_info=True)
+        init_failed.set()
+        # 窗口可能还没有创建，主线程在创建前后都会检查init_failed
+        window.stop()
+
 def signal_handler(sig, frame):
     """处理 Ctrl+C 中断信号"""
     logger.info("收到退出信号 (Ctrl+C)，正在停止...")
@@ -35,6 +84,7 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 if __name__ == '__main__':
+    args = parse_args()
     logger.info("="*10 + " AI自动反驳Agent启动 " + "="*10)
     
     signal.signal(signal.SIGINT, signal_handler)
@@ -42,20 +92,37 @@ if __name__ == '__main__':
     try:
         # 1. 初始化API Key
         api_key = init_dashscope_api_key()
-        dashscope.api_key = api_key 
+        if config.RECORDER_ENABLED:
+            recorder.start()
         
-        # 2. 创建WebView窗口实例
+        # 2. 创建WebView窗口实例（不导入pywebview）
         window = RefutationWebViewWindow()
         
-        # 3. 创建Agent实例，并传入窗口实例
-        agent = MainAgent(api_key=api_key, window=window)
+        # 2.1 屏幕特效覆盖窗口（可选），AI回复中的表情与关键词会抛到屏幕上
+        if config.SCREEN_EFFECTS_ENABLED:
+            from tools.screen_effects import ScreenEffectsOverlay
+            effects = ScreenEffectsOverlay()
+            window.effect_trigger = effects.trigger
         
-        # 4. 在后台线程中启动Agent的核心逻辑
-        agent.run()
+        # 3. 在后台线程中创建并启动Agent，页面就绪前的UI操作由JS桥缓冲
+        init_thread = threading.Thread(target=init_agent, args=(args.runtime, api_key, window),
+                                       name="AgentInit", daemon=True)
+        init_thread.start()
+        tracer.start()
         
-        # 5. 在主线程中启动并运行WebView窗口（这将阻塞主线程）
-        window.start()
+        # 4. 在主线程中创建并运行WebView窗口（这将阻塞主线程），页面加载完成后通过js_api通知就绪
+        with startup.step('window_create'):
+            if init_failed.is_set():
+                sys.exit(1)
+            window.start()
+            if init_failed.is_set():
+                # 初始化在窗口创建期间失败：窗口在webview.start()之前不会显示，直接退出
+                sys.exit(1)
+            if effects:
+                effects.start(owner=window.window)
         window.run()
+        if init_failed.is_set():
+            sys.exit(1)
 
     except KeyboardInterrupt:
         logger.info("程序已通过 Ctrl+C 确认退出。")
@@ -63,6 +130,14 @@ if __name__ == '__main__':
         logger.critical(f"程序启动时发生致命错误: {e}", exc_info=True)
     
     finally:
+        if init_thread is not None:
+            init_thread.join(timeout=10)
         if agent:
             agent.stop()
+        if effects:
+            effects.stop()
+        recorder.stop()
+        tracer.stop()
+        tracer.log_summary()
         logger.info("="*10 + " 程序已退出 " + "="*10)
+        shutdown_logging()
@@ -0,0 +1,6 @@
+# server/__main__.py
+# python -m server 启动多会话服务。VAD进程以spawn方式启动，入口必须放在__main__判断内。
+from server.app import main
+
+if __name__ == '__main__':
+    main()
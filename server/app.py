@@ -0,0 +1,306 @@
+# server/app.py
+# 无界面的多会话服务模式：一个进程同时为多个直播间运行Agent。
+# 页面经浏览器打开 http://<host>:<port>/s/<会话ID>/ ，界面更新经websocket推送；
+# 直播间的音频由推流端（见server/audio_client.py）经同一地址的websocket上传。
+# 用法: python -m server --sessions sessions.json --port 8760
+import os
+import sys
+import json
+import html
+import signal
+import asyncio
+import logging
+import argparse
+import threading
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
+import config
+from agent.hedging import HedgePolicy
+from agent.moderation import Moderator
+from agent.response_cache import ResponseCache
+from agent.async_runtime import AsyncLLMHandler
+from utils.tracing import tracer
+from .llm_pool import FairLLMPool
+from .audio_pool import VADWorkerPool
+from .session import Session, load_sessions
+from .websocket import WebSocketConnection, read_request, http_response, origin_allowed
+
+logger = logging.getLogger(__name__)
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ui', 'web')
+# 会话页面可以取用的静态文件
+STATIC_FILES = {
+    'script.js': 'application/javascript; charset=utf-8',
+    'remote.js': 'application/javascript; charset=utf-8',
+    'style.css': 'text/css; charset=utf-8',
+}
+
+class ServerRuntime:
+    """
+    所有会话共享的部分：事件循环线程、AsyncOpenAI客户端（连接池按并发额度与对冲请求数确定大小）、
+    公平额度池、对冲策略、VAD进程池、违禁词审核器与回复缓存。
+    """
+
+    def __init__(self, api_key: str, base_url: str = config.LLM_BASE_URL,
+                 vad_workers: int = config.SERVER_VAD_WORKERS,
+                 max_concurrent: int = config.SERVER_LLM_MAX_CONCURRENT):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_loop, name="ServerLoop", daemon=True)
+        self._loop_thread.start()
+        self._keepalive_task = None
+
+        max_connections = max(1, max_concurrent) * config.LLM_HEDGE_MAX_ATTEMPTS
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=config.LLM_POOL_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+        )
+        self.llm_client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+        self.llm_pool = FairLLMPool(max_concurrent)
+        self.hedge_policy = HedgePolicy()
+        logger.info(f"共享大模型客户端已初始化（并发额度 {self.llm_pool.max_concurrent}，连接池上限 {max_connections}）。")
+
+        self.vad_pool = VADWorkerPool(vad_workers).start() if vad_workers >= 0 else None
+
+        self.response_cache = None
+        if config.RESPONSE_CACHE_ENABLED:
+            self.response_cache = ResponseCache()
+            self.response_cache.load()
+            self.response_cache.start_autosave()
+        # 违禁词表为空时不审核
+        self.moderator = None
+        if config.MODERATION_ENABLED:
+            moderator = Moderator.load()
+            if moderator.automaton.pattern_count:
+                self.moderator = moderator
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call(self, coro, timeout: float = None):
+        """在事件循环中执行协程并等待结果（不能在事件循环线程中调用）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def _warm_up(self):
+        handler = AsyncLLMHandler(self.llm_client, None, loop=self.loop)
+        await handler.prewarm()
+        self._keepalive_task = asyncio.create_task(handler.keep_warm())
+
+    def start_warm_up(self):
+        if config.LLM_PREWARM_ENABLED:
+            asyncio.run_coroutine_threadsafe(self._warm_up(), self.loop)
+
+    async def _shutdown(self):
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        await self.llm_client.close()
+
+    def stop(self):
+        try:
+            self.call(self._shutdown(), timeout=3)
+        except Exception as e:
+            logger.warning(f"关闭共享大模型客户端时出错: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join(timeout=2)
+        if self.vad_pool is not None:
+            logger.info(f"VAD进程池统计: {self.vad_pool.get_stats()}")
+            self.vad_pool.close()
+        logger.info(f"对冲请求统计: {self.hedge_policy.get_stats()}")
+        if self.moderator is not None:
+            logger.info(f"回复审核统计: {self.moderator.get_stats()}")
+        if self.response_cache:
+            logger.info(f"回复缓存统计: {self.response_cache.get_stats()}")
+            self.response_cache.stop()
+
+class AgentServer:
+    """
+    HTTP/WebSocket服务：
+      /            会话列表
+      /stats       各会话与共享组件的统计（JSON）
+      /s/<id>/     会话的页面（与桌面窗口相同的界面）
+      /ws/<id>     会话的websocket：下行为界面更新，上行的二进制消息为音频
+    source_factory与recognition_factory为以SessionSpec为参数的可调用对象，可替换各会话的音频输入与识别服务（用于压测）。
+    """
+
+    def __init__(self, specs: list, runtime: ServerRuntime, host: str = config.SERVER_HOST,
+                 port: int = config.SERVER_PORT, source_factory=None, recognition_factory=None):
+        self.specs = specs
+        self.runtime = runtime
+        self.host = host
+        self.port = port
+        self.source_factory = source_factory
+        self.recognition_factory = recognition_factory
+        self.sessions = {}
+        self._server = None
+        self._connections = set()
+
+    def start(self):
+        self._server = self.runtime.call(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.runtime.start_warm_up()
+        # 会话编号从1开始（VAD进程池中0号表示退出），进程池按编号分配进程
+        for index, spec in enumerate(self.specs, start=1):
+            session = Session(spec, index, self.runtime,
+                              audio_source_factory=self.source_factory(spec) if self.source_factory else None,
+                              recognition_factory=self.recognition_factory(spec) if self.recognition_factory else None)
+            self.sessions[spec.id] = session
+            session.start()
+        logger.info(f"服务已启动: http://{self.host}:{self.port}/ ，共{len(self.sessions)}个会话")
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        request = await read_request(reader)
+        if request is None:
+            writer.close()
+            return
+        path = request.path.split('?', 1)[0]
+        try:
+            if path.startswith('/ws/'):
+                session = self.sessions.get(path[len('/ws/'):])
+                if session is not None and request.wants_websocket:
+                    if not origin_allowed(request, self.host, self.port):
+                        logger.warning(f"拒绝来自其他网页的websocket连接: {request.headers.get('origin')} -> {path}")
+                        writer.write(http_response('403 Forbidden', b'forbidden'))
+                        await writer.drain()
+                        return
+                    await self._serve_websocket(session, request, reader, writer)
+                    return
+                response = http_response('404 Not Found', b'not found')
+            else:
+                response = self._route(path)
+            writer.write(response)
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_websocket(self, session: Session, request, reader, writer):
+        conn = await WebSocketConnection.accept(request, reader, writer)
+        self._connections.add(conn)
+        try:
+            await session.serve_client(conn)
+        finally:
+            self._connections.discard(conn)
+            conn.abort()
+
+    def _route(self, path: str) -> bytes:
+        if path == '/':
+            items = ''.join(f'<li><a href="/s/{sid}/">{html.escape(sid)}</a></li>' for sid in self.sessions)
+            body = f'<!DOCTYPE html><meta charset="UTF-8"><title>AI杠精</title><ul>{items}</ul>'
+            return http_response('200 OK', body.encode('utf-8'), 'text/html; charset=utf-8')
+        if path == '/stats':
+            body = json.dumps(self._stats(), ensure_ascii=False)
+            return http_response('200 OK', body.encode('utf-8'), 'application/json; charset=utf-8')
+        prefix, _, rest = path[len('/s/'):].partition('/') if path.startswith('/s/') else ('', '', '')
+        if prefix not in self.sessions:
+            return http_response('404 Not Found', b'not found')
+        if rest in ('', 'index.html'):
+            return http_response('200 OK', self._index_html(), 'text/html; charset=utf-8')
+        if rest in STATIC_FILES:
+            with open(os.path.join(WEB_DIR, rest), 'rb') as f:
+                return http_response('200 OK', f.read(), STATIC_FILES[rest])
+        return http_response('404 Not Found', b'not found')
+
+    @staticmethod
+    def _index_html() -> bytes:
+        """桌面窗口的页面，先加载remote.js（代替pywebview接口并连接websocket）再加载script.js"""
+        with open(os.path.join(WEB_DIR, 'index.html'), encoding='utf-8') as f:
+            page = f.read()
+        page = page.replace('<script src="script.js"></script>',
+                            '<script src="remote.js"></script>\n    <script src="script.js"></script>')
+        return page.encode('utf-8')
+
+    def _stats(self) -> dict:
+        """在事件循环线程中调用"""
+        return {
+            "sessions": {sid: session.get_stats() for sid, session in self.sessions.items()},
+            "connections": len(self._connections),
+            "llm_pool": self.runtime.llm_pool.get_stats(),
+            "vad_pool": self.runtime.vad_pool.get_stats() if self.runtime.vad_pool is not None else None,
+            "hedging": self.runtime.hedge_policy.get_stats(),
+        }
+
+    def get_stats(self) -> dict:
+        async def collect():
+            return self._stats()
+        return self.runtime.call(collect(), timeout=5)
+
+    async def _close_server(self):
+        self._server.close()
+        for conn in list(self._connections):
+            await conn.close()
+        await self._server.wait_closed()
+
+    def stop(self):
+        if self._server is not None:
+            try:
+                self.runtime.call(self._close_server(), timeout=3)
+            except Exception as e:
+                logger.warning(f"关闭HTTP服务时出错: {e}")
+        # 各会话的停止过程互不依赖（主要是等待各自的线程退出），并行进行
+        threads = [threading.Thread(target=session.stop, name=f"SessionStop-{sid}")
+                   for sid, session in self.sessions.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="AI自动反驳Agent - 多会话服务模式")
+    parser.add_argument('--sessions', default=config.SERVER_SESSIONS_PATH, help="会话配置文件（JSON列表）")
+    parser.add_argument('--host', default=config.SERVER_HOST, help="监听地址")
+    parser.add_argument('--port', type=int, default=config.SERVER_PORT, help="监听端口")
+    parser.add_argument('--vad-workers', type=int, default=config.SERVER_VAD_WORKERS,
+                        help="VAD进程数，0为CPU核数，-1为不用进程池")
+    parser.add_argument('--max-concurrent', type=int, default=config.SERVER_LLM_MAX_CONCURRENT,
+                        help="所有会话同时进行的LLM回复数上限")
+    return parser.parse_args()
+
+def main():
+    from dotenv import load_dotenv
+    from utils.logger_setup import setup_global_logger, shutdown_logging
+
+    args = parse_args()
+    setup_global_logger()
+    load_dotenv()
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        logger.error("未在 .env 文件或环境变量中找到 DASHSCOPE_API_KEY！")
+        sys.exit(1)
+    if config.ASR_BACKEND == 'dashscope':
+        # 没有单独配置识别服务密钥的会话使用这个全局密钥
+        import dashscope
+        dashscope.api_key = api_key
+
+    specs = load_sessions(args.sessions)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda sig, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda sig, frame: stop_event.set())
+
+    logger.info("=" * 10 + f" AI自动反驳Agent服务模式启动（{len(specs)}个会话） " + "=" * 10)
+    runtime = ServerRuntime(api_key, vad_workers=args.vad_workers, max_concurrent=args.max_concurrent)
+    server = AgentServer(specs, runtime, host=args.host, port=args.port)
+    tracer.start()
+    try:
+        server.start()
+        stop_event.wait()
+        logger.info("收到退出信号，正在停止所有会话...")
+    except Exception as e:
+        logger.critical(f"服务运行时发生致命错误: {e}", exc_info=True)
+    finally:
+        server.stop()
+        runtime.stop()
+        tracer.stop()
+        tracer.log_summary()
+        logger.info("=" * 10 + " 服务已退出 " + "=" * 10)
+        shutdown_logging()
@@ -0,0 +1,62 @@
+# server/audio_client.py
+# 推流端：把本机麦克风（或WAV文件）的16kHz单声道PCM经websocket上传给服务模式中的某个会话。
+# 用法: python -m server.audio_client --url ws://127.0.0.1:8760/ws/<会话ID> [--device 设备名] [--wav 文件]
+import os
+import sys
+import logging
+import argparse
+import threading
+import websocket
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from agent.audio_capture import PyAudioSource
+
+logger = logging.getLogger(__name__)
+
+def _drain(ws: websocket.WebSocket):
+    """服务端也会把界面更新推给推流端，读出来丢掉，避免服务端发送缓冲积压而断开连接"""
+    try:
+        while ws.recv():
+            pass
+    except (websocket.WebSocketException, OSError):
+        pass
+
+def stream_audio(url: str, source, block_size: int = config.BLOCK_SIZE):
+    ws = websocket.create_connection(url)
+    threading.Thread(target=_drain, args=(ws,), name="AudioClientDrain", daemon=True).start()
+    logger.info(f"已连接 {url}，开始上传音频。")
+    sent = 0
+    try:
+        while True:
+            ws.send(source.read(block_size), opcode=websocket.ABNF.OPCODE_BINARY)
+            sent += 1
+    except (IOError, websocket.WebSocketException) as e:
+        logger.info(f"音频上传结束: {e}")
+    finally:
+        source.close()
+        ws.close()
+        logger.info(f"共上传{sent}个音频块。")
+
+def main():
+    parser = argparse.ArgumentParser(description="把麦克风或WAV文件的音频推给服务模式中的会话")
+    parser.add_argument('--url', required=True, help="会话的websocket地址，例如 ws://127.0.0.1:8760/ws/room1")
+    parser.add_argument('--device', default=None, help="音频输入设备（序号或名称的一部分），默认使用默认麦克风")
+    parser.add_argument('--wav', default=None, help="改为循环推送此WAV文件（非16kHz单声道的文件会先转换）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
+
+    if args.wav:
+        from benchmarks.fakes import WavFileSource
+        source = WavFileSource(args.wav)
+    else:
+        # 服务端不做重采样，直接按识别用的采样率和声道数打开设备
+        source = PyAudioSource(device=args.device, rate=config.SAMPLE_RATE, channels=config.CHANNELS)
+    try:
+        stream_audio(args.url, source)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
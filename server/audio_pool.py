@@ -0,0 +1,231 @@
+# server/audio_pool.py
+# 服务模式的VAD进程池：各会话的VAD检测分散到多个进程中计算，不再全部挤在主进程的GIL上。
+# 会话按ID固定分配给某个进程，检测器（含自适应噪声基底）留在该进程中；
+# 音频块经共享内存环形缓冲区（见asr_backends.SharedAudioRing）送入，判定结果经另一个环形缓冲区返回。
+import os
+import time
+import struct
+import logging
+import threading
+import multiprocessing
+import numpy as np
+import config
+from agent.vad import VADEngine, create_vad
+from agent.asr_backends import SharedAudioRing
+
+logger = logging.getLogger(__name__)
+
+# 请求记录的内容：[操作 1字节][序号 u32][PCM]；会话ID为0的记录通知进程退出
+OP_PROCESS = b'P'
+OP_RESET = b'R'
+OP_DROP = b'D'
+_REQUEST = struct.Struct('<cI')
+_RESPONSE = struct.Struct('<IB')
+_SHUTDOWN_SESSION = 0
+
+def _vad_worker(request_name: str, response_name: str, capacity: int, requests_ready, responses_ready,
+                detectors, block_size: int):
+    """VAD进程主循环：每个会话一个检测器，逐条处理请求并写回(序号, 是否语音)"""
+    requests = SharedAudioRing(capacity, name=request_name)
+    responses = SharedAudioRing(capacity, name=response_name)
+    parent = multiprocessing.parent_process()
+    engines = {}
+    while True:
+        record = requests.read()
+        if record is None:
+            if not requests_ready.acquire(timeout=0.5) and parent is not None and not parent.is_alive():
+                break
+            continue
+        session_id, data, _ = record
+        if session_id == _SHUTDOWN_SESSION:
+            break
+        op, seq = _REQUEST.unpack_from(data)
+        if op == OP_DROP:
+            engines.pop(session_id, None)
+            continue
+        engine = engines.get(session_id)
+        if engine is None:
+            engine = engines[session_id] = create_vad(detectors, block_size)
+        if op == OP_RESET:
+            engine.reset()
+            continue
+        speech = engine.process(np.frombuffer(data, dtype=np.int16, offset=_REQUEST.size))
+        # 结果缓冲区满说明主进程的分发线程已停止，丢弃即可（调用方会超时并改为本地计算）
+        if responses.write(session_id, _RESPONSE.pack(seq, bool(speech))):
+            responses_ready.release()
+    requests.close()
+    responses.close()
+
+class _Slot:
+    """一个会话进行中的请求，会话的音频线程一次只有一个请求在等结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.seq = 0
+        self.result = False
+
+class _Worker:
+    def __init__(self, context, index: int, capacity: int, detectors, block_size: int):
+        self.index = index
+        self.requests = SharedAudioRing(capacity)
+        self.responses = SharedAudioRing(capacity)
+        self.requests_ready = context.Semaphore(0)
+        self.responses_ready = context.Semaphore(0)
+        self.write_lock = threading.Lock()
+        self.process = context.Process(
+            target=_vad_worker, name=f"VADWorker-{index}", daemon=True,
+            args=(self.requests.name, self.responses.name, capacity, self.requests_ready, self.responses_ready,
+                  tuple(detectors), block_size))
+        self.dispatcher = None
+
+    def send(self, session_id: int, data: bytes) -> bool:
+        with self.write_lock:
+            written = self.requests.write(session_id, data)
+        if written:
+            self.requests_ready.release()
+        return written
+
+class VADWorkerPool:
+    """
+    VAD进程池。engine(session_id)返回VADEngine接口的代理，可直接交给VADGate；
+    进程没有及时返回结果时，该音频块改在调用方线程中用本地检测器计算，不会卡住音频。
+    """
+
+    def __init__(self, workers: int = config.SERVER_VAD_WORKERS, detectors=config.VAD_DETECTORS,
+                 block_size: int = config.BLOCK_SIZE, timeout: float = config.SERVER_VAD_TIMEOUT_SECONDS,
+                 ring_seconds: float = config.SERVER_VAD_RING_SECONDS):
+        self.size = workers or os.cpu_count() or 1
+        self.detectors = tuple(detectors)
+        self.block_size = block_size
+        self.timeout = timeout
+        self._context = multiprocessing.get_context('spawn')
+        capacity = int(ring_seconds * config.SAMPLE_RATE * 2)
+        self._workers = [_Worker(self._context, i, capacity, self.detectors, block_size) for i in range(self.size)]
+        self._slots = {}
+        self._local = {}
+        self._lock = threading.Lock()
+        self._closing = False
+
+        # 统计信息（各会话的音频线程都会更新，由_stats_lock保护）
+        self._stats_lock = threading.Lock()
+        self.blocks = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        for worker in self._workers:
+            worker.process.start()
+            worker.dispatcher = threading.Thread(target=self._dispatch_loop, args=(worker,),
+                                                 name=f"VADDispatch-{worker.index}", daemon=True)
+            worker.dispatcher.start()
+        logger.info(f"VAD进程池已启动: {self.size}个进程，检测器 {', '.join(self.detectors)}")
+        return self
+
+    def engine(self, session_id: int) -> "PooledVAD":
+        with self._lock:
+            self._slots[session_id] = _Slot()
+        return PooledVAD(self, session_id)
+
+    def _worker_for(self, session_id: int) -> _Worker:
+        return self._workers[session_id % self.size]
+
+    def _local_engine(self, session_id: int) -> VADEngine:
+        engine = self._local.get(session_id)
+        if engine is None:
+            engine = self._local[session_id] = create_vad(self.detectors, self.block_size)
+        return engine
+
+    def process(self, session_id: int, samples: np.ndarray) -> bool:
+        slot = self._slots[session_id]
+        slot.seq += 1
+        slot.event.clear()
+        started = time.perf_counter()
+        worker = self._worker_for(session_id)
+        if worker.send(session_id, _REQUEST.pack(OP_PROCESS, slot.seq) + samples.tobytes()):
+            if slot.event.wait(self.timeout):
+                waited = time.perf_counter() - started
+                with self._stats_lock:
+                    self.blocks += 1
+                    self.total_wait += waited
+                    self.max_wait = max(self.max_wait, waited)
+                return slot.result
+            with self._stats_lock:
+                self.timeouts += 1
+        else:
+            with self._stats_lock:
+                self.rejected += 1
+        return self._local_engine(session_id).process(samples)
+
+    def reset(self, session_id: int):
+        self._worker_for(session_id).send(session_id, _REQUEST.pack(OP_RESET, 0))
+        engine = self._local.get(session_id)
+        if engine is not None:
+            engine.reset()
+
+    def drop(self, session_id: int):
+        with self._lock:
+            self._slots.pop(session_id, None)
+            self._local.pop(session_id, None)
+        if not self._closing:
+            self._worker_for(session_id).send(session_id, _REQUEST.pack(OP_DROP, 0))
+
+    def _dispatch_loop(self, worker: _Worker):
+        while True:
+            record = worker.responses.read()
+            if record is None:
+                if self._closing:
+                    break
+                if not worker.responses_ready.acquire(timeout=0.5) and not worker.process.is_alive():
+                    if not self._closing:
+                        logger.error(f"VAD进程{worker.index}已退出，相关会话改为本地计算。")
+                    break
+                continue
+            session_id, data, _ = record
+            seq, speech = _RESPONSE.unpack(data)
+            slot = self._slots.get(session_id)
+            # 超时后才到达的旧结果直接丢弃
+            if slot is not None and slot.seq == seq:
+                slot.result = bool(speech)
+                slot.event.set()
+
+    def close(self):
+        self._closing = True
+        for worker in self._workers:
+            worker.send(_SHUTDOWN_SESSION, _REQUEST.pack(OP_PROCESS, 0))
+        for worker in self._workers:
+            worker.process.join(timeout=2)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            if worker.dispatcher is not None:
+                worker.dispatcher.join(timeout=1)
+            worker.requests.close(unlink=True)
+            worker.responses.close(unlink=True)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "workers": self.size,
+                "blocks": self.blocks,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "avg_round_trip_ms": self.total_wait / self.blocks * 1000 if self.blocks else 0.0,
+                "max_round_trip_ms": self.max_wait * 1000,
+            }
+
+class PooledVAD(VADEngine):
+    """在VAD进程中计算的检测器，接口与本地检测器相同"""
+
+    def __init__(self, pool: VADWorkerPool, session_id: int):
+        self.pool = pool
+        self.session_id = session_id
+
+    def process(self, samples: np.ndarray) -> bool:
+        return self.pool.process(self.session_id, samples)
+
+    def reset(self):
+        self.pool.reset(self.session_id)
+
+    def close(self):
+        self.pool.drop(self.session_id)
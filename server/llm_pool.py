@@ -0,0 +1,126 @@
+# server/llm_pool.py
+# 服务模式下所有会话共享的LLM并发额度。额度有限时按会话公平分配，
+# 话多的直播间不会把其他直播间的回复一直挤在队列后面。
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+import config
+
+logger = logging.getLogger(__name__)
+
+class _SessionUsage:
+    def __init__(self):
+        self.waiters = deque()   # 等待额度的Future
+        self.in_use = 0
+        self.last_grant = 0      # 上次获得额度的序号，越小越久没轮到
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+class FairLLMPool:
+    """
+    有界的LLM并发额度（在事件循环中使用）。额度用完时，等待中的会话按“当前占用的额度最少、
+    其次最久没有获得额度”的顺序轮流获得，单个会话最多同时占用per_session_max个额度。
+    """
+
+    def __init__(self, max_concurrent: int = config.SERVER_LLM_MAX_CONCURRENT,
+                 per_session_max: int = config.SERVER_LLM_PER_SESSION_MAX):
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_session_max = max(1, per_session_max)
+        self._sessions = {}
+        self._in_use = 0
+        self._grant_seq = 0
+        self._waits = deque(maxlen=2000)
+
+        # 统计信息
+        self.peak_in_use = 0
+        self.peak_waiting = 0
+
+    def _usage(self, session_id) -> _SessionUsage:
+        usage = self._sessions.get(session_id)
+        if usage is None:
+            usage = self._sessions[session_id] = _SessionUsage()
+        return usage
+
+    def _dispatch(self):
+        """把空闲的额度分给等待中的会话"""
+        while self._in_use < self.max_concurrent:
+            best = None
+            for usage in self._sessions.values():
+                while usage.waiters and usage.waiters[0].done():
+                    # 等待期间已被取消
+                    usage.waiters.popleft()
+                if not usage.waiters or usage.in_use >= self.per_session_max:
+                    continue
+                if best is None or (usage.in_use, usage.last_grant) < (best.in_use, best.last_grant):
+                    best = usage
+            if best is None:
+                return
+            self._grant_seq += 1
+            best.last_grant = self._grant_seq
+            best.in_use += 1
+            self._in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self._in_use)
+            best.waiters.popleft().set_result(None)
+
+    async def acquire(self, session_id):
+        usage = self._usage(session_id)
+        future = asyncio.get_running_loop().create_future()
+        usage.waiters.append(future)
+        self._dispatch()
+        waiting = sum(len(u.waiters) for u in self._sessions.values())
+        self.peak_waiting = max(self.peak_waiting, waiting)
+        started = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 刚分到额度就被取消，把额度还回去
+                self.release(session_id)
+            raise
+        waited = time.perf_counter() - started
+        usage.granted += 1
+        usage.total_wait += waited
+        usage.max_wait = max(usage.max_wait, waited)
+        self._waits.append(waited)
+
+    def release(self, session_id):
+        usage = self._sessions[session_id]
+        usage.in_use -= 1
+        self._in_use -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session_id):
+        await self.acquire(session_id)
+        try:
+            yield
+        finally:
+            self.release(session_id)
+
+    def remove_session(self, session_id):
+        usage = self._sessions.get(session_id)
+        if usage is not None and not usage.waiters and not usage.in_use:
+            del self._sessions[session_id]
+
+    def get_stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_use": self._in_use,
+            "waiting": sum(len(u.waiters) for u in self._sessions.values()),
+            "peak_in_use": self.peak_in_use,
+            "peak_waiting": self.peak_waiting,
+            "p50_wait_ms": waits[len(waits) // 2] * 1000 if waits else 0.0,
+            "p99_wait_ms": waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000 if waits else 0.0,
+            "sessions": {
+                session_id: {
+                    "granted": u.granted,
+                    "avg_wait_ms": u.total_wait / u.granted * 1000 if u.granted else 0.0,
+                    "max_wait_ms": u.max_wait * 1000,
+                }
+                for session_id, u in self._sessions.items()
+            },
+        }
@@ -0,0 +1,275 @@
+# server/session.py
+# 服务模式下的一个会话（一个直播间）：配置、界面输出通道、音频输入与Agent。
+# 事件循环、LLM客户端、并发额度、VAD进程池、审核器与回复缓存由所有会话共享（见server/app.py的ServerRuntime）。
+import os
+import re
+import json
+import logging
+import threading
+from collections import deque
+from functools import partial
+import config
+from agent.vad import VADGate
+from agent.asr_backends import DashScopeASRBackend
+from agent.async_runtime import AsyncMainAgent, AsyncLLMHandler, AsyncLLMDispatcher
+from ui.webview_window import RefutationWebViewWindow
+from .audio_pool import PooledVAD
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class SessionSpec:
+    """
+    sessions.json中的一个会话。id出现在页面地址中（/s/<id>/）；system_prompt为该直播间的人设，
+    为空时使用默认人设；asr_api_key_env为该会话识别服务密钥所在的环境变量，为空时使用全局密钥。
+    """
+
+    def __init__(self, id: str, system_prompt: str = None, danmaku_room_id: int = None, danmaku_url: str = None,
+                 asr_api_key_env: str = None):
+        if not _SESSION_ID.match(id or ''):
+            raise ValueError(f"会话ID只能包含字母、数字、下划线和连字符: {id!r}")
+        self.id = id
+        self.system_prompt = system_prompt
+        self.danmaku_room_id = danmaku_room_id
+        self.danmaku_url = danmaku_url
+        self.asr_api_key_env = asr_api_key_env
+
+    @property
+    def asr_api_key(self):
+        return os.getenv(self.asr_api_key_env) if self.asr_api_key_env else None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SessionSpec":
+        return cls(**data)
+
+def load_sessions(path: str = config.SERVER_SESSIONS_PATH) -> list:
+    with open(path, encoding='utf-8') as f:
+        specs = [SessionSpec.from_dict(item) for item in json.load(f)]
+    ids = [spec.id for spec in specs]
+    duplicated = {i for i in ids if ids.count(i) > 1}
+    if duplicated:
+        raise ValueError(f"会话ID重复: {', '.join(sorted(duplicated))}")
+    return specs
+
+class SessionWindow(RefutationWebViewWindow):
+    """
+    会话的界面输出通道。不创建窗口：JS桥按帧合并好的界面更新经websocket推送给订阅该会话的所有页面，
+    并保留最近的若干次，新打开（或刷新）的页面先补发这些更新。
+    """
+
+    def __init__(self, session_id: str, loop, history: int = config.SERVER_UI_HISTORY_BATCHES):
+        super().__init__()
+        self.session_id = session_id
+        self.loop = loop
+        self.is_running = True
+        # 以下只在事件循环线程中访问
+        self.clients = set()
+        self.history = deque(maxlen=history)
+
+        # 统计信息
+        self.js_calls = 0
+        self.js_chars = 0
+        self.mark_ready()
+
+    def execute_js(self, js_code: str):
+        """在JS桥的刷新线程中调用，交给事件循环发送"""
+        self.js_calls += 1
+        self.js_chars += len(js_code)
+        self.loop.call_soon_threadsafe(self._broadcast, js_code)
+
+    def _broadcast(self, js_code: str):
+        self.history.append(js_code)
+        for client in list(self.clients):
+            client.send_text(js_code)
+            if client.closed:
+                self.clients.discard(client)
+
+    def add_client(self, client):
+        for js_code in self.history:
+            client.send_text(js_code)
+        self.clients.add(client)
+
+    def remove_client(self, client):
+        self.clients.discard(client)
+
+    def stop(self):
+        self.bridge.stop()
+        self.is_running = False
+
+class WebSocketAudioSource:
+    """
+    会话的音频输入：推流端经websocket发来的16kHz单声道int16 PCM，接口与PyAudioSource相同，可作为AudioCapture的输入源。
+    一段时间收不到音频时以静音补齐（识别会话照常计时与重置）；积压过多时丢弃最旧的音频，延迟不会越积越大。
+    """
+
+    def __init__(self, backlog_seconds: float = config.SERVER_AUDIO_BACKLOG_SECONDS,
+                 stall_seconds: float = config.SERVER_AUDIO_STALL_SECONDS):
+        self.max_backlog = int(backlog_seconds * config.SAMPLE_RATE) * 2
+        self.stall_seconds = stall_seconds
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # 统计信息
+        self.bytes_in = 0
+        self.bytes_dropped = 0
+        self.stalls = 0
+
+    def open(self, block_size: int = config.BLOCK_SIZE) -> "WebSocketAudioSource":
+        """作为AudioCapture的source_factory，采集线程重新启动时复用同一个缓冲区"""
+        with self._cond:
+            self._closed = False
+        return self
+
+    def feed(self, data: bytes):
+        """收到一段音频（在事件循环线程中调用）"""
+        with self._cond:
+            self._buf += data
+            self.bytes_in += len(data)
+            excess = len(self._buf) - self.max_backlog
+            if excess > 0:
+                excess += excess % 2
+                del self._buf[:excess]
+                self.bytes_dropped += excess
+            self._cond.notify()
+
+    def read(self, frames: int) -> bytes:
+        size = frames * 2
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._buf) >= size or self._closed, timeout=self.stall_seconds)
+            if self._closed:
+                raise IOError("音频输入源已关闭")
+            data = bytes(self._buf[:size])
+            del self._buf[:size]
+        if len(data) < size:
+            self.stalls += 1
+            data += bytes(size - len(data))
+        return data
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get_stats(self) -> dict:
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_dropped": self.bytes_dropped,
+            "stalls": self.stalls,
+        }
+
+class SessionAgent(AsyncMainAgent):
+    """
+    一个会话的Agent。音频采集、识别会话、对话记忆与人设各自独立；LLM请求在共享的事件循环中
+    经共享连接池发出，发出前先向公平额度池申请额度。
+    """
+
+    def __init__(self, spec: SessionSpec, index: int, runtime, window: SessionWindow,
+                 audio_source_factory, recognition_factory=None):
+        self.spec = spec
+        self.index = index
+        self.runtime = runtime
+        if recognition_factory is None and config.ASR_BACKEND == 'dashscope':
+            # 各会话使用自己的识别服务密钥，不修改进程全局的dashscope.api_key
+            recognition_factory = partial(DashScopeASRBackend, api_key=spec.asr_api_key)
+        super().__init__(api_key=runtime.api_key, window=window, base_url=runtime.base_url,
+                         audio_source_factory=audio_source_factory, recognition_factory=recognition_factory,
+                         danmaku_url=spec.danmaku_url)
+        if runtime.vad_pool is not None:
+            # VAD检测在进程池中计算，门控（pre-roll与hangover）仍在本会话的音频线程中
+            self.vad_gate = VADGate(engine=runtime.vad_pool.engine(index))
+        self.danmaku_enabled = spec.danmaku_room_id is not None
+        self.danmaku_room_id = spec.danmaku_room_id
+
+    def _create_response_cache(self):
+        # 缓存按人设区分，可以在会话间共享
+        return self.runtime.response_cache
+
+    def _create_moderator(self):
+        return self.runtime.moderator
+
+    def _create_persona_registry(self):
+        # 各会话的人设由sessions.json中的system_prompt指定，不读人设目录
+        return None
+
+    def _create_speech_output(self):
+        # 服务端没有扬声器，也不能让各直播间的播报混在一起
+        return None
+
+    def _create_llm_pipeline(self, base_url: str):
+        self._owns_loop = False
+        self._loop = self.runtime.loop
+        self._keepalive_task = None
+        self.llm_client = self.runtime.llm_client
+        self.llm_handler = AsyncLLMHandler(self.llm_client, self.window, response_cache=self.response_cache,
+                                           memory=self.conversation_memory, moderator=self.moderator,
+                                           loop=self._loop)
+        # 各模型的首token延迟分布与熔断状态对所有会话都一样
+        self.llm_handler.hedge_policy = self.runtime.hedge_policy
+        if self.spec.system_prompt:
+            self.llm_handler.system_prompt = self.spec.system_prompt
+        self.llm_dispatcher = AsyncLLMDispatcher(self._pooled_response, self._loop)
+
+    async def _pooled_response(self, text: str, job):
+        """排队等待额度期间被新句子取代时，任务直接取消，不会占用额度"""
+        async with self.runtime.llm_pool.slot(self.spec.id):
+            return await self.llm_handler.get_response(text, job)
+
+    def _start_llm_warm_up(self):
+        # 共享连接池由ServerRuntime统一预热
+        pass
+
+    def _stop_shared_components(self):
+        # 对冲策略、审核器与回复缓存由ServerRuntime在服务停止时统一输出统计并保存，
+        # 单个会话停止时其他会话仍在使用，不能停止缓存的后台保存
+        pass
+
+    def stop(self):
+        super().stop()
+        if isinstance(self.vad_gate.engine, PooledVAD):
+            self.vad_gate.engine.close()
+        self._loop.call_soon_threadsafe(self.runtime.llm_pool.remove_session, self.spec.id)
+
+class Session:
+    """一个会话的全部组成部分，以及页面连接的收发"""
+
+    def __init__(self, spec: SessionSpec, index: int, runtime, audio_source_factory=None, recognition_factory=None):
+        self.spec = spec
+        self.window = SessionWindow(spec.id, runtime.loop)
+        self.audio = WebSocketAudioSource()
+        self.agent = SessionAgent(spec, index, runtime, self.window,
+                                  audio_source_factory=audio_source_factory or self.audio.open,
+                                  recognition_factory=recognition_factory)
+
+    async def serve_client(self, conn):
+        """页面或推流端的连接：文本消息为页面状态（忽略），二进制消息为上传的音频"""
+        from .websocket import OP_BINARY
+        self.window.add_client(conn)
+        try:
+            while True:
+                opcode, payload = await conn.recv()
+                if opcode is None:
+                    break
+                if opcode == OP_BINARY:
+                    self.audio.feed(payload)
+        finally:
+            self.window.remove_client(conn)
+
+    def start(self):
+        self.agent.run()
+
+    def stop(self):
+        self.agent.stop()
+        self.audio.close()
+        self.window.stop()
+
+    def get_stats(self) -> dict:
+        return {
+            "dispatcher": self.agent.llm_dispatcher.get_stats(),
+            "audio_in": self.audio.get_stats(),
+            "audio": self.agent.audio_capture.get_stats(),
+            "vad": self.agent.vad_gate.get_stats(),
+            "ui": {"js_calls": self.window.js_calls, "js_chars": self.window.js_chars,
+                   "clients": len(self.window.clients)},
+        }
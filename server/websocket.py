@@ -0,0 +1,195 @@
+# server/websocket.py
+# 服务模式用到的最小HTTP/WebSocket实现（基于asyncio流，只依赖标准库与numpy）：
+# 解析请求头、完成握手、读写帧。只实现本项目用到的部分：文本/二进制帧、分片、ping/pong与关闭。
+import base64
+import struct
+import asyncio
+import hashlib
+import logging
+from urllib.parse import urlsplit
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+_LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# 客户端帧的最大长度，超过时断开（音频帧通常只有几KB）
+MAX_FRAME_BYTES = 4 * 1024 * 1024
+
+class HTTPRequest:
+    def __init__(self, method: str, path: str, headers: dict):
+        self.method = method
+        self.path = path
+        self.headers = headers
+
+    @property
+    def wants_websocket(self) -> bool:
+        return self.headers.get('upgrade', '').lower() == 'websocket' and 'sec-websocket-key' in self.headers
+
+def origin_allowed(request: HTTPRequest, host: str, port: int) -> bool:
+    """
+    websocket握手的来源检查：浏览器总会带上Origin，没有Origin的是推流端等非浏览器客户端。
+    只接受本服务自己的页面（Origin的主机与端口与服务相同），防止其他网页借用户的浏览器连进会话（跨站websocket劫持）。
+    """
+    origin = request.headers.get('origin')
+    if origin is None:
+        return True
+    parsed = urlsplit(origin)
+    try:
+        origin_port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError:
+        return False
+    if parsed.scheme not in ('http', 'https') or origin_port != port or not parsed.hostname:
+        return False
+    origin_host = parsed.hostname.lower()
+    if host in ('0.0.0.0', '::', ''):
+        # 监听全部地址时页面可能经任一地址打开，要求与浏览器实际连接的Host一致
+        return origin_host == urlsplit(f"//{request.headers.get('host', '')}").hostname
+    if host in _LOOPBACK_HOSTS:
+        return origin_host in _LOOPBACK_HOSTS
+    return origin_host == host.lower()
+
+async def read_request(reader: asyncio.StreamReader):
+    """读取请求行与请求头，连接关闭或格式错误时返回None"""
+    try:
+        request_line = await reader.readline()
+        parts = request_line.decode('latin-1').split()
+        if len(parts) < 2:
+            return None
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        return None
+    return HTTPRequest(parts[0], parts[1], headers)
+
+def http_response(status: str, body: bytes = b'', content_type: str = 'text/plain; charset=utf-8') -> bytes:
+    return (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            "Cache-Control: no-cache\r\nConnection: close\r\n\r\n").encode('ascii') + body
+
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+
+def encode_frame(opcode: int, payload: bytes) -> bytes:
+    """服务端发出的帧不带掩码"""
+    size = len(payload)
+    if size < 126:
+        header = struct.pack('!BB', 0x80 | opcode, size)
+    elif size < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+    return header + payload
+
+def unmask(payload: bytes, mask: bytes) -> bytes:
+    """客户端帧总是带掩码；音频帧较长，用numpy按8字节一组异或"""
+    size = len(payload)
+    if size < 64:
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    padded = payload + bytes(-size % 8)
+    data = np.frombuffer(padded, dtype=np.uint64) ^ np.frombuffer(mask * 2, dtype=np.uint64)
+    return data.tobytes()[:size]
+
+class WebSocketConnection:
+    """
+    一个已完成握手的连接。发送不等待（写入传输层缓冲区），接收过慢的页面在缓冲超过上限时被断开，
+    不会拖慢其他会话。只应在事件循环线程中使用。
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 max_buffer: int = config.SERVER_CLIENT_MAX_BUFFER_BYTES):
+        self.reader = reader
+        self.writer = writer
+        self.max_buffer = max_buffer
+        self.closed = False
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    @classmethod
+    async def accept(cls, request: HTTPRequest, reader, writer) -> "WebSocketConnection":
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept_key(request.headers['sec-websocket-key'])}\r\n\r\n")
+                     .encode('ascii'))
+        await writer.drain()
+        return cls(reader, writer)
+
+    def _send(self, opcode: int, payload: bytes):
+        if self.closed:
+            return
+        if self.writer.transport.get_write_buffer_size() > self.max_buffer:
+            logger.warning("页面接收过慢，断开该websocket连接。")
+            self.abort()
+            return
+        frame = encode_frame(opcode, payload)
+        self.writer.write(frame)
+        self.frames_sent += 1
+        self.bytes_sent += len(frame)
+
+    def send_text(self, text: str):
+        self._send(OP_TEXT, text.encode('utf-8'))
+
+    def send_binary(self, data: bytes):
+        self._send(OP_BINARY, data)
+
+    async def _read_frame(self):
+        head = await self.reader.readexactly(2)
+        fin, opcode, size = head[0] & 0x80, head[0] & 0x0F, head[1] & 0x7F
+        if size == 126:
+            size = struct.unpack('!H', await self.reader.readexactly(2))[0]
+        elif size == 127:
+            size = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+        if size > MAX_FRAME_BYTES:
+            raise ConnectionError(f"websocket帧过大: {size}字节")
+        mask = await self.reader.readexactly(4) if head[1] & 0x80 else None
+        payload = await self.reader.readexactly(size) if size else b''
+        if mask:
+            payload = unmask(payload, mask)
+        return bool(fin), opcode, payload
+
+    async def recv(self):
+        """读取下一条消息，返回(opcode, 内容)；连接关闭时返回(None, None)。ping在这里直接回复。"""
+        message_opcode, parts = None, []
+        while not self.closed:
+            try:
+                fin, opcode, payload = await self._read_frame()
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                break
+            if opcode == OP_CLOSE:
+                self._send(OP_CLOSE, payload[:2])
+                break
+            if opcode == OP_PING:
+                self._send(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode != OP_CONTINUATION:
+                message_opcode, parts = opcode, []
+            parts.append(payload)
+            if fin and message_opcode is not None:
+                return message_opcode, b''.join(parts)
+        self.abort()
+        return None, None
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+    async def close(self):
+        if not self.closed:
+            self._send(OP_CLOSE, struct.pack('!H', 1001))
+            self.abort()
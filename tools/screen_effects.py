@@ -1 +1,343 @@
-# 预留：屏幕特效工具
\ No newline at end of file
+# tools/screen_effects.py
+# 屏幕特效：AI回复里出现表情或关键词时，向屏幕抛出一把表情粒子。
+# 粒子状态保存在预分配的NumPy数组中，每帧一次向量化更新；空闲槽位用栈复用，发射与回收不分配对象。
+# 绘制命令每帧打包成一次JS调用，发给透明置顶的覆盖窗口（ui/web/overlay.html），在浏览器中按帧绘制。
+import re
+import sys
+import json
+import time
+import base64
+import logging
+import threading
+from collections import deque
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+class ParticlePool:
+    """
+    粒子系统。所有属性按槽位存放在定长数组中，capacity即同屏粒子上限；
+    空闲槽位保存在一个栈里，发射时弹出、消失时压回，不会为单个粒子创建对象。
+    """
+
+    def __init__(self, capacity: int = config.SCREEN_EFFECTS_MAX_PARTICLES,
+                 width: int = 1920, height: int = 1080,
+                 gravity: float = config.SCREEN_EFFECTS_GRAVITY, seed: int = None):
+        self.capacity = capacity
+        self.width = width
+        self.height = height
+        self.gravity = gravity
+        self._rng = np.random.default_rng(seed)
+
+        self.pos = np.zeros((capacity, 2), dtype=np.float32)
+        self.vel = np.zeros((capacity, 2), dtype=np.float32)
+        self.angle = np.zeros(capacity, dtype=np.float32)
+        self.spin = np.zeros(capacity, dtype=np.float32)
+        self.scale = np.ones(capacity, dtype=np.float32)
+        self.life = np.zeros(capacity, dtype=np.float32)
+        self.sprite = np.zeros(capacity, dtype=np.int16)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # 空闲槽位栈：_free[:_free_top]为可用槽位
+        self._free = np.arange(capacity - 1, -1, -1, dtype=np.int32)
+        self._free_top = capacity
+        # 每帧复用的绘制缓冲区：[精灵, x, y, 角度(0.01弧度), 缩放(%), 透明度(0-255)]
+        self._commands = np.zeros((capacity, 6), dtype=np.int16)
+        self._mask = np.zeros(capacity, dtype=bool)
+
+        # 统计信息
+        self.emitted = 0
+        self.dropped = 0
+
+    @property
+    def count(self) -> int:
+        return self.capacity - self._free_top
+
+    def emit(self, sprite: int, count: int, origin=None, spread: float = 0.6, speed=(700.0, 1300.0),
+             life=(1.8, 3.0)) -> int:
+        """从origin向屏幕中间抛出count个粒子，槽位不足时只发射能容纳的部分，返回实际发射数"""
+        self.dropped += max(0, count - self._free_top)
+        count = min(count, self._free_top)
+        if count <= 0:
+            return 0
+        slots = self._free[self._free_top - count:self._free_top]
+        self._free_top -= count
+        rng = self._rng
+        if origin is None:
+            origin = (self.width * 0.85, self.height * 0.75)
+        # 朝左上方抛出，角度与速度随机
+        direction = np.pi * 1.2 + rng.uniform(-spread, spread, count)
+        magnitude = rng.uniform(speed[0], speed[1], count)
+        self.pos[slots] = origin
+        self.vel[slots, 0] = np.cos(direction) * magnitude
+        self.vel[slots, 1] = np.sin(direction) * magnitude
+        self.angle[slots] = rng.uniform(-np.pi, np.pi, count)
+        self.spin[slots] = rng.uniform(-6.0, 6.0, count)
+        self.scale[slots] = rng.uniform(0.7, 1.4, count)
+        self.life[slots] = rng.uniform(life[0], life[1], count)
+        self.sprite[slots] = sprite
+        self.alive[slots] = True
+        self.emitted += count
+        return count
+
+    def step(self, dt: float) -> int:
+        """推进dt秒：对整个数组做一次向量化更新（空槽位也参与计算，省去按下标取子集），回收消失的粒子"""
+        self.vel[:, 1] += self.gravity * dt
+        self.vel *= np.float32(config.SCREEN_EFFECTS_DRAG ** dt)
+        self.pos += self.vel * np.float32(dt)
+        self.angle += self.spin * np.float32(dt)
+        self.life -= np.float32(dt)
+
+        mask = self._mask
+        np.less_equal(self.life, 0, out=mask)
+        mask |= self.pos[:, 1] > self.height + 100
+        mask |= self.pos[:, 0] < -100
+        mask |= self.pos[:, 0] > self.width + 100
+        mask &= self.alive
+        dead = np.flatnonzero(mask)
+        if dead.size:
+            self.alive[dead] = False
+            self._free[self._free_top:self._free_top + dead.size] = dead
+            self._free_top += dead.size
+        return self.count
+
+    def draw_commands(self) -> np.ndarray:
+        """当前存活粒子的绘制命令，形状(n, 6)的int16数组（复用内部缓冲区）"""
+        live = np.flatnonzero(self.alive)
+        commands = self._commands[:live.size]
+        commands[:, 0] = self.sprite[live]
+        commands[:, 1:3] = self.pos[live]
+        # 角度折回[-π, π)后以0.01弧度为单位，避免int16溢出
+        commands[:, 3] = (np.mod(self.angle[live] + np.pi, 2 * np.pi) - np.pi) * 100
+        commands[:, 4] = self.scale[live] * 100
+        commands[:, 5] = np.clip(self.life[live] / config.SCREEN_EFFECTS_FADE_SECONDS, 0, 1) * 255
+        return commands
+
+class EffectEngine:
+    """
+    特效线程：按固定帧率推进粒子、打包绘制命令并调用renderer执行一段JS。
+    trigger()只把请求放进队列，任何线程（例如读取LLM流的线程）调用都不会阻塞；没有粒子时线程休眠。
+    """
+
+    def __init__(self, renderer, pool: ParticlePool = None, fps: int = config.SCREEN_EFFECTS_FPS):
+        self.renderer = renderer  # 接收一段JS代码的函数
+        self.pool = pool or ParticlePool()
+        self.frame_interval = 1.0 / fps
+        self._requests = deque()
+        self._sprites = {}          # 表情 -> 精灵编号
+        self._new_sprites = []      # 尚未发给页面的精灵
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        # 统计信息
+        self.frames = 0
+        self.late_frames = 0        # 超过帧间隔的帧数
+        self.bursts = 0
+        self._frame_times = deque(maxlen=600)
+
+    def trigger(self, emoji: str, count: int = config.SCREEN_EFFECTS_BURST_SIZE, origin=None):
+        """请求抛出一把表情（非阻塞）"""
+        self._requests.append((emoji, count, origin))
+        self._wake.set()
+
+    def _sprite_id(self, emoji: str) -> int:
+        sprite = self._sprites.get(emoji)
+        if sprite is None:
+            sprite = self._sprites[emoji] = len(self._sprites)
+            self._new_sprites.append((sprite, emoji))
+        return sprite
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="ScreenEffects", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def render_frame(self, dt: float) -> str:
+        """推进一帧并返回本帧的JS代码（精灵注册与绘制合并为一次调用）"""
+        while self._requests:
+            emoji, count, origin = self._requests.popleft()
+            if self.pool.emit(self._sprite_id(emoji), count, origin):
+                self.bursts += 1
+        self.pool.step(dt)
+        commands = self.pool.draw_commands()
+        # 表情与关键词来自回复和配置，按JSON编码成JS字面量，引号与反斜杠不会破坏脚本
+        js = "".join(f"registerSprite({sprite}, {json.dumps(emoji)});" for sprite, emoji in self._new_sprites)
+        self._new_sprites.clear()
+        return js + f"drawFrame('{base64.b64encode(commands.tobytes()).decode('ascii')}');"
+
+    def _run(self):
+        last = None
+        while not self._stopped.is_set():
+            if not self.pool.count and not self._requests:
+                # 没有粒子：画一帧空画面后休眠，直到下一次触发
+                if last is not None:
+                    self.renderer("drawFrame('');")
+                last = None
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            started = time.perf_counter()
+            dt = self.frame_interval if last is None else min(started - last, 0.1)
+            last = started
+            self.renderer(self.render_frame(dt))
+            elapsed = time.perf_counter() - started
+            self.frames += 1
+            self._frame_times.append(elapsed)
+            if elapsed > self.frame_interval:
+                self.late_frames += 1
+            self._stopped.wait(max(0.0, self.frame_interval - elapsed))
+
+    def get_stats(self) -> dict:
+        times = sorted(self._frame_times)
+        return {
+            "frames": self.frames,
+            "late_frames": self.late_frames,
+            "bursts": self.bursts,
+            "particles": self.pool.count,
+            "emitted": self.pool.emitted,
+            "dropped": self.pool.dropped,
+            "frame_ms_p50": times[len(times) // 2] * 1000 if times else 0.0,
+            "frame_ms_p99": times[min(len(times) - 1, int(len(times) * 0.99))] * 1000 if times else 0.0,
+        }
+
+class EffectTrigger:
+    """
+    扫描AI回复的文本增量：遇到表情直接抛出该表情，遇到config中的关键词抛出对应表情。
+    每条回复用begin()取得自己的扫描状态，同时进行的回复（预测生成、对冲降级）互不影响。
+    """
+
+    EMOJI_PATTERN = re.compile('[\U0001F300-\U0001FAFF\u2600-\u27BF]')
+
+    def __init__(self, engine: EffectEngine, keywords: dict = config.SCREEN_EFFECTS_KEYWORDS,
+                 max_bursts: int = config.SCREEN_EFFECTS_MAX_BURSTS_PER_REPLY):
+        self.engine = engine
+        self.keywords = keywords
+        self.max_bursts = max_bursts
+        self.keep = max((len(k) for k in keywords), default=1) - 1
+
+    def begin(self) -> "ReplyEffects":
+        """开始一条回复"""
+        return ReplyEffects(self)
+
+class ReplyEffects:
+    """
+    一条回复的特效扫描状态。关键词可能被拆在两个增量中，保留上一段末尾若干字符一起匹配；
+    每条回复最多触发max_bursts次。
+    """
+
+    def __init__(self, trigger: EffectTrigger):
+        self.trigger = trigger
+        self._tail = ''
+        self._bursts = 0
+
+    def feed(self, text: str):
+        trigger = self.trigger
+        if self._bursts >= trigger.max_bursts:
+            return
+        hits = [m.group() for m in trigger.EMOJI_PATTERN.finditer(text)]
+        combined = self._tail + text
+        for keyword, emoji in trigger.keywords.items():
+            start = combined.find(keyword)
+            while start != -1:
+                # 只算结束位置落在新文本中的匹配，上一段已经算过的不重复触发
+                if start + len(keyword) > len(self._tail):
+                    hits.append(emoji)
+                start = combined.find(keyword, start + 1)
+        self._tail = combined[-trigger.keep:] if trigger.keep else ''
+        for emoji in hits[:trigger.max_bursts - self._bursts]:
+            trigger.engine.trigger(emoji)
+            self._bursts += 1
+
+class OverlayApi:
+    def __init__(self, overlay):
+        self._overlay = overlay
+
+    def ready(self):
+        """覆盖页面加载完成时由JS调用"""
+        self._overlay.mark_ready()
+
+class ScreenEffectsOverlay:
+    """
+    全屏透明置顶的覆盖窗口，只负责显示。与主窗口一样在主线程中于webview.start()之前创建，
+    页面就绪后启动特效线程。Windows上设置为鼠标穿透，不影响操作下面的游戏。
+    """
+
+    def __init__(self):
+        self.window = None
+        self.js_api = OverlayApi(self)
+        self.engine = EffectEngine(self.execute_js)
+        self.trigger = EffectTrigger(self.engine)
+        self._ready = threading.Event()
+
+    def start(self, owner=None):
+        """创建覆盖窗口 - 必须在主线程中、webview.start()之前调用。owner为主窗口，主窗口关闭时覆盖窗口随之关闭"""
+        import os
+        import webview
+        width, height = 1920, 1080
+        try:
+            screen = webview.screens[0]
+            width, height = screen.width, screen.height
+        except Exception as e:
+            logger.debug(f"无法获取屏幕尺寸: {e}")
+        self.engine.pool.width, self.engine.pool.height = width, height
+        html_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ui', 'web', 'overlay.html')
+        self.window = webview.create_window(
+            title='AI杠精特效', url=html_path, js_api=self.js_api,
+            width=width, height=height, x=0, y=0,
+            transparent=True, frameless=True, on_top=True, focus=False, easy_drag=False,
+        )
+        self.window.events.shown += self._make_click_through
+        if owner is not None:
+            owner.events.closed += self.close
+        logger.info("屏幕特效覆盖窗口已创建。")
+
+    def _make_click_through(self):
+        """Windows上给窗口加上WS_EX_LAYERED|WS_EX_TRANSPARENT，鼠标事件穿透到下面的窗口"""
+        if sys.platform != 'win32':
+            logger.info("当前平台的覆盖窗口不支持鼠标穿透。")
+            return
+        try:
+            import ctypes
+            hwnd = self.window.native.Handle.ToInt32()
+            user32 = ctypes.windll.user32
+            style = user32.GetWindowLongW(hwnd, -20)  # GWL_EXSTYLE
+            user32.SetWindowLongW(hwnd, -20, style | 0x80000 | 0x20)
+        except Exception as e:
+            logger.warning(f"设置覆盖窗口鼠标穿透失败: {e}")
+
+    def mark_ready(self):
+        if not self._ready.is_set():
+            self._ready.set()
+            self.engine.start()
+            logger.info("屏幕特效已就绪。")
+
+    def execute_js(self, js_code: str):
+        if self.window is None:
+            return
+        try:
+            self.window.evaluate_js(js_code)
+        except Exception as e:
+            logger.debug(f"屏幕特效绘制失败: {e}")
+
+    def close(self):
+        """停止特效线程并关闭覆盖窗口"""
+        self.engine.stop()
+        window, self.window = self.window, None
+        if window is not None:
+            try:
+                window.destroy()
+            except Exception as e:
+                logger.debug(f"关闭覆盖窗口失败: {e}")
+
+    def stop(self):
+        self.close()
+        logger.info(f"屏幕特效统计: {self.engine.get_stats()}")
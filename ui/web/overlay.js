@@ -0,0 +1,80 @@
+// ui/web/overlay.js
+
+// 屏幕特效覆盖层：Python每帧调用一次drawFrame，传入打包好的绘制命令（base64编码的Int16Array，
+// 每个粒子6个数：精灵、x、y、角度(0.01弧度)、缩放(%)、透明度(0-255)）。
+// 只保存最新一帧，在requestAnimationFrame中绘制；每个表情预先画到离屏canvas上，之后只做贴图。
+const SPRITE_SIZE = 64;
+const FIELDS = 6;
+
+const sprites = [];       // 精灵编号 -> 离屏canvas
+let latest = null;        // 最新一帧的绘制命令
+let frameRequested = false;
+let canvas = null;
+let ctx = null;
+
+window.addEventListener('load', () => {
+    canvas = document.getElementById('effects');
+    ctx = canvas.getContext('2d');
+    resize();
+    window.addEventListener('resize', resize);
+});
+
+function resize() {
+    canvas.width = window.innerWidth;
+    canvas.height = window.innerHeight;
+}
+
+// 页面加载完成且pywebview接口注入后通知Python，Python端此后才开始推送帧
+let readyNotified = false;
+function notifyReady() {
+    if (readyNotified || !window.pywebview || !window.pywebview.api) return;
+    readyNotified = true;
+    pywebview.api.ready();
+}
+window.addEventListener('pywebviewready', notifyReady);
+notifyReady();
+
+function registerSprite(id, emoji) {
+    const sprite = document.createElement('canvas');
+    sprite.width = sprite.height = SPRITE_SIZE;
+    const sctx = sprite.getContext('2d');
+    sctx.font = `${SPRITE_SIZE * 0.8}px "Segoe UI Emoji", "Apple Color Emoji", "Noto Color Emoji", sans-serif`;
+    sctx.textAlign = 'center';
+    sctx.textBaseline = 'middle';
+    sctx.fillText(emoji, SPRITE_SIZE / 2, SPRITE_SIZE / 2);
+    sprites[id] = sprite;
+}
+
+function drawFrame(encoded) {
+    const binary = atob(encoded);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    latest = new Int16Array(bytes.buffer);
+    if (!frameRequested) {
+        frameRequested = true;
+        requestAnimationFrame(commitFrame);
+    }
+}
+
+function commitFrame() {
+    frameRequested = false;
+    if (!ctx) return;
+    ctx.setTransform(1, 0, 0, 1, 0, 0);
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    const commands = latest;
+    const half = SPRITE_SIZE / 2;
+    for (let i = 0; i < commands.length; i += FIELDS) {
+        const sprite = sprites[commands[i]];
+        if (!sprite) continue;
+        const scale = commands[i + 4] / 100;
+        const angle = commands[i + 3] / 100;
+        const cos = Math.cos(angle) * scale;
+        const sin = Math.sin(angle) * scale;
+        ctx.globalAlpha = commands[i + 5] / 255;
+        ctx.setTransform(cos, sin, -sin, cos, commands[i + 1], commands[i + 2]);
+        ctx.drawImage(sprite, -half, -half);
+    }
+    ctx.globalAlpha = 1;
+}
@@ -0,0 +1,45 @@
+// ui/web/remote.js
+
+// 服务模式（server/app.py）下在浏览器中打开页面时使用：代替pywebview注入的接口，
+// 并通过websocket接收该会话的界面更新（JS桥按帧合并好的代码），在页面全局作用域中执行。
+// 必须在script.js之前加载。
+window.pywebview = {
+    api: {
+        ready() {},
+        destroy() {},
+        resize() {},
+        list_personas() { return Promise.resolve(null); },
+        switch_persona() { return Promise.resolve(false); },
+    },
+};
+
+(function () {
+    const match = location.pathname.match(/^\/s\/([A-Za-z0-9_-]+)\//);
+    if (!match) return;
+    const url = (location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/ws/' + match[1];
+    let retryDelay = 1000;
+    let disconnected = false;
+
+    function connect() {
+        const socket = new WebSocket(url);
+        socket.addEventListener('open', () => {
+            // 服务端会先补发最近的界面更新，断线重连后重新加载页面以免消息重复
+            if (disconnected) location.reload();
+        });
+        socket.addEventListener('message', (event) => {
+            if (typeof event.data !== 'string') return;
+            try {
+                new Function(event.data)();
+            } catch (e) {
+                console.error('执行界面更新失败:', e);
+            }
+        });
+        socket.addEventListener('close', () => {
+            disconnected = true;
+            setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        });
+    }
+
+    window.addEventListener('load', connect);
+})();
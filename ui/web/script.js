@@ -1,107 +1,155 @@
 // ui/web/script.js
 
-let currentStreamingBubble = null;
+// 渲染层：对外函数只修改状态，所有DOM写入在下一帧（requestAnimationFrame）统一提交，
+// 每帧最多滚动一次。全部消息保存在messages中，DOM里只保留一个连续的窗口，
+// 向上翻看时按页补充更早的消息，回到底部后再裁掉，长时间运行也不会拖慢每帧的布局。
+const RENDER_OPTIONS = Object.assign({
+    renderWindow: 40,     // 跟随底部时DOM中最多保留的消息数
+    pageSize: 20,         // 翻看历史时每次补充的消息数
+    historyLimit: 2000,   // 内存中最多保留的消息数
+    edgeThreshold: 40,    // 距顶部/底部多少像素内算到达边缘
+}, window.RENDER_OPTIONS || {});
+
+const messages = [];      // [{role, text, node, pending}]，node为当前对应的气泡（不在DOM中时为null）
+let historyBase = 0;      // messages[0]对应的全局序号（超出上限丢弃最旧的消息时增加）
+let renderStart = 0;      // DOM中消息窗口的范围：全局序号[renderStart, renderEnd)
+let renderEnd = 0;
+let streamingEntry = null;
+let finishedEntries = [];
+
+let statusVisible = false;
 let statusBubble = null;
+let statusTimer = null;
+
+let followBottom = true;  // 用户没有向上翻看时，新内容出现后滚动到底部
+let pageRequest = 0;      // -1 补充更早的消息，1 补充更新的消息
+let frameRequested = false;
+let container = null;
 
 // 等待整个窗口加载完成
 window.addEventListener('load', () => {
+    container = document.getElementById('chat-container');
+    container.addEventListener('scroll', onScroll, { passive: true });
+
     // 初始化状态
     showListeningStatus();
-    
+
     // 初始化字体大小和窗口缩放功能
     initControls();
 });
 
+// 页面加载完成且pywebview接口注入后通知Python，Python端此后才开始推送UI更新
+let readyNotified = false;
+function notifyReady() {
+    if (readyNotified || !window.pywebview || !window.pywebview.api) return;
+    readyNotified = true;
+    pywebview.api.ready();
+}
+window.addEventListener('pywebviewready', notifyReady);
+// 接口可能在本脚本执行前就已注入
+notifyReady();
+
+function scheduleRender() {
+    if (!frameRequested) {
+        frameRequested = true;
+        requestAnimationFrame(commitFrame);
+    }
+}
+
 // 显示偷听状态
 function showListeningStatus() {
-    const container = document.getElementById('chat-container');
-    
-    // 移除之前的状态气泡
-    if (statusBubble) {
-        statusBubble.remove();
-    }
-    
-    statusBubble = document.createElement('div');
-    statusBubble.classList.add('bubble', 'status', 'listening');
-    statusBubble.textContent = 'AI杠精偷听中... (点击关闭)';
-    
-    // 添加点击事件来关闭窗口
-    statusBubble.addEventListener('click', () => {
-        // 调用暴露给JS的Python API
-        pywebview.api.destroy();
-    });
-    
-    container.appendChild(statusBubble);
-    scrollToBottom();
+    clearTimeout(statusTimer);
+    statusVisible = true;
+    scheduleRender();
 }
 
 // 隐藏偷听状态
 function hideListeningStatus() {
-    if (statusBubble) {
-        statusBubble.remove();
-        statusBubble = null;
+    clearTimeout(statusTimer);
+    statusVisible = false;
+    scheduleRender();
+}
+
+function pushEntry(role, text) {
+    const entry = { role: role, text: text, node: null, pending: '' };
+    messages.push(entry);
+    if (messages.length > RENDER_OPTIONS.historyLimit) {
+        const dropped = messages.shift();
+        if (dropped.node) {
+            dropped.node.remove();
+            dropped.node = null;
+        }
+        historyBase++;
+        renderStart = Math.max(renderStart, historyBase);
+        renderEnd = Math.max(renderEnd, renderStart);
     }
+    scheduleRender();
+    return entry;
 }
 
 // 添加用户消息（听到的内容）
 function addUserMessage(text) {
     hideListeningStatus();
-    
-    const container = document.getElementById('chat-container');
-    const bubble = document.createElement('div');
-    bubble.classList.add('bubble', 'user');
-    
-    const textNode = document.createTextNode(text);
-    bubble.appendChild(textNode);
-    
-    container.appendChild(bubble);
-    scrollToBottom();
-    
-    // 清理旧消息，保持窗口整洁
-    cleanupOldMessages();
+    pushEntry('user', text);
 }
 
 // 开始AI流式回复
 function startAIResponse() {
-    const container = document.getElementById('chat-container');
-    
-    currentStreamingBubble = document.createElement('div');
-    currentStreamingBubble.classList.add('bubble', 'ai', 'streaming');
-    
-    container.appendChild(currentStreamingBubble);
-    scrollToBottom();
-    
-    return currentStreamingBubble;
+    if (streamingEntry) {
+        finishAIResponse();
+    }
+    streamingEntry = pushEntry('ai', '');
+    streamingEntry.streaming = true;
+    return streamingEntry;
 }
 
 // 追加AI回复内容（流式传输）
 function appendAIResponse(text) {
-    if (currentStreamingBubble) {
-        // 移除光标效果，添加文本，然后重新添加光标效果
-        currentStreamingBubble.classList.remove('streaming');
-        currentStreamingBubble.textContent += text;
-        currentStreamingBubble.classList.add('streaming');
-        
-        scrollToBottom();
+    if (streamingEntry) {
+        streamingEntry.text += text;
+        streamingEntry.pending += text;
+        scheduleRender();
     }
 }
 
 // 完成AI回复
 function finishAIResponse() {
-    if (currentStreamingBubble) {
-        currentStreamingBubble.classList.remove('streaming');
-        currentStreamingBubble = null;
-        
+    if (streamingEntry) {
+        streamingEntry.streaming = false;
+        finishedEntries.push(streamingEntry);
+        streamingEntry = null;
+        scheduleRender();
+
         // 回复完成后，重新显示偷听状态
-        setTimeout(() => {
-            showListeningStatus();
-        }, 1000);
-        
-        // 清理旧消息
-        cleanupOldMessages();
+        clearTimeout(statusTimer);
+        statusTimer = setTimeout(showListeningStatus, 1000);
     }
 }
 
+// 系统提示（例如人设已切换）
+function addSystemMessage(text) {
+    pushEntry('system', text);
+}
+
+// 人设按钮显示当前人设，点击后切换到下一个人设（下一次回复开始生效）
+function setPersona(name, title) {
+    const button = document.getElementById('persona-switch');
+    if (button) {
+        button.textContent = title;
+        button.title = `切换人设（当前: ${name}）`;
+        button.hidden = false;
+    }
+}
+
+function switchToNextPersona() {
+    pywebview.api.list_personas().then((info) => {
+        if (!info || info.personas.length < 2) return;
+        const index = info.personas.findIndex((p) => p.name === info.active);
+        const next = info.personas[(index + 1) % info.personas.length];
+        pywebview.api.switch_persona(next.name);
+    });
+}
+
 // 兼容旧的addMessage函数
 function addMessage(role, text) {
     if (role === 'status') {
@@ -117,50 +165,152 @@ function addMessage(role, text) {
     }
 }
 
-// 自动滚动到底部
-function scrollToBottom() {
-    const container = document.getElementById('chat-container');
-    container.scrollTop = container.scrollHeight;
-}
-
-// 清理旧消息，保持最近的几条
-function cleanupOldMessages() {
-    const container = document.getElementById('chat-container');
-    const bubbles = container.querySelectorAll('.bubble:not(.status)');
-    
-    // 保留最近的6条消息（3对对话）
-    const maxMessages = 6;
-    if (bubbles.length > maxMessages) {
-        for (let i = 0; i < bubbles.length - maxMessages; i++) {
-            bubbles[i].style.animation = 'slideOut 0.3s ease-in';
-            setTimeout(() => {
-                if (bubbles[i].parentNode) {
-                    bubbles[i].remove();
-                }
-            }, 300);
-        }
+function createBubble(entry) {
+    const bubble = document.createElement('div');
+    bubble.classList.add('bubble', entry.role);
+    if (entry.streaming) {
+        bubble.classList.add('streaming');
+    }
+    if (entry.text) {
+        bubble.appendChild(document.createTextNode(entry.text));
+    }
+    entry.node = bubble;
+    entry.pending = '';
+    return bubble;
+}
+
+function entryAt(index) {
+    return messages[index - historyBase];
+}
+
+function detach(index) {
+    const entry = entryAt(index);
+    if (entry && entry.node) {
+        entry.node.remove();
+        entry.node = null;
     }
 }
 
-// 添加滑出动画
-const style = document.createElement('style');
-style.textContent = `
-@keyframes slideOut {
-    from {
-        opacity: 1;
-        transform: translateY(0);
-        height: auto;
-        margin-bottom: 6px;
+function createStatusBubble() {
+    statusBubble = document.createElement('div');
+    statusBubble.classList.add('bubble', 'status', 'listening');
+    statusBubble.textContent = 'AI杠精偷听中... (点击关闭)';
+    // 添加点击事件来关闭窗口
+    statusBubble.addEventListener('click', () => {
+        // 调用暴露给JS的Python API
+        pywebview.api.destroy();
+    });
+}
+
+function renderRange(from, to) {
+    const fragment = document.createDocumentFragment();
+    for (let i = from; i < to; i++) {
+        fragment.appendChild(createBubble(entryAt(i)));
+    }
+    return fragment;
+}
+
+// 每帧一次：先写入全部DOM改动，最后至多滚动一次
+function commitFrame() {
+    frameRequested = false;
+    if (!container) {
+        container = document.getElementById('chat-container');
+    }
+    const total = historyBase + messages.length;
+    const maxRendered = RENDER_OPTIONS.renderWindow + RENDER_OPTIONS.pageSize;
+    // 翻页时以一个保留下来的气泡为锚点，改动后把它放回原来的位置，可见内容不跳动
+    let anchor = null;
+    let anchorTop = 0;
+
+    // 1. 翻看历史：向上时在顶部补充一页、裁掉底部，向下时反之
+    if (pageRequest < 0 && renderStart > historyBase) {
+        anchor = entryAt(renderStart).node;
+        anchorTop = anchor.offsetTop;
+        const start = Math.max(historyBase, renderStart - RENDER_OPTIONS.pageSize);
+        container.insertBefore(renderRange(start, renderStart), container.firstChild);
+        renderStart = start;
+        const keepTo = Math.min(renderEnd, renderStart + maxRendered);
+        for (let i = keepTo; i < renderEnd; i++) {
+            detach(i);
+        }
+        renderEnd = keepTo;
+    } else if (pageRequest > 0 && renderEnd < total) {
+        anchor = entryAt(renderEnd - 1).node;
+        anchorTop = anchor.offsetTop;
+        const end = Math.min(total, renderEnd + RENDER_OPTIONS.pageSize);
+        const keepFrom = Math.max(renderStart, end - maxRendered);
+        for (let i = renderStart; i < keepFrom; i++) {
+            detach(i);
+        }
+        renderStart = keepFrom;
+        container.insertBefore(renderRange(renderEnd, end), statusBubble && statusBubble.parentNode ? statusBubble : null);
+        renderEnd = end;
+    }
+    pageRequest = 0;
+
+    // 2. 新消息：跟随底部时直接追加；用户正在翻看历史时，等翻到底部再补充
+    if (followBottom && renderEnd < total) {
+        container.insertBefore(renderRange(Math.max(renderEnd, renderStart), total),
+                               statusBubble && statusBubble.parentNode ? statusBubble : null);
+        renderEnd = total;
+    }
+
+    // 3. 流式文本：每帧追加一个文本节点，不重写已有内容
+    if (streamingEntry && streamingEntry.node && streamingEntry.pending) {
+        streamingEntry.node.appendChild(document.createTextNode(streamingEntry.pending));
+        streamingEntry.pending = '';
     }
-    to {
-        opacity: 0;
-        transform: translateY(-10px);
-        height: 0;
-        margin-bottom: 0;
+    for (const entry of finishedEntries) {
+        if (entry.node) {
+            if (entry.pending) {
+                entry.node.appendChild(document.createTextNode(entry.pending));
+                entry.pending = '';
+            }
+            entry.node.classList.remove('streaming');
+        }
+    }
+    finishedEntries = [];
+
+    // 4. 跟随底部时把窗口裁到renderWindow条
+    if (followBottom) {
+        const keepFrom = Math.max(renderStart, renderEnd - RENDER_OPTIONS.renderWindow);
+        for (let i = renderStart; i < keepFrom; i++) {
+            detach(i);
+        }
+        renderStart = keepFrom;
+    }
+
+    // 5. 状态气泡始终在最下方
+    if (statusVisible && !(statusBubble && statusBubble.parentNode)) {
+        if (!statusBubble) {
+            createStatusBubble();
+        }
+        container.appendChild(statusBubble);
+    } else if (!statusVisible && statusBubble && statusBubble.parentNode) {
+        statusBubble.remove();
+    }
+
+    // 6. 本帧唯一的一次滚动
+    if (anchor) {
+        container.scrollTop += anchor.offsetTop - anchorTop;
+    } else if (followBottom) {
+        container.scrollTop = container.scrollHeight;
+    }
+}
+
+function onScroll() {
+    const top = container.scrollTop;
+    const atBottom = container.scrollHeight - top - container.clientHeight <= RENDER_OPTIONS.edgeThreshold;
+    const total = historyBase + messages.length;
+    followBottom = atBottom && renderEnd >= total;
+    if (top <= RENDER_OPTIONS.edgeThreshold && renderStart > historyBase) {
+        pageRequest = -1;
+        scheduleRender();
+    } else if (atBottom && renderEnd < total) {
+        pageRequest = 1;
+        scheduleRender();
     }
 }
-`;
-document.head.appendChild(style);
 
 // 错误处理
 window.addEventListener('error', (e) => {
@@ -172,11 +322,13 @@ function initControls() {
     const decreaseFontBtn = document.getElementById('decrease-font');
     const increaseFontBtn = document.getElementById('increase-font');
     const resizeHandle = document.querySelector('.resize-handle');
-    
+    const personaBtn = document.getElementById('persona-switch');
+
     // 字体大小控制
     decreaseFontBtn.addEventListener('click', () => changeFontSize(-1));
     increaseFontBtn.addEventListener('click', () => changeFontSize(1));
-    
+    personaBtn.addEventListener('click', switchToNextPersona);
+
     // 窗口缩放控制
     let isResizing = false;
     let lastX, lastY;
@@ -191,12 +343,12 @@ function initControls() {
 
     window.addEventListener('mousemove', (e) => {
         if (!isResizing) return;
-        
+
         const deltaX = e.screenX - lastX;
         const deltaY = e.screenY - lastY;
-        
+
         pywebview.api.resize(deltaX, deltaY);
-        
+
         lastX = e.screenX;
         lastY = e.screenY;
     });
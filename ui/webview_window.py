@@ -1,10 +1,13 @@
 # ui/webview_window.py
 from typing import Optional
-import webview
 import time
 import logging
 import os
 import json
+import threading
+import config
+from utils.tracing import tracer, startup
+from utils.session_recorder import recorder, KIND_UI
 
 logger = logging.getLogger(__name__)
 
@@ -12,11 +15,27 @@ class Api:
     def __init__(self, window_instance):
         self._window = window_instance
 
+    def ready(self):
+        """页面加载完成、pywebview接口可用时由JS调用"""
+        self._window.mark_ready()
+
     def destroy(self):
         """关闭窗口"""
         logger.info("从JS API请求关闭窗口")
         self._window.stop()
 
+    def list_personas(self):
+        """人设列表与当前人设，未启用人设时返回None"""
+        personas = self._window.personas
+        return personas.describe() if personas is not None else None
+
+    def switch_persona(self, name):
+        """切换人设，下一次回复开始生效；找不到该人设时返回False"""
+        personas = self._window.personas
+        if personas is None:
+            return False
+        return personas.switch(name) is not None
+
     def resize(self, delta_x, delta_y):
         """根据增量调整窗口大小"""
         if self._window.window:
@@ -25,6 +44,149 @@ class Api:
             new_height = current_height + delta_y
             self._window.window.resize(new_width, new_height)
 
+class JSBridge:
+    """
+    按帧合并的JS调用桥。
+    UI操作先进入缓冲区，再由后台线程按帧间隔（或缓冲超过大小阈值时）合并成一次evaluate_js执行，
+    调用方（例如LLM读流线程）不再被GUI线程阻塞。操作顺序严格保持不变，
+    相邻的appendAIResponse会被拼接成一次调用。
+    """
+
+    APPEND_FUNC = "appendAIResponse"
+    FINISH_FUNC = "finishAIResponse"
+
+    def __init__(self, executor, flush_interval: float = config.UI_FLUSH_INTERVAL_SECONDS,
+                 max_batch_chars: int = config.UI_FLUSH_MAX_CHARS, ready_event: threading.Event = None):
+        self._executor = executor  # 实际执行JS的函数，接收一段JS代码
+        # 页面就绪前的操作留在缓冲区中，就绪后再一并执行
+        self._ready = ready_event
+        self.flush_interval = flush_interval
+        self.max_batch_chars = max_batch_chars
+
+        self._cond = threading.Condition()
+        self._pending = []          # [(函数名, [参数...], 追踪ID)]
+        self._pending_chars = 0
+        self._first_enqueue_time = None
+        self._stopped = False
+        self._thread = None
+
+        # 统计信息
+        self.ops_enqueued = 0
+        self.js_calls = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._flush_loop, name="JSBridgeFlush", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, func_name: str, *args, trace_ids=None):
+        """缓冲一次JS函数调用，不阻塞调用方。trace_ids用于在实际执行时记录延迟追踪。"""
+        with self._cond:
+            self._ensure_thread()
+            self.ops_enqueued += 1
+            if self._first_enqueue_time is None:
+                self._first_enqueue_time = time.perf_counter()
+
+            last = self._pending[-1] if self._pending else None
+            if func_name == self.APPEND_FUNC and last is not None and last[0] == self.APPEND_FUNC:
+                # 相邻的追加操作直接拼接文本，顺序不变
+                last[1][0] += args[0]
+            else:
+                self._pending.append((func_name, list(args), trace_ids))
+
+            self._pending_chars += sum(len(a) for a in args if isinstance(a, str))
+            if self._pending_chars >= self.max_batch_chars:
+                self._cond.notify()
+            elif len(self._pending) == 1:
+                self._cond.notify()
+
+    def _take_batch(self):
+        batch = self._pending
+        started = self._first_enqueue_time
+        self._pending = []
+        self._pending_chars = 0
+        self._first_enqueue_time = None
+        return batch, started
+
+    def _wait_ready(self) -> bool:
+        """等待页面就绪，停止时返回False"""
+        if self._ready is None:
+            return True
+        while not self._ready.wait(0.1):
+            if self._stopped:
+                return False
+        return True
+
+    def _flush_loop(self):
+        if not self._wait_ready():
+            return
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending and self._stopped:
+                    return
+                # 等到本帧结束或缓冲超过阈值再刷新
+                deadline = self._first_enqueue_time + self.flush_interval
+                while not self._stopped and self._pending_chars < self.max_batch_chars:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, started = self._take_batch()
+            self._execute_batch(batch, started)
+
+    def _execute_batch(self, batch, started):
+        if not batch:
+            return
+        js_code = "".join(
+            f"{name}({', '.join(json.dumps(a) for a in args)});" for name, args, _ in batch
+        )
+        recorder.record(KIND_UI, js_code)
+        self._executor(js_code)
+        for name, _, trace_ids in batch:
+            if trace_ids and name == self.APPEND_FUNC:
+                tracer.mark(trace_ids, 'first_js')
+            elif trace_ids and name == self.FINISH_FUNC:
+                tracer.mark(trace_ids, 'last_js')
+        latency = time.perf_counter() - started
+        self.js_calls += 1
+        self.total_flush_latency += latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+
+    def flush(self):
+        """在当前线程立即执行所有缓冲的操作"""
+        with self._cond:
+            batch, started = self._take_batch()
+        if self._ready is not None and not self._ready.is_set():
+            # 页面从未加载完成（例如启动途中退出），没有可执行JS的对象
+            return
+        self._execute_batch(batch, started)
+
+    def stop(self):
+        """刷新剩余操作并停止后台线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+        self.flush()
+
+    def get_stats(self) -> dict:
+        """返回合并统计：节省的JS调用次数与刷新延迟"""
+        avg_latency = self.total_flush_latency / self.js_calls if self.js_calls else 0.0
+        return {
+            "ops_enqueued": self.ops_enqueued,
+            "js_calls": self.js_calls,
+            "calls_saved": self.ops_enqueued - self.js_calls,
+            "avg_flush_latency_ms": avg_latency * 1000,
+            "max_flush_latency_ms": self.max_flush_latency * 1000,
+        }
+
 class RefutationWebViewWindow:
     """AI杠精半透明竖向小窗口"""
     
@@ -33,7 +195,16 @@ class RefutationWebViewWindow:
         self.height = height
         self.window = None
         self.is_running = False
+        self._ready = threading.Event()
         self.js_api = Api(self)
+        # 流式UI操作经由JS桥按帧合并执行，页面就绪前先缓冲
+        self.bridge = JSBridge(self.execute_js, ready_event=self._ready)
+        # 屏幕特效触发器（tools.screen_effects.EffectTrigger），AI回复的每段文本都会交给它扫描
+        self.effect_trigger = None
+        # 语音播报（agent.tts.SpeechOutput），AI回复的文本边生成边切句合成并播放
+        self.speech_output = None
+        # 人设注册表（agent.personas.PersonaRegistry），页面上的人设按钮经js_api切换
+        self.personas = None
         
         # 获取web文件路径
         self.web_dir = os.path.join(os.path.dirname(__file__), 'web')
@@ -53,16 +224,8 @@ class RefutationWebViewWindow:
         self.is_running = True
         
         try:
-            # 获取屏幕尺寸并计算窗口位置（右侧边缘）
-            import tkinter as tk
-            root = tk.Tk()
-            screen_width = root.winfo_screenwidth()
-            screen_height = root.winfo_screenheight()
-            root.destroy()
-            
-            # 计算窗口位置（屏幕右侧，垂直居中）
-            x = screen_width - self.width - 20  # 距离右边缘20像素
-            y = (screen_height - self.height) // 2  # 垂直居中
+            import webview
+            x, y = self._initial_position(webview)
             
             # 创建webview窗口，启用无边框模式
             self.window = webview.create_window(
@@ -89,6 +252,20 @@ class RefutationWebViewWindow:
             self.is_running = False
             raise
     
+    def _initial_position(self, webview):
+        """
+        计算窗口位置（屏幕右侧，垂直居中）。屏幕尺寸取自pywebview，
+        取不到时返回(None, None)，由pywebview自行摆放。
+        """
+        try:
+            screen = webview.screens[0]
+        except Exception as e:
+            logger.debug(f"无法获取屏幕尺寸: {e}")
+            return None, None
+        x = screen.width - self.width - 20  # 距离右边缘20像素
+        y = (screen.height - self.height) // 2  # 垂直居中
+        return x, y
+
     def run(self):
         """运行窗口 - 阻塞调用，必须在主线程中执行"""
         if not self.is_running:
@@ -96,6 +273,7 @@ class RefutationWebViewWindow:
             return
             
         try:
+            import webview
             # 启动webview - 这会阻塞主线程
             webview.start(debug=False, private_mode=False)
             
@@ -106,21 +284,29 @@ class RefutationWebViewWindow:
     
     def stop(self):
         """停止窗口"""
+        self.bridge.stop()
+        stats = self.bridge.get_stats()
+        logger.info(f"JS桥统计: 共{stats['ops_enqueued']}次UI操作，实际执行{stats['js_calls']}次JS调用，"
+                    f"节省{stats['calls_saved']}次，平均刷新延迟{stats['avg_flush_latency_ms']:.1f}ms")
         if self.window:
             self.window.destroy()
         self.is_running = False
         logger.info("WebView窗口已停止")
     
+    def mark_ready(self):
+        """页面已加载完成，可以执行JS"""
+        if not self._ready.is_set():
+            self._ready.set()
+            startup.mark('ui_ready')
+            logger.info("WebView UI已准备就绪")
+    
     def is_ready(self) -> bool:
         """检查UI是否准备就绪"""
-        # 由于移除了js_api，我们假设窗口创建后很快就绪
-        return self.is_running and self.window is not None
+        return self.is_running and self._ready.is_set()
     
     def wait_for_ready(self, timeout: int = 10) -> bool:
-        """等待UI准备就绪"""
-        # 简化处理：给UI一点加载时间
-        time.sleep(2)
-        return self.is_ready()
+        """等待页面通过js_api发来就绪信号"""
+        return self._ready.wait(timeout) and self.is_ready()
     
     def execute_js(self, js_code: str):
         """执行JavaScript代码"""
@@ -135,64 +321,82 @@ class RefutationWebViewWindow:
     
     def show_listening_status(self):
         """显示偷听状态"""
-        self.execute_js("showListeningStatus();")
+        self.bridge.enqueue("showListeningStatus")
     
     def add_user_message(self, text: str):
         """添加用户消息"""
-        # 转义JavaScript字符串
-        escaped_text = json.dumps(text)
-        self.execute_js(f"addUserMessage({escaped_text});")
+        self.bridge.enqueue("addUserMessage", text)
     
-    def start_ai_response(self):
+    def start_ai_response(self, trace_ids=None):
         """开始AI流式回复"""
-        self.execute_js("startAIResponse();")
+        self.bridge.enqueue("startAIResponse", trace_ids=trace_ids)
     
-    def append_ai_response(self, text: str):
+    def append_ai_response(self, text: str, trace_ids=None):
         """追加AI回复内容（流式传输）"""
-        # 转义JavaScript字符串
-        escaped_text = json.dumps(text)
-        self.execute_js(f"appendAIResponse({escaped_text});")
+        self.bridge.enqueue(JSBridge.APPEND_FUNC, text, trace_ids=trace_ids)
     
-    def finish_ai_response(self):
+    def finish_ai_response(self, trace_ids=None):
         """完成AI回复"""
-        self.execute_js("finishAIResponse();")
+        self.bridge.enqueue(JSBridge.FINISH_FUNC, trace_ids=trace_ids)
     
+    def set_persona(self, name: str, title: str):
+        """在人设按钮上显示当前人设"""
+        self.bridge.enqueue("setPersona", name, title)
+
+    def add_system_message(self, text: str):
+        """添加系统提示（例如人设已切换）"""
+        self.bridge.enqueue("addSystemMessage", text)
+
     def add_message(self, role: str, text: str):
         """兼容旧接口：添加消息"""
-        escaped_text = json.dumps(text)
-        escaped_role = json.dumps(role)
-        self.execute_js(f"addMessage({escaped_role}, {escaped_text});")
+        self.bridge.enqueue("addMessage", role, text)
 
 class StreamingAIResponse:
     """AI流式回复管理器"""
     
-    def __init__(self, window: RefutationWebViewWindow):
+    def __init__(self, window: RefutationWebViewWindow, trace_ids=None):
         self.window = window
+        self.trace_ids = trace_ids
         self.is_streaming = False
+        self.speech = None
+        self.effects = None
     
     def start(self):
         """开始流式回复"""
         if not self.is_streaming:
-            self.window.start_ai_response()
+            self.window.start_ai_response(trace_ids=self.trace_ids)
             self.is_streaming = True
+            if self.window.speech_output is not None:
+                self.speech = self.window.speech_output.begin()
+            if self.window.effect_trigger is not None:
+                self.effects = self.window.effect_trigger.begin()
     
     def append(self, text: str):
         """追加文本"""
         if self.is_streaming:
-            self.window.append_ai_response(text)
+            self.window.append_ai_response(text, trace_ids=self.trace_ids)
+            if self.effects is not None:
+                self.effects.feed(text)
+            if self.speech is not None:
+                self.speech.feed(text)
     
-    def finish(self):
-        """完成回复"""
+    def finish(self, interrupted: bool = False):
+        """完成回复；回复被打断（例如被更新的句子取代）时不再播报剩下半句"""
         if self.is_streaming:
-            self.window.finish_ai_response()
+            self.window.finish_ai_response(trace_ids=self.trace_ids)
             self.is_streaming = False
+            if self.speech is not None:
+                if interrupted:
+                    self.speech.cancel()
+                else:
+                    self.speech.end()
     
     def __enter__(self):
         self.start()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.finish()
+        self.finish(interrupted=exc_type is not None)
 
 # 全局窗口实例
 _global_window: Optional[RefutationWebViewWindow] = None
@@ -1,39 +1,184 @@
 # utils/logger_setup.py
 import io
 import os
+import copy
+import sys
+import json
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
-import sys
+import config
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-def setup_global_logger():
+# 当前正在处理的语句（追踪ID），随线程/协程上下文传递，写入每条日志
+_utterance_id = contextvars.ContextVar('utterance_id', default=None)
+
+_listener = None
+
+@contextmanager
+def utterance_context(utterance_id):
+    """在with块内产生的日志都带上utterance_id"""
+    token = _utterance_id.set(utterance_id)
+    try:
+        yield
+    finally:
+        _utterance_id.reset(token)
+
+class UtteranceFilter(logging.Filter):
+    """在产生日志的线程中取出当前的utterance_id，写入日志记录"""
+
+    def filter(self, record):
+        if not hasattr(record, 'utterance_id'):
+            record.utterance_id = _utterance_id.get()
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """
+    按代码位置限速：同一行代码产生的日志超过速率后丢弃，放行下一条时注明期间抑制的条数。
+    WARNING以上的级别不受限制。
+    """
+
+    def __init__(self, rate: float = config.LOG_RATE_LIMIT_PER_SECOND, burst: int = config.LOG_RATE_LIMIT_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # (文件, 行号) -> [剩余令牌, 上次更新时间, 已抑制条数]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        # 同一条记录经过多个处理器时只判定一次
+        decision = getattr(record, '_rate_limit_pass', None)
+        if decision is not None:
+            return decision
+        record._rate_limit_pass = self._allow(record)
+        return record._rate_limit_pass
+
+    def _allow(self, record) -> bool:
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.getMessage()}（期间已抑制{suppressed}条同类日志）"
+            record.args = None
+        return True
+
+_EXC_FORMATTER = logging.Formatter()
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时直接丢弃日志并计数，保证产生日志的线程永不阻塞"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """
+        在产生日志的线程中合并消息参数、把异常格式化为exc_text，但不像默认实现那样把异常拼进msg：
+        由写日志线程中的格式化器决定异常如何输出（文本格式附在消息后，JSON格式放在exc字段）。
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # 异常对象带着整条调用栈的帧，不放进队列
+            record.exc_text = record.exc_text or _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行JSON，便于按utterance_id检索同一句话的完整处理过程"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        utterance_id = getattr(record, 'utterance_id', None)
+        if utterance_id is not None:
+            entry["utterance_id"] = utterance_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            # 队列模式下exc_info已在产生日志的线程中格式化为exc_text
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+def echo_token(content: str):
+    """把流式token回显到控制台（可关闭）。不逐token刷新，回复结束时由finish_token_echo统一刷新。"""
+    if config.CONSOLE_TOKEN_ECHO:
+        sys.stdout.write(content)
+
+def finish_token_echo():
+    if config.CONSOLE_TOKEN_ECHO:
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+def setup_global_logger(use_queue: bool = config.LOG_QUEUE_ENABLED, json_format: bool = config.LOG_JSON_FORMAT,
+                        rate_limit: float = config.LOG_RATE_LIMIT_PER_SECOND, log_dir: str = 'logs',
+                        console_stream=None):
     """
     配置全局日志系统，输出到控制台和文件。
+    use_queue为真时，各线程只把日志放进队列，由后台线程统一写控制台和文件，
+    流式输出token和读取音频的线程不再等待磁盘与终端I/O。
     """
+    global _listener
+    shutdown_logging()
+
     # 创建 logs 文件夹
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
 
     # 生成带时间戳的文件名
     log_filename = datetime.now().strftime('log_%Y-%m-%d_%H-%M-%S.log')
-    log_filepath = os.path.join('logs', log_filename)
+    log_filepath = os.path.join(log_dir, log_filename)
 
     # 创建格式化器
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'
-    )
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'
+        )
 
     # 获取根日志器
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO) # 设置根日志器的最低级别
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
 
     # --- 配置控制台处理器 ---
-    console_handler = logging.StreamHandler()
+    console_handler = logging.StreamHandler(console_stream)
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
 
     # --- 配置文件处理器 ---
     # RotatingFileHandler: 当文件达到指定大小时，会自动重命名并创建新文件
@@ -42,6 +187,41 @@ def setup_global_logger():
         log_filepath, maxBytes=4 * 1024 * 1024, backupCount=5, encoding='utf-8'
     )
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
 
-    logging.info("全局日志系统已成功配置。")
\ No newline at end of file
+    if use_queue:
+        front = DroppingQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_MAX_SIZE))
+        _listener = QueueListener(front.queue, console_handler, file_handler, respect_handler_level=True)
+        _listener.start()
+        handlers = [front]
+    else:
+        handlers = [console_handler, file_handler]
+
+    # 过滤器在产生日志的线程中执行：先取上下文中的utterance_id，再按代码位置限速
+    rate_limit_filter = RateLimitFilter(rate=rate_limit)
+    for handler in handlers:
+        handler.addFilter(UtteranceFilter())
+        handler.addFilter(rate_limit_filter)
+        root_logger.addHandler(handler)
+
+    logging.info("全局日志系统已成功配置。")
+
+def shutdown_logging():
+    """停止后台写日志线程，写完队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+def get_logging_stats() -> dict:
+    stats = {"queued": False}
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            stats = {"queued": True, "queue_depth": handler.queue.qsize(), "dropped": handler.dropped}
+        for log_filter in handler.filters:
+            if isinstance(log_filter, RateLimitFilter):
+                stats["rate_limited"] = log_filter.suppressed
+    return stats
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,421 @@
+# utils/session_recorder.py
+# 会话录制：把原始音频块、ASR事件、LLM的token增量和实际执行的UI调用带时间戳写入一个只追加的二进制文件，
+# 用于事后排查（漏句、回复卡住、反复重连）和回归回放（见benchmarks/replay_session.py）。
+#
+# 文件格式（小端）：
+#   文件头    b'RFSREC01' + u32 元数据长度 + 元数据JSON
+#   数据块    块头 _CHUNK + 记录...（flags含CHUNK_ZLIB时整块经zlib压缩）
+#   记录      _RECORD(时间戳, 类型, 标签, 长度) + 负载；标签为追踪ID（没有时为0）
+#   索引      b'RIDX' + u32 块数 + 每块一条_INDEX_ENTRY，只在正常结束时写入
+#   文件尾    u64 索引偏移 + b'RTAL'
+# 音频与事件分两路（lane）缓冲，各自成块，搜索文字时不必读取音频块。
+# 每块的crc32针对存储的负载（压缩时为压缩后的数据），读取时逐块校验。
+# 程序崩溃时没有索引，读取时按块头逐块跳读重建，遇到不完整或校验失败的块即停止。
+import os
+import json
+import mmap
+import time
+import zlib
+import heapq
+import struct
+import bisect
+import logging
+import threading
+from collections import namedtuple
+import config
+
+logger = logging.getLogger(__name__)
+
+# 记录类型
+KIND_AUDIO = 1          # 原始PCM音频块
+KIND_ASR_PARTIAL = 2    # 识别中间结果
+KIND_ASR_FINAL = 3      # 识别到的完整句子
+KIND_ASR_STATUS = 4     # 识别会话状态：open / close / error: ...
+KIND_LLM_REQUEST = 5    # 发给大模型的句子
+KIND_LLM_DELTA = 6      # 大模型的文本增量
+KIND_LLM_END = 7        # 回复结束，负载为出字的模型，被取消时为cancelled，被审核中止时为moderated
+KIND_UI = 8             # 实际执行的一段JS（JS桥合并后的批次）
+
+KIND_NAMES = {
+    KIND_AUDIO: 'audio', KIND_ASR_PARTIAL: 'asr_partial', KIND_ASR_FINAL: 'asr_final',
+    KIND_ASR_STATUS: 'asr_status', KIND_LLM_REQUEST: 'llm_request', KIND_LLM_DELTA: 'llm_delta',
+    KIND_LLM_END: 'llm_end', KIND_UI: 'ui',
+}
+TEXT_KINDS = frozenset(KIND_NAMES) - {KIND_AUDIO}
+
+LANE_AUDIO = 0
+LANE_EVENTS = 1
+
+FILE_MAGIC = b'RFSREC01'
+INDEX_MAGIC = b'RIDX'
+TRAILER_MAGIC = b'RTAL'
+CHUNK_ZLIB = 0x01
+
+_FILE_HEADER = struct.Struct('<8sI')
+_CHUNK = struct.Struct('<4sBBIIddII')     # b'CHNK', 路, flags, 存储长度, 记录数, 首/末时间戳, 类型掩码, crc32
+_RECORD = struct.Struct('<dBII')          # 时间戳, 类型, 标签, 负载长度
+_INDEX_HEADER = struct.Struct('<4sI')
+_INDEX_ENTRY = struct.Struct('<QBIddI')   # 块偏移, 路, 记录数, 首/末时间戳, 类型掩码
+_TRAILER = struct.Struct('<Q4s')
+
+ChunkInfo = namedtuple('ChunkInfo', 'offset lane count first_ts last_ts kinds')
+Record = namedtuple('Record', 'ts kind tag payload')
+
+def _lane_of(kind: int) -> int:
+    return LANE_AUDIO if kind == KIND_AUDIO else LANE_EVENTS
+
+def _kinds_mask(kinds) -> int:
+    mask = 0
+    for kind in kinds:
+        mask |= 1 << kind
+    return mask
+
+class _LaneBuffer:
+    """一路正在填充的数据块"""
+
+    __slots__ = ('data', 'count', 'first_ts', 'last_ts', 'kinds')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.count = 0
+        self.first_ts = 0.0
+        self.last_ts = 0.0
+        self.kinds = 0
+
+class SessionRecorder:
+    """
+    会话录制器。record()只在内存中追加记录（持锁时间为两次bytearray拼接），
+    块写满或每隔flush_interval由后台线程封块写盘；写盘跟不上、积压超过max_pending_bytes时丢弃新记录而不是阻塞。
+    未调用start()时record()直接返回。
+    """
+
+    def __init__(self, chunk_bytes: int = config.RECORDER_CHUNK_BYTES,
+                 flush_interval: float = config.RECORDER_FLUSH_SECONDS,
+                 max_pending_bytes: int = config.RECORDER_MAX_PENDING_BYTES,
+                 compress: bool = config.RECORDER_COMPRESS, clock=time.time):
+        self.chunk_bytes = chunk_bytes
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.compress = compress
+        self.clock = clock  # 记录的时间戳来源，基准测试可替换为模拟时钟
+        self.path = None
+        self._active = False
+        self._lock = threading.Lock()
+        self._lanes = [_LaneBuffer(), _LaneBuffer()]
+        self._sealed = []           # [(路, _LaneBuffer)]，等待写盘
+        self._pending_bytes = 0
+        self._audio_seq = -1        # 已录制的最新音频块序号，会话重连回放的块不重复录制
+        self._file = None
+        self._index = []
+        self._wake = threading.Event()
+        self._thread = None
+
+        # 统计信息
+        self.records = 0
+        self.dropped = 0
+        self.chunks_written = 0
+        self.bytes_written = 0
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def start(self, path: str = None, meta: dict = None):
+        """开始录制到path（默认在config.RECORDER_DIR下按时间命名）"""
+        if self._active:
+            return
+        if path is None:
+            path = os.path.join(config.RECORDER_DIR, time.strftime('session-%Y%m%d-%H%M%S.rec'))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = {
+            "version": 1,
+            "started_at": self.clock(),
+            "sample_rate": config.SAMPLE_RATE,
+            "channels": config.CHANNELS,
+            "block_size": config.BLOCK_SIZE,
+            "llm_model": config.LLM_MODEL,
+            "asr_backend": config.ASR_BACKEND,
+            **(meta or {}),
+        }
+        encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        self._file = open(path, 'wb')
+        self._file.write(_FILE_HEADER.pack(FILE_MAGIC, len(encoded)) + encoded)
+        self.path = path
+        self._index = []
+        self._audio_seq = -1
+        self._active = True
+        self._thread = threading.Thread(target=self._write_loop, name="SessionRecorder", daemon=True)
+        self._thread.start()
+        logger.info(f"会话录制已开始: {path}")
+
+    def record(self, kind: int, payload, tag: int = None):
+        """追加一条记录（任何线程均可调用，不做IO）。payload为bytes或str。"""
+        if not self._active:
+            return
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        size = _RECORD.size + len(payload)
+        with self._lock:
+            # 在锁内取时间戳，同一路中记录的时间戳按写入顺序不减
+            ts = self.clock()
+            if self._pending_bytes + size > self.max_pending_bytes:
+                self.dropped += 1
+                return
+            lane = self._lanes[_lane_of(kind)]
+            if not lane.count:
+                lane.first_ts = ts
+            lane.data += _RECORD.pack(ts, kind, tag or 0, len(payload))
+            lane.data += payload
+            lane.count += 1
+            lane.last_ts = ts
+            lane.kinds |= 1 << kind
+            self._pending_bytes += size
+            self.records += 1
+            if len(lane.data) >= self.chunk_bytes:
+                self._seal(_lane_of(kind))
+                self._wake.set()
+
+    def record_audio(self, seq: int, data: bytes):
+        """录制一个音频块。seq为环形缓冲区中的块序号，重连后回放的旧块不会重复录制。"""
+        if not self._active or seq <= self._audio_seq:
+            return
+        self._audio_seq = seq
+        self.record(KIND_AUDIO, data)
+
+    def _seal(self, lane_id: int):
+        """把一路当前的缓冲封成块，交给写盘线程（持锁调用）"""
+        lane = self._lanes[lane_id]
+        if lane.count:
+            self._sealed.append((lane_id, lane))
+            self._lanes[lane_id] = _LaneBuffer()
+
+    def _take_sealed(self, seal_all: bool) -> list:
+        with self._lock:
+            if seal_all:
+                for lane_id in (LANE_AUDIO, LANE_EVENTS):
+                    self._seal(lane_id)
+            sealed, self._sealed = self._sealed, []
+        return sealed
+
+    def _write_chunks(self, sealed: list):
+        written = 0
+        for lane_id, lane in sealed:
+            data = lane.data
+            flags = 0
+            if self.compress:
+                data, flags = zlib.compress(data, 1), CHUNK_ZLIB
+            offset = self._file.tell()
+            self._file.write(_CHUNK.pack(b'CHNK', lane_id, flags, len(data), lane.count,
+                                         lane.first_ts, lane.last_ts, lane.kinds, zlib.crc32(data)))
+            self._file.write(data)
+            self._index.append(ChunkInfo(offset, lane_id, lane.count, lane.first_ts, lane.last_ts, lane.kinds))
+            self.chunks_written += 1
+            self.bytes_written += _CHUNK.size + len(data)
+            written += len(lane.data)
+        if sealed:
+            self._file.flush()
+            with self._lock:
+                self._pending_bytes -= written
+
+    def _write_loop(self):
+        while self._active:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self._write_chunks(self._take_sealed(seal_all=True))
+            except OSError as e:
+                logger.error(f"写入会话录制失败，停止录制: {e}")
+                self._active = False
+
+    def stop(self):
+        """停止录制：写出剩余记录和索引"""
+        if self._file is None:
+            return
+        self._active = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            self._write_chunks(self._take_sealed(seal_all=True))
+            index_offset = self._file.tell()
+            self._file.write(_INDEX_HEADER.pack(INDEX_MAGIC, len(self._index)))
+            for chunk in self._index:
+                self._file.write(_INDEX_ENTRY.pack(*chunk))
+            self._file.write(_TRAILER.pack(index_offset, TRAILER_MAGIC))
+        except OSError as e:
+            logger.error(f"写入会话录制索引失败: {e}")
+        self._file.close()
+        self._file = None
+        logger.info(f"会话录制已结束: {self.path}，{self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        return {
+            "records": self.records,
+            "dropped": self.dropped,
+            "chunks": self.chunks_written,
+            "bytes_written": self.bytes_written,
+            "pending_bytes": self._pending_bytes,
+        }
+
+class SessionReader:
+    """
+    内存映射读取录制文件。打开时只读取索引（或块头），记录在遍历时才从映射中解析，
+    几小时的录音也不需要整体载入内存。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"录制文件为空: {path}")
+        magic, meta_len = _FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != FILE_MAGIC:
+            self.close()
+            raise ValueError(f"不是会话录制文件: {path}")
+        self.meta = json.loads(self._mm[_FILE_HEADER.size:_FILE_HEADER.size + meta_len])
+        self._data_start = _FILE_HEADER.size + meta_len
+        self._verified = set()      # 已通过校验的块偏移
+        self.indexed = True
+        self.chunks = self._load_index()
+        if self.chunks is None:
+            self.indexed = False
+            self.chunks = self._scan_chunks()
+        self._lanes = {}
+        for chunk in self.chunks:
+            self._lanes.setdefault(chunk.lane, []).append(chunk)
+        self._lane_ends = {lane: [c.last_ts for c in chunks] for lane, chunks in self._lanes.items()}
+
+    def _load_index(self):
+        size = len(self._mm)
+        if size < self._data_start + _TRAILER.size:
+            return None
+        index_offset, magic = _TRAILER.unpack_from(self._mm, size - _TRAILER.size)
+        if magic != TRAILER_MAGIC or index_offset + _INDEX_HEADER.size > size:
+            return None
+        magic, count = _INDEX_HEADER.unpack_from(self._mm, index_offset)
+        if magic != INDEX_MAGIC:
+            return None
+        base = index_offset + _INDEX_HEADER.size
+        return [ChunkInfo(*_INDEX_ENTRY.unpack_from(self._mm, base + i * _INDEX_ENTRY.size)) for i in range(count)]
+
+    def _scan_chunks(self) -> list:
+        """没有索引（录制中途退出）时按块头逐块跳读"""
+        chunks = []
+        offset, size = self._data_start, len(self._mm)
+        while offset + _CHUNK.size <= size:
+            magic, lane, _, length, count, first_ts, last_ts, kinds, crc = _CHUNK.unpack_from(self._mm, offset)
+            if magic != b'CHNK' or offset + _CHUNK.size + length > size:
+                break
+            if self._crc(offset + _CHUNK.size, length) != crc:
+                # 写到一半的块：之后的内容不可信
+                logger.warning(f"录制文件的数据块校验失败（偏移{offset}），只读取此前的{len(chunks)}块。")
+                break
+            self._verified.add(offset)
+            chunks.append(ChunkInfo(offset, lane, count, first_ts, last_ts, kinds))
+            offset += _CHUNK.size + length
+        logger.info(f"录制文件没有索引，已按块头重建（{len(chunks)}块）。")
+        return chunks
+
+    @property
+    def start_ts(self) -> float:
+        return min((c.first_ts for c in self.chunks), default=self.meta.get("started_at", 0.0))
+
+    @property
+    def end_ts(self) -> float:
+        return max((c.last_ts for c in self.chunks), default=self.start_ts)
+
+    def _crc(self, begin: int, length: int) -> int:
+        """映射中一段数据的crc32，不复制"""
+        with memoryview(self._mm) as view, view[begin:begin + length] as stored:
+            return zlib.crc32(stored)
+
+    def _chunk_data(self, chunk: ChunkInfo):
+        """返回(缓冲, 起始, 结束)；每块首次读取时校验，未压缩的块直接在映射上解析，不复制"""
+        _, _, flags, length, _, _, _, _, crc = _CHUNK.unpack_from(self._mm, chunk.offset)
+        begin = chunk.offset + _CHUNK.size
+        if chunk.offset not in self._verified:
+            if self._crc(begin, length) != crc:
+                raise ValueError(f"数据块校验失败（偏移{chunk.offset}）")
+            self._verified.add(chunk.offset)
+        if flags & CHUNK_ZLIB:
+            data = zlib.decompress(self._mm[begin:begin + length])
+            return data, 0, len(data)
+        return self._mm, begin, begin + length
+
+    def _iter_chunk(self, chunk: ChunkInfo, kinds, start: float, end: float):
+        buf, pos, stop = self._chunk_data(chunk)
+        while pos < stop:
+            ts, kind, tag, length = _RECORD.unpack_from(buf, pos)
+            pos += _RECORD.size
+            # 系统时间可能被回拨，块内不依赖时间戳有序，逐条判断
+            if start <= ts <= end and (kinds is None or kind in kinds):
+                yield Record(ts, kind, tag, buf[pos:pos + length])
+            pos += length
+
+    def _iter_lane(self, lane: int, kinds, start: float, end: float):
+        chunks = self._lanes[lane]
+        mask = _kinds_mask(kinds) if kinds is not None else -1
+        for chunk in chunks[bisect.bisect_left(self._lane_ends[lane], start):]:
+            if chunk.first_ts > end:
+                return
+            if chunk.kinds & mask:
+                yield from self._iter_chunk(chunk, kinds, start, end)
+
+    def records(self, start: float = None, end: float = None, kinds=None):
+        """按时间顺序遍历[start, end]内（时间戳为time.time()）指定类型的记录，只读取相关的块"""
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        kinds = frozenset(kinds) if kinds is not None else None
+        lanes = [lane for lane in self._lanes if kinds is None or
+                 any(_lane_of(kind) == lane for kind in kinds)]
+        iterators = [self._iter_lane(lane, kinds, start, end) for lane in lanes]
+        if len(iterators) == 1:
+            return iterators[0]
+        return heapq.merge(*iterators, key=lambda record: record.ts)
+
+    def search(self, text: str, kinds=TEXT_KINDS, start: float = None, end: float = None):
+        """查找负载中包含text的文字记录。未压缩的块先在映射上整体查找，不含该文字的块不逐条解析。"""
+        needle = text.encode('utf-8')
+        kinds = frozenset(kinds)
+        mask = _kinds_mask(kinds)
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        for chunk in self.chunks:
+            if not chunk.kinds & mask or chunk.last_ts < start or chunk.first_ts > end:
+                continue
+            buf, begin, stop = self._chunk_data(chunk)
+            if buf.find(needle, begin, stop) == -1:
+                continue
+            for record in self._iter_chunk(chunk, kinds, start, end):
+                if needle in record.payload:
+                    yield record
+
+    def summary(self) -> dict:
+        """只根据索引统计，不读取记录"""
+        lanes = {LANE_AUDIO: 'audio', LANE_EVENTS: 'events'}
+        return {
+            "path": self.path,
+            "bytes": len(self._mm),
+            "indexed": self.indexed,
+            "duration_s": self.end_ts - self.start_ts if self.chunks else 0.0,
+            "chunks": len(self.chunks),
+            "records": sum(c.count for c in self.chunks),
+            **{f"{name}_records": sum(c.count for c in self._lanes.get(lane, ())) for lane, name in lanes.items()},
+        }
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+# 全局录制器，未调用start()时不录制
+recorder = SessionRecorder()
@@ -0,0 +1,295 @@
+# utils/tracing.py
+import os
+import json
+import time
+import bisect
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import config
+
+logger = logging.getLogger(__name__)
+
+# 每句话经过的阶段（按时间顺序）
+STAGES = (
+    'voice_end',     # 最后一个有声音频块
+    'sentence_end',  # ASR返回句子结束事件
+    'llm_request',   # 发出LLM请求
+    'first_token',   # 收到首个token
+    'last_token',    # 收到最后一个token
+    'first_js',      # 第一次把回复内容写入UI的evaluate_js
+    'last_js',       # 完成回复的evaluate_js
+)
+
+# 统计的延迟区间：(名称, 起始阶段, 结束阶段)
+SPANS = (
+    ('asr_endpoint', 'voice_end', 'sentence_end'),
+    ('dispatch', 'sentence_end', 'llm_request'),
+    ('ttft', 'llm_request', 'first_token'),
+    ('generation', 'first_token', 'last_token'),
+    ('ui_first_paint', 'first_token', 'first_js'),
+    ('ui_last_paint', 'last_token', 'last_js'),
+    ('end_to_end', 'voice_end', 'first_js'),
+)
+
+# 直方图桶上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """固定桶的延迟直方图，可按桶估算分位数"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为+Inf桶
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        value = max(0.0, value)
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """按桶线性插值估算分位数（秒）"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for i, c in enumerate(self.counts):
+            upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+            if c and cumulative + c >= target:
+                return lower + (upper - lower) * (target - cumulative) / c
+            cumulative += c
+            lower = upper
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p90_ms": self.percentile(0.9) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+class Tracer:
+    """
+    端到端延迟追踪。每句话分配一个追踪ID，从ASR经过Agent、LLM一直传递到UI，
+    各阶段打点后计算区间延迟并记入直方图，定期导出到文件。
+    """
+
+    def __init__(self, enabled: bool = config.TRACING_ENABLED,
+                 export_path: str = config.TRACING_EXPORT_PATH,
+                 export_format: str = config.TRACING_EXPORT_FORMAT,
+                 export_interval: float = config.TRACING_EXPORT_INTERVAL_SECONDS,
+                 max_open: int = config.TRACING_MAX_OPEN_TRACES):
+        self.enabled = enabled
+        self.export_path = export_path
+        self.export_format = export_format
+        self.export_interval = export_interval
+        self.max_open = max_open
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._open = OrderedDict()  # trace_id -> {阶段: 时间戳}
+        self.histograms = {name: Histogram() for name, _, _ in SPANS}
+        self.completed = 0
+        self.abandoned = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def new_trace(self, **marks) -> int:
+        """创建一条新的追踪，可同时传入已知阶段的时间戳"""
+        if not self.enabled:
+            return None
+        trace_id = next(self._ids)
+        with self._lock:
+            self._open[trace_id] = {stage: ts for stage, ts in marks.items() if ts is not None}
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+                self.abandoned += 1
+        return trace_id
+
+    def mark(self, trace_ids, stage: str, ts: float = None):
+        """为一个或多个追踪记录某阶段的时间（每个阶段只记录第一次）"""
+        if not self.enabled or trace_ids is None:
+            return
+        if isinstance(trace_ids, int):
+            trace_ids = (trace_ids,)
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            for trace_id in trace_ids:
+                stages = self._open.get(trace_id)
+                if stages is None or stage in stages:
+                    continue
+                stages[stage] = ts
+                if stage == STAGES[-1]:
+                    self._finish(trace_id)
+
+    def discard(self, trace_id: int):
+        """丢弃一条不会走完全程的追踪（如语音命令），不计入直方图"""
+        if not self.enabled or trace_id is None:
+            return
+        with self._lock:
+            self._open.pop(trace_id, None)
+
+    def _finish(self, trace_id: int):
+        stages = self._open.pop(trace_id)
+        for name, start, end in SPANS:
+            if start in stages and end in stages:
+                self.histograms[name].observe(stages[end] - stages[start])
+        self.completed += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: h.snapshot() for name, h in self.histograms.items() if h.count}
+
+    def log_summary(self):
+        summary = self.summary()
+        if not summary:
+            logger.info("延迟追踪: 本次运行没有完成的追踪记录。")
+            return
+        logger.info(f"延迟追踪汇总（完成{self.completed}条，丢弃{self.abandoned}条）:")
+        for name, s in summary.items():
+            logger.info(f"  {name:<15} n={s['count']:<5} p50={s['p50_ms']:7.0f}ms "
+                        f"p90={s['p90_ms']:7.0f}ms p99={s['p99_ms']:7.0f}ms max={s['max_ms']:7.0f}ms")
+
+    def _prometheus_text(self) -> str:
+        lines = [
+            "# HELP refutation_stage_latency_seconds Per-stage latency of each utterance.",
+            "# TYPE refutation_stage_latency_seconds histogram",
+        ]
+        for name, h in self.histograms.items():
+            cumulative = 0
+            for upper, c in zip(list(h.buckets) + ['+Inf'], h.counts):
+                cumulative += c
+                lines.append(f'refutation_stage_latency_seconds_bucket{{stage="{name}",le="{upper}"}} {cumulative}')
+            lines.append(f'refutation_stage_latency_seconds_sum{{stage="{name}"}} {h.sum:.6f}')
+            lines.append(f'refutation_stage_latency_seconds_count{{stage="{name}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """把当前直方图写入文件"""
+        if not self.enabled or not self.export_path:
+            return
+        directory = os.path.dirname(self.export_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            if self.export_format == 'jsonl':
+                record = {"ts": time.time(), "completed": self.completed, "histograms": self.summary()}
+                with open(self.export_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                with self._lock:
+                    text = self._prometheus_text()
+                tmp_path = self.export_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, self.export_path)
+        except OSError as e:
+            logger.error(f"导出延迟指标失败: {e}")
+
+    def start(self):
+        """启动定期导出线程"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._export_loop, name="TracingExport", daemon=True)
+        self._thread.start()
+
+    def _export_loop(self):
+        while not self._stop_event.wait(self.export_interval):
+            self.export()
+
+    def stop(self):
+        """停止定期导出，并做最后一次导出"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        self.export()
+
+# 全局追踪器
+tracer = Tracer()
+
+class StartupTimeline:
+    """
+    启动阶段计时。step记录一个步骤的起止时刻（各步骤可能在不同线程中并行），mark记录单个事件；
+    必需事件（ASR已连接、界面已就绪）都到齐后输出一次耗时分解。
+    """
+
+    REQUIRED = ('asr_connected', 'ui_ready')
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self._steps = []   # [(名称, 开始, 结束, 线程名)]，时刻相对origin
+        self._marks = {}   # 名称 -> 相对origin的时刻，只记第一次
+        self._lock = threading.Lock()
+        self._reported = False
+
+    def begin(self):
+        """以当前时刻作为启动起点"""
+        with self._lock:
+            self.origin = time.perf_counter()
+            self._steps.clear()
+            self._marks.clear()
+            self._reported = False
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter() - self.origin
+        try:
+            yield
+        finally:
+            ended = time.perf_counter() - self.origin
+            with self._lock:
+                self._steps.append((name, started, ended, threading.current_thread().name))
+
+    def mark(self, name: str):
+        with self._lock:
+            if name in self._marks:
+                return
+            self._marks[name] = time.perf_counter() - self.origin
+            ready = not self._reported and all(n in self._marks for n in self.REQUIRED)
+            if ready:
+                self._reported = True
+        if ready:
+            self.log_summary()
+
+    def time_to_listening(self):
+        """ASR已连接且界面已就绪的时刻（秒），尚未到达时返回None"""
+        with self._lock:
+            if not all(n in self._marks for n in self.REQUIRED):
+                return None
+            return max(self._marks[n] for n in self.REQUIRED)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "steps": [{"name": name, "start_ms": start * 1000, "end_ms": end * 1000,
+                           "duration_ms": (end - start) * 1000, "thread": thread}
+                          for name, start, end, thread in sorted(self._steps, key=lambda s: s[1])],
+                "marks_ms": {name: t * 1000 for name, t in sorted(self._marks.items(), key=lambda m: m[1])},
+            }
+
+    def log_summary(self):
+        summary = self.summary()
+        lines = [f"  {s['name']:<16} {s['start_ms']:7.0f} → {s['end_ms']:7.0f} ms"
+                 f"（耗时 {s['duration_ms']:6.0f} ms，线程 {s['thread']}）" for s in summary["steps"]]
+        lines += [f"  {name:<16} {t:7.0f} ms" for name, t in summary["marks_ms"].items()]
+        listening = self.time_to_listening()
+        if listening is not None:
+            lines.append(f"  开始偷听耗时: {listening * 1000:.0f} ms")
+        logger.info("启动耗时分解:\n" + "\n".join(lines))
+
+# 启动计时
+startup = StartupTimeline()